@@ -1,9 +1,72 @@
 from ctypes import *
+import ctypes
+import os
 from daqmxconstants import constants
 from util import DAQmxException
 
-dll = windll.LoadLibrary("nicaiu.dll")
-"""handle to NI DAQmx c library"""
+NI_DRIVER = 'nicaiu'
+"""the NI DAQmx c library"""
+
+SIMULATED_DRIVER = 'simulated'
+"""L{simulator.Simulator}, for machines without NI hardware"""
+
+DRIVER_ENV = 'DAQMX_DRIVER'
+"""environment variable naming the driver to use"""
+
+DRIVER_KEY = 'daqmx driver'
+"""registry key in a server's directory naming the driver to use"""
+
+class Driver(object):
+    """
+    stands in for the driver loaded by L{load_driver}.
+
+    DAQmx functions are looked up on the loaded driver, and
+    if none has been loaded when the first one is called, the
+    driver is chosen by L{select_driver}.
+    """
+    def __init__(self):
+        self.name = None
+        self.lib = None
+
+    def __getattr__(self,name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if self.lib is None:
+            select_driver()
+        return getattr(self.lib,name)
+
+dll = Driver()
+"""handle to NI DAQmx c library, or the driver standing in for it"""
+
+def load_driver(name):
+    """
+    load a DAQmx driver. tasks created with the previous driver
+    can not be used any more.
+
+    @param name: L{NI_DRIVER} or L{SIMULATED_DRIVER}
+    @type name: str
+    """
+    if name == NI_DRIVER:
+        lib = ctypes.windll.LoadLibrary("nicaiu.dll")
+    elif name == SIMULATED_DRIVER:
+        from simulator import Simulator
+        lib = Simulator()
+    else:
+        raise ValueError('unknown DAQmx driver: %s' % name)
+    dll.name = name
+    dll.lib = lib
+
+def select_driver(name=None):
+    """
+    load the driver named by the L{DRIVER_ENV} environment
+    variable if it is set, or else the one named, or else the
+    NI driver.
+
+    @param name: driver to use unless overridden by the
+        environment, e.g. from the L{DRIVER_KEY} registry key
+    @type name: str
+    """
+    load_driver(os.environ.get(DRIVER_ENV) or name or NI_DRIVER)
 
 BUF_SIZE = 100000
 """size of string buffers for daqmx calls"""
@@ -0,0 +1,768 @@
+import ctypes
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from daqmxconstants import constants
+
+############## instructions #####################
+#
+# the simulator stands in for the NI DAQmx c
+# library on machines without NI hardware. it
+# has the functions of the library used by the
+# daqmx tasks, taking the same ctypes arguments
+# and returning the same error codes, so the
+# tasks and the servers built on them run
+# unchanged. load it with
+#
+#     daqmx.load_driver(daqmx.SIMULATED_DRIVER)
+#
+# or by setting the DAQMX_DRIVER environment
+# variable or the 'daqmx driver' registry key
+# of a server to 'simulated'.
+#
+# tasks are made of global channels, as set up
+# in NI MAX on a lab computer. the channels and
+# global tasks come from the json file named by
+# the DAQMX_SIMULATOR_CONFIG environment variable,
+# or else from DEFAULT_CONFIG. in the config,
+# channels maps global channel names to a dict
+# with the keys
+#
+#     type        AI, AO, DI, DO, CI or CO
+#     physical    physical channel name
+#
+# and for each type
+#
+#     AI  offset, amplitude, frequency, phase,
+#         noise: the sine wave with gaussian
+#         noise that is read from the channel.
+#         units: volts, amps, degs C, degs F,
+#         degs K or any other name, which is
+#         given to a custom scale
+#     AO  min, max, units
+#     CI  source: CO channel whose pulses are
+#         counted, or rate: counts per second
+#     CO  frequency and initial delay of pulses
+#
+# tasks maps global task names to lists of
+# channels, and triggers maps trigger terminals
+# to the period of the pulses arriving at them,
+# which are high for the first half of each
+# period. a terminal that is not listed gets
+# pulses every TRIGGER_PERIOD.
+#
+# samples are clocked in real time: an
+# acquisition started at t has sample n at
+# t + n / rate, or after the first trigger edge
+# following t, and reads wait for the samples
+# they ask for. starting and stopping a task
+# takes START_LATENCY and STOP_LATENCY, about
+# what committing and releasing a task on a
+# pci card does.
+#
+###################################################
+
+CONFIG_ENV = 'DAQMX_SIMULATOR_CONFIG'
+
+NIDAQ_VERSION = (9, 0)
+MAX_SAMPLING_RATE = 250000. # aggregate over all ai channels of a task
+TRIGGER_PERIOD = .1
+START_LATENCY = .002
+STOP_LATENCY = .001
+DEFAULT_SAMPLES = 1000 # samples per channel of a new task
+
+DEFAULT_CONFIG = {
+    'devices': ['Dev1'],
+    'channels': dict(
+        [
+            (
+                'ai%d' % i,
+                {
+                    'type': 'AI',
+                    'physical': 'Dev1/ai%d' % i,
+                    'offset': .1 * i,
+                    'amplitude': .01,
+                    'frequency': 60.,
+                    'noise': .001
+                }
+            ) for i in range(8)
+        ] + [
+            ('ao%d' % i, {'type': 'AO', 'physical': 'Dev1/ao%d' % i, 'min': -10., 'max': 10.})
+            for i in range(2)
+        ] + [
+            ('do%d' % i, {'type': 'DO', 'physical': 'Dev1/port0/line%d' % i})
+            for i in range(8)
+        ] + [
+            ('co0', {'type': 'CO', 'physical': 'Dev1/ctr0', 'frequency': 1000.}),
+            ('ci1', {'type': 'CI', 'physical': 'Dev1/ctr1', 'source': 'co0'})
+        ]
+    ),
+    'tasks': {},
+    'triggers': {}
+}
+
+SUCCESS = 0
+WARNING_STOPPED_BEFORE_DONE = 200010
+ERROR_INVALID_TASK = -200088
+ERROR_INVALID_ATTRIBUTE_VALUE = -200077
+ERROR_CHANNEL_NOT_FOUND = -200170
+ERROR_READ_BUFFER_TOO_SMALL = -200229
+ERROR_SAMPLES_NO_LONGER_AVAILABLE = -200279
+ERROR_SAMPLES_NOT_YET_AVAILABLE = -200284
+ERROR_ATTRIBUTE_NOT_SUPPORTED = -200452
+ERROR_NO_CHANNELS = -200478
+ERROR_TASK_RUNNING = -200479
+ERROR_WAIT_TIMED_OUT = -200560
+
+ERRORS = {
+    WARNING_STOPPED_BEFORE_DONE: 'Finite acquisition or generation has been stopped before the requested number of samples were acquired or generated.',
+    ERROR_INVALID_TASK: 'Task specified is invalid or does not exist.',
+    ERROR_INVALID_ATTRIBUTE_VALUE: 'Requested value is not a supported value for this property.',
+    ERROR_CHANNEL_NOT_FOUND: 'Channel specified does not exist.',
+    ERROR_READ_BUFFER_TOO_SMALL: 'Buffer is too small to fit read data.',
+    ERROR_SAMPLES_NO_LONGER_AVAILABLE: 'Attempted to read samples that are no longer available. The requested sample was previously available, but has since been overwritten.',
+    ERROR_SAMPLES_NOT_YET_AVAILABLE: 'Some or all of the samples requested have not yet been acquired.',
+    ERROR_ATTRIBUTE_NOT_SUPPORTED: 'Specified property is not supported by the device or is not applicable to the task.',
+    ERROR_NO_CHANNELS: 'Specified operation cannot be performed when there are no channels in the task.',
+    ERROR_TASK_RUNNING: 'Specified operation cannot be performed while the task is running.',
+    ERROR_WAIT_TIMED_OUT: 'Wait Until Done did not indicate all samples were acquired or generated before timeout.',
+}
+
+CHANNEL_TYPES = {
+    'AI': 'DAQmx_Val_AI',
+    'AO': 'DAQmx_Val_AO',
+    'DI': 'DAQmx_Val_DI',
+    'DO': 'DAQmx_Val_DO',
+    'CI': 'DAQmx_Val_CI',
+    'CO': 'DAQmx_Val_CO',
+}
+
+UNITS = {
+    'volts': ('DAQmx_Val_Voltage', 'DAQmx_Val_Volts'),
+    'amps': ('DAQmx_Val_Current', 'DAQmx_Val_Amps'),
+    'degs C': ('DAQmx_Val_Temp_TC', 'DAQmx_Val_DegC'),
+    'degs F': ('DAQmx_Val_Temp_TC', 'DAQmx_Val_DegF'),
+    'degs K': ('DAQmx_Val_Temp_TC', 'DAQmx_Val_Kelvins'),
+}
+
+def load_config():
+    """config from the file named by CONFIG_ENV, or DEFAULT_CONFIG"""
+    filename = os.environ.get(CONFIG_ENV)
+    if not filename:
+        return DEFAULT_CONFIG
+    with open(filename, 'r') as file:
+        return json.loads(file.read())
+
+def _value(arg):
+    """python value of an argument passed by value"""
+    if isinstance(arg, ctypes._SimpleCData):
+        return arg.value
+    return arg
+
+def _set(ref, value):
+    """set an argument passed by reference"""
+    getattr(ref, '_obj', ref).value = value
+
+def _set_string(buf, size, value):
+    _set(buf, value[:max(_value(size) - 1, 0)])
+
+def _floor(x):
+    """floor of a number of samples or pulses, forgiving rounding errors"""
+    return int(np.floor(x + 1e-6))
+
+def _buffer_size(rate):
+    """default input buffer size of a continuous acquisition"""
+    if rate <= 100:
+        return 1000
+    if rate <= 10000:
+        return 10000
+    if rate <= 1000000:
+        return 100000
+    return 1000000
+
+class SimulatorError(Exception):
+    def __init__(self, code):
+        Exception.__init__(self, ERRORS[code])
+        self.code = code
+
+def daqmx_function(f):
+    """
+    turn SimulatorErrors raised by f into the return codes
+    the c library would give.
+    """
+    def wrapped(*args):
+        try:
+            f(*args)
+        except SimulatorError, e:
+            return e.code
+        return SUCCESS
+    wrapped.__name__ = f.__name__
+    wrapped.__doc__ = f.__doc__
+    return wrapped
+
+class SimulatedTask:
+    def __init__(self, name):
+        self.name = name
+        self.channels = []
+        self.sample_mode = constants['DAQmx_Val_FiniteSamps']
+        self.sample_timing = None
+        self.rate = 1000.
+        self.samples = DEFAULT_SAMPLES
+        self.buffer_size = None
+        self.trigger = None # (source, edge)
+        self.initial_delay = 0.
+        self.running = False
+        self.start_time = None # time of the first sample or pulse
+        self.stop_time = None
+        self.read = 0 # samples per channel read so far
+        self.count = 0 # counter value when last stopped
+
+    def is_finite(self):
+        return self.sample_mode == constants['DAQmx_Val_FiniteSamps']
+
+    def end_time(self):
+        if self.is_finite():
+            return self.start_time + self.samples / self.rate
+        return None
+
+class Simulator:
+    """simulated NI DAQmx c library"""
+
+    def __init__(self, config=None, clock=time.time, sleep=time.sleep):
+        if config is None:
+            config = load_config()
+        self.config = config
+        self.clock = clock
+        self.sleep = sleep
+        self.epoch = clock()
+        self.lock = threading.RLock()
+        self.tasks = {}
+        self.next_handle = 1
+        self.line_states = {}
+        self.outputs = {}
+        self.generations = {} # co channel -> [(start, end, frequency)]
+
+    # helpers
+
+    def _now(self):
+        """seconds since the simulator was created, small enough to keep sample times exact"""
+        return self.clock() - self.epoch
+
+    def _task(self, handle):
+        handle = _value(handle)
+        with self.lock:
+            if handle not in self.tasks:
+                raise SimulatorError(ERROR_INVALID_TASK)
+            return self.tasks[handle]
+
+    def _channel(self, name):
+        channels = self.config['channels']
+        if name not in channels:
+            raise SimulatorError(ERROR_CHANNEL_NOT_FOUND)
+        return channels[name]
+
+    def _task_channel(self, task, name):
+        if name:
+            return self._channel(name)
+        if not task.channels:
+            raise SimulatorError(ERROR_NO_CHANNELS)
+        return self._channel(task.channels[0])
+
+    def _type(self, task):
+        if not task.channels:
+            raise SimulatorError(ERROR_NO_CHANNELS)
+        return self._channel(task.channels[0])['type']
+
+    def _require(self, task, *types):
+        if self._type(task) not in types:
+            raise SimulatorError(ERROR_ATTRIBUTE_NOT_SUPPORTED)
+
+    def _new_handle(self, name, handle):
+        with self.lock:
+            task = SimulatedTask(name)
+            self.tasks[self.next_handle] = task
+            _set(handle, self.next_handle)
+            self.next_handle += 1
+        return task
+
+    def _next_edge(self, source, edge, after):
+        """time of the first trigger edge at a terminal after a time"""
+        period = self.config.get('triggers', {}).get(source, TRIGGER_PERIOD)
+        offset = 0. if edge == constants['DAQmx_Val_Rising'] else period / 2.
+        return (np.floor((after - offset) / period) + 1) * period + offset
+
+    def _acquired(self, task, now):
+        """samples per channel acquired by now"""
+        if task.start_time is None:
+            return 0
+        end = now if task.stop_time is None else min(now, task.stop_time)
+        acquired = max(_floor((end - task.start_time) * task.rate) + 1, 0)
+        if task.is_finite():
+            acquired = min(acquired, task.samples)
+        return acquired
+
+    def _input_buffer_size(self, task):
+        if task.buffer_size is not None:
+            return task.buffer_size
+        if task.is_finite():
+            return task.samples
+        return _buffer_size(task.rate)
+
+    def _waveform(self, name, task, first, count):
+        channel = self._channel(name)
+        t = task.start_time + (first + np.arange(count)) / task.rate
+        samples = channel.get('offset', 0.) + channel.get('amplitude', 0.) * np.sin(
+            2 * np.pi * channel.get('frequency', 0.) * t + channel.get('phase', 0.)
+        )
+        noise = channel.get('noise', 0.)
+        if noise:
+            samples = samples + np.random.normal(0., noise, count)
+        return samples
+
+    def _is_done(self, task):
+        if not task.running:
+            return True
+        end = task.end_time()
+        return end is not None and self._now() >= end
+
+    def _pulses(self, source, start, end):
+        """pulses generated on a co channel between two times"""
+        pulses = 0
+        for first, last, frequency, count in self.generations.get(source, []):
+            if last is None:
+                last = end
+            overlap_start = max(first, start)
+            overlap_end = min(last, end)
+            if overlap_end > overlap_start:
+                generated = [_floor((t - first) * frequency) for t in (overlap_start, overlap_end)]
+                if count is not None:
+                    generated = [min(g, count) for g in generated]
+                pulses += generated[1] - generated[0]
+        return pulses
+
+    def _count(self, task, now):
+        channel = self._channel(task.channels[0])
+        if not task.running:
+            return task.count
+        if 'source' in channel:
+            return self._pulses(channel['source'], task.start_time, now)
+        return int((now - task.start_time) * channel.get('rate', 0.))
+
+    # system
+
+    @daqmx_function
+    def DAQmxGetErrorString(self, code, buf, size):
+        _set_string(buf, size, ERRORS.get(_value(code), 'unknown error %d' % _value(code)))
+
+    @daqmx_function
+    def DAQmxGetSysNIDAQMajorVersion(self, version):
+        _set(version, NIDAQ_VERSION[0])
+
+    @daqmx_function
+    def DAQmxGetSysNIDAQMinorVersion(self, version):
+        _set(version, NIDAQ_VERSION[1])
+
+    @daqmx_function
+    def DAQmxGetSysDevNames(self, buf, size):
+        _set_string(buf, size, ', '.join(self.config.get('devices', [])))
+
+    @daqmx_function
+    def DAQmxGetSysGlobalChans(self, buf, size):
+        _set_string(buf, size, ', '.join(sorted(self.config['channels'])))
+
+    @daqmx_function
+    def DAQmxGetSysTasks(self, buf, size):
+        _set_string(buf, size, ', '.join(sorted(self.config.get('tasks', {}))))
+
+    # tasks
+
+    @daqmx_function
+    def DAQmxCreateTask(self, name, handle):
+        self._new_handle(_value(name), handle)
+
+    @daqmx_function
+    def DAQmxLoadTask(self, name, handle):
+        name = _value(name)
+        tasks = self.config.get('tasks', {})
+        if name not in tasks:
+            raise SimulatorError(ERROR_INVALID_TASK)
+        for channel in tasks[name]:
+            self._channel(channel)
+        self._new_handle(name, handle).channels = list(tasks[name])
+
+    @daqmx_function
+    def DAQmxAddGlobalChansToTask(self, handle, names):
+        task = self._task(handle)
+        names = [name.strip() for name in _value(names).split(',')]
+        for name in names:
+            self._channel(name)
+        task.channels.extend(names)
+
+    @daqmx_function
+    def DAQmxClearTask(self, handle):
+        task = self._task(handle)
+        if task.running:
+            self._stop(task)
+        with self.lock:
+            del self.tasks[_value(handle)]
+
+    @daqmx_function
+    def DAQmxGetTaskChannels(self, handle, buf, size):
+        _set_string(buf, size, ', '.join(self._task(handle).channels))
+
+    @daqmx_function
+    def DAQmxGetChanType(self, handle, channel, channel_type):
+        self._task(handle)
+        _set(channel_type, constants[CHANNEL_TYPES[self._channel(_value(channel))['type']]])
+
+    @daqmx_function
+    def DAQmxGetPhysicalChanName(self, handle, channel, buf, size):
+        task = self._task(handle)
+        _set_string(buf, size, self._task_channel(task, _value(channel))['physical'])
+
+    @daqmx_function
+    def DAQmxStartTask(self, handle):
+        task = self._task(handle)
+        if task.running:
+            raise SimulatorError(ERROR_TASK_RUNNING)
+        self._type(task)
+        self.sleep(START_LATENCY)
+        now = self._now()
+        if task.trigger is not None:
+            now = self._next_edge(task.trigger[0], task.trigger[1], now)
+        task.running = True
+        task.start_time = now
+        task.stop_time = None
+        task.read = 0
+        if self._type(task) == 'CO':
+            channel = self._channel(task.channels[0])
+            start = now + task.initial_delay
+            frequency = channel.get('frequency', 1000.)
+            if task.is_finite():
+                end, count = start + task.samples / frequency, task.samples
+            else:
+                end, count = None, None
+            with self.lock:
+                self.generations.setdefault(task.channels[0], []).append([start, end, frequency, count])
+            task.rate = frequency
+            task.start_time = start
+
+    def _stop(self, task):
+        now = self._now()
+        task.count = self._count(task, now) if self._type(task) == 'CI' else 0
+        task.running = False
+        task.stop_time = now
+        if self._type(task) == 'CO':
+            with self.lock:
+                generation = self.generations[task.channels[0]][-1]
+                if generation[1] is None or generation[1] > now:
+                    generation[1] = now
+        self.sleep(STOP_LATENCY)
+
+    @daqmx_function
+    def DAQmxStopTask(self, handle):
+        task = self._task(handle)
+        if not task.running:
+            return
+        stopped_early = task.is_finite() and not self._is_done(task)
+        self._stop(task)
+        if stopped_early and self._type(task) in ('AI', 'CO'):
+            raise SimulatorError(WARNING_STOPPED_BEFORE_DONE)
+
+    @daqmx_function
+    def DAQmxIsTaskDone(self, handle, is_done):
+        _set(is_done, int(self._is_done(self._task(handle))))
+
+    @daqmx_function
+    def DAQmxGetTaskComplete(self, handle, is_done):
+        _set(is_done, int(self._is_done(self._task(handle))))
+
+    @daqmx_function
+    def DAQmxWaitUntilTaskDone(self, handle, timeout):
+        task = self._task(handle)
+        timeout = _value(timeout)
+        if not task.running:
+            return
+        end = task.end_time()
+        if end is None:
+            if timeout >= 0:
+                self.sleep(timeout)
+            raise SimulatorError(ERROR_WAIT_TIMED_OUT)
+        wait = end - self._now()
+        if timeout >= 0 and wait > timeout:
+            self.sleep(timeout)
+            raise SimulatorError(ERROR_WAIT_TIMED_OUT)
+        if wait > 0:
+            self.sleep(wait)
+
+    @daqmx_function
+    def DAQmxSaveGlobalChan(self, handle, channel, save_as, author, options):
+        self._task(handle)
+
+    # timing
+
+    @daqmx_function
+    def DAQmxSetSampQuantSampMode(self, handle, mode):
+        self._task(handle).sample_mode = _value(mode)
+
+    @daqmx_function
+    def DAQmxSetSampTimingType(self, handle, timing):
+        self._task(handle).sample_timing = _value(timing)
+
+    @daqmx_function
+    def DAQmxCfgSampClkTiming(self, handle, source, rate, edge, mode, samples):
+        task = self._task(handle)
+        self._set_rate(task, _value(rate))
+        task.sample_timing = constants['DAQmx_Val_SampClk']
+        task.sample_mode = _value(mode)
+        task.samples = _value(samples)
+
+    @daqmx_function
+    def DAQmxCfgImplicitTiming(self, handle, mode, samples):
+        task = self._task(handle)
+        task.sample_mode = _value(mode)
+        task.samples = _value(samples)
+
+    def _max_rate(self, task):
+        return MAX_SAMPLING_RATE / max(len(task.channels), 1)
+
+    @daqmx_function
+    def DAQmxGetSampClkRate(self, handle, rate):
+        _set(rate, self._task(handle).rate)
+
+    def _set_rate(self, task, rate):
+        if not 0 < rate <= self._max_rate(task):
+            raise SimulatorError(ERROR_INVALID_ATTRIBUTE_VALUE)
+        task.rate = float(rate)
+
+    @daqmx_function
+    def DAQmxSetSampClkRate(self, handle, rate):
+        self._set_rate(self._task(handle), _value(rate))
+
+    @daqmx_function
+    def DAQmxGetSampClkMaxRate(self, handle, rate):
+        _set(rate, self._max_rate(self._task(handle)))
+
+    @daqmx_function
+    def DAQmxSetSampQuantSampPerChan(self, handle, samples):
+        samples = _value(samples)
+        if samples < 1:
+            raise SimulatorError(ERROR_INVALID_ATTRIBUTE_VALUE)
+        self._task(handle).samples = samples
+
+    @daqmx_function
+    def DAQmxGetSampQuantSampPerChan(self, handle, samples):
+        _set(samples, self._task(handle).samples)
+
+    @daqmx_function
+    def DAQmxCfgInputBuffer(self, handle, samples):
+        self._task(handle).buffer_size = _value(samples)
+
+    @daqmx_function
+    def DAQmxGetBufInputBufSize(self, handle, samples):
+        _set(samples, self._input_buffer_size(self._task(handle)))
+
+    @daqmx_function
+    def DAQmxGetReadAvailSampPerChan(self, handle, samples):
+        task = self._task(handle)
+        _set(samples, self._acquired(task, self._now()) - task.read)
+
+    @daqmx_function
+    def DAQmxGetReadTotalSampPerChanAcquired(self, handle, samples):
+        task = self._task(handle)
+        _set(samples, self._acquired(task, self._now()))
+
+    # triggers
+
+    @daqmx_function
+    def DAQmxCfgDigEdgeStartTrig(self, handle, source, edge):
+        self._task(handle).trigger = (_value(source), _value(edge))
+
+    @daqmx_function
+    def DAQmxDisableStartTrig(self, handle):
+        self._task(handle).trigger = None
+
+    @daqmx_function
+    def DAQmxGetStartTrigType(self, handle, trigger_type):
+        task = self._task(handle)
+        _set(
+            trigger_type,
+            constants['DAQmx_Val_DigEdge' if task.trigger else 'DAQmx_Val_None']
+        )
+
+    @daqmx_function
+    def DAQmxGetDigEdgeStartTrigSrc(self, handle, buf, size):
+        task = self._task(handle)
+        _set_string(buf, size, task.trigger[0] if task.trigger else '')
+
+    @daqmx_function
+    def DAQmxGetDigEdgeStartTrigEdge(self, handle, edge):
+        task = self._task(handle)
+        _set(edge, task.trigger[1] if task.trigger else constants['DAQmx_Val_Rising'])
+
+    # analog input
+
+    @daqmx_function
+    def DAQmxGetAIMeasType(self, handle, channel, measurement_type):
+        task = self._task(handle)
+        self._require(task, 'AI')
+        units = self._task_channel(task, _value(channel)).get('units', 'volts')
+        _set(measurement_type, constants[UNITS.get(units, UNITS['volts'])[0]])
+
+    def _units(self, handle, channel, unit_type, *types):
+        task = self._task(handle)
+        self._require(task, *types)
+        units = self._task_channel(task, _value(channel)).get('units', 'volts')
+        if units in UNITS:
+            _set(unit_type, constants[UNITS[units][1]])
+        else:
+            _set(unit_type, constants['DAQmx_Val_FromCustomScale'])
+
+    @daqmx_function
+    def DAQmxGetAIVoltageUnits(self, handle, channel, unit_type):
+        self._units(handle, channel, unit_type, 'AI')
+
+    @daqmx_function
+    def DAQmxGetAICurrentUnits(self, handle, channel, unit_type):
+        self._units(handle, channel, unit_type, 'AI')
+
+    @daqmx_function
+    def DAQmxGetAITempUnits(self, handle, channel, unit_type):
+        self._units(handle, channel, unit_type, 'AI')
+
+    def _scale_name(self, handle, channel, buf, size, *types):
+        task = self._task(handle)
+        self._require(task, *types)
+        name = _value(channel) or task.channels[0]
+        self._channel(name)
+        _set_string(buf, size, name + ' scale')
+
+    @daqmx_function
+    def DAQmxGetAICustomScaleName(self, handle, channel, buf, size):
+        self._scale_name(handle, channel, buf, size, 'AI')
+
+    @daqmx_function
+    def DAQmxGetScaleScaledUnits(self, scale, buf, size):
+        name = _value(scale)[:-len(' scale')]
+        _set_string(buf, size, self._channel(name).get('units', 'volts'))
+
+    @daqmx_function
+    def DAQmxReadAnalogF64(self, handle, samples, timeout, fill_mode, data, size, read, reserved):
+        task = self._task(handle)
+        self._require(task, 'AI')
+        samples = _value(samples)
+        timeout = _value(timeout)
+        if task.start_time is None:
+            raise SimulatorError(ERROR_SAMPLES_NOT_YET_AVAILABLE)
+        if samples == constants['DAQmx_Val_Auto']:
+            if task.is_finite():
+                samples = task.samples - task.read
+            else:
+                samples = self._acquired(task, self._now()) - task.read
+        # wait for the samples asked for
+        ready = task.start_time + (task.read + samples - 1) / task.rate
+        wait = ready - self._now()
+        if samples and wait > 0:
+            if timeout >= 0 and wait > timeout:
+                self.sleep(timeout)
+                raise SimulatorError(ERROR_SAMPLES_NOT_YET_AVAILABLE)
+            self.sleep(wait)
+        acquired = self._acquired(task, self._now())
+        if task.read + samples > acquired:
+            raise SimulatorError(ERROR_SAMPLES_NOT_YET_AVAILABLE)
+        if acquired - task.read > self._input_buffer_size(task):
+            raise SimulatorError(ERROR_SAMPLES_NO_LONGER_AVAILABLE)
+        channels = len(task.channels)
+        if samples * channels > _value(size):
+            raise SimulatorError(ERROR_READ_BUFFER_TOO_SMALL)
+        values = np.array(
+            [self._waveform(name, task, task.read, samples) for name in task.channels]
+        )
+        if _value(fill_mode) != constants['DAQmx_Val_GroupByChannel']:
+            values = values.T
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        ctypes.memmove(data, values.ctypes.data, values.nbytes)
+        task.read += samples
+        if read is not None:
+            _set(read, samples)
+
+    # analog output
+
+    @daqmx_function
+    def DAQmxGetAOOutputType(self, handle, channel, output_type):
+        task = self._task(handle)
+        self._require(task, 'AO')
+        units = self._task_channel(task, _value(channel)).get('units', 'volts')
+        _set(output_type, constants[UNITS.get(units, UNITS['volts'])[0]])
+
+    @daqmx_function
+    def DAQmxGetAOVoltageUnits(self, handle, channel, unit_type):
+        self._units(handle, channel, unit_type, 'AO')
+
+    @daqmx_function
+    def DAQmxGetAOCurrentUnits(self, handle, channel, unit_type):
+        self._units(handle, channel, unit_type, 'AO')
+
+    @daqmx_function
+    def DAQmxGetAOCustomScaleName(self, handle, channel, buf, size):
+        self._scale_name(handle, channel, buf, size, 'AO')
+
+    @daqmx_function
+    def DAQmxGetAOMin(self, handle, channel, value):
+        task = self._task(handle)
+        self._require(task, 'AO')
+        _set(value, self._task_channel(task, _value(channel)).get('min', -10.))
+
+    @daqmx_function
+    def DAQmxGetAOMax(self, handle, channel, value):
+        task = self._task(handle)
+        self._require(task, 'AO')
+        _set(value, self._task_channel(task, _value(channel)).get('max', 10.))
+
+    @daqmx_function
+    def DAQmxWriteAnalogScalarF64(self, handle, autostart, timeout, value, reserved):
+        task = self._task(handle)
+        self._require(task, 'AO')
+        channel = self._channel(task.channels[0])
+        value = _value(value)
+        if not channel.get('min', -10.) <= value <= channel.get('max', 10.):
+            raise SimulatorError(ERROR_INVALID_ATTRIBUTE_VALUE)
+        self.outputs[task.channels[0]] = value
+
+    # digital output
+
+    @daqmx_function
+    def DAQmxWriteDigitalScalarU32(self, handle, autostart, timeout, value, reserved):
+        task = self._task(handle)
+        self._require(task, 'DO')
+        self.line_states[task.channels[0]] = _value(value)
+
+    # counters
+
+    @daqmx_function
+    def DAQmxReadCounterScalarU32(self, handle, timeout, count, reserved):
+        task = self._task(handle)
+        self._require(task, 'CI')
+        _set(count, self._count(task, self._now()))
+
+    @daqmx_function
+    def DAQmxGetCOPulseTimeInitialDelay(self, handle, channel, delay):
+        task = self._task(handle)
+        self._require(task, 'CO')
+        _set(delay, task.initial_delay)
+
+    @daqmx_function
+    def DAQmxSetCOPulseTimeInitialDelay(self, handle, channel, delay):
+        task = self._task(handle)
+        self._require(task, 'CO')
+        task.initial_delay = _value(delay)
+
+    @daqmx_function
+    def DAQmxGetCOPulseDone(self, handle, channel, done):
+        task = self._task(handle)
+        self._require(task, 'CO')
+        _set(done, int(self._is_done(task)))
@@ -14,30 +14,41 @@ class Task(object):
     AI,AO,DI,DO,CI,CO,EMPTY=0,1,2,3,4,5,6
     TASK_TYPES = (AI,AO,DI,DO,CI,CO,EMPTY)
 
-    majversionraw = c_uint32(0)
-    minversionraw = c_uint32(0)
-    daqmx(
-        dll.DAQmxGetSysNIDAQMajorVersion,
-        (
-            byref(majversionraw),
-        )
-    )
-    daqmx(
-        dll.DAQmxGetSysNIDAQMinorVersion,
-        (
-            byref(minversionraw),
-        )
-    )
-    majversion = majversionraw.value
-    minversion = minversionraw.value
-    _handle = c_uint if (
-            (
-                majversion < 8
-            ) or
-            (
-                majversion == 8 and minversion <= 8
+    _handle_type = None
+
+    @classmethod
+    def _handle(cls,value=0):
+        """
+        task handle of the c type used by the installed DAQmx
+        version, which is looked up the first time so that
+        importing tasks does not load the driver
+        """
+        if Task._handle_type is None:
+            majversionraw = c_uint32(0)
+            minversionraw = c_uint32(0)
+            daqmx(
+                dll.DAQmxGetSysNIDAQMajorVersion,
+                (
+                    byref(majversionraw),
+                )
             )
-    ) else c_void_p
+            daqmx(
+                dll.DAQmxGetSysNIDAQMinorVersion,
+                (
+                    byref(minversionraw),
+                )
+            )
+            majversion = majversionraw.value
+            minversion = minversionraw.value
+            Task._handle_type = c_uint if (
+                    (
+                        majversion < 8
+                    ) or
+                    (
+                        majversion == 8 and minversion <= 8
+                    )
+            ) else c_void_p
+        return Task._handle_type(value)
 
     def __init__(self,*channels):
         """
@@ -1,12 +1,91 @@
 from daqmx import *
 from daqmx.task import Task
 import numpy as np
-from time import clock
+import threading
+from time import time
+
+RING_WINDOWS = 4
+"""windows of samples kept per channel in continuous mode"""
+
+READ_INTERVAL = .01
+"""seconds of samples taken from the driver at a time in continuous mode"""
+
+DRIVER_BUFFER = 1.
+"""minimum seconds of samples the driver buffers in continuous mode"""
+
+ERROR_SAMPLING_STOPPED = -201452
+"""DAQmx error code (operation aborted) raised by get_latest when continuous sampling stops"""
+
+class RingBuffer(object):
+    """
+    preallocated buffer holding the most recent samples
+    of each channel, written by one thread and read by
+    others
+    """
+    def __init__(self,channels,size):
+        self.data = np.zeros((channels,size))
+        self.size = size
+        self.written = 0
+        self.error = None
+        self.condition = threading.Condition()
+
+    def write(self,samples):
+        """
+        @param samples: array of shape (channels, samples)
+        """
+        count = samples.shape[1]
+        if count > self.size:
+            samples = samples[:,-self.size:]
+        with self.condition:
+            start = (self.written + count - samples.shape[1]) % self.size
+            first = min(samples.shape[1],self.size - start)
+            self.data[:,start:start + first] = samples[:,:first]
+            self.data[:,:samples.shape[1] - first] = samples[:,first:]
+            self.written += count
+            self.condition.notify_all()
+
+    def fail(self,error):
+        """make readers raise error"""
+        with self.condition:
+            self.error = error
+            self.condition.notify_all()
+
+    def latest(self,count,rows=None,timeout=None):
+        """
+        copy of the last count samples of some channels,
+        waiting until that many have been written
+
+        @param rows: indices of channels, or all if C{None}
+        """
+        if count > self.size:
+            raise ValueError(
+                'ring buffer holds %d samples, %d requested' % (self.size,count)
+            )
+        deadline = None if timeout is None else time() + timeout
+        with self.condition:
+            while self.written < count and self.error is None:
+                remaining = None if deadline is None else deadline - time()
+                if remaining is not None and remaining <= 0:
+                    raise DAQmxException(
+                        -200284,
+                        'samples requested have not yet been acquired'
+                    )
+                self.condition.wait(remaining)
+            if self.error is not None:
+                raise self.error
+            columns = np.arange(self.written - count,self.written) % self.size
+            if rows is None:
+                return self.data[:,columns]
+            return self.data[np.ix_(rows,columns)]
+
 class AITask(Task):
     RISING, FALLING = 'rising','falling'
 
     def __init__(self,*channels):
         Task.__init__(self,*channels)
+        self.ring = None
+        self.reader = None
+        self.continuous_channels = None
         daqmx(
             dll.DAQmxSetSampQuantSampMode,
             (
@@ -75,6 +154,127 @@ class AITask(Task):
         )
         return {channel: data for channel, data in zip(channels,byChannel)}
 
+    def start_continuous(self,window):
+        """
+        start sampling continuously, with a thread reading
+        the samples into a ring buffer that holds
+        L{RING_WINDOWS} windows of the most recent samples
+
+        @param window: samples per channel of a window
+        @type window: int
+        """
+        channels = self.continuous_channels = self.get_channels()
+        rate = self.get_sampling_rate()
+        self.ring = RingBuffer(len(channels),window * RING_WINDOWS)
+        daqmx(
+            dll.DAQmxSetSampQuantSampMode,
+            (
+                self.handle,
+                constants['DAQmx_Val_ContSamps']
+            )
+        )
+        daqmx(
+            dll.DAQmxCfgInputBuffer,
+            (
+                self.handle,
+                c_uint32(max(self.ring.size,int(rate * DRIVER_BUFFER)))
+            )
+        )
+        daqmx(
+            dll.DAQmxStartTask,
+            (
+                self.handle,
+            )
+        )
+        self.reader = threading.Thread(
+            target=self._read_continuously,
+            args=(len(channels),max(int(rate * READ_INTERVAL),1))
+        )
+        self.reader.daemon = True
+        self.reading = True
+        self.reader.start()
+
+    def _read_continuously(self,channels,chunk):
+        samples = np.zeros(channels * chunk)
+        samplesRead = c_int(0)
+        while self.reading:
+            try:
+                daqmx(
+                    dll.DAQmxReadAnalogF64,
+                    (
+                        self.handle,
+                        chunk,
+                        c_double(TIMEOUT),
+                        constants['DAQmx_Val_GroupByChannel'],
+                        samples.ctypes.data_as(POINTER(c_double)),
+                        samples.size,
+                        byref(samplesRead),
+                        None
+                    )
+                )
+            except DAQmxException, e:
+                if self.reading:
+                    self.ring.fail(e)
+                return
+            count = samplesRead.value
+            self.ring.write(
+                np.reshape(samples[:channels * count],(channels,count))
+            )
+
+    def stop_continuous(self):
+        """
+        stop sampling continuously, making calls to
+        L{get_latest} still waiting for samples raise
+        """
+        self.reading = False
+        self.ring.fail(
+            DAQmxException(
+                ERROR_SAMPLING_STOPPED,
+                'continuous sampling was stopped'
+            )
+        )
+        self.reader.join()
+        self.reader = None
+        daqmx(
+            dll.DAQmxStopTask,
+            (
+                self.handle,
+            )
+        )
+        daqmx(
+            dll.DAQmxSetSampQuantSampMode,
+            (
+                self.handle,
+                constants['DAQmx_Val_FiniteSamps']
+            )
+        )
+
+    def is_continuous(self):
+        return self.reader is not None
+
+    def has_samples(self,samples):
+        """whether get_latest can return samples without waiting"""
+        return self.ring.written >= samples and self.ring.error is None
+
+    def has_failed(self):
+        """whether continuous sampling stopped with an error"""
+        return self.ring.error is not None
+
+    def get_latest(self,samples,channels=None,timeout=None):
+        """
+        most recent samples acquired in continuous mode,
+        waiting for them if sampling only just started
+
+        @param samples: samples per channel
+        @param channels: channels to get, or all if C{None}
+        @returns: dict of arrays of samples by channel
+        """
+        if channels is None:
+            channels = self.continuous_channels
+        rows = [self.continuous_channels.index(channel) for channel in channels]
+        data = self.ring.latest(samples,rows,timeout)
+        return {channel: series for channel, series in zip(channels,data)}
+
     def get_sampling_rate(self):
         sampling_rate = c_double(0)
         daqmx(
@@ -0,0 +1,107 @@
+import pytest
+import threading
+import time
+import unittest
+
+import numpy as np
+
+import daqmx
+from daqmx import simulator
+from daqmx.task.ai import AITask, RingBuffer, ERROR_SAMPLING_STOPPED
+
+
+CONFIG = {
+    'devices': ['Dev1'],
+    'channels': {
+        'offset': {'type': 'AI', 'physical': 'Dev1/ai0', 'offset': 1.5},
+        'ground': {'type': 'AI', 'physical': 'Dev1/ai1'},
+    },
+}
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def test_wraps_around(self):
+        ring = RingBuffer(2, 5)
+        ring.write(np.array([[0., 1, 2], [10, 11, 12]]))
+        ring.write(np.array([[3., 4, 5, 6], [13, 14, 15, 16]]))
+        self.assertEqual(7, ring.written)
+        np.testing.assert_array_equal([[2, 3, 4, 5, 6], [12, 13, 14, 15, 16]],
+                                      ring.latest(5))
+        np.testing.assert_array_equal([[15, 16]], ring.latest(2, [1]))
+
+    def test_keeps_end_of_long_writes(self):
+        ring = RingBuffer(1, 3)
+        ring.write(np.array([[1.]]))
+        ring.write(np.arange(10.).reshape(1, 10))
+        self.assertEqual(11, ring.written)
+        np.testing.assert_array_equal([[7, 8, 9]], ring.latest(3))
+
+    def test_waits_for_samples(self):
+        ring = RingBuffer(1, 4)
+        ring.write(np.zeros((1, 1)))
+        with self.assertRaises(daqmx.DAQmxException) as e:
+            ring.latest(2, timeout=.01)
+        self.assertEqual(-200284, e.exception.code)
+        self.assertRaises(ValueError, ring.latest, 5)
+        ring.fail(daqmx.DAQmxException(-200279, 'overwritten'))
+        self.assertRaises(daqmx.DAQmxException, ring.latest, 1)
+
+
+class ContinuousTest(unittest.TestCase):
+
+    def setUp(self):
+        daqmx.dll.lib = simulator.Simulator(CONFIG)
+        daqmx.dll.name = daqmx.SIMULATED_DRIVER
+        self.task = AITask('offset', 'ground')
+        self.task.set_sampling_rate(10000.)
+        self.task.set_sample_quantity(100)
+
+    def tearDown(self):
+        if self.task.is_continuous():
+            self.task.stop_continuous()
+        daqmx.dll.lib = None
+        daqmx.dll.name = None
+
+    def test_latest_window(self):
+        self.task.start_continuous(100)
+        self.assertTrue(self.task.is_continuous())
+        samples = self.task.get_latest(100, ['offset'], timeout=1.)
+        self.assertEqual(['offset'], list(samples))
+        np.testing.assert_array_equal(np.ones(100) * 1.5, samples['offset'])
+        written = self.task.ring.written
+        time.sleep(.05)
+        self.assertTrue(self.task.ring.written > written)
+        self.assertTrue(self.task.has_samples(100))
+        self.assertEqual(['ground', 'offset'], sorted(self.task.get_latest(100)))
+        self.assertRaises(ValueError, self.task.get_latest, 100, ['missing'])
+
+    def test_back_to_finite(self):
+        self.task.start_continuous(100)
+        self.task.get_latest(100, timeout=1.)
+        self.task.stop_continuous()
+        self.assertFalse(self.task.is_continuous())
+        samples = self.task.acquire_samples()
+        np.testing.assert_array_equal(np.ones(100) * 1.5, samples['offset'])
+
+    def test_stopping_wakes_waiters(self):
+        self.task.set_sampling_rate(10.)
+        self.task.start_continuous(100)
+        errors = []
+
+        def wait():
+            try:
+                self.task.get_latest(100)
+            except daqmx.DAQmxException, e:
+                errors.append(e)
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        time.sleep(.05)
+        self.task.stop_continuous()
+        waiter.join(1.)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual([ERROR_SAMPLING_STOPPED], [e.code for e in errors])
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
@@ -0,0 +1,185 @@
+import json
+import os
+import pytest
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+import daqmx
+from daqmx import simulator
+from daqmx.task import Task
+from daqmx.task.ai import AITask
+from daqmx.task.ao import AOTask
+from daqmx.task.ci import CITask
+from daqmx.task.co import COTask, GenerationStoppedException
+from daqmx.task.do import DOTask
+
+
+CONFIG = {
+    'devices': ['Dev1'],
+    'channels': {
+        'offset': {'type': 'AI', 'physical': 'Dev1/ai0', 'offset': 1.5},
+        'sine': {'type': 'AI', 'physical': 'Dev1/ai1', 'amplitude': 2.,
+                 'frequency': 10.},
+        'thermocouple': {'type': 'AI', 'physical': 'Dev1/ai2', 'units': 'degs C'},
+        'pressure': {'type': 'AI', 'physical': 'Dev1/ai3', 'units': 'torr'},
+        'heater': {'type': 'AO', 'physical': 'Dev1/ao0', 'min': 0., 'max': 5.},
+        'direction': {'type': 'DO', 'physical': 'Dev1/port0/line5'},
+        'steps out': {'type': 'CO', 'physical': 'Dev1/ctr0', 'frequency': 10000.},
+        'steps in': {'type': 'CI', 'physical': 'Dev1/ctr1', 'source': 'steps out'},
+    },
+    'tasks': {'delay': ['steps out']},
+    'triggers': {'/Dev1/PFI0': .05},
+}
+
+
+class SimulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        daqmx.dll.lib = simulator.Simulator(CONFIG)
+        daqmx.dll.name = daqmx.SIMULATED_DRIVER
+
+    def tearDown(self):
+        daqmx.dll.lib = None
+        daqmx.dll.name = None
+
+    def test_finite_acquisition(self):
+        task = AITask('offset', 'sine')
+        self.assertEqual(simulator.MAX_SAMPLING_RATE / 2, task.get_max_sampling_rate())
+        task.set_sampling_rate(10000.)
+        task.set_sample_quantity(1000)
+        start = time.time()
+        samples = task.acquire_samples()
+        self.assertTrue(time.time() - start >= .1)
+        self.assertEqual(['offset', 'sine'], sorted(samples))
+        np.testing.assert_array_equal(np.ones(1000) * 1.5, samples['offset'])
+        self.assertAlmostEqual(0., samples['sine'].mean(), 6)
+        self.assertAlmostEqual(2., samples['sine'].max(), 2)
+        self.assertTrue(task.is_done())
+
+    def test_triggered_acquisition(self):
+        task = AITask('offset')
+        task.set_sample_quantity(1)
+        task.set_trigger('/Dev1/PFI0', AITask.FALLING)
+        self.assertTrue(task.is_triggering())
+        self.assertEqual('/Dev1/PFI0', task.get_trigger_source())
+        self.assertEqual(AITask.FALLING, task.get_trigger_edge())
+        for _ in range(3):
+            task.acquire_samples()
+        started = daqmx.dll.lib.tasks[task.handle.value].start_time
+        self.assertAlmostEqual(.5, (started / .05) % 1, 6)
+        task.unset_trigger()
+        self.assertFalse(task.is_triggering())
+
+    def test_continuous_reads(self):
+        task = AITask('offset')
+        daqmx.daqmx(daqmx.dll.DAQmxCfgSampClkTiming,
+                    (task.handle, None, daqmx.c_double(100000.),
+                     daqmx.constants['DAQmx_Val_Rising'],
+                     daqmx.constants['DAQmx_Val_ContSamps'], daqmx.c_uint64(0)))
+        daqmx.daqmx(daqmx.dll.DAQmxCfgInputBuffer, (task.handle, 1000))
+        daqmx.daqmx(daqmx.dll.DAQmxStartTask, (task.handle,))
+        data = np.zeros(100)
+        read = daqmx.c_int(0)
+        args = lambda samples: (task.handle, samples, daqmx.c_double(1.),
+                                daqmx.constants['DAQmx_Val_GroupByChannel'],
+                                data.ctypes.data_as(daqmx.POINTER(daqmx.c_double)),
+                                100, daqmx.byref(read), None)
+        daqmx.daqmx(daqmx.dll.DAQmxReadAnalogF64, args(100))
+        self.assertEqual(100, read.value)
+        time.sleep(.05)
+        with self.assertRaises(daqmx.DAQmxException) as e:
+            daqmx.daqmx(daqmx.dll.DAQmxReadAnalogF64, args(100))
+        self.assertEqual(simulator.ERROR_SAMPLES_NO_LONGER_AVAILABLE, e.exception.code)
+        daqmx.daqmx(daqmx.dll.DAQmxStopTask, (task.handle,))
+
+    def test_units(self):
+        self.assertEqual({'offset': 'volts'}, AITask('offset').get_units())
+        self.assertEqual({'thermocouple': 'degs C'}, AITask('thermocouple').get_units())
+        self.assertEqual({'pressure': 'torr'}, AITask('pressure').get_units())
+
+    def test_outputs(self):
+        heater = AOTask('heater')
+        heater.write_sample(2.5)
+        self.assertEqual((0., 5., 'volts'),
+                         (heater.get_min(), heater.get_max(), heater.get_units()))
+        self.assertEqual(2.5, daqmx.dll.lib.outputs['heater'])
+        self.assertRaises(daqmx.DAQmxException, heater.write_sample, 6.)
+        direction = DOTask('direction')
+        self.assertEqual(5, direction.exponent)
+        direction.write_state(True)
+        self.assertEqual(32, daqmx.dll.lib.line_states['direction'])
+
+    def test_counters(self):
+        steps_in = CITask('steps in')
+        steps_out = COTask('steps out')
+        steps_in.start_counting()
+        start = time.time()
+        steps_out.generate_pulses(500)
+        self.assertTrue(time.time() - start >= .05)
+        self.assertEqual(500, steps_in.get_count())
+        steps_in.stop_counting()
+        steps_out.generate_pulses(500)
+        self.assertEqual(500, steps_in.get_count())
+
+    def test_stopping_generation(self):
+        steps_out = COTask('steps out')
+        threading.Timer(.02, steps_out.stop_generation).start()
+        start = time.time()
+        self.assertRaises(GenerationStoppedException, steps_out.generate_pulses, 100000)
+        self.assertTrue(time.time() - start < 1.)
+
+    def test_errors_and_system(self):
+        self.assertEqual(['Dev1'], daqmx.get_devices())
+        channels = Task.get_global_channels()
+        self.assertEqual(['offset', 'pressure', 'sine', 'thermocouple'],
+                         channels[Task.AI])
+        handle = Task._handle(0)
+        daqmx.daqmx(daqmx.dll.DAQmxLoadTask, ('delay', daqmx.byref(handle)))
+        delay = daqmx.c_double(0)
+        daqmx.daqmx(daqmx.dll.DAQmxGetCOPulseTimeInitialDelay,
+                    (handle.value, None, daqmx.byref(delay)))
+        self.assertEqual(0., delay.value)
+        with self.assertRaises(daqmx.DAQmxException) as e:
+            AITask('missing')
+        self.assertEqual(simulator.ERROR_CHANNEL_NOT_FOUND, e.exception.code)
+        task = AITask('offset')
+        task.clear_task()
+        self.assertRaises(daqmx.DAQmxException, task.get_channels)
+
+
+class DriverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='daqmxtest')
+        self.environ = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        daqmx.dll.lib = None
+        daqmx.dll.name = None
+        shutil.rmtree(self.dir)
+
+    def test_select_driver(self):
+        filename = os.path.join(self.dir, 'config.json')
+        with open(filename, 'w') as file:
+            file.write(json.dumps(CONFIG))
+        os.environ[simulator.CONFIG_ENV] = filename
+        os.environ.pop(daqmx.DRIVER_ENV, None)
+        daqmx.select_driver(daqmx.SIMULATED_DRIVER)
+        self.assertEqual(daqmx.SIMULATED_DRIVER, daqmx.dll.name)
+        self.assertEqual(['direction'], Task.get_global_channels()[Task.DO])
+
+        os.environ[daqmx.DRIVER_ENV] = daqmx.SIMULATED_DRIVER
+        daqmx.dll.lib = None
+        self.assertEqual(['Dev1'], daqmx.get_devices()) # loaded on first use
+        self.assertRaises(ValueError, daqmx.load_driver, 'nope')
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
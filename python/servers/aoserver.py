@@ -1,6 +1,7 @@
 from deviceserver import DeviceServer, device_setting, DeviceSignal, Device
 from twisted.internet.defer import inlineCallbacks, Deferred
 import labrad
+from daqmx import select_driver, DRIVER_KEY
 from daqmx.task import Task
 from daqmx.task.ao import AOTask
 from twisted.internet.threads import deferToThread
@@ -68,6 +69,8 @@ class AnalogOutputServer(DeviceServer):
     def initServer(self):
         reg = self.client.registry
         reg.cd(REGISTRY_PATH)
+        dirs, keys = yield reg.dir()
+        select_driver((yield reg.get(DRIVER_KEY)) if DRIVER_KEY in keys else None)
         channels = self.channels = yield reg.get(CHANNELS)
         for channel in channels:
             self.add_device(
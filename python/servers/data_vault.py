@@ -35,13 +35,14 @@ from __future__ import absolute_import
 import os
 import sys
 
-from twisted.internet import reactor
+from twisted.internet import reactor, threads
 from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.python import log
 
 import labrad.util
 import labrad.wrappers
 
-from datavault import SessionStore
+from datavault import SessionStore, backend, cache, executor, search
 from datavault.server import DataVault
 
 
@@ -81,6 +82,59 @@ def load_settings(cxn, name):
         print 'To change this, edit the registry keys and restart the server.'
     returnValue(datadir)
 
+@inlineCallbacks
+def load_storage_profile(cxn, name):
+    """Load the server-wide HDF5 storage profile from the registry.
+
+    The profile name is read from the 'Storage Profile' key in the
+    server's registry directory.  If the key is missing, the default
+    profile is used.
+    """
+    path = ['', 'Servers', name]
+    reg = cxn.registry
+    yield reg.cd(path, True)
+    (dirs, keys) = yield reg.dir()
+    if 'Storage Profile' in keys:
+        profile = yield reg.get('Storage Profile')
+        backend.get_storage_profile(profile) # check that the name is valid
+    else:
+        profile = None
+    returnValue(profile)
+
+@inlineCallbacks
+def load_max_open_files(cxn, name):
+    """Load the most data files to keep open at once from the registry.
+
+    The number is read from the 'Max Open Files' key in the server's
+    registry directory.  If the key is missing, the default is used.
+    """
+    path = ['', 'Servers', name]
+    reg = cxn.registry
+    yield reg.cd(path, True)
+    (dirs, keys) = yield reg.dir()
+    if 'Max Open Files' in keys:
+        max_open = yield reg.get('Max Open Files')
+    else:
+        max_open = backend.FILE_POOL_MAX_OPEN
+    returnValue(int(max_open))
+
+@inlineCallbacks
+def load_cache_bytes(cxn, name):
+    """Load the byte budget of the block cache from the registry.
+
+    The number is read from the 'Cache Bytes' key in the server's registry
+    directory.  If the key is missing, the default is used.
+    """
+    path = ['', 'Servers', name]
+    reg = cxn.registry
+    yield reg.cd(path, True)
+    (dirs, keys) = yield reg.dir()
+    if 'Cache Bytes' in keys:
+        max_bytes = yield reg.get('Cache Bytes')
+    else:
+        max_bytes = cache.CACHE_MAX_BYTES
+    returnValue(int(max_bytes))
+
 def main(argv=sys.argv):
     @inlineCallbacks
     def start():
@@ -88,10 +142,26 @@ def main(argv=sys.argv):
         cxn = yield labrad.wrappers.connectAsync(
             host=opts['host'], port=int(opts['port']), password=opts['password'])
         datadir = yield load_settings(cxn, opts['name'])
+        storage_profile = yield load_storage_profile(cxn, opts['name'])
+        backend.get_file_pool().max_open = yield load_max_open_files(cxn, opts['name'])
+        cache.get_block_cache().max_bytes = yield load_cache_bytes(cxn, opts['name'])
         yield cxn.disconnect()
-        session_store = SessionStore(datadir, hub=None)
+        # dataset reads and writes run in worker threads, so that a large
+        # read does not hold up other clients
+        io_executor = executor.ThreadPoolExecutor(executor.IO_THREADS)
+        io_executor.start()
+        # datasets are indexed for searching as they change, and datasets
+        # changed while we were not running are picked up in the background
+        search_index = search.SearchIndex(
+                os.path.join(datadir, search.SEARCH_INDEX_FILE))
+        session_store = SessionStore(datadir, hub=None,
+                                     storage_profile=storage_profile,
+                                     io_executor=io_executor,
+                                     search_index=search_index)
         server = DataVault(session_store)
         session_store.hub = server
+        d = threads.deferToThread(search.crawl, search_index, datadir)
+        d.addErrback(log.err, 'Failed to update the search index')
 
         # Run the server. We do not need to start the reactor, but we will
         # stop it after the data_vault shuts down.
@@ -1,13 +1,22 @@
 import base64
+import bisect
 from datetime import datetime
+import json
 import os
 import re
 import collections
+import StringIO
+import time
 import weakref
 
+import numpy as np
+from twisted.internet import defer, reactor
+from twisted.python import log
+
 from labrad import types as T
 
-from . import backend, errors, util
+from . import backend, decimate, errors, executor, search, util
+from .subscriptions import SubscriptionRegistry
 
 
 ## Filename translation.
@@ -82,11 +91,226 @@ def parse_dependent(s):
 DATA_URL_PREFIX = 'data:application/labrad;base64,'
 
 
+## write-behind buffering of added data
+
+WRITE_BUFFER_ROWS = 10000 # flush when this many rows are waiting
+WRITE_BUFFER_BYTES = 4*1024**2 # or when they take up this much memory
+WRITE_BUFFER_DELAY = 1.0 # or when the oldest row has waited this long (sec)
+
+## Read cursors.
+
+CURSOR_PAGE_BYTES = 4*1024**2 # largest page a cursor returns
+
+## Push-mode streaming.
+
+STREAM_MAX_ROWS = 10000 # most rows per streamed message
+STREAM_MAX_BYTES = 1024**2 # most bytes of row data per streamed message
+STREAM_MIN_INTERVAL = 0.05 # least seconds between streamed messages
+
+## Session metadata.
+
+SESSION_SAVE_DELAY = 5.0 # seconds from the first change to saving session.ini
+
+def _tags_to_json(tags):
+    # names and tags are byte strings; latin-1 maps every byte to a character
+    tags = dict((name, sorted(entry_tags)) for name, entry_tags in tags.items())
+    s = json.dumps(tags, encoding='latin-1', sort_keys=True)
+    # the config parser does not allow % in values
+    return s.replace('%', '\\u0025')
+
+def _tags_from_json(s):
+    return dict((name.encode('latin-1'), set(t.encode('latin-1') for t in tags))
+                for name, tags in json.loads(s).items())
+
+## Session directory index.
+
+SESSION_INDEX_FILE = 'session.index'
+SESSION_INDEX_VERSION = 2
+# directory times this close to now may not reflect the latest change yet
+SESSION_INDEX_MTIME_SLACK = 2.0 # seconds
+
+
+def _index_entry(filename):
+    """The (extension, name) of a directory entry, if it is one we list."""
+    base, _, ext = filename.rpartition('.')
+    if not base or ext not in ('dir', 'csv', 'ini', 'hdf5'):
+        return None
+    if filename.lower() == 'session.ini':
+        return None
+    return ext, filename_decode(base)
+
+def _invert_tags(tags):
+    """Turn a dict of name -> tags into a dict of tag -> set of names."""
+    names = collections.defaultdict(set)
+    for name, entry_tags in tags.items():
+        for tag in entry_tags:
+            names[tag].add(name)
+    return names
+
+
+class SessionIndex(object):
+    """Index of the subdirectories and datasets of a session directory.
+
+    Listing a directory with tens of thousands of datasets and decoding
+    every filename is slow, so the decoded names are kept here and only
+    new directory entries are decoded.  Changes made on disk are noticed
+    through the modification time of the directory.  The index is saved
+    next to session.ini, so that a session is also quick to open after the
+    data vault is restarted.  It is saved as JSON, since anyone who can
+    write to the data directory can write the file.
+    """
+
+    def __init__(self, path):
+        self.dir = path
+        self.indexfile = os.path.join(path, SESSION_INDEX_FILE)
+        self._entries = {} # filename -> (extension, decoded name)
+        self._mtime = None
+        self._saved_mtime = None
+        self._load()
+        self._changed()
+
+    def _load(self):
+        try:
+            with open(self.indexfile, 'rb') as f:
+                index = json.load(f)
+            if index['version'] != SESSION_INDEX_VERSION:
+                return
+            mtime = index['mtime']
+            # filenames and names are byte strings, saved as latin-1
+            entries = dict(
+                    (filename.encode('latin-1'),
+                     (str(ext), name.encode('latin-1')))
+                    for filename, (ext, name) in index['entries'].items())
+        except Exception:
+            # a missing or damaged index is rebuilt from the directory
+            return
+        self._entries = entries
+        self._mtime = self._saved_mtime = mtime
+
+    def _save(self):
+        index = {
+            'version': SESSION_INDEX_VERSION,
+            'mtime': self._mtime,
+            'entries': self._entries,
+        }
+        try:
+            with open(self.indexfile, 'wb') as f:
+                json.dump(index, f, encoding='latin-1')
+            self._saved_mtime = self._mtime
+        except (IOError, OSError):
+            log.err(None, 'Could not save session index {}'.format(self.indexfile))
+
+    def _changed(self):
+        self._dirs = None
+        self._listed = None
+        self._datasets = None
+        self._numbers = None
+
+    def refresh(self):
+        """Pick up changes made to the directory since it was last read."""
+        mtime = os.stat(self.dir).st_mtime
+        if mtime == self._mtime:
+            return
+        entries = {}
+        for filename in os.listdir(self.dir):
+            entry = self._entries.get(filename) or _index_entry(filename)
+            if entry is not None:
+                entries[filename] = entry
+        changed = set(entries) != set(self._entries)
+        self._entries = entries
+        if time.time() - mtime > SESSION_INDEX_MTIME_SLACK:
+            self._mtime = mtime
+        else:
+            # another change could still come with the same time
+            self._mtime = None
+        if changed:
+            self._changed()
+        if changed or self._mtime not in (None, self._saved_mtime):
+            self._save()
+
+    def add(self, filename):
+        """Add a file that was just created in the directory."""
+        entry = _index_entry(filename)
+        if entry is None or filename in self._entries:
+            return
+        self._entries[filename] = entry
+        # keep the cached views, which are expensive to rebuild for big
+        # directories
+        ext, name = entry
+        if ext == 'dir' and self._dirs is not None:
+            self._dirs.add(name)
+        if ext in ('ini', 'hdf5') and self._listed is not None:
+            self._listed.add(name)
+        if ext in ('csv', 'hdf5') and self._datasets is not None:
+            i = bisect.bisect_left(self._datasets, name)
+            if self._datasets[i:i + 1] != [name]:
+                self._datasets.insert(i, name)
+                if self._numbers is not None:
+                    self._addNumber(name)
+
+    def _names(self, extensions):
+        return set(name for ext, name in self._entries.values() if ext in extensions)
+
+    def dirs(self):
+        """Set of the names of the subdirectories."""
+        self.refresh()
+        if self._dirs is None:
+            self._dirs = self._names(('dir',))
+        return self._dirs
+
+    def listed(self):
+        """Set of the names of the datasets with metadata (ini or hdf5 files)."""
+        self.refresh()
+        if self._listed is None:
+            self._listed = self._names(('ini', 'hdf5'))
+        return self._listed
+
+    def datasets(self):
+        """Sorted list of the names of the datasets with data files."""
+        self.refresh()
+        if self._datasets is None:
+            self._datasets = sorted(self._names(('csv', 'hdf5')))
+        return self._datasets
+
+    def _addNumber(self, name):
+        try:
+            num = int(name[:5])
+        except ValueError:
+            return
+        self._numbers[num] = min(name, self._numbers.get(num, name))
+
+    def _numberMap(self):
+        datasets = self.datasets()
+        if self._numbers is None:
+            self._numbers = {}
+            for name in datasets:
+                self._addNumber(name)
+        return self._numbers
+
+    def byNumber(self, num):
+        """Name of the first dataset with the given number, or None."""
+        return self._numberMap().get(num)
+
+    def lastNumber(self):
+        """Highest dataset number in the directory, or 0."""
+        return max(self._numberMap() or [0])
+
+
 class SessionStore(object):
-    def __init__(self, datadir, hub):
+    def __init__(self, datadir, hub, storage_profile=None, io_executor=None,
+                 reactor=reactor, search_index=None):
         self._sessions = weakref.WeakValueDictionary()
         self.datadir = datadir
         self.hub = hub
+        self.storage_profile = storage_profile
+        self.io_executor = io_executor
+        self.search_index = search_index # a search.SearchIndex, or None
+        self.reactor = reactor
+        self.subscriptions = SubscriptionRegistry(reactor)
+        # datasets with rows not yet written, kept alive until they are
+        self.unwritten = set()
+        # infofile -> SessionInfo with unsaved changes
+        self.unsaved_info = {}
 
     def get_all(self):
         return self._sessions.values()
@@ -108,45 +332,40 @@ class SessionStore(object):
         path = tuple(path)
         if path in self._sessions:
             return self._sessions[path]
-        session = Session(self.datadir, path, self.hub, self)
+        session = Session(self.datadir, path, self.hub, self, self.reactor)
         self._sessions[path] = session
         return session
 
 
-class Session(object):
-    """Stores information about a directory on disk.
+class SessionInfo(object):
+    """Session metadata, stored in the session.ini file of a session directory.
 
-    One session object is created for each data directory accessed.
-    The session object manages reading from and writing to the config
-    file, and manages the datasets in this directory.
+    Changes are not saved right away, but collected for SESSION_SAVE_DELAY
+    seconds and then saved together, or when flush is called.  Unsaved
+    changes are kept even if the Session goes away, and are saved before
+    the file is read again.  The unsaved dict, shared by all sessions of a
+    SessionStore, holds each SessionInfo with unsaved changes by infofile.
     """
 
-    def __init__(self, datadir, path, hub, session_store):
-        """Initialization that happens once when session object is created."""
-        self.path = path
-        self.hub = hub
-        self.dir = filedir(datadir, path)
-        self.infofile = os.path.join(self.dir, 'session.ini')
-        self.datasets = weakref.WeakValueDictionary()
-
-        if not os.path.exists(self.dir):
-            os.makedirs(self.dir)
-
-            # notify listeners about this new directory
-            parent_session = session_store.get(path[:-1])
-            hub.onNewDir(path[-1], parent_session.listeners)
-
+    def __init__(self, infofile, reactor=reactor, unsaved=None):
+        self.unsaved = {} if unsaved is None else unsaved
+        pending = self.unsaved.get(infofile)
+        if pending is not None:
+            pending.flush()
+        self.infofile = infofile
+        self.reactor = reactor
+        self.save_delay = SESSION_SAVE_DELAY
+        self._dirty = False
+        self._save_call = None
+        self._tag_sets = None
         if os.path.exists(self.infofile):
             self.load()
         else:
             self.counter = 1
-            self.created = self.modified = datetime.now()
+            self.created = self.accessed = self.modified = datetime.now()
             self.session_tags = {}
             self.dataset_tags = {}
 
-        self.access() # update current access time and save
-        self.listeners = set()
-
     def load(self):
         """Load info from the session.ini file."""
         S = util.DVSafeConfigParser()
@@ -162,11 +381,19 @@ class Session(object):
 
         # get tags if they're there
         if S.has_section('Tags'):
-            self.session_tags = eval(S.get('Tags', 'sessions', raw=True))
-            self.dataset_tags = eval(S.get('Tags', 'datasets', raw=True))
+            sessions = S.get('Tags', 'sessions', raw=True)
+            datasets = S.get('Tags', 'datasets', raw=True)
+            if S.has_option('Tags', 'format') and S.get('Tags', 'format') == 'json':
+                self.session_tags = _tags_from_json(sessions)
+                self.dataset_tags = _tags_from_json(datasets)
+            else:
+                # older versions saved the repr of the tag dicts
+                self.session_tags = eval(sessions)
+                self.dataset_tags = eval(datasets)
         else:
             self.session_tags = {}
             self.dataset_tags = {}
+        self._tag_sets = None
 
     def save(self):
         """Save info to the session.ini file."""
@@ -184,65 +411,159 @@ class Session(object):
 
         sec = 'Tags'
         S.add_section(sec)
-        S.set(sec, 'sessions', repr(self.session_tags))
-        S.set(sec, 'datasets', repr(self.dataset_tags))
+        S.set(sec, 'format', 'json')
+        S.set(sec, 'sessions', _tags_to_json(self.session_tags))
+        S.set(sec, 'datasets', _tags_to_json(self.dataset_tags))
+
+        f = StringIO.StringIO()
+        S.write(f)
+        util.atomic_write(self.infofile, f.getvalue())
+        self._dirty = False
+
+    def changed(self, tags=False):
+        """Mark the metadata as changed, to be saved shortly.
+
+        tags should be set if the tag dicts were changed.
+        """
+        if tags:
+            self._tag_sets = None
+        self._dirty = True
+        self.unsaved[self.infofile] = self
+        if self._save_call is None:
+            self._save_call = self.reactor.callLater(self.save_delay, self.flush)
+
+    def flush(self):
+        """Save the metadata now if it has changed."""
+        if self.unsaved.get(self.infofile) is self:
+            del self.unsaved[self.infofile]
+        if self._save_call is not None:
+            if self._save_call.active():
+                self._save_call.cancel()
+            self._save_call = None
+        if self._dirty:
+            self.save()
+
+    def tagSets(self):
+        """Sets of the sessions and of the datasets with each tag."""
+        if self._tag_sets is None:
+            self._tag_sets = (_invert_tags(self.session_tags),
+                              _invert_tags(self.dataset_tags))
+        return self._tag_sets
+
+
+def _info_property(name):
+    return property(lambda self: getattr(self.info, name),
+                    lambda self, value: setattr(self.info, name, value))
+
+
+class Session(object):
+    """Stores information about a directory on disk.
+
+    One session object is created for each data directory accessed.
+    The session object manages the session metadata (see SessionInfo)
+    and the datasets in this directory.
+    """
+
+    counter = _info_property('counter')
+    created = _info_property('created')
+    accessed = _info_property('accessed')
+    modified = _info_property('modified')
+    session_tags = _info_property('session_tags')
+    dataset_tags = _info_property('dataset_tags')
+
+    def __init__(self, datadir, path, hub, session_store, reactor=reactor):
+        """Initialization that happens once when session object is created."""
+        self.path = path
+        self.hub = hub
+        self.session_store = session_store
+        self.dir = filedir(datadir, path)
+        self.infofile = os.path.join(self.dir, 'session.ini')
+        self.datasets = weakref.WeakValueDictionary()
+
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir)
+
+            # notify listeners about this new directory
+            parent_session = session_store.get(path[:-1])
+            hub.onNewDir(path[-1], parent_session.listeners)
+        self.index = SessionIndex(self.dir)
+        self.info = SessionInfo(self.infofile, reactor,
+                                unsaved=session_store.unsaved_info)
 
-        with open(self.infofile, 'w') as f:
-            S.write(f)
+        self.access() # update current access time
+        self.listeners = session_store.subscriptions.listeners()
+
+    def load(self):
+        """Load info from the session.ini file."""
+        self.info.load()
+
+    def save(self):
+        """Save info to the session.ini file."""
+        self.info.save()
+
+    def flush(self):
+        """Save info to the session.ini file now if it has changed."""
+        self.info.flush()
 
     def access(self):
-        """Update last access time and save."""
+        """Update last access time."""
         self.accessed = datetime.now()
-        self.save()
+        self.info.changed()
 
     def listContents(self, tagFilters):
         """Get a list of directory names in this directory."""
-        files = os.listdir(self.dir)
-        dirs = [filename_decode(s[:-4]) for s in files if s.endswith('.dir')]
-        csv_datasets = [filename_decode(s[:-4]) for s in files if s.endswith('.ini') and s.lower() != 'session.ini' ]
-        hdf5_datasets = [filename_decode(s[:-5]) for s in files if s.endswith('.hdf5')]
-        datasets = sorted(csv_datasets + hdf5_datasets)
+        dirs = self.index.dirs()
+        datasets = self.index.listed()
         # apply tag filters
-        def include(entries, tag, tags):
-            """Include only entries that have the specified tag."""
-            return [e for e in entries
-                    if e in tags and tag in tags[e]]
-        def exclude(entries, tag, tags):
-            """Exclude all entries that have the specified tag."""
-            return [e for e in entries
-                    if e not in tags or tag not in tags[e]]
+        session_sets, dataset_sets = self.info.tagSets()
         for tag in tagFilters:
             if tag[:1] == '-':
-                filter = exclude
+                # exclude all entries that have the specified tag
                 tag = tag[1:]
+                dirs = dirs - session_sets.get(tag, set())
+                datasets = datasets - dataset_sets.get(tag, set())
             else:
-                filter = include
-            dirs = filter(dirs, tag, self.session_tags)
-            datasets = filter(datasets, tag, self.dataset_tags)
+                # include only entries that have the specified tag
+                dirs = dirs & session_sets.get(tag, set())
+                datasets = datasets & dataset_sets.get(tag, set())
         return sorted(dirs), sorted(datasets)
 
     def listDatasets(self):
         """Get a list of dataset names in this directory."""
-        files = os.listdir(self.dir)
-        filenames = []
-        for s in files:
-            base, _, ext = s.rpartition('.')
-            if ext in ['csv', 'hdf5']:
-                filenames.append(filename_decode(base))
-        return sorted(filenames)
-
-    def newDataset(self, title, independents, dependents, extended=False):
-        num = self.counter
-        self.counter += 1
+        return list(self.index.datasets())
+
+    def newDataset(self, title, independents, dependents, extended=False,
+                   profile=None):
+        """Create a new dataset in this directory.
+
+        If no storage profile is given, the server-wide profile configured
+        on the session store is used.
+        """
+        if profile is None:
+            profile = self.session_store.storage_profile
+        backend.get_storage_profile(profile) # fail before touching the counter
+        # the counter on disk may be behind if we were stopped before saving
+        num = max(self.counter, self.index.lastNumber() + 1)
+        self.counter = num + 1
         self.modified = datetime.now()
 
         name = '%05d - %s' % (num, title)
         dataset = Dataset(self, name, title, create=True,
                           independents=independents,
                           dependents=dependents,
-                          extended=extended)
+                          extended=extended,
+                          profile=profile,
+                          io_executor=self.session_store.io_executor,
+                          subscriptions=self.session_store.subscriptions,
+                          search_index=self.session_store.search_index,
+                          unwritten=self.session_store.unwritten)
         self.datasets[name] = dataset
+        self.index.add(filename_encode(name) + '.hdf5')
         self.access()
+        search_index = self.session_store.search_index
+        if search_index is not None:
+            search_index.addDataset(self.path, name, title, time.time(),
+                                    search.variable_words(dataset))
 
         # notify listeners about the new dataset
         self.hub.onNewDataset(name, self.listeners)
@@ -251,11 +572,7 @@ class Session(object):
     def openDataset(self, name):
         # first lookup by number if necessary
         if isinstance(name, (int, long)):
-            for oldName in self.listDatasets():
-                num = int(oldName[:5])
-                if name == num:
-                    name = oldName
-                    break
+            name = self.index.byNumber(name) or name
         # if it's still a number, we didn't find the set
         if isinstance(name, (int, long)):
             raise errors.DatasetNotFoundError(name)
@@ -270,7 +587,12 @@ class Session(object):
             dataset.access()
         else:
             # need to create a new wrapper for this dataset
-            dataset = Dataset(self, name)
+            dataset = Dataset(self, name,
+                              profile=self.session_store.storage_profile,
+                              io_executor=self.session_store.io_executor,
+                              subscriptions=self.session_store.subscriptions,
+                              search_index=self.session_store.search_index,
+                              unwritten=self.session_store.unwritten)
             self.datasets[name] = dataset
         self.access()
 
@@ -310,6 +632,11 @@ class Session(object):
 
         sessUpdates = updateTagDict(tags, sessions, self.session_tags)
         dataUpdates = updateTagDict(tags, datasets, self.dataset_tags)
+        self.info.changed(tags=True)
+        search_index = self.session_store.search_index
+        if search_index is not None:
+            for name, entryTags in dataUpdates:
+                search_index.setTags(self.path, name, entryTags)
 
         self.access()
         if len(sessUpdates) + len(dataUpdates):
@@ -326,27 +653,76 @@ class Dataset(object):
     """
     This object basically takes care of listeners and notifications.
     All the actual data or metadata access is proxied through to a
-    backend object.
+    backend object.  Reading and writing rows goes through the I/O
+    executor and returns Deferreds, and so does reading and writing
+    parameters and comments, since the backend may be using the same file
+    in an I/O worker.  The variables never change, so they are read once
+    when the dataset is opened.
+    Signals are sent through the SubscriptionRegistry, at most once per
+    reactor turn.  While rows are buffered or being written, the dataset
+    is kept in the unwritten set, so that it can be flushed even after
+    its session has gone away.
     """
-    def __init__(self, session, name, title=None, create=False, independents=[], dependents=[], extended=False):
+    def __init__(self, session, name, title=None, create=False, independents=[], dependents=[], extended=False, profile=None, reactor=reactor, io_executor=None, subscriptions=None, search_index=None, unwritten=None):
         self.hub = session.hub
         self.name = name
+        self.path = session.path
+        self.search_index = search_index
         file_base = os.path.join(session.dir, filename_encode(name))
-        self.listeners = set() # contexts that want to hear about added data
-        self.param_listeners = set()
-        self.comment_listeners = set()
+        if subscriptions is None:
+            subscriptions = SubscriptionRegistry(reactor)
+        self.subscriptions = subscriptions
+        self.listeners = subscriptions.listeners() # contexts that want to hear about added data
+        self.param_listeners = subscriptions.listeners()
+        self.comment_listeners = subscriptions.listeners()
+
+        # rows added but not yet written to the backend
+        self.reactor = reactor
+        self.buffer_rows = WRITE_BUFFER_ROWS
+        self.buffer_bytes = WRITE_BUFFER_BYTES
+        self.buffer_delay = WRITE_BUFFER_DELAY
+        self._pending = []
+        self._pending_rows = 0
+        self._pending_bytes = 0
+        self._flush_call = None
+        self._writing_rows = 0 # rows handed to the executor but not yet written
+        self.unwritten = set() if unwritten is None else unwritten
+        self._pyramids = {} # decimation pyramids by x column
+        self.streams = {} # context -> Stream pushing added rows to it
+        self._stream_call = None
 
         if create:
             indep = [self.makeIndependent(i, extended) for i in independents]
             dep = [self.makeDependent(d, extended) for d in dependents]
-            self.data = backend.create_backend(file_base, title, indep, dep, extended)
+            self.data = backend.create_backend(file_base, title, indep, dep,
+                                               extended, profile)
+        else:
+            self.data = backend.open_backend(file_base, profile)
+
+        if io_executor is None or not self.data.threadsafe:
+            io_executor = executor.SynchronousExecutor()
+        self.io_executor = io_executor
+
+        if create:
             self.save()
         else:
-            self.data = backend.open_backend(file_base)
             self.load()
+        # nothing else uses the file yet
+        self._independents = self.data.getIndependents()
+        self._dependents = self.data.getDependents()
+        self._rowType = self.data.getRowType()
+        self._transposeType = self.data.getTransposeType()
+        self.data.getColumnTypes()
+        self.data.dtype
+        if not create:
             self.access()
 
+    def _io(self, f, *args, **kw):
+        """Run a backend call through the I/O executor."""
+        return self.io_executor.run(self.data._file, f, *args, **kw)
+
     def save(self):
+        self.flush()
         self.data.save()
 
     def load(self):
@@ -358,7 +734,8 @@ class Dataset(object):
 
     def access(self):
         """Update time of last access for this dataset."""
-        self.data.access()
+        d = self._io(self.data.access)
+        d.addErrback(log.err, 'Failed to update access time of {}'.format(self.name))
         self.save()
 
     def makeIndependent(self, label, extended):
@@ -382,53 +759,299 @@ class Dataset(object):
         return backend.Dependent(label=label, legend=legend, shape=(1,), datatype='v', unit=units)
 
     def getIndependents(self):
-        return self.data.getIndependents()
+        return self._independents
 
     def getDependents(self):
-        return self.data.getDependents()
+        return self._dependents
 
     def getRowType(self):
-        return self.data.getRowType()
+        return self._rowType
 
     def getTransposeType(self):
-        return self.data.getTransposeType()
+        return self._transposeType
 
     def addParameter(self, name, data, saveNow=True):
-        self.data.addParam(name, data)
-        if saveNow:
-            self.save()
-
-        # notify all listening contexts
-        self.hub.onNewParameter(None, self.param_listeners)
-        self.param_listeners = set()
-        return name
+        """Add a parameter.  Returns a Deferred that fires with its name."""
+        d = self.addParameters([(name, data)], saveNow)
+        d.addCallback(lambda _: name)
+        return d
 
     def addParameters(self, params, saveNow=True):
-        for name, data in params:
-            self.data.addParam(name, data)
-        if saveNow:
-            self.save()
-
-        # notify all listening contexts
-        self.hub.onNewParameter(None, self.param_listeners)
-        self.param_listeners = set()
+        """Add parameters.  Returns a Deferred that fires once they are written."""
+        d = self._io(self.data.addParams, params)
+        def added(_):
+            if saveNow:
+                self.save()
+            if self.search_index is not None:
+                self.search_index.addParameters(self.path, self.name, params)
+
+            # notify all listening contexts
+            self.subscriptions.notify(self.hub.onNewParameter, self.param_listeners)
+        d.addCallback(added)
+        return d
 
     def getParameter(self, name, case_sensitive=True):
-        return self.data.getParameter(name, case_sensitive)
+        """Returns a Deferred that fires with the value of a parameter."""
+        return self._io(self.data.getParameter, name, case_sensitive)
 
     def getParamNames(self):
-        return self.data.getParamNames()
+        """Returns a Deferred that fires with the names of the parameters."""
+        return self._io(self.data.getParamNames)
+
+    def getParameters(self):
+        """Returns a Deferred that fires with a list of (name, value) pairs."""
+        def read():
+            return [(name, self.data.getParameter(name))
+                    for name in self.data.getParamNames()]
+        return self._io(read)
 
     def addData(self, data):
-        # append the data to the file
-        self.data.addData(data)
+        """Add rows to the dataset.
+
+        Record arrays in the dataset's own dtype are held in memory and
+        written to the backend in one go once enough rows have piled up,
+        after buffer_delay seconds, or when flush is called.  Anything else
+        is written through immediately so that the backend can check it.
+
+        Returns a Deferred that fires when any write started by this call
+        has finished.
+        """
+        if (self.buffer_rows and isinstance(data, np.ndarray)
+                and data.dtype == self.data.dtype):
+            self._pending.append(data)
+            self.unwritten.add(self)
+            self._pending_rows += len(data)
+            self._pending_bytes += data.nbytes
+            if (self._pending_rows >= self.buffer_rows or
+                    self._pending_bytes >= self.buffer_bytes):
+                d = self.flush()
+            else:
+                if self._flush_call is None:
+                    self._flush_call = self.reactor.callLater(
+                            self.buffer_delay, self._timedFlush)
+                d = defer.succeed(None)
+        else:
+            self.flush()
+            d = self._write(data, len(data))
 
+        if self.streams:
+            self._stream(data)
         # notify all listening contexts
-        self.hub.onDataAvailable(None, self.listeners)
-        self.listeners = set()
+        self.subscriptions.notify(self.hub.onDataAvailable, self.listeners)
+        return d
+
+    def startStream(self, context, max_rows=STREAM_MAX_ROWS,
+                    max_bytes=STREAM_MAX_BYTES, summary=False,
+                    min_interval=STREAM_MIN_INTERVAL):
+        """Push rows added from now on to a context (see Stream).
+
+        Returns a Deferred that fires once the stream knows its first row.
+        """
+        try:
+            descriptor = util.dtype_descriptor(self.data.dtype)
+        except ValueError as e:
+            raise errors.BadRawDataError(str(e))
+        stream = Stream(self.data.dtype, descriptor, max_rows, max_bytes, summary,
+                        min_interval)
+        self.streams[context] = stream
+        # rows added from here on go to the stream, so its first row is the
+        # length of the dataset once the rows added so far are written
+        self.flush()
+        d = self._io(len, self.data)
+        def started(rows):
+            stream.pos = rows
+            if stream.rows:
+                self._scheduleStreams()
+        d.addCallback(started)
+        return d
+
+    def stopStream(self, context):
+        self.streams.pop(context, None)
+
+    def _stream(self, data):
+        records = (isinstance(data, np.ndarray) and data.dtype == self.data.dtype)
+        for stream in self.streams.values():
+            if records:
+                stream.add(data)
+            else:
+                stream.skip(len(data))
+        self._scheduleStreams()
+
+    def _scheduleStreams(self, delay=0):
+        if self._stream_call is None:
+            self._stream_call = self.reactor.callLater(delay, self._sendStreams)
+        elif self._stream_call.getTime() > self.reactor.seconds() + delay:
+            self._stream_call.reset(delay)
+
+    def _sendStreams(self):
+        self._stream_call = None
+        now = self.reactor.seconds()
+        wait = None
+        for context, stream in self.streams.items():
+            if stream.rows and stream.due > now:
+                # rows added until then go out together in the next message
+                wait = min(wait, stream.due - now) if wait is not None else stream.due - now
+                continue
+            message = stream.take(now)
+            if message is not None:
+                self.hub.onDataStreamed(message, [context])
+        if wait is not None:
+            self._scheduleStreams(wait)
+
+    def _timedFlush(self):
+        self._flush_call = None
+        d = self.flush()
+        d.addErrback(log.err, 'Failed to write buffered data for {}'.format(self.name))
+
+    def flush(self):
+        """Write any buffered rows to the backend.
+
+        Returns a Deferred that fires when all rows added so far have been
+        written.
+        """
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+        if not self._pending:
+            if self._writing_rows:
+                # queued behind the writes in progress
+                return self._io(lambda: None)
+            return defer.succeed(None)
+        if len(self._pending) == 1:
+            data = self._pending[0]
+        else:
+            data = np.concatenate(self._pending)
+        rows = self._pending_rows
+        self._pending = []
+        self._pending_rows = 0
+        self._pending_bytes = 0
+        return self._write(data, rows)
+
+    def _write(self, data, rows):
+        self._writing_rows += rows
+        self.unwritten.add(self)
+        def done(result):
+            self._writing_rows -= rows
+            if not self._pending and not self._writing_rows:
+                self.unwritten.discard(self)
+            return result
+        return self._io(self._addRows, data).addBoth(done)
+
+    def _addRows(self, data):
+        # runs through the executor, so the pyramids only change in step
+        # with the file
+        self.data.addData(data)
+        for pyramid in self._pyramids.values():
+            pyramid.appendRecords(data)
+
+    def numPending(self):
+        """Number of rows added but not yet written to the backend."""
+        return self._pending_rows + self._writing_rows
 
     def getData(self, limit, start, transpose=False, simpleOnly=False):
-        return self.data.getData(limit, start, transpose, simpleOnly)
+        """Read rows from the dataset.
+
+        Returns a Deferred that fires with (data, new position).
+        """
+        # buffered rows must be visible to readers, so write them out first.
+        # The executor runs the read after the write.
+        if self._pending:
+            self.flush()
+        return self._io(self.data.getData, limit, start, transpose, simpleOnly)
+
+    def getRecords(self, limit, start):
+        """Read rows from the dataset as a 1-D array of records.
+
+        Returns a Deferred that fires with (records, new position).
+        """
+        if self._pending:
+            self.flush()
+        return self._io(self.data.getRecords, limit, start)
+
+    def getSelection(self, columns=None, start=0, stop=None, step=1,
+                     transpose=False, simpleOnly=False):
+        """Read some of the columns of every step-th row in [start, stop).
+
+        Columns are given by index or by label, and None selects all of
+        them.  Returns a Deferred that fires with (data, position of the
+        next row in the selection).
+        """
+        indices = None if columns is None else self.columnIndices(columns)
+        if step < 1:
+            raise errors.BadSelectionError('Stride must be at least 1, not {}'.format(step))
+        if self._pending:
+            self.flush()
+        return self._io(self.data.getSelection, indices, start, stop, step,
+                        transpose, simpleOnly)
+
+    def getDecimated(self, x, y, points, start=0, stop=None, method='minmax'):
+        """Reduce column y against column x to about the given number of points.
+
+        Rows [start, stop) are reduced with one of decimate.METHODS.
+        Returns a Deferred that fires with an (n, 2) array of (x, y)
+        points.
+        """
+        [x], [y] = self.columnIndices([x]), self.columnIndices([y])
+        if method not in decimate.METHODS:
+            raise errors.BadSelectionError(
+                    "Unknown decimation method '{}'.  Choose one of: {}".format(
+                            method, ', '.join(decimate.METHODS)))
+        numeric = self._numericColumns()
+        for col in (x, y):
+            if col not in numeric:
+                raise errors.BadSelectionError(
+                        'Column {} is not a numeric scalar column'.format(col))
+        if self._pending:
+            self.flush()
+        return self._io(self._decimate, x, y, points, start, stop, method)
+
+    def _numericColumns(self):
+        dtype = self.data.dtype
+        return [i for i, name in enumerate(dtype.names)
+                if dtype[name].kind in 'iuf' and dtype[name].shape == ()]
+
+    def _decimate(self, x, y, points, start, stop, method):
+        pyramid = self._pyramids.get(x)
+        if pyramid is None:
+            pyramid = decimate.Pyramid(x, self._numericColumns())
+            self._pyramids[x] = pyramid
+        pyramid.sync(self.data)
+        return decimate.decimate(self.data, pyramid, y, start, stop, points, method)
+
+    def columnIndices(self, columns):
+        """Convert a list of column indices or labels to indices.
+
+        Dependents can also be named as 'label (legend)', which is needed
+        when several dependents share a label.
+        """
+        names = [[i.label] for i in self.getIndependents()]
+        names += [[d.label, '{} ({})'.format(d.label, d.legend)]
+                  for d in self.getDependents()]
+        if not len(columns):
+            raise errors.BadSelectionError('No columns selected')
+        indices = []
+        for col in columns:
+            if isinstance(col, basestring):
+                matches = [i for i, n in enumerate(names) if col in n]
+                if len(matches) != 1:
+                    problem = 'not found' if not matches else 'ambiguous'
+                    raise errors.BadSelectionError(
+                            "Column '{}' {}".format(col, problem))
+                indices.append(matches[0])
+            elif 0 <= col < len(names):
+                indices.append(int(col))
+            else:
+                raise errors.BadSelectionError(
+                        'Column {} out of range for {} columns'.format(col, len(names)))
+            if indices.count(indices[-1]) > 1:
+                raise errors.BadSelectionError(
+                        'Column {} selected more than once'.format(col))
+        return indices
+
+    def openCursor(self, page_rows=None, start=0, max_bytes=CURSOR_PAGE_BYTES):
+        """Open a Cursor that reads this dataset a page at a time."""
+        return Cursor(self, page_rows, start, max_bytes)
 
     def keepStreaming(self, context, pos):
         # keepStreaming does something a bit odd and has a confusing name (ERJ)
@@ -445,29 +1068,209 @@ class Dataset(object):
         # 
         # If a client reads, but not to the end of the dataset, it is immediately notified that
         # there is more data for it to read, and then removed from the set of notifiers.
-        if self.data.hasMore(pos):
-            if context in self.listeners:
-                self.listeners.remove(context)
-            self.hub.onDataAvailable(None, [context])
-        else:
-            self.listeners.add(context)
+        # There is more to read if pos < stored rows + buffered rows.
+        #
+        # The stored rows are counted through the executor, after the writes
+        # already queued, and the context listens in the meantime so that it
+        # does not miss rows added before the count comes back.
+        self.listeners.add(context)
+        d = self._io(self.data.hasMore, pos - self._pending_rows)
+        d.addCallback(self._notifyIfMore, context, self.listeners,
+                      self.hub.onDataAvailable)
+        return d
+
+    def _notifyIfMore(self, more, context, listeners, signal):
+        if more:
+            listeners.discard(context)
+            self.subscriptions.send(signal, [context])
 
     def addComment(self, user, comment):
-        self.data.addComment(user, comment)
-        self.save()
+        """Add a comment.  Returns a Deferred that fires once it is written."""
+        d = self._io(self.data.addComment, user, comment)
+        def added(_):
+            self.save()
 
-        # notify all listening contexts
-        self.hub.onCommentsAvailable(None, self.comment_listeners)
-        self.comment_listeners = set()
+            # notify all listening contexts
+            self.subscriptions.notify(self.hub.onCommentsAvailable, self.comment_listeners)
+        d.addCallback(added)
+        return d
 
     def getComments(self, limit, start):
-        return self.data.getComments(limit, start)
+        """Returns a Deferred that fires with (comments, new position)."""
+        return self._io(self.data.getComments, limit, start)
 
     def keepStreamingComments(self, context, pos):
-        if pos < self.data.numComments():
-            if context in self.comment_listeners:
-                self.comment_listeners.remove(context)
-            self.hub.onCommentsAvailable(None, [context])
+        self.comment_listeners.add(context)
+        d = self._io(lambda: pos < self.data.numComments())
+        d.addCallback(self._notifyIfMore, context, self.comment_listeners,
+                      self.hub.onCommentsAvailable)
+        return d
+
+
+
+class Stream(object):
+    """Rows added to a dataset, to be pushed to one context.
+
+    Rows added during a turn of the reactor are sent together in one
+    message at the end of the turn, but messages are at least min_interval
+    seconds apart: rows added in the meantime wait, and go out together in
+    the next message, so a client is never sent more messages than it can
+    take however often rows are added.  A message holds at most max_rows rows
+    and max_bytes bytes of row data.  If more rows came in, because data is
+    added faster than the messages can carry it, the rows are coalesced:
+    only the newest rows that fit are sent or, with summary set, the rows
+    holding the minimum and maximum of each numeric column in each of a
+    number of buckets, which keeps the envelope of every curve.
+
+    Messages are (first row, rows, dtype, data), where rows is the number of
+    rows of the dataset the message stands for, starting at first row, and
+    data holds the rows that were sent packed back to back in the layout
+    given by dtype, as in get_raw.  The rows sent are the newest ones, or
+    in summary mode a selection of them in row order.  If fewer rows were
+    sent than the message stands for, the client can read the rest with
+    get_selection.
+    """
+    def __init__(self, dtype, descriptor, max_rows=STREAM_MAX_ROWS,
+                 max_bytes=STREAM_MAX_BYTES, summary=False,
+                 min_interval=STREAM_MIN_INTERVAL):
+        self.dtype = dtype
+        self.descriptor = descriptor
+        self.max_rows = max(min(max_rows, max_bytes // max(dtype.itemsize, 1)), 1)
+        self.summary = summary
+        self.min_interval = min_interval
+        self.due = 0 # earliest time of the next message
+        self.pos = None # first row of the next message, once known
+        self.rows = 0 # rows waiting to be sent, including skipped ones
+        self._chunks = [] # records of the last waiting rows
+        self._skipped = 0 # waiting rows before those that cannot be sent
+        self.messages = 0
+        self.coalesced = 0 # messages that left rows out
+
+    def add(self, records):
+        self._chunks.append(records)
+        self.rows += len(records)
+
+    def skip(self, rows):
+        """Account for rows that were added in a form that cannot be sent."""
+        self._chunks = []
+        self.rows += rows
+        self._skipped = self.rows
+
+    def take(self, now=0):
+        """The message for the rows waiting to be sent, or None.
+
+        now is the current time, from which the next message is due after
+        min_interval.
+        """
+        if self.pos is None or not self.rows:
+            return None
+        if len(self._chunks) == 1:
+            records = self._chunks[0]
+        elif self._chunks:
+            records = np.concatenate(self._chunks)
         else:
-            self.comment_listeners.add(context)
-
+            records = np.empty((0,), dtype=self.dtype)
+        if self._skipped or len(records) > self.max_rows:
+            self.coalesced += 1
+        if len(records) > self.max_rows:
+            if self.summary:
+                records = records[_summary_rows(records, self.max_rows)]
+            else:
+                records = records[-self.max_rows:]
+        message = (self.pos, self.rows, self.descriptor,
+                   np.ascontiguousarray(records).tostring())
+        self.pos += self.rows
+        self.rows = 0
+        self._chunks = []
+        self._skipped = 0
+        self.messages += 1
+        self.due = now + self.min_interval
+        return message
+
+
+def _summary_rows(records, max_rows):
+    """Indices of the rows holding the extremes of each numeric column.
+
+    The records are split into buckets, and the rows with the minimum and
+    maximum of each numeric scalar column in each bucket are picked, for at
+    most max_rows rows.  Without numeric columns the newest rows are picked.
+    """
+    n = len(records)
+    names = [name for name in records.dtype.names
+             if records.dtype[name].kind in 'iuf' and records.dtype[name].shape == ()]
+    if not names:
+        return np.arange(n - max_rows, n)
+    buckets = max(max_rows // (2 * len(names)), 1)
+    rows = np.arange(n, dtype=np.int64)
+    picked = []
+    for name in names:
+        values = records[name].astype(np.float64)
+        for largest in (False, True):
+            picked.append(decimate._bucket_extrema(
+                    rows, rows, values, 0, n, buckets, largest)[0])
+    picked = np.unique(np.concatenate(picked))
+    if len(picked) > max_rows:
+        picked = picked[np.linspace(0, len(picked) - 1, max_rows).astype(np.int64)]
+    return picked
+
+
+class Cursor(object):
+    """Reads a dataset one page at a time.
+
+    Pages hold at most page_rows rows and at most max_bytes of row data, so
+    the memory needed to read a dataset does not depend on its size.  After
+    a full page is returned, the next page is read in the background, so a
+    client that keeps paging does not wait for the disk.
+    """
+    def __init__(self, dataset, page_rows=None, start=0,
+                 max_bytes=CURSOR_PAGE_BYTES):
+        self.dataset = dataset
+        max_rows = max(max_bytes // max(dataset.data.dtype.itemsize, 1), 1)
+        self.page_rows = min(page_rows or max_rows, max_rows)
+        self.pos = start
+        self._prefetch = None # ((pos, transpose, simpleOnly), Deferred)
+
+    def next(self, transpose=False, simpleOnly=False):
+        """Read the next page.
+
+        Returns a Deferred that fires with the data for the page, which is
+        empty once the cursor has reached the end of the dataset.
+        """
+        key = (self.pos, transpose, simpleOnly)
+        if self._prefetch is not None and self._prefetch[0] == key:
+            d = self._prefetch[1]
+            # a short page may have been read before more rows came in
+            d.addCallback(self._checkPrefetched, key)
+        else:
+            self._dropPrefetch()
+            d = self._read(key)
+        self._prefetch = None
+        d.addCallback(self._gotPage, key)
+        return d
+
+    def close(self):
+        self._dropPrefetch()
+
+    def _read(self, key):
+        start, transpose, simpleOnly = key
+        return self.dataset.getData(self.page_rows, start, transpose, simpleOnly)
+
+    def _checkPrefetched(self, result, key):
+        data, pos = result
+        if pos - key[0] < self.page_rows:
+            return self._read(key)
+        return result
+
+    def _gotPage(self, result, key):
+        data, pos = result
+        self.pos = pos
+        if pos - key[0] == self.page_rows:
+            next_key = (pos,) + key[1:]
+            self._prefetch = (next_key, self._read(next_key))
+        return data
+
+    def _dropPrefetch(self):
+        if self._prefetch is not None:
+            # nobody is going to look at this result, errors included
+            self._prefetch[1].addErrback(lambda failure: None)
+            self._prefetch = None
@@ -4,7 +4,11 @@ import datetime
 import os
 import re
 import sys
+import threading
 import time
+import urllib
+import warnings
+import weakref
 
 import h5py
 from twisted.internet import reactor
@@ -18,7 +22,7 @@ except ImportError, e:
     use_numpy = False
 
 from labrad import types as T
-from . import errors, util
+from . import cache, errors, util
 
 
 ## Data types for variable defintions
@@ -30,6 +34,7 @@ TIME_FORMAT = '%Y-%m-%d, %H:%M:%S'
 PRECISION = 12 # digits of precision to use when saving data
 DATA_FORMAT = '%%.%dG' % PRECISION
 FILE_TIMEOUT_SEC = 60 # how long to keep datafiles open if not accessed
+FILE_POOL_MAX_OPEN = 256 # most datafiles kept open at once
 DATA_TIMEOUT = 300 # how long to keep data in memory if not accessed
 DATA_URL_PREFIX = 'data:application/labrad;base64,'
 
@@ -56,38 +61,212 @@ def labrad_urldecode(data_url):
         raise ValueError("Trying to labrad_urldecode data that doesn't start "
                          "with prefix: {}".format(DATA_URL_PREFIX))
 
+## Storage profiles for HDF5 datasets
+
+StorageProfile = collections.namedtuple('StorageProfile', [
+    'chunk_bytes', # target size of one chunk, or None to let h5py pick
+    'compression', # None, 'lzf' or 'gzip'
+    'compression_opts', # gzip level, ignored otherwise
+    'shuffle', # apply the byte shuffle filter before compression
+    'cache_bytes', # raw chunk cache size per file, or None for hdf5 default
+    'cache_slots', # number of hash slots in the raw chunk cache
+    'cache_w0', # chunk preemption policy (0 to 1)
+    'growth', # over-allocation factor when appending, or None to resize exactly
+])
+
+STORAGE_PROFILES = {
+    # layout used by data vault versions before storage profiles existed
+    'legacy': StorageProfile(None, None, None, False, None, None, None, None),
+    'default': StorageProfile(64*1024, None, None, False, 4*1024**2, 1021, 0.75, 2.0),
+    'lzf': StorageProfile(256*1024, 'lzf', None, True, 16*1024**2, 1021, 0.75, 2.0),
+    'gzip': StorageProfile(256*1024, 'gzip', 4, True, 16*1024**2, 1021, 0.75, 2.0),
+}
+DEFAULT_STORAGE_PROFILE = 'default'
+MAX_CHUNK_ROWS = 2**20 # keep chunks of tiny rows from getting out of hand
+COMMENT_CHUNK_ROWS = 256 # comments per chunk of the extensible comment dataset
+PARTIAL_DATASET = 'DataVault.partial' # name of a dataset being rewritten
+PARTIAL_SUFFIX = '.partial' # added to the name of a file being rewritten
+
+def get_storage_profile(profile=None):
+    """Look up a storage profile by name.
+
+    Profile objects are passed through unchanged, and None selects the
+    default profile.
+    """
+    if profile is None:
+        profile = DEFAULT_STORAGE_PROFILE
+    if isinstance(profile, StorageProfile):
+        return profile
+    if profile not in STORAGE_PROFILES:
+        raise errors.BadStorageProfileError(profile, sorted(STORAGE_PROFILES))
+    return STORAGE_PROFILES[profile]
+
+def chunk_rows(dtype, profile):
+    """Number of rows per chunk so that one chunk is about chunk_bytes."""
+    rows = profile.chunk_bytes // max(np.dtype(dtype).itemsize, 1)
+    return int(min(max(rows, 1), MAX_CHUNK_ROWS))
+
+def dataset_options(dtype, profile):
+    """Keyword arguments for h5py create_dataset for the given profile."""
+    profile = get_storage_profile(profile)
+    kw = {}
+    if profile.chunk_bytes is not None:
+        kw['chunks'] = (chunk_rows(dtype, profile),)
+    if profile.compression is not None:
+        kw['compression'] = profile.compression
+        if profile.compression_opts is not None:
+            kw['compression_opts'] = profile.compression_opts
+    if profile.shuffle:
+        kw['shuffle'] = True
+    return kw
+
+def file_options(profile):
+    """Keyword arguments for h5py.File to set up the raw chunk cache."""
+    profile = get_storage_profile(profile)
+    kw = {}
+    if profile.cache_bytes is not None:
+        kw['rdcc_nbytes'] = profile.cache_bytes
+        kw['rdcc_nslots'] = profile.cache_slots
+        kw['rdcc_w0'] = profile.cache_w0
+    return kw
+
+class FileHandlePool(object):
+    """Keeps track of the open files of all SelfClosingFiles of a reactor.
+
+    At most max_open files are kept open: when another file is opened, the
+    least recently used file that is not held is closed (an eviction).
+    Files that are not used for their timeout are closed by a single
+    sweeper timer, which is scheduled for the earliest expiry.  Held files
+    are never closed; their timeout starts again when they are released.
+    """
+
+    def __init__(self, max_open=FILE_POOL_MAX_OPEN, reactor=reactor):
+        self.max_open = max_open
+        self.reactor = reactor
+        self._files = collections.OrderedDict() # file -> time of last use
+        self._sweep_call = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.timeouts = 0
+
+    def __len__(self):
+        return len(self._files)
+
+    def stats(self):
+        """Usage counts as a list of (name, value) pairs."""
+        return [('open', len(self._files)),
+                ('max open', self.max_open),
+                ('hits', self.hits),
+                ('misses', self.misses),
+                ('evictions', self.evictions),
+                ('timeouts', self.timeouts)]
+
+    def opened(self, fh):
+        """Called by a SelfClosingFile that just opened its file."""
+        self.misses += 1
+        self._files[fh] = self.reactor.seconds()
+        for old in list(self._files):
+            if len(self._files) <= self.max_open:
+                break
+            if old is not fh and not old.holds:
+                self.evictions += 1
+                old.close()
+        self._schedule()
+
+    def used(self, fh, hit=True):
+        """Called by a SelfClosingFile whose open file is used again."""
+        if hit:
+            self.hits += 1
+        del self._files[fh]
+        self._files[fh] = self.reactor.seconds()
+        self._schedule()
+
+    def closed(self, fh):
+        """Called by a SelfClosingFile that closed its file."""
+        self._files.pop(fh, None)
+
+    def _schedule(self):
+        if self._sweep_call is not None and self._sweep_call.active():
+            return
+        expiries = [t + fh.timeout for fh, t in self._files.items() if not fh.holds]
+        if expiries:
+            delay = max(min(expiries) - self.reactor.seconds(), 0)
+            self._sweep_call = self.reactor.callLater(delay, self._sweep)
+
+    def _sweep(self):
+        self._sweep_call = None
+        now = self.reactor.seconds()
+        for fh, t in list(self._files.items()):
+            if not fh.holds and now >= t + fh.timeout:
+                self.timeouts += 1
+                fh.close()
+        self._schedule()
+
+_file_pools = weakref.WeakKeyDictionary()
+
+def get_file_pool(reactor=reactor):
+    """The FileHandlePool shared by all files of the given reactor."""
+    if reactor not in _file_pools:
+        _file_pools[reactor] = FileHandlePool(reactor=reactor)
+    return _file_pools[reactor]
+
 class SelfClosingFile(object):
     """A container for a file object that manages the underlying file handle.
 
     The file will be opened on demand when this container is called, then
-    closed automatically if not accessed within a specified timeout.
+    closed automatically if not accessed within a specified timeout, or to
+    make room for other files (see FileHandlePool).  While the file is held
+    (see hold), it is not closed.
     """
     def __init__(self, opener=open, open_args=(), open_kw={},
-                 timeout=FILE_TIMEOUT_SEC, touch=True, reactor=reactor):
+                 timeout=FILE_TIMEOUT_SEC, touch=True, reactor=reactor,
+                 pool=None):
         self.opener = opener
         self.open_args = open_args
         self.open_kw = open_kw
         self.timeout = timeout
         self.callbacks = []
-        self.reactor = reactor
+        self.pool = pool if pool is not None else get_file_pool(reactor)
+        self.holds = 0
         if touch:
             self.__call__()
 
     def __call__(self):
         if not hasattr(self, '_file'):
             self._file = self.opener(*self.open_args, **self.open_kw)
-            self._fileTimeoutCall = self.reactor.callLater(
-                    self.timeout, self._fileTimeout)
-        else:
-            self._fileTimeoutCall.reset(self.timeout)
+            self.pool.opened(self)
+        elif not self.holds:
+            # while the file is held, it is marked as used on release
+            # instead, so worker threads never touch the pool
+            self.pool.used(self)
         return self._file
 
-    def _fileTimeout(self):
+    def hold(self):
+        """Open the file if needed and keep it open until release is called.
+
+        Holds are counted, and must be made in the reactor thread.  While
+        the file is held, calling this container from another thread is
+        safe.
+        """
+        f = self()
+        self.holds += 1
+        return f
+
+    def release(self):
+        self.holds -= 1
+        if not self.holds and hasattr(self, '_file'):
+            self.pool.used(self, hit=False)
+
+    def close(self):
+        """Close the file now.  It is opened again when next used."""
+        if not hasattr(self, '_file'):
+            return
         for callback in self.callbacks:
             callback(self)
         self._file.close()
         del self._file
-        del self._fileTimeoutCall
+        self.pool.closed(self)
 
     def size(self):
         return os.fstat(self().fileno()).st_size
@@ -251,6 +430,10 @@ class IniData(object):
         type_tag = '({})'.format(','.join(units))
         return type_tag
 
+    def getColumnTypes(self):
+        """The labrad type tag of each column, without units or shape."""
+        return ['v'] * self.cols
+
     def addParam(self, name, data):
         for p in self.parameters:
             if p['label'] == name:
@@ -258,6 +441,15 @@ class IniData(object):
         d = dict(label=name, data=data)
         self.parameters.append(d)
 
+    def addParams(self, params):
+        """Add several parameters, or none if one of the names is in use."""
+        names = set(p['label'] for p in self.parameters)
+        for name, _ in params:
+            if name in names:
+                raise errors.ParameterInUseError(name)
+            names.add(name)
+        self.parameters.extend(dict(label=name, data=data) for name, data in params)
+
     def getParameter(self, name, case_sensitive=True):
         for p in self.parameters:
             if case_sensitive:
@@ -290,6 +482,9 @@ class CsvListData(IniData):
     Stores the entire contents of the file in memory as a list or numpy array
     """
 
+    # data reads schedule reactor timers, so keep them in the reactor thread
+    threadsafe = False
+
     def __init__(self,
                  filename,
                  file_timeout=FILE_TIMEOUT_SEC,
@@ -343,6 +538,9 @@ class CsvListData(IniData):
         f.flush()
 
     def addData(self, data):
+        if getattr(getattr(data, 'dtype', None), 'names', None):
+            # a record array, as passed on by the server
+            data = util.from_record_array(data).tolist()
         if not len(data) or not isinstance(data[0], list):
             data = [data]
         if len(data[0]) != self.cols:
@@ -360,69 +558,251 @@ class CsvListData(IniData):
             data = self.data[start:start+limit]
         return data, start + len(data)
 
+    def getSelection(self, columns, start, stop, step, transpose, simpleOnly):
+        """Get the given columns of every step-th row in [start, stop)."""
+        if transpose:
+            raise RuntimeError("Transpose specified for simple data format: not supported")
+        rows = self.data[start:stop:step]
+        if columns is not None:
+            rows = [[row[i] for i in columns] for row in rows]
+        return rows, start + len(rows) * step
+
+    def getColumns(self, columns, start, stop):
+        """Get columns of rows [start, stop) as a list of 1-D arrays."""
+        rows = self.data[start:stop]
+        return [np.array([row[i] for row in rows], dtype=np.float64) for i in columns]
+
     def hasMore(self, pos):
         return pos < len(self.data)
 
+CSV_INDEX_STRIDE = 1024 # rows between entries of the csv row-offset index
+CSV_INDEX_VERSION = 2 # rows are the lines holding data, not all lines
+CSV_READ_BYTES = 2**22 # bytes read at a time when scanning a csv file
+CSV_READ_ROWS = 65536 # most rows read at a time to fill the block cache
+
+def _parse_csv_block(text, cols):
+    """Parse complete lines of comma-separated floats into a 2-D array.
+
+    The text is handed to numpy in one go, which is much faster than
+    converting the values one at a time.  Anything numpy does not
+    understand is parsed again with np.loadtxt, without the lines that
+    are blank or begin with a '#' comment (see _data_lines), which raises
+    a sensible error for anything else.
+    """
+    lines = text.count('\n')
+    values = np.fromstring(text.replace(',', ' '), dtype=np.float64, sep=' ')
+    if values.size == lines * cols:
+        return values.reshape((lines, cols))
+    with warnings.catch_warnings():
+        # a block of only blank lines is not worth a warning
+        warnings.simplefilter('ignore', UserWarning)
+        lines = [line for line in text.splitlines()
+                 if line.split('#', 1)[0].strip()]
+        values = np.loadtxt(lines, delimiter=',', ndmin=2)
+    if values.size == 0:
+        return np.zeros((0, cols))
+    if values.shape[1] != cols:
+        raise ValueError('Expected {} columns of data, found {}'.format(
+                cols, values.shape[1]))
+    return values
+
+def _data_lines(block, state=None):
+    """Which lines of a block of csv text hold data.
+
+    A line holds data unless it is blank or its first visible character
+    is '#', the same lines _parse_csv_block skips.  state tells whether
+    the first line, begun in an earlier block, holds data (None if nothing
+    visible was seen yet).  Returns the newline positions, whether each
+    complete line holds data and the state of the incomplete last line.
+    """
+    chars = np.frombuffer(block, np.uint8)
+    newlines = np.flatnonzero(chars == ord('\n'))
+    visible = np.flatnonzero((chars != ord(' ')) & (chars != ord('\t')) &
+                             (chars != ord('\r')) & (chars != ord('\n')))
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.append(newlines, len(chars))
+    # the first visible character of each line, if there is one
+    first = np.searchsorted(visible, starts)
+    shown = first < len(visible)
+    shown[shown] = visible[first[shown]] < ends[shown]
+    data = shown.copy()
+    data[shown] = chars[visible[first[shown]]] != ord('#')
+    if state is not None:
+        shown[0], data[0] = True, state
+    return newlines, data[:-1], (data[-1] if shown[-1] else None)
+
+class CsvRowIndex(object):
+    """Byte offsets of every stride-th row of a csv data file.
+
+    Rows are the lines that hold data; blank and comment lines are not
+    counted, just as they are not parsed.  This lets us seek to a row
+    without parsing the lines before it.  The index is saved next to the
+    data file as raw int64 values: the version, the stride, the number of
+    rows and bytes indexed and then the offsets.  It is only
+    saved when new offsets are added, and is checked against the data file
+    when loaded, so a stale or damaged index is simply rebuilt.
+    """
+    def __init__(self, filename, stride=CSV_INDEX_STRIDE):
+        self.filename = filename
+        self.stride = stride
+        self._loaded = False
+        self._reset()
+
+    def _reset(self):
+        self.offsets = [0]
+        self.rows = 0 # complete lines holding data indexed
+        self.end = 0 # bytes indexed, up to the end of the last complete line
+
+    def load(self, size):
+        """Read the saved index, if it is consistent with a file of size bytes."""
+        self._loaded = True
+        self._reset()
+        try:
+            values = np.fromfile(self.filename, dtype='<i8')
+        except (IOError, ValueError):
+            return
+        if len(values) < 5 or values[0] != CSV_INDEX_VERSION:
+            return
+        stride, rows, end = values[1:4]
+        offsets = values[4:]
+        if (stride != self.stride or end > size or
+                len(offsets) != rows // stride + 1 or offsets[0] != 0):
+            return
+        self.offsets = offsets.tolist()
+        self.rows = int(rows)
+        self.end = int(end)
+
+    def save(self):
+        header = [CSV_INDEX_VERSION, self.stride, self.rows, self.end]
+        try:
+            np.asarray(header + self.offsets, dtype='<i8').tofile(self.filename)
+        except IOError:
+            # the index is only an optimization
+            pass
+
+    def update(self, f):
+        """Index any complete lines that were added to the open file f."""
+        f.seek(0, 2)
+        size = f.tell()
+        if not self._loaded:
+            self.load(size)
+        if size <= self.end:
+            if size < self.end:
+                # the file was truncated behind our back
+                self._reset()
+            else:
+                return
+        f.seek(self.end)
+        pos = self.end
+        count = len(self.offsets)
+        line, state = pos, None # start of the line being read, see _data_lines
+        while pos < size:
+            block = f.read(min(CSV_READ_BYTES, size - pos))
+            if not block:
+                break
+            newlines, data, state = _data_lines(block, state)
+            if len(newlines):
+                starts = np.concatenate(([line], pos + newlines[:-1] + 1))
+                starts = starts[data]
+                # row number of each line holding data
+                rows = self.rows + np.arange(len(starts))
+                self.offsets.extend(
+                    starts[(rows % self.stride == 0) & (rows > 0)].tolist())
+                self.rows += len(starts)
+                self.end = line = pos + int(newlines[-1]) + 1
+            pos += len(block)
+        if len(self.offsets) > count:
+            self.save()
+
+    def locate(self, row):
+        """Byte offset of an indexed row at or before row, and rows to skip."""
+        i = row // self.stride
+        return self.offsets[i], row - i * self.stride
+
 class CsvNumpyData(CsvListData):
     """Data backed by a csv-formatted file.
 
-    Stores the entire contents of the file in memory as a list or numpy array
+    Rows are read straight from the file using a row-offset index
+    (see CsvRowIndex), through the shared block cache, while the data
+    property holds the entire contents of the file in memory as a numpy
+    array, which is cleared again when not accessed for a while.
     """
 
     def __init__(self, filename, reactor=reactor):
         self.filename = filename
-        self._file = SelfClosingFile(open_args=(filename, 'a+'), reactor=reactor)
+        # binary mode, so that file positions are byte offsets everywhere
+        self._file = SelfClosingFile(open_args=(filename, 'a+b'), reactor=reactor)
         self.infofile = filename[:-4] + '.ini'
+        self.index = CsvRowIndex(filename[:-4] + '.idx')
         self.reactor = reactor
+        self.cache = cache.get_block_cache()
+        self.cache_name = os.path.abspath(filename)
 
     @property
     def file(self):
         return self._file()
 
-    def _get_data(self):
+    def _numCols(self, text=''):
+        if hasattr(self, 'cols'):
+            return self.cols
+        return text[:text.find('\n')].count(',') + 1
+
+    @property
+    def data(self):
         """Read data from file on demand.
 
-        The data is scheduled to be cleared from memory unless accessed."""
+        Only lines added to the file since the last read are parsed.  The
+        data is scheduled to be cleared from memory unless accessed."""
         if not hasattr(self, '_data'):
-            try:
-                # if the file is empty, this line can barf in certain versions
-                # of numpy.  Clearly, if the file does not exist on disk, this
-                # will be the case.  Even if the file exists on disk, we must
-                # check its size
-                if self._file.size() > 0:
-                    self.file.seek(0)
-                    self._data = np.loadtxt(self.file, delimiter=',')
-                else:
-                    self._data = np.array([[]])
-                if len(self._data.shape) == 1:
-                    self._data.shape = (1, len(self._data))
-            except ValueError:
-                # no data saved yet
-                # this error is raised by numpy <=1.2
-                self._data = np.array([[]])
-            except IOError:
-                # no data saved yet
-                # this error is raised by numpy 1.3
-                self.file.seek(0)
-                self._data = np.array([[]])
+            self._data = np.empty((0, self._numCols()))
+            self._rows = 0
+            self._datapos = 0
             self._timeout_call = self.reactor.callLater(DATA_TIMEOUT, self._on_timeout)
         else:
             self._timeout_call.reset(DATA_TIMEOUT)
-        return self._data
-
-    def _set_data(self, data):
-        self._data = data
+        self._readTail()
+        if not self._rows:
+            return np.array([[]])
+        return self._data[:self._rows]
 
-    data = property(_get_data, _set_data)
+    def _readTail(self):
+        f = self.file
+        f.seek(0, 2)
+        size = f.tell()
+        if size <= self._datapos:
+            return
+        f.seek(self._datapos)
+        text = f.read(size - self._datapos)
+        # leave a partly written last line for next time
+        text = text[:text.rfind('\n') + 1]
+        if text:
+            self._append(_parse_csv_block(text, self._numCols(text)))
+            self._datapos += len(text)
+
+    def _append(self, rows):
+        """Add rows to the in-memory data, growing it geometrically."""
+        n = len(rows)
+        capacity = len(self._data)
+        if self._rows + n > capacity or self._data.shape[1] != rows.shape[1]:
+            capacity = max(2 * capacity, self._rows + n, 1024)
+            grown = np.empty((capacity, rows.shape[1]))
+            grown[:self._rows] = self._data[:self._rows]
+            self._data = grown
+        self._data[self._rows:self._rows + n] = rows
+        self._rows += n
 
     def _on_timeout(self):
         del self._data
+        del self._rows
+        del self._datapos
         del self._timeout_call
 
     def _saveData(self, data):
         f = self.file
-        # always save with dos linebreaks (requires numpy 1.5.0 or greater)
-        np.savetxt(f, data, fmt=DATA_FORMAT, delimiter=',', newline='\r\n')
+        # format all rows in one go; this writes the same text as
+        # np.savetxt, always with dos linebreaks
+        line = ','.join([DATA_FORMAT] * data.shape[1]) + '\r\n'
+        f.write((line * len(data)) % tuple(data.ravel()))
         f.flush()
 
     def addData(self, data):
@@ -430,37 +810,180 @@ class CsvNumpyData(CsvListData):
         if len(data[0]) != self.cols:
             raise errors.BadDataError(self.cols, len(data[0]))
 
-        # Ordinarily, we are using record arrays, but for numpy savetxt we want a 2-D array
-        record_data = util.from_record_array(data)
-        # append data to in-memory data
-        if self.data.size > 0:
-            self.data = np.vstack((self.data, record_data))
-        else:
-            self.data = record_data
+        # Ordinarily, we are using record arrays, but for writing we want a 2-D array
+        record_data = util.from_record_array(data).astype(np.float64)
+        record_data = record_data.reshape((-1, self.cols))
+        loaded = hasattr(self, '_data')
+        if loaded:
+            # catch up with the file before appending to it
+            self._readTail()
 
         # append data to file
-        self._saveData(data)
+        self._saveData(record_data)
+        self.cache.invalidate(self.cache_name, self.index.rows // self.cache.block_rows)
+
+        # append data to in-memory data, without parsing it back
+        if loaded:
+            self._append(record_data)
+            self._datapos = self.file.tell()
+
+    def _readRows(self, start, stop):
+        """Rows [start, stop) as a 2-D array.
+
+        Served from memory if the data is loaded, otherwise from the block
+        cache, reading missing blocks from the file (see _readFile).
+        """
+        if hasattr(self, '_data'):
+            data = self.data
+            if data.size == 0:
+                return np.zeros((0, self.cols))
+            return data[start:stop]
+        self.index.update(self.file)
+        nrows = self.index.rows
+        stop = nrows if stop is None else min(stop, nrows)
+        if start >= stop:
+            return np.zeros((0, self._numCols()))
+        if self.cache.firstRead(self.cache_name, (None,), start, stop):
+            parts = [self._readFile(lo, min(lo + CSV_READ_ROWS, stop))
+                     for lo in xrange(start, stop, CSV_READ_ROWS)]
+            return parts[0] if len(parts) == 1 else np.concatenate(parts)
+        def read(parts, lo, hi):
+            return {None: self._readFile(lo, hi)}
+        blocks = self.cache.blocks(self.cache_name, (None,), start, stop, nrows,
+                                   read, CSV_READ_ROWS)
+        parts = [rows[None][max(start - lo, 0):stop - lo] for lo, rows in blocks]
+        if len(parts) == 1:
+            return parts[0].copy()
+        return np.concatenate(parts)
+
+    def _readFile(self, start, stop):
+        """Rows [start, stop) of the file, which must all be in the index.
+
+        Seeks to the rows with the row-offset index and parses just those
+        lines, or all lines up to the next indexed row if there are blank
+        or comment lines among them.
+        """
+        f = self.file
+        offset, skip = self.index.locate(start)
+        needed = skip + stop - start
+        end = self.index.end
+        # the first indexed row at or after stop bounds the read
+        later = -(-stop // self.index.stride)
+        rows = self.index.rows - (start - skip)
+        if later < len(self.index.offsets):
+            end = self.index.offsets[later]
+            rows = later * self.index.stride - (start - skip)
+        f.seek(offset)
+        text = f.read(end - offset)
+        newlines = np.flatnonzero(np.frombuffer(text, np.uint8) == ord('\n'))
+        if len(newlines) != rows:
+            data = _parse_csv_block(text, self._numCols(text))
+            return data[skip:needed]
+        first = newlines[skip - 1] + 1 if skip else 0
+        text = text[first:newlines[needed - 1] + 1]
+        return _parse_csv_block(text, self._numCols(text))
 
     def getData(self, limit, start, transpose, simpleOnly):
         if transpose:
             raise RuntimeError("Transpose specified for simple data format: not supported")
 
-        if limit is None:
-            data = self.data[start:]
-        else:
-            data = self.data[start:start+limit]
-        # nrows should be zero for an empty row
-        nrows = len(data) if data.size > 0 else 0
-        return data, start + nrows
+        stop = None if limit is None else start + limit
+        data = self._readRows(start, stop)
+        return data, start + len(data)
+
+    def getSelection(self, columns, start, stop, step, transpose, simpleOnly):
+        """Get the given columns of every step-th row in [start, stop)."""
+        if transpose:
+            raise RuntimeError("Transpose specified for simple data format: not supported")
+        data = self._readRows(start, stop)[::step]
+        if columns is not None:
+            data = data[:, columns]
+        return data, start + len(data) * step
+
+    def getColumns(self, columns, start, stop):
+        """Get columns of rows [start, stop) as a list of 1-D arrays."""
+        data = self._readRows(start, stop)
+        return [data[:, i] for i in columns]
 
     def hasMore(self, pos):
-        # cheesy hack: if pos == 0, we only need to check whether
-        # the filesize is nonzero
-        if pos == 0:
-            return os.path.getsize(self.filename) > 0
-        else:
-            nrows = len(self.data) if self.data.size > 0 else 0
-            return pos < nrows
+        return len(self._readRows(pos, pos + 1)) > 0
+
+    def getRecords(self, limit, start):
+        """Get up to limit rows as a 1-D array of records of self.dtype."""
+        stop = None if limit is None else start + limit
+        data = self._readRows(start, stop)
+        records = np.ascontiguousarray(data, dtype=np.float64).view(self.dtype)
+        return records.reshape((-1,)), start + len(records)
+
+TIMESTAMP_DTYPE = 'datetime64[us]' # timestamps are stored as microseconds since 1970
+
+def encode_column(values, datatype, dtype):
+    """Convert the values of one column to an array of its storage dtype.
+
+    Timestamps ('t') may be datetime objects or numpy datetime64 values
+    and are stored as int64 microseconds since 1970-01-01; numbers are
+    taken to be such microseconds already.  Strings going into a
+    fixed-width column must fit.  The conversions are done by numpy, not
+    value by value.  Raises ValueError if the values do not fit.
+    """
+    if datatype == 't':
+        array = np.asarray(values)
+        if array.dtype.kind in 'iu':
+            return array.astype(np.int64)
+        return np.asarray(array, dtype=TIMESTAMP_DTYPE).view(np.int64)
+    if datatype == 's' and dtype.kind == 'S':
+        array = np.asarray(values)
+        if array.dtype.kind == 'U':
+            array = np.char.encode(array, 'utf-8')
+        elif array.dtype.kind != 'S':
+            array = array.astype(str)
+        if array.dtype.itemsize > dtype.itemsize:
+            too_long = np.flatnonzero(np.char.str_len(array) > dtype.itemsize)
+            if len(too_long):
+                raise ValueError('String {!r} is longer than the {} bytes of its '
+                                 'column'.format(array[too_long[0]], dtype.itemsize))
+        return array.astype(dtype)
+    return values
+
+def decode_column(array, datatype):
+    """Convert the stored values of one column to what labrad can flatten.
+
+    Strings become a list of str, converted by numpy.  Other columns,
+    including timestamps, which clients get as int64 microseconds since
+    1970-01-01 as they always have, are returned as they are.
+    """
+    if datatype == 's':
+        return array.tolist()
+    return array
+
+def records_from_columns(columns, dtype, datatypes):
+    """Make a record array from one sequence of values per column."""
+    if len(columns) != len(dtype.names):
+        raise errors.BadDataError(len(dtype.names), len(columns))
+    arrays = [encode_column(values, datatype, dtype[name])
+              for values, datatype, name in zip(columns, datatypes, dtype.names)]
+    return np.core.records.fromarrays(arrays, dtype=dtype)
+
+def records_from_rows(rows, dtype, datatypes):
+    """Make a record array from a sequence of rows of column values."""
+    rows = list(rows)
+    if not rows:
+        return np.recarray((0,), dtype=dtype)
+    lengths = set(map(len, rows))
+    if lengths != set([len(dtype.names)]):
+        raise errors.BadDataError(len(dtype.names), max(lengths - set([len(dtype.names)])))
+    return records_from_columns(zip(*rows), dtype, datatypes)
+
+def rows_from_records(records, datatypes):
+    """Make a list of row tuples from a record array, decoding each column."""
+    columns = []
+    for name, datatype in zip(records.dtype.names, datatypes):
+        column = decode_column(records[name], datatype)
+        if isinstance(column, np.ndarray):
+            # scalars as python numbers, array columns as one array per row
+            column = column.tolist() if column.ndim == 1 else list(column)
+        columns.append(column)
+    return zip(*columns)
 
 class HDF5MetaData(object):
     """Class to store metadata inside the file itself.
@@ -477,6 +1000,9 @@ class HDF5MetaData(object):
         ('Comment', h5py.special_dtype(vlen=str))
     ]
 
+    COMMENTS = 'Comments' # extensible dataset of comments, next to the data
+    PARAMETERS = 'Parameters' # group with a string dataset per parameter
+
     def load(self):
         """Load and save do nothing because HDF5 metadata is accessed live"""
         pass
@@ -487,7 +1013,10 @@ class HDF5MetaData(object):
 
     @property
     def dtype(self):
-        return self.dataset.dtype
+        # the row type never changes, and is needed outside the I/O workers
+        if getattr(self, '_dtype', None) is None:
+            self._dtype = self.dataset.dtype
+        return self._dtype
 
     def initialize_info(self, title, indep, dep):
         """Initializes the metadata for a newly created dataset."""
@@ -591,74 +1120,418 @@ class HDF5MetaData(object):
         type_tag = '({})'.format(','.join(column_type))
         return type_tag
 
+    def getColumnTypes(self):
+        """The labrad type tag of each column, without units or shape."""
+        # the columns never change, and reading the attributes is slow
+        if not getattr(self, '_column_types', None):
+            self._column_types = [
+                    str(col.datatype)
+                    for col in self.getIndependents() + self.getDependents()]
+        return self._column_types
+
+    def _paramKey(self, name):
+        # '/' separates groups and '.' alone names the group itself
+        return urllib.quote(name, safe='').replace('.', '%2E')
+
+    def _paramGroup(self, create=False):
+        f = self.dataset.file
+        if self.PARAMETERS in f:
+            return f[self.PARAMETERS]
+        if create:
+            return f.create_group(self.PARAMETERS, track_order=True)
+        return None
+
+    def _hasParam(self, name):
+        group = self._paramGroup()
+        if group is not None and self._paramKey(name) in group:
+            return True
+        return 'Param.{}'.format(name) in self.dataset.attrs
+
     def addParam(self, name, data):
-        keyname = 'Param.{}'.format(name)
-        if keyname in self.dataset.attrs:
-            raise errors.ParameterInUseError(name)
-        value = labrad_urlencode(data)
-        self.dataset.attrs[keyname] = value
+        self.addParams([(name, data)])
+
+    def addParams(self, params):
+        """Add several parameters.
+
+        All names are checked before anything is written, so either all
+        parameters are added or, if one of the names is in use, none.
+        """
+        names = set()
+        for name, _ in params:
+            if name in names or self._hasParam(name):
+                raise errors.ParameterInUseError(name)
+            names.add(name)
+        if not params:
+            return
+        group = self._paramGroup(create=True)
+        attrs = self.dataset.attrs
+        for name, data in params:
+            value = labrad_urlencode(data)
+            group[self._paramKey(name)] = value
+            # older readers only look for parameters in the attributes
+            attrs['Param.{}'.format(name)] = value
+
+    def _paramValue(self, name):
+        """The encoded value of a parameter, or None if there is none."""
+        group = self._paramGroup()
+        key = self._paramKey(name)
+        if group is not None and key in group:
+            return group[key][()]
+        return self.dataset.attrs.get('Param.{}'.format(name))
 
     def getParameter(self, name, case_sensitive=True):
         """Get a parameter from the dataset."""
-        keyname = 'Param.{}'.format(name)
-        if case_sensitive:
-            if keyname in self.dataset.attrs:
-                return labrad_urldecode(self.dataset.attrs[keyname])
-        else:
-            for k in self.dataset.attrs:
-                if k.lower() == keyname.lower():
-                    return labrad_urldecode(self.dataset.attrs[k])
-        raise errors.BadParameterError(name)
+        value = self._paramValue(name)
+        if value is None and not case_sensitive:
+            for other in self.getParamNames():
+                if other.lower() == name.lower():
+                    value = self._paramValue(other)
+                    break
+        if value is None:
+            raise errors.BadParameterError(name)
+        return labrad_urldecode(value)
 
     def getParamNames(self):
         """Get the names of all dataset parameters.
 
-        Parameter names in the HDF5 file are prefixed with 'Param.' to avoid
-        conflicts with the other metadata.
+        Parameters are kept as string datasets in the /Parameters group,
+        and also as attributes of the data set, prefixed with 'Param.' to
+        avoid conflicts with the other metadata, for older readers.  Files
+        written by older versions only have the attributes; parameters
+        found only there come first.
         """
+        group = self._paramGroup()
+        grouped = [] if group is None else [urllib.unquote(str(k)) for k in group]
         names = [str(k[6:]) for k in self.dataset.attrs if k.startswith('Param.')]
-        return names
+        return [name for name in names if name not in set(grouped)] + grouped
+
+    def _commentDataset(self, create=False):
+        f = self.dataset.file
+        if self.COMMENTS in f:
+            return f[self.COMMENTS]
+        if create:
+            return f.create_dataset(self.COMMENTS, (0,), dtype=self.comment_type,
+                                    maxshape=(None,), chunks=(COMMENT_CHUNK_ROWS,))
+        return None
+
+    def _numLegacyComments(self):
+        attrs = self.dataset.attrs
+        if 'Comments' not in attrs:
+            return 0
+        return attrs.get_id('Comments').shape[0]
+
+    def appendComments(self, comments):
+        """Append comments given as a structured array of comment_type."""
+        comment_set = self._commentDataset(create=True)
+        n = comment_set.shape[0]
+        comment_set.resize((n + len(comments),))
+        comment_set[n:] = comments
 
     def addComment(self, user, comment):
         """Add a comment to the dataset."""
         t = time.time()
-        new_comment = np.array([(t, user, comment)], dtype=self.comment_type)
-        old_comments = self.dataset.attrs['Comments']
-        data = np.hstack((old_comments, new_comment))
-        self.dataset.attrs.create('Comments', data, dtype=self.comment_type)
+        self.appendComments(np.array([(t, user, comment)], dtype=self.comment_type))
 
     def getComments(self, limit, start):
-        """Get comments in [(datetime, username, comment), ...] format."""
-        if limit is None:
-            raw_comments = self.dataset.attrs['Comments'][start:]
-        else:
-            raw_comments = self.dataset.attrs['Comments'][start:start+limit]
+        """Get comments in [(datetime, username, comment), ...] format.
+
+        Comments are kept in the extensible /Comments dataset.  Older files
+        store them in the 'Comments' attribute of the data set, which has to
+        be rewritten for every comment; those come first.
+        """
+        legacy = self._numLegacyComments()
+        stop = self.numComments()
+        if limit is not None:
+            stop = min(stop, start + limit)
+        raw_comments = []
+        if start < legacy:
+            raw_comments.extend(self.dataset.attrs['Comments'][start:min(stop, legacy)])
+        if stop > legacy:
+            comment_set = self._commentDataset()
+            raw_comments.extend(comment_set[max(start - legacy, 0):stop - legacy])
         comments = [(datetime.datetime.fromtimestamp(c[0]), str(c[1]), str(c[2])) for c in raw_comments]
         return comments, start+len(comments)
 
     def numComments(self):
-        return len(self.dataset.attrs['Comments'])
+        comment_set = self._commentDataset()
+        n = 0 if comment_set is None else comment_set.shape[0]
+        return self._numLegacyComments() + n
+
+class HDF5Data(HDF5MetaData):
+    """Row storage shared by the HDF5 backends.
+
+    Rows are kept in the one-dimensional compound dataset /DataVault.  If
+    the storage profile has a growth factor, the dataset is over-allocated
+    geometrically when rows are appended and the number of valid rows is
+    kept in the 'Length' attribute.  The extra capacity is trimmed off when
+    the file is closed, so files on disk only hold valid rows.  Files
+    without the 'Length' attribute hold exactly dataset.shape[0] rows.
+    """
+
+    LENGTH_ATTR = 'Length'
+    READ_BLOCK_ROWS = 65536
+    MIN_HYPERSLAB_STRIDE = 512
 
-class ExtendedHDF5Data(HDF5MetaData):
+    # data access may be run in an I/O worker thread while the file is held
+    threadsafe = True
+
+    def __init__(self, fh, profile=None):
+        self._file = fh
+        self.profile = get_storage_profile(profile)
+        self._cached_file = None
+        self._length_attr = None
+        # rows read are kept in the shared block cache, one block per field
+        self.cache = cache.get_block_cache()
+        self.cache_name = os.path.abspath(fh.open_args[0])
+        fh.onClose(self._onFileClose)
+
+    @property
+    def file(self):
+        return self._file()
+
+    @property
+    def dataset(self):
+        # looking up the dataset by name is a large part of the cost of a
+        # small append, so we keep the dataset object until the file closes
+        f = self.file
+        if self._cached_file is not f:
+            self._dataset = f['DataVault']
+            if self.LENGTH_ATTR in self._dataset.attrs:
+                self._length_attr = h5py.h5a.open(self._dataset.id, self.LENGTH_ATTR)
+                self._length = int(self._dataset.attrs[self.LENGTH_ATTR])
+            else:
+                self._length = None
+            self._cached_file = f
+        return self._dataset
+
+    def __len__(self):
+        dataset = self.dataset
+        if self._length is None:
+            return dataset.shape[0]
+        return self._length
+
+    def capacity(self):
+        """Number of rows allocated in the file, including unused ones."""
+        return self.dataset.shape[0]
+
+    def addData(self, data):
+        """Appends rows, growing the dataset geometrically if enabled."""
+        dataset = self.dataset
+        old_rows = len(self)
+        new_rows = old_rows + len(data)
+        if new_rows > dataset.shape[0]:
+            if dataset.maxshape[0] is not None:
+                # repacked (see repack_hdf5_file), so it cannot grow
+                dataset = self._makeExtensible(dataset)
+            dataset.resize((self._newCapacity(new_rows),))
+        dataset[old_rows:new_rows] = data
+        if self._length is not None or dataset.shape[0] != new_rows:
+            self._setLength(dataset, new_rows)
+        self.cache.invalidate(self.cache_name, old_rows // self.cache.block_rows)
+
+    def _setLength(self, dataset, length):
+        # writing through a cached low-level attribute handle is several
+        # times faster than dataset.attrs, which recreates the attribute
+        if self._length is None:
+            dataset.attrs.create(self.LENGTH_ATTR, length, dtype=np.int64)
+            self._length_attr = h5py.h5a.open(dataset.id, self.LENGTH_ATTR)
+        self._length_attr.write(np.asarray(length, dtype=np.int64))
+        self._length = length
+
+    def _newCapacity(self, rows):
+        growth = self.profile.growth
+        if not growth or growth <= 1:
+            return rows
+        capacity = int(self.dataset.shape[0] * growth)
+        if self.dataset.chunks is not None:
+            # unwritten chunks take no space on disk, so always fill a chunk
+            capacity = max(capacity, self.dataset.chunks[0])
+        return max(capacity, rows)
+
+    def trim(self):
+        """Shrink the dataset to the valid rows."""
+        self._trim(self.dataset)
+
+    def _trim(self, dataset):
+        if self.LENGTH_ATTR in dataset.attrs:
+            length = int(dataset.attrs[self.LENGTH_ATTR])
+            if dataset.shape[0] != length:
+                dataset.resize((length,))
+
+    def _makeExtensible(self, dataset):
+        """Copy a fixed-size dataset into a new one that can be resized."""
+        f = self.file
+        rows = len(self)
+        options = dataset_options(dataset.dtype, self.profile)
+        new = f.create_dataset(PARTIAL_DATASET, (rows,), dtype=dataset.dtype,
+                               maxshape=(None,), **options)
+        _copy_rows(dataset, new, rows, self.READ_BLOCK_ROWS)
+        _copy_attrs(dataset, new, skip=(self.LENGTH_ATTR,))
+        self._forgetDataset()
+        del f['DataVault']
+        f.move(PARTIAL_DATASET, 'DataVault')
+        return self.dataset
+
+    def _forgetDataset(self):
+        self._cached_file = None
+        self._length_attr = None
+        self._dataset = None
+
+    def _onFileClose(self, fh):
+        # called from the SelfClosingFile right before the handle is closed;
+        # calling fh() here would reopen the file, so use the open handle.
+        if self._cached_file is not None:
+            self._trim(self._dataset)
+            self._forgetDataset()
+
+    def _getData(self, limit, start):
+        stop = None if limit is None else start + limit
+        return self._getSelection(None, start, stop, 1)
+
+    def _getSelection(self, columns, start, stop, step):
+        """Read the given columns of every step-th row in [start, stop).
+
+        Only the selected fields in the row range are read from the file,
+        and for large strides only the selected rows.  Returns
+        a structured array holding the selected fields, and the position of
+        the next row in the selection.
+        """
+        dataset = self.dataset
+        names = dataset.dtype.names
+        if columns is not None:
+            names = tuple(names[i] for i in columns)
+        # an empty field list would mean all fields to h5py
+        if not names:
+            raise ValueError('No columns selected')
+        length = len(self)
+        stop = length if stop is None else min(stop, length)
+        nrows = len(xrange(start, max(start, stop), step))
+        struct_data = np.empty((nrows,), dtype=[(name, dataset.dtype[name]) for name in names])
+        if step < self.MIN_HYPERSLAB_STRIDE:
+            self._readCached(struct_data, start, stop, step)
+        else:
+            self._readStrided(struct_data, start, stop, step)
+        return struct_data, start + nrows * step
+
+    def _readCached(self, struct_data, start, stop, step):
+        """Fill struct_data with every step-th row in [start, stop).
+
+        HDF5 handles strided selections element by element, which is much
+        slower than reading every row unless the stride is large, so small
+        strides read whole blocks of rows, through the block cache, and
+        subsample them in memory.  Rows that are not cached are read at most
+        READ_BLOCK_ROWS at a time, since h5py holds the GIL for the whole of
+        each read, and other threads (the reactor) should get to run.
+        """
+        dataset = self.dataset
+        names = struct_data.dtype.names
+        if self.cache.firstRead(self.cache_name, names, start, stop):
+            self._readDense(struct_data, start, stop, step)
+            return
+        def read(fields, lo, hi):
+            if len(fields) == 1:
+                # h5py returns a single field as a plain array
+                return {fields[0]: dataset[fields[0], lo:hi]}
+            part = dataset[tuple(fields) + (slice(lo, hi),)]
+            return dict((name, part[name]) for name in fields)
+        blocks = self.cache.blocks(self.cache_name, names, start, stop, len(self),
+                                   read, self.READ_BLOCK_ROWS)
+        for lo, parts in blocks:
+            # the first selected row in this block
+            first = max(lo, start)
+            first += -(first - start) % step
+            rows = slice(first - lo, stop - lo, step)
+            pos = (first - start) // step
+            for name in names:
+                part = parts[name][rows]
+                struct_data[name][pos:pos + len(part)] = part
+
+    def _readDense(self, struct_data, start, stop, step):
+        """Fill struct_data with every step-th row in [start, stop).
+
+        Used for rows that were not read before, which go straight into
+        struct_data rather than through the block cache.
+        """
+        dataset = self.dataset
+        names = struct_data.dtype.names
+        block = max(self.READ_BLOCK_ROWS // step, 1) * step
+        pos = 0
+        for first in xrange(start, stop, block):
+            rows = slice(first, min(first + block, stop))
+            if names == dataset.dtype.names:
+                part = dataset[rows][::step]
+                struct_data[pos:pos + len(part)] = part
+            elif len(names) == 1:
+                part = dataset[names[0], rows][::step]
+                struct_data[names[0]][pos:pos + len(part)] = part
+            else:
+                part = dataset[names + (rows,)][::step]
+                struct_data[pos:pos + len(part)] = part
+            pos += len(part)
+
+    def _readStrided(self, struct_data, start, stop, step):
+        """Fill struct_data with every step-th row in [start, stop).
+
+        For large strides, only the selected rows are read, bypassing the
+        block cache.
+        """
+        dataset = self.dataset
+        names = struct_data.dtype.names
+        block = self.READ_BLOCK_ROWS * step
+        pos = 0
+        for first in xrange(start, stop, block):
+            rows = slice(first, min(first + block, stop), step)
+            if len(names) == 1:
+                part = dataset[names[0], rows]
+                struct_data[names[0]][pos:pos + len(part)] = part
+            else:
+                part = dataset[names + (rows,)]
+                struct_data[pos:pos + len(part)] = part
+            pos += len(part)
+
+    def getColumns(self, columns, start, stop):
+        """Get columns of rows [start, stop) as a list of 1-D arrays."""
+        # each field can only be read once
+        unique = sorted(set(columns))
+        struct_data, _ = self._getSelection(unique, start, stop, 1)
+        names = struct_data.dtype.names
+        return [struct_data[names[unique.index(i)]] for i in columns]
+
+    def hasMore(self, pos):
+        return pos < len(self)
+
+    def getRecords(self, limit, start):
+        """Get up to limit rows as a 1-D array of records."""
+        return self._getData(limit, start)
+
+class ExtendedHDF5Data(HDF5Data):
     """Dataset backed by HDF5 file
 
     This supports the extended dataset format which allows each column
     to have a different type and to be arrays themselves.
     """
 
-    def __init__(self, fh):
-        self._file = fh
+    def __init__(self, fh, profile=None):
+        HDF5Data.__init__(self, fh, profile)
         if 'Version' not in self.file.attrs:
             self.file.attrs['Version'] = np.asarray([3, 0, 0], dtype=np.int32)
         self.version = np.asarray(self.file.attrs['Version'], np.int32)
 
-    def initialize_info(self, title, indep, dep):
-        """Initialize the columns when creating a new dataset"""
+    def initialize_info(self, title, indep, dep, profile=None):
+        """Initialize the columns when creating a new dataset
+
+        The storage profile sets the chunk layout and compression filters
+        of the new dataset.  See STORAGE_PROFILES.
+        """
         dtype = []
         for idx, col in enumerate(indep + dep):
             shape = col.shape
             ttag = col.datatype
             unit = col.unit
+            width = None
+            if re.match(r's\d+$', ttag):
+                width = int(ttag[1:])
+                ttag = 's'
             if len(shape) == 1 and shape[0] == 1:
                 shapestr = ''
             else:
@@ -671,7 +1544,10 @@ class ExtendedHDF5Data(HDF5MetaData):
             elif ttag == 's':
                 if shapestr:
                     raise ValueError("Cannot create string array column")
-                dtype.append((varname, h5py.special_dtype(vlen=str)))
+                if width:
+                    dtype.append((varname, 'S{}'.format(width)))
+                else:
+                    dtype.append((varname, h5py.special_dtype(vlen=str)))
             elif ttag == 't':
                 dtype.append((varname, shapestr + 'i8'))
             elif ttag == 'v':
@@ -681,75 +1557,51 @@ class ExtendedHDF5Data(HDF5MetaData):
             else:
                 raise RuntimeError("Invalid type tag {}".format(ttag))
 
-        self.file.create_dataset('DataVault', (0,), dtype=dtype, maxshape=(None,))
+        self.file.create_dataset('DataVault', (0,), dtype=dtype, maxshape=(None,),
+                                 **dataset_options(dtype, profile))
+        # the width of a string column is only kept in the dtype
+        indep = [self._plainStrings(i) for i in indep]
+        dep = [self._plainStrings(d) for d in dep]
         HDF5MetaData.initialize_info(self, title, indep, dep)
 
-    @property
-    def file(self):
-        return self._file()
-
-    @property
-    def dataset(self):
-        return self.file["DataVault"]
-
-    def addData(self, data):
-        """Adds one or more rows or data from a numpy struct array."""
-        new_rows = len(data)
-        old_rows = self.dataset.shape[0]
-        self.dataset.resize((old_rows + new_rows,))
-        self.dataset[old_rows:(old_rows + new_rows)] = data
+    @staticmethod
+    def _plainStrings(col):
+        if re.match(r's\d+$', col.datatype):
+            return col._replace(datatype='s')
+        return col
 
     def getData(self, limit, start, transpose, simpleOnly):
         """Get up to limit rows from a dataset."""
+        stop = None if limit is None else start + limit
+        return self.getSelection(None, start, stop, 1, transpose, simpleOnly)
+
+    def getSelection(self, columns, start, stop, step, transpose, simpleOnly):
+        """Get the given columns of every step-th row in [start, stop)."""
         if simpleOnly:
             datatype = self.dataset.dtype
-            for idx in range(len(datatype)):
+            for idx in range(len(datatype)) if columns is None else columns:
                 if datatype[idx] != np.float64:
                     raise errors.DataVersionMismatchError()
+        struct_data, new_pos = self._getSelection(columns, start, stop, step)
+        datatypes = self.getColumnTypes()
+        if columns is not None:
+            datatypes = [datatypes[i] for i in columns]
         if transpose:
-            return self.getDataTranspose(limit, start)
-
-        data, new_pos = self._getData(limit, start)
-        row_data = [tuple(row) for row in data]
-        return row_data, new_pos
+            return self._transpose(struct_data, datatypes), new_pos
+        return rows_from_records(struct_data, datatypes), new_pos
 
     def getDataTranspose(self, limit, start):
         struct_data, new_pos = self._getData(limit, start)
-        columns = []
-        for idx in range(len(struct_data.dtype)):
-            col = struct_data['f{}'.format(idx)]
-            # Strings are stored as hdf5 vlen objects.  Numpy can't do
-            # variable length strings, so they get encoded as object
-            # arrays by hdf5.  we don't know how to flatten object
-            # arrays so we special case vlen types here and convert
-            # them to lists.  Also, h5py has a bug where when you
-            # index a dataset with a compound type, it loses the
-            # special dtype information, so we pull it directly from
-            # self.dataset.dtype rather than the data returned by
-            # _getData
-            if self.dataset.dtype[idx] == np.object:
-                base_type = h5py.check_dtype(vlen=self.dataset.dtype[idx])
-                if not base_type or not issubclass(base_type, str):
-                    raise RuntimeError("Found object type array, but not vlen str.  Not supported.  This shouldn't happen")
-                col = [base_type(x) for x in col]
-            columns.append(col)
-        columns = tuple(columns)
-        return columns, new_pos
+        return self._transpose(struct_data, self.getColumnTypes()), new_pos
 
-    def _getData(self, limit, start):
-        if limit is None:
-            struct_data = self.dataset[start:]
-        else:
-            struct_data = self.dataset[start:start+limit]
-        return struct_data, start + struct_data.shape[0]
-
-    def __len__(self):
-        return self.dataset.shape[0]
-
-    def hasMore(self, pos):
-        return pos < len(self)
+    def _transpose(self, struct_data, datatypes):
+        # Strings come back from hdf5 as object arrays (variable length)
+        # or fixed-width byte arrays, so these columns are converted to
+        # lists that labrad can flatten.
+        return tuple(decode_column(struct_data[name], datatype)
+                     for name, datatype in zip(struct_data.dtype.names, datatypes))
 
-class SimpleHDF5Data(HDF5MetaData):
+class SimpleHDF5Data(HDF5Data):
     """Basic dataset backed by HDF5 file.
 
     This is a very simple implementation that only supports a single 2-D dataset
@@ -757,101 +1609,203 @@ class SimpleHDF5Data(HDF5MetaData):
     a filesystem-like tree of datasets within one file.  Here, the single dataset
     is stored in /DataVault within the HDF5 file.
     """
-    def __init__(self, fh):
-        self._file = fh
+    def __init__(self, fh, profile=None):
+        HDF5Data.__init__(self, fh, profile)
         if 'Version' not in self.file.attrs:
             self.file.attrs['Version'] = np.asarray([2, 0, 0], dtype=np.int32)
         self.version = np.asarray(self.file.attrs['Version'], dtype=np.int32)
+        self._map_dataset = None
+        self._map = None
 
-    def initialize_info(self, title, indep, dep):
+    def _memmap(self):
+        """The rows as a read-only memory map, or None if that is not possible.
+
+        Only datasets whose rows are stored contiguously and uncompressed in
+        the file, as written by repack_hdf5_file, can be mapped.  Such
+        datasets cannot grow, so the map stays valid until the file closes
+        or rows are added, which copies the rows to a new, chunked dataset.
+        """
+        dataset = self.dataset
+        if self._map_dataset is not dataset:
+            self._map = self._openMap(dataset)
+            self._map_dataset = dataset
+        return self._map
+
+    def _openMap(self, dataset):
+        if dataset.chunks is not None or dataset.external is not None:
+            return None
+        if dataset.maxshape != dataset.shape or self.LENGTH_ATTR in dataset.attrs:
+            return None
+        dtype = dataset.dtype
+        if dataset.id.get_type().get_size() != dtype.itemsize:
+            return None
+        if any(dtype[name] != np.dtype(np.float64) for name in dtype.names):
+            return None
+        offset = dataset.id.get_offset()
+        if offset is None or not dataset.shape[0]:
+            return None
+        return np.memmap(self._file.open_args[0], dtype=dtype, mode='r',
+                         offset=offset, shape=dataset.shape)
+
+    def _forgetDataset(self):
+        HDF5Data._forgetDataset(self)
+        self._map_dataset = None
+        self._map = None
+
+    def _getSelection(self, columns, start, stop, step):
+        rows = self._memmap()
+        if rows is None:
+            return HDF5Data._getSelection(self, columns, start, stop, step)
+        names = rows.dtype.names
+        if columns is not None:
+            names = tuple(names[i] for i in columns)
+        if not names:
+            raise ValueError('No columns selected')
+        selected = rows[start:stop:step]
+        struct_data = np.empty((len(selected),),
+                               dtype=[(name, rows.dtype[name]) for name in names])
+        for name in names:
+            struct_data[name] = selected[name]
+        return struct_data, start + len(selected) * step
+
+    def initialize_info(self, title, indep, dep, profile=None):
         ncol = len(indep) + len(dep)
         dtype = [('f{}'.format(idx), np.float64) for idx in range(ncol)]
         if 'DataVault' not in self.file:
-            self.file.create_dataset('DataVault', (0,), dtype=dtype, maxshape=(None,))
+            self.file.create_dataset('DataVault', (0,), dtype=dtype, maxshape=(None,),
+                                     **dataset_options(dtype, profile))
         HDF5MetaData.initialize_info(self, title, indep, dep)
 
-    @property
-    def file(self):
-        return self._file()
-
-    @property
-    def dataset(self):
-        return self.file["DataVault"]
-
-    def addData(self, data):
-        """Adds one or more rows or data from a 2D array of floats."""
-        new_rows = data.shape[0]
-        old_rows = self.dataset.shape[0]
-        #if data.shape[1] != len(self.dataset.dtype):
-        #    raise errors.BadDataError(len(self.dataset.dtype), data.shape[1])
-
-        self.dataset.resize((old_rows + new_rows,))
-        #new_data = np.zeros((new_rows,), dtype=self.dataset.dtype)
-        #for col in range(data.shape[1]):
-        #    field = "f%d" % (col,)
-        #    new_data[field] = data[:,col]
-        self.dataset[old_rows:(old_rows + new_rows)] = data
-
     def getData(self, limit, start, transpose, simpleOnly):
         """Get up to limit rows from a dataset."""
+        stop = None if limit is None else start + limit
+        return self.getSelection(None, start, stop, 1, transpose, simpleOnly)
+
+    def getSelection(self, columns, start, stop, step, transpose, simpleOnly):
+        """Get the given columns of every step-th row in [start, stop)."""
         if transpose:
             raise RuntimeError("Transpose specified for simple data format: not supported")
-        if limit is None:
-            struct_data = self.dataset[start:]
-        else:
-            struct_data = self.dataset[start:start+limit]
+        rows = self._memmap()
+        if rows is not None and columns is None:
+            # all columns are float64, so the rows can be sliced as a 2-D array
+            table = rows.view(np.float64).reshape((len(rows), len(rows.dtype.names)))
+            data = np.array(table[start:stop:step])
+            return data, start + len(data) * step
+        struct_data, new_pos = self._getSelection(columns, start, stop, step)
         columns = []
-        for idx in range(len(struct_data.dtype)):
-            columns.append(struct_data['f{}'.format(idx)])
+        for name in struct_data.dtype.names:
+            columns.append(struct_data[name])
         data = np.column_stack(columns)
-        return data, start + data.shape[0]
-
-    def __len__(self):
-        return self.dataset.shape[0]
-
-    def hasMore(self, pos):
-        return pos < len(self)
+        return data, new_pos
+
+def _copy_rows(src, dst, rows, block_rows):
+    for start in xrange(0, rows, block_rows):
+        stop = min(start + block_rows, rows)
+        dst[start:stop] = src[start:stop]
+
+def _copy_attrs(src, dst, skip=()):
+    """Copy the attributes of one HDF5 object to another, keeping their types."""
+    for name in src.attrs:
+        if name not in skip:
+            dst.attrs.create(name, src.attrs[name], dtype=src.attrs.get_id(name).dtype)
+
+def repack_hdf5_file(filename):
+    """Rewrite a finished HDF5 dataset file with its rows stored contiguously.
+
+    The rows of the new DataVault dataset are stored uncompressed in one
+    block with no spare capacity, so that SimpleHDF5Data can read them
+    through a memory map instead of h5py.  Everything else in the file is
+    copied unchanged.  The new file is written under a temporary name and
+    renamed over the old one once complete, so the file must not be open
+    anywhere else, for example in a running data vault that may write to
+    it.  Data can still be added to a repacked dataset; the rows are then
+    copied back into a chunked dataset first.  Returns the number of rows.
+    """
+    partial = filename + PARTIAL_SUFFIX
+    try:
+        with h5py.File(filename, 'r') as src, h5py.File(partial, 'w') as dst:
+            _copy_attrs(src, dst)
+            for name in src:
+                if name != 'DataVault':
+                    src.copy(name, dst)
+            old = src['DataVault']
+            rows = int(old.attrs.get(HDF5Data.LENGTH_ATTR, old.shape[0]))
+            new = dst.create_dataset('DataVault', (rows,), dtype=old.dtype)
+            _copy_rows(old, new, rows, HDF5Data.READ_BLOCK_ROWS)
+            _copy_attrs(old, new, skip=(HDF5Data.LENGTH_ATTR,))
+        os.rename(partial, filename)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return rows
+
+# held while an HDF5 file is open read-only beside the server, as the
+# search crawl does with each dataset it indexes (see open_hdf5)
+read_only_lock = threading.Lock()
+
+def open_hdf5(filename, mode='a', **kw):
+    """Open an HDF5 file with h5py for the server.
+
+    HDF5 refuses to open a file for writing while it is open read-only
+    elsewhere in this process, so if opening fails we wait for any such
+    reader to close its file (see read_only_lock) and try once more.
+    """
+    try:
+        return h5py.File(filename, mode, **kw)
+    except IOError:
+        with read_only_lock:
+            return h5py.File(filename, mode, **kw)
 
-def open_hdf5_file(filename):
+def open_hdf5_file(filename, profile=None):
     """Factory for HDF5 files.  
 
     We check the version of the file to construct the proper class.  Currently, only two
     options exist: version 2.0.0 -> legacy format, 3.0.0 -> extended format.
-    Version 1 is reserved for CSV files.
+    Version 1 is reserved for CSV files.  The storage profile only sets the
+    chunk cache used when reading, since the layout is fixed at creation.
     """
-    fh = SelfClosingFile(h5py.File, open_args=(filename, 'a'))
+    fh = SelfClosingFile(open_hdf5, open_args=(filename, 'a'),
+                         open_kw=file_options(profile))
     version = fh().attrs['Version']
     if version[0] == 2:
-        return SimpleHDF5Data(fh)
+        return SimpleHDF5Data(fh, profile)
     else:
-        return ExtendedHDF5Data(fh)
+        return ExtendedHDF5Data(fh, profile)
 
-def create_backend(filename, title, indep, dep, extended):
+def create_backend(filename, title, indep, dep, extended, profile=None):
     hdf5_file = filename + '.hdf5'
-    fh = SelfClosingFile(h5py.File, open_args=(hdf5_file, 'a'))
+    fh = SelfClosingFile(open_hdf5, open_args=(hdf5_file, 'a'),
+                         open_kw=file_options(profile))
     if extended:
-        data = ExtendedHDF5Data(fh)
+        data = ExtendedHDF5Data(fh, profile)
     else:
-        data = SimpleHDF5Data(fh)
-    data.initialize_info(title, indep, dep)
+        data = SimpleHDF5Data(fh, profile)
+    data.initialize_info(title, indep, dep, profile)
+    # drop anything cached from an earlier file of the same name
+    data.cache.invalidate(data.cache_name)
     return data
 
-def open_backend(filename):
+def open_backend(filename, profile=None):
     """Make a data object that manages in-memory and on-disk storage for a dataset.
 
     filename should be specified without a file extension. If there is an existing
     file in csv format, we create a backend of the appropriate type. If
     no file exists, we create a new backend to store data in binary form.
+    A csv dataset that was converted to HDF5 (see datavault.migrate) is
+    opened from the HDF5 file, unless the csv file has been modified since.
     """
     csv_file = filename + '.csv'
     hdf5_file = filename + '.hdf5'
 
+    if os.path.exists(csv_file) and os.path.exists(hdf5_file):
+        if os.path.getmtime(hdf5_file) >= os.path.getmtime(csv_file):
+            return open_hdf5_file(hdf5_file, profile)
     if os.path.exists(csv_file):
         if use_numpy:
             return CsvNumpyData(csv_file)
         else:
             return CsvListData(csv_file)
     elif os.path.exists(hdf5_file):
-        return open_hdf5_file(hdf5_file)
+        return open_hdf5_file(hdf5_file, profile)
     else: # We should have already checked, this should not happen
         raise errors.DatasetNotFoundError(filename)
@@ -0,0 +1,668 @@
+"""Micro-benchmarks for the data vault storage backends.
+
+Run from the servers directory:
+
+    python -m datavault.benchmark [--rows N] [--batch N] [--cols N] [--wide-cols N]
+
+Each benchmark creates scratch datasets in a temporary directory and
+prints throughput numbers, so that storage changes can be compared against
+the layout used by older versions of the data vault.
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from labrad import types as T
+from labrad import units as U
+from labrad.server import Signal
+from twisted.internet import task
+
+from . import SessionStore, backend, decimate, hub, search, testing, util
+from .server import ExtendedContext
+from .subscriptions import SubscriptionRegistry
+
+
+_INDEPENDENT = backend.Independent(label='x', shape=(1,), datatype='v', unit='')
+
+def _dependent(i):
+    return backend.Dependent(label='y', legend=str(i), shape=(1,), datatype='v', unit='')
+
+def _timed(f, *args, **kw):
+    start = time.time()
+    f(*args, **kw)
+    return time.time() - start
+
+def _records(rows, cols, offset=0):
+    data = np.arange(offset * cols, (offset + rows) * cols, dtype=np.float64)
+    data = data.reshape((rows, cols))
+    return np.core.records.fromarrays(data.T, dtype=','.join(['f8'] * cols))
+
+def bench_profiles(tmpdir, rows, batch, cols, profiles=None):
+    """Compare append and read throughput of the HDF5 storage profiles.
+
+    Returns a list of (profile, append rows/s, read rows/s, slice reads/s,
+    file size) tuples.
+    """
+    if profiles is None:
+        profiles = sorted(backend.STORAGE_PROFILES)
+    results = []
+    for profile in profiles:
+        filename = os.path.join(tmpdir, 'profile_' + profile)
+        data = backend.create_backend(
+                filename, profile, [_INDEPENDENT],
+                [_dependent(i) for i in range(cols - 1)], False, profile)
+        blocks = [_records(batch, cols, i) for i in xrange(0, rows, batch)]
+
+        def append():
+            for block in blocks:
+                data.addData(block)
+        t_append = _timed(append)
+
+        # reopen so that reads are not served from the write cache
+        data._file.close()
+        data = backend.open_backend(filename, profile)
+        t_read = _timed(data.getData, None, 0, False, False)
+
+        starts = np.random.RandomState(0).randint(0, max(rows - batch, 1), 200)
+        def slices():
+            for start in starts:
+                data.getData(batch, int(start), False, False)
+        t_slice = _timed(slices)
+
+        data.file.flush()
+        size = os.path.getsize(filename + '.hdf5')
+        results.append((profile, rows / t_append, rows / t_read,
+                        len(starts) / t_slice, size))
+    return results
+
+def _percentiles(samples):
+    samples = np.asarray(samples) * 1e6
+    return np.median(samples), np.percentile(samples, 99)
+
+def bench_single_row_add(tmpdir, rows, cols, profiles=('legacy', 'default')):
+    """Latency of appending one row at a time.
+
+    'resize per add' reproduces the append path used before capacity-based
+    growth: look up /DataVault and resize it on every call.  Returns a list
+    of (mode, p50 us, p99 us) tuples.
+    """
+    blocks = [_records(1, cols, i) for i in xrange(rows)]
+    results = []
+
+    filename = os.path.join(tmpdir, 'single_resize')
+    data = backend.create_backend(
+            filename, 'resize', [_INDEPENDENT],
+            [_dependent(i) for i in range(cols - 1)], False, 'legacy')
+    f = data.file
+    samples = []
+    for block in blocks:
+        start = time.time()
+        dataset = f['DataVault']
+        old_rows = dataset.shape[0]
+        dataset.resize((old_rows + 1,))
+        dataset[old_rows:old_rows + 1] = block
+        samples.append(time.time() - start)
+    results.append(('resize per add',) + _percentiles(samples))
+
+    for profile in profiles:
+        filename = os.path.join(tmpdir, 'single_' + profile)
+        data = backend.create_backend(
+                filename, profile, [_INDEPENDENT],
+                [_dependent(i) for i in range(cols - 1)], False, profile)
+        samples = []
+        for block in blocks:
+            start = time.time()
+            data.addData(block)
+            samples.append(time.time() - start)
+        results.append((profile,) + _percentiles(samples))
+    return results
+
+def bench_column_projection(tmpdir, rows, cols, profiles=('default', 'lzf')):
+    """Read one column out of many, with and without column selection.
+
+    Returns a list of (profile, all columns s, one column s, strided s)
+    tuples, where the strided read takes every 10th row of one column.
+    """
+    results = []
+    for profile in profiles:
+        filename = os.path.join(tmpdir, 'columns_' + profile)
+        data = backend.create_backend(
+                filename, profile, [_INDEPENDENT],
+                [_dependent(i) for i in range(cols - 1)], True, profile)
+        batch = 10000
+        for start in xrange(0, rows, batch):
+            data.addData(_records(min(batch, rows - start), cols, start))
+        data._file.close()
+        data = backend.open_backend(filename, profile)
+
+        t_all = _timed(data.getData, None, 0, True, False)
+        t_one = _timed(data.getSelection, [cols // 2], 0, None, 1, True, False)
+        t_stride = _timed(data.getSelection, [cols // 2], 0, None, 10, True, False)
+        results.append((profile, t_all, t_one, t_stride))
+    return results
+
+def bench_random_slices(tmpdir, rows, cols, slice_rows=100, reads=2000):
+    """Latency of reading slices at random positions of a finished dataset.
+
+    The same rows are read straight from h5py and through getData, from a
+    chunked file and from a repacked copy that getData reads through a
+    memory map.  Returns a list of (mode, p50 us, p99 us) tuples.
+    """
+    filename = os.path.join(tmpdir, 'random_slices')
+    data = backend.create_backend(
+            filename, 'slices', [_INDEPENDENT],
+            [_dependent(i) for i in range(cols - 1)], False)
+    batch = 100000
+    for start in xrange(0, rows, batch):
+        data.addData(_records(min(batch, rows - start), cols, start))
+    data._file.close()
+    shutil.copy(filename + '.hdf5', filename + '_repacked.hdf5')
+    backend.repack_hdf5_file(filename + '_repacked.hdf5')
+    starts = np.random.RandomState(0).randint(0, rows - slice_rows, reads)
+
+    def latencies(read):
+        samples = []
+        for start in starts:
+            t = time.time()
+            read(start)
+            samples.append(time.time() - t)
+        return _percentiles(samples)
+
+    results = []
+    for name, label in [('random_slices', 'chunked'),
+                        ('random_slices_repacked', 'repacked')]:
+        data = backend.open_backend(os.path.join(tmpdir, name))
+        data.cache.invalidate(data.cache_name)
+        dataset = data.dataset
+        results.append(('h5py, ' + label,) +
+                       latencies(lambda start: dataset[start:start + slice_rows]))
+        results.append(('getData, ' + label,) +
+                       latencies(lambda start: data.getData(slice_rows, start, False, False)))
+        data._file.close()
+    return results
+
+def bench_decimation(tmpdir, rows, points=2000):
+    """Time decimated reads of a large dataset against reading every row.
+
+    Returns a list of (operation, seconds) tuples.
+    """
+    filename = os.path.join(tmpdir, 'decimate')
+    data = backend.create_backend(
+            filename, 'decimate', [_INDEPENDENT], [_dependent(0)], False)
+    batch = 100000
+    for start in xrange(0, rows, batch):
+        data.addData(_records(min(batch, rows - start), 2, start))
+    data._file.close()
+    data = backend.open_backend(filename)
+
+    results = [('read all rows', _timed(data.getData, None, 0, False, False))]
+    pyramid = decimate.Pyramid(0, [0, 1])
+    results.append(('build pyramid', _timed(pyramid.sync, data)))
+    for method in decimate.METHODS:
+        results.append(('{} all rows'.format(method), _timed(
+                decimate.decimate, data, pyramid, 1, 0, None, points, method)))
+        results.append(('{} 1% of rows'.format(method), _timed(
+                decimate.decimate, data, pyramid, 1, rows // 3,
+                rows // 3 + rows // 100, points, method)))
+    return results
+
+def bench_csv(tmpdir, rows, cols, page=1000):
+    """Compare the csv parsers on a file of the given size.
+
+    Returns a list of (operation, seconds) tuples.
+    """
+    filename = os.path.join(tmpdir, 'legacy.csv')
+    data = backend.CsvNumpyData(filename)
+    data.initialize_info('legacy', [_INDEPENDENT],
+                         [_dependent(i) for i in range(cols - 1)])
+    batch = 100000
+    results = [('write', _timed(lambda: [
+            data.addData(_records(min(batch, rows - start), cols, start))
+            for start in xrange(0, rows, batch)]))]
+    data._file.close()
+
+    def loadtxt():
+        with open(filename) as f:
+            np.loadtxt(f, delimiter=',')
+    results.append(('np.loadtxt', _timed(loadtxt)))
+    results.append(('float() per value',
+                    _timed(lambda: backend.CsvListData(filename).data)))
+    results.append(('block parse',
+                    _timed(lambda: backend.CsvNumpyData(filename).data)))
+    middle = rows // 2
+    for name in ('page read, new index', 'page read, saved index'):
+        results.append((name, _timed(
+                backend.CsvNumpyData(filename).getData, page, middle, False, False)))
+    return results
+
+def bench_strings(tmpdir, rows):
+    """Time reading string and timestamp columns in both formats.
+
+    Returns a list of (column type, rows seconds, columns seconds) tuples.
+    """
+    names = np.array(['row {}'.format(i % 1000) for i in xrange(rows)])
+    times = np.arange(rows, dtype=np.int64) * 1000
+    results = []
+    for datatype, values in [('s', names), ('s16', names), ('t', times)]:
+        filename = os.path.join(tmpdir, 'strings_' + datatype)
+        data = backend.create_backend(
+                filename, datatype,
+                [backend.Independent(label='x', shape=(1,), datatype=datatype, unit='')],
+                [_dependent(0)], True)
+        records = backend.records_from_columns(
+                [values, np.zeros(rows)], data.dtype, data.getColumnTypes())
+        data.addData(records)
+        data.cache.invalidate(data.cache_name)
+        t_rows = _timed(data.getData, None, 0, False, False)
+        data.cache.invalidate(data.cache_name)
+        t_columns = _timed(data.getData, None, 0, True, False)
+        results.append((datatype, t_rows, t_columns))
+    return results
+
+class _NullHub(object):
+    """Stands in for the server's signals."""
+    def __getattr__(self, name):
+        return lambda *args, **kw: None
+
+def _wire(value, tag=None):
+    """Pass a value through the labrad wire format, as a request or reply does."""
+    flat = T.flatten(value, tag)
+    return T.unflatten(flat.bytes, flat.tag)
+
+def bench_transfer(tmpdir, rows, batch, cols):
+    """Compare the raw byte settings with add_ex/add_ex_t/get_ex/get_ex_t.
+
+    The data vault settings are called directly, with the data passed
+    through labrad flattening and unflattening on the way in and out, which
+    is where most of the time of the cluster formats goes.  Returns a list
+    of (setting, rows/s) tuples.
+    """
+    from .server import DataVault
+    store = SessionStore(tmpdir, hub=_NullHub())
+    server = DataVault(store)
+    server.initServer()
+    records = _records(rows, cols)
+    row_tag = '*({})'.format(','.join(['v'] * cols))
+    column_tag = '({})'.format(','.join(['*v'] * cols))
+    layout = util.dtype_descriptor(records.dtype)
+    blocks = [records[i:i + batch] for i in xrange(0, rows, batch)]
+
+    adds = [
+        ('add_ex', lambda c, block: server.add_ex(
+                c, _wire([tuple(row) for row in block], row_tag))),
+        ('add_ex_t', lambda c, block: server.add_ex_t(
+                c, _wire([block[name] for name in block.dtype.names], column_tag))),
+        ('add_raw', lambda c, block: server.add_raw(
+                c, *_wire((block.tostring(), layout), '(ys)'))),
+    ]
+    gets = [
+        ('get_ex', server.get_ex),
+        ('get_ex_t', server.get_ex_t),
+        ('get_raw', server.get_raw),
+    ]
+    results = []
+    for (add_name, add), (get_name, get) in zip(adds, gets):
+        c = testing.Context(add_name)
+        server.initContext(c)
+        server.new_ex(c, add_name, [('x', [1], 'v', '')],
+                      [('y', str(i), [1], 'v', '') for i in range(cols - 1)])
+        def add_all():
+            for block in blocks:
+                add(c, block)
+            testing.result(server.flush(c))
+        results.append((add_name, rows / _timed(add_all)))
+        def get_all():
+            for start in xrange(0, rows, batch):
+                _wire(testing.result(get(c, limit=batch, startOver=not start)))
+        results.append((get_name, rows / _timed(get_all)))
+    server.flushAll()
+    return results
+
+def bench_comments(tmpdir, comments=10000):
+    """Time adding comments one at a time.
+
+    'attribute' reproduces the storage used by older versions, which
+    rewrites the whole 'Comments' attribute of /DataVault for every comment
+    and fails once the attribute no longer fits in the object header.
+    Returns a list of (storage, comments added, seconds, p99 us) tuples.
+    """
+    results = []
+    filename = os.path.join(tmpdir, 'comments_attribute')
+    data = backend.create_backend(filename, 'comments', [_INDEPENDENT],
+                                  [_dependent(0)], False)
+    attrs = data.dataset.attrs
+    samples = []
+    for i in xrange(comments):
+        start = time.time()
+        new_comment = np.array([(start, 'user', 'comment {}'.format(i))],
+                               dtype=data.comment_type)
+        try:
+            old_comments = attrs['Comments']
+            attrs.create('Comments', np.hstack((old_comments, new_comment)),
+                         dtype=data.comment_type)
+        except (RuntimeError, ValueError):
+            break
+        samples.append(time.time() - start)
+    results.append(('attribute', len(samples), sum(samples), _percentiles(samples)[1]))
+
+    filename = os.path.join(tmpdir, 'comments_dataset')
+    data = backend.create_backend(filename, 'comments', [_INDEPENDENT],
+                                  [_dependent(0)], False)
+    samples = []
+    for i in xrange(comments):
+        start = time.time()
+        data.addComment('user', 'comment {}'.format(i))
+        samples.append(time.time() - start)
+    assert data.numComments() == comments
+    results.append(('dataset', len(samples), sum(samples), _percentiles(samples)[1]))
+    return results
+
+class _RecordingHub(object):
+    """Keeps the payloads of the data streamed signals."""
+    def __init__(self):
+        self.streamed = []
+
+    def onDataStreamed(self, data, contexts):
+        self.streamed.append(data)
+
+    def __getattr__(self, name):
+        return lambda *args, **kw: None
+
+def bench_streaming(tmpdir, updates=1000, rows=10, cols=4):
+    """Compare polling with get after each signal against pushed rows.
+
+    A writer adds rows updates times and a plotting client follows along.
+    When polling, every update costs an empty signal plus a get request
+    and its reply; when streaming, it costs one signal carrying the rows.
+    Returns a list of (mode, messages, bytes, seconds) tuples, where bytes
+    are the flattened payloads.
+    """
+    from .server import DataVault
+    hub = _RecordingHub()
+    store = SessionStore(tmpdir, hub=hub)
+    server = DataVault(store)
+    server.initServer()
+    blocks = [np.arange(i * rows * cols, (i + 1) * rows * cols, dtype=np.float64)
+              .reshape((rows, cols)) for i in xrange(updates)]
+    writer = testing.Context('writer')
+    server.initContext(writer)
+    server.new(writer, 'streaming', ['x [s]'],
+               ['y{} (y) [V]'.format(i) for i in range(cols - 1)])
+    dataset = server.getDataset(writer)
+    results = []
+
+    reader = testing.Context('poll')
+    server.initContext(reader)
+    server.open(reader, dataset.name)
+    messages = nbytes = 0
+    start = time.time()
+    for block in blocks:
+        server.add(writer, block)
+        # signal, then a get request and its reply
+        data = testing.result(server.get(reader))
+        messages += 3
+        nbytes += len(T.flatten(None, '').bytes) + len(T.flatten(data, '*2v').bytes)
+    results.append(('poll', messages, nbytes, time.time() - start))
+
+    reader = testing.Context('push')
+    server.initContext(reader)
+    server.open(reader, dataset.name)
+    # one message per update, to compare with the polling
+    testing.result(server.stream_data(reader, min_interval=U.Value(0, 's')))
+    messages = nbytes = 0
+    start = time.time()
+    for block in blocks:
+        server.add(writer, block)
+        dataset._sendStreams() # the end of the reactor turn
+        messages += 1
+        nbytes += len(T.flatten(hub.streamed.pop(), '(wwsy)').bytes)
+    results.append(('push', messages, nbytes, time.time() - start))
+    server.flushAll()
+    return results
+
+def bench_search(tmpdir, datasets=100000, per_dir=100):
+    """Time searches of an index of many datasets.
+
+    Returns a list of (query, results, ms) tuples, with the time to build
+    the index first.
+    """
+    index = search.SearchIndex(os.path.join(tmpdir, search.SEARCH_INDEX_FILE))
+    kinds = ['rabi', 'ramsey', 'T1', 'spectroscopy', 'echo']
+    start = time.time()
+    for d in xrange(datasets // per_dir):
+        path = ['', 'cooldown {}'.format(d // 100), 'run {}'.format(d)]
+        entries = []
+        for i in xrange(per_dir):
+            n = d * per_dir + i
+            entries.append(('{:05d} - {}'.format(i, kinds[n % 5]), kinds[n % 5],
+                            float(n), ['time', 'ns', 'P1', 'qubit {}'.format(n % 7), ''],
+                            [('qubit', 'q{}'.format(n % 7)), ('power', str(n % 100))],
+                            None))
+        tags = dict((e[0], set(['good'])) for e in entries[::10])
+        index.updateDirectory(path, entries, tags, set(e[0] for e in entries))
+    results = [('build index', datasets, (time.time() - start) * 1e3)]
+    queries = [
+        ('text', dict(text='ramsey')),
+        ('text and tag', dict(text='echo', tags=['good'])),
+        ('text prefix', dict(text='spectro*', limit=100)),
+        ('parameter', dict(params=[('qubit', 'q3'), ('power', '42')])),
+        ('tag, not text', dict(tags=['good'], text='NOT_A_WORD')),
+        ('directory', dict(under=['', 'cooldown 3'])),
+        ('newest', dict(limit=50)),
+    ]
+    for name, query in queries:
+        start = time.time()
+        found = index.search(**query)
+        results.append((name, len(found), (time.time() - start) * 1e3))
+    index.close()
+    return results
+
+class _CountingSignal(object):
+    def __init__(self):
+        self.messages = 0
+
+    def __call__(self, data, contexts):
+        self.messages += len(contexts)
+
+def bench_notifications(contexts=1000, datasets=1000, adds=100):
+    """Context expiry and signal fan-out with many listening contexts.
+
+    Each context listens for data, parameters and comments of one of the
+    datasets.  'scan' reproduces the expiry used before the subscription
+    registry, which looked at the three listener sets of every dataset.
+    Each dataset then gets adds additions in one reactor turn, with every
+    context subscribing again after each signal as a client reading to the
+    end does.  Returns a list of (operation, seconds, signals) tuples.
+    """
+    results = []
+    names = ['ctx {}'.format(i) for i in xrange(contexts)]
+
+    listener_sets = [(set(), set(), set()) for _ in xrange(datasets)]
+    for i, name in enumerate(names):
+        for listeners in listener_sets[i % datasets]:
+            listeners.add(name)
+    start = time.time()
+    for name in names:
+        for sets in listener_sets:
+            for listeners in sets:
+                if name in listeners:
+                    listeners.remove(name)
+    results.append(('expire, scan', time.time() - start, 0))
+
+    clock = task.Clock()
+    registry = SubscriptionRegistry(clock)
+    listener_sets = [[registry.listeners() for _ in range(3)] for _ in xrange(datasets)]
+    for i, name in enumerate(names):
+        for listeners in listener_sets[i % datasets]:
+            listeners.add(name)
+    start = time.time()
+    for name in names:
+        registry.expire(name)
+    results.append(('expire, registry', time.time() - start, 0))
+
+    signal = _CountingSignal()
+    data_listeners = [sets[0] for sets in listener_sets]
+    for i, name in enumerate(names):
+        data_listeners[i % datasets].add(name)
+    start = time.time()
+    for _ in xrange(adds):
+        for listeners in data_listeners:
+            subscribed = set(listeners)
+            registry.notify(signal, listeners)
+            for name in subscribed:
+                listeners.add(name)
+    clock.advance(0)
+    results.append(('{} adds per dataset'.format(adds), time.time() - start,
+                    signal.messages))
+    return results
+
+class _FakeConnection(object):
+    """Records when each message would have gone out to the manager."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.sent = []
+
+    def sendMessage(self, target, records, context):
+        if self.delay:
+            time.sleep(self.delay)
+        self.sent.append(time.time())
+
+class _FakeManager(object):
+    """A DataVaultMultiHead as the hub sees it, with contexts listening."""
+
+    def __init__(self, port, contexts, delay=0):
+        self.host = 'localhost'
+        self.port = port
+        self._cxn = _FakeConnection(delay)
+        self.onNewDataset = Signal(543618, 'signal: new dataset', 's')
+        self.onNewDataset.parent = self
+        for i in xrange(contexts):
+            self.onNewDataset.connect((1, i), 'client', 1)
+        self.contexts = [ExtendedContext(self, (1, i)) for i in xrange(contexts)]
+
+def bench_fanout(managers=4, contexts=100, notifications=200, delay=0.0002):
+    """Latency of a signal sent through several managers, one of them slow.
+
+    Every manager has contexts listening for new datasets, and the first
+    takes delay seconds to send each message.  'direct' calls the signal of
+    each manager in turn; 'hub' goes through a SignalHub, which sees the
+    slow manager miss a keepalive and holds its signals back.  Returns a
+    list of (mode, p50 ms, p99 ms, messages) tuples, with the latency from
+    the signal being fired to the last message of the other managers.
+    """
+    results = []
+    for mode in ['direct', 'hub']:
+        fakes = [_FakeManager(7682 + i, contexts, delay if i == 0 else 0)
+                 for i in range(managers)]
+        clock = task.Clock()
+        signal_hub = hub.SignalHub(reactor=clock)
+        for fake in fakes:
+            signal_hub.connect(fake)
+        signal_hub.keepaliveSent(fakes[0])
+        signal_hub.keepaliveSent(fakes[0])
+        everyone = [context for fake in fakes for context in fake.contexts]
+        samples = []
+        for i in xrange(notifications):
+            name = '{:05d} - scan'.format(i)
+            start = time.time()
+            if mode == 'direct':
+                for fake in fakes:
+                    fake.onNewDataset(name, [c.context for c in fake.contexts])
+            else:
+                signal_hub.onNewDataset(name, everyone)
+                clock.advance(0)
+            samples.extend(fake._cxn.sent[-1] - start for fake in fakes[1:])
+        p50, p99 = np.percentile(samples, [50, 99]) * 1e3
+        messages = sum(len(fake._cxn.sent) for fake in fakes)
+        results.append((mode, p50, p99, messages))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--cols', type=int, default=4)
+    parser.add_argument('--wide-cols', type=int, default=20)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='dvbench_')
+    try:
+        print 'HDF5 storage profiles: {} rows x {} cols in batches of {}'.format(
+                args.rows, args.cols, args.batch)
+        print '{:>10} {:>14} {:>14} {:>12} {:>12}'.format(
+                'profile', 'append rows/s', 'read rows/s', 'slices/s', 'bytes')
+        for result in bench_profiles(tmpdir, args.rows, args.batch, args.cols):
+            print '{:>10} {:>14.0f} {:>14.0f} {:>12.0f} {:>12d}'.format(*result)
+        print
+        single_rows = min(args.rows, 20000)
+        print 'Single row add latency: {} rows x {} cols'.format(
+                single_rows, args.cols)
+        print '{:>16} {:>10} {:>10}'.format('mode', 'p50 us', 'p99 us')
+        for result in bench_single_row_add(tmpdir, single_rows, args.cols):
+            print '{:>16} {:>10.1f} {:>10.1f}'.format(*result)
+        print
+        print 'Reading 1 of {} columns: {} rows'.format(args.wide_cols, args.rows)
+        print '{:>10} {:>10} {:>10} {:>12}'.format(
+                'profile', 'all s', 'one s', 'one/10 s')
+        for result in bench_column_projection(tmpdir, args.rows, args.wide_cols):
+            print '{:>10} {:>10.3f} {:>10.3f} {:>12.3f}'.format(*result)
+        print
+        print 'Reading 100 rows at random positions: {} rows x {} cols'.format(
+                args.rows, args.cols)
+        print '{:>20} {:>10} {:>10}'.format('mode', 'p50 us', 'p99 us')
+        for result in bench_random_slices(tmpdir, args.rows, args.cols):
+            print '{:>20} {:>10.1f} {:>10.1f}'.format(*result)
+        print
+        print 'Decimation to 2000 points: {} rows'.format(args.rows)
+        for result in bench_decimation(tmpdir, args.rows):
+            print '{:>20} {:>10.4f} s'.format(*result)
+        print
+        print 'Parsing csv: {} rows x {} cols'.format(args.rows, args.cols)
+        for result in bench_csv(tmpdir, args.rows, args.cols):
+            print '{:>24} {:>10.4f} s'.format(*result)
+        print
+        print 'Reading string and timestamp columns: {} rows'.format(args.rows)
+        print '{:>6} {:>10} {:>10}'.format('type', 'rows s', 'columns s')
+        for result in bench_strings(tmpdir, args.rows):
+            print '{:>6} {:>10.3f} {:>10.3f}'.format(*result)
+        print
+        transfer_rows = min(args.rows, 100000)
+        print 'Transfer formats: {} rows x {} cols in batches of {}'.format(
+                transfer_rows, args.cols, args.batch * 10)
+        for result in bench_transfer(tmpdir, transfer_rows, args.batch * 10, args.cols):
+            print '{:>10} {:>14.0f} rows/s'.format(*result)
+        print
+        print 'Adding 10000 comments one at a time'
+        print '{:>10} {:>10} {:>10} {:>10}'.format('storage', 'added', 'total s', 'p99 us')
+        for result in bench_comments(tmpdir):
+            print '{:>10} {:>10d} {:>10.3f} {:>10.1f}'.format(*result)
+        print
+        print 'Following a live dataset: 1000 updates of 10 rows'
+        print '{:>6} {:>10} {:>10} {:>10}'.format('mode', 'messages', 'bytes', 'seconds')
+        for result in bench_streaming(tmpdir, cols=args.cols):
+            print '{:>6} {:>10d} {:>10d} {:>10.3f}'.format(*result)
+        print
+        print 'Search: 100000 datasets'
+        for result in bench_search(tmpdir):
+            print '{:>16} {:>8d} results {:>10.1f} ms'.format(*result)
+        print
+        print 'Notifications: 1000 contexts listening to 1000 datasets'
+        for result in bench_notifications():
+            print '{:>20} {:>10.4f} s {:>8d} signals'.format(*result)
+        print
+        print 'Fan-out: 4 managers with 100 contexts each, one slow'
+        print '{:>6} {:>10} {:>10} {:>10}'.format('mode', 'p50 ms', 'p99 ms', 'messages')
+        for result in bench_fanout():
+            print '{:>6} {:>10.3f} {:>10.3f} {:>10d}'.format(*result)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,403 @@
+"""Throughput and latency of the data vault settings under client-like load.
+
+Run from the servers directory:
+
+    python -m datavault.benchsuite [--quick] [--backends NAME,...]
+                                   [--json FILE] [--compare OLD.json]
+                                   [--threshold FRACTION]
+
+The DataVault settings are called directly, without a manager, with
+contexts set up the way the server tests do it and a task.Clock standing
+in for the reactor, so that the signals sent between reactor turns can be
+counted.  Each workload is run once for every backend:
+
+    csv list    csv files, read with the pure python reader
+    csv numpy   csv files, read with numpy
+    hdf5 v2     SimpleHDF5Data, as created by new
+    hdf5 v3     ExtendedHDF5Data, as created by new_ex
+
+and reports operations per second and the median and 99th percentile
+latency of one operation.  The csv datasets are created on disk and
+opened for appending, since the data vault no longer creates them.
+
+With --json, the results are saved along with the parameters of the run,
+and --compare prints them next to an earlier run and exits with status 1
+if any workload got slower by more than the threshold (by default 20%),
+so that runs before and after a change can be compared.  Labrad flattening
+is not included; see benchmark.bench_transfer for that.
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import collections
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from twisted.internet import task
+
+from . import SessionStore, backend, filename_encode, testing
+from .server import DataVault
+
+
+RESULTS_VERSION = 1
+
+BACKENDS = ['csv list', 'csv numpy', 'hdf5 v2', 'hdf5 v3']
+
+Workload = collections.namedtuple('Workload', ['ops', 'rows'])
+
+# operations per workload, and rows per bulk append
+DEFAULT_SIZES = {
+    'small appends': Workload(5000, 1),
+    'bulk appends': Workload(200, 1000),
+    'full reads': Workload(20, None),
+    'tail reads': Workload(1000, 10),
+    'list directory': Workload(20, 10000),
+    'tag updates': Workload(1000, None),
+    'concurrent listeners': Workload(200, 10),
+}
+QUICK_SIZES = {
+    'small appends': Workload(500, 1),
+    'bulk appends': Workload(20, 1000),
+    'full reads': Workload(5, None),
+    'tail reads': Workload(100, 10),
+    'list directory': Workload(5, 1000),
+    'tag updates': Workload(100, None),
+    'concurrent listeners': Workload(20, 10),
+}
+LISTENERS = 100 # contexts following the dataset in 'concurrent listeners'
+COLUMNS = 4
+REGRESSION_THRESHOLD = 0.2
+
+
+class _CountingHub(object):
+    """Stands in for the server's signals, counting the messages sent."""
+
+    def __init__(self):
+        self.messages = collections.Counter()
+
+    def __getattr__(self, name):
+        def signal(data, contexts=None):
+            self.messages[name] += 1 if contexts is None else len(contexts)
+        return signal
+
+
+class _Timer(object):
+    """Collects the latencies of the operations of one workload."""
+
+    def __init__(self):
+        self.samples = []
+        self.extra = 0.0 # time spent outside operations, such as a final flush
+        self.counts = {} # anything else worth keeping, such as signals sent
+
+    def time(self, f, *args, **kw):
+        start = time.time()
+        result = f(*args, **kw)
+        self.samples.append(time.time() - start)
+        return result
+
+    def stats(self):
+        samples = np.asarray(self.samples)
+        total = samples.sum() + self.extra
+        stats = {
+            'ops': len(samples),
+            'ops_per_sec': len(samples) / total if total else None,
+            'p50_us': float(np.median(samples) * 1e6),
+            'p99_us': float(np.percentile(samples, 99) * 1e6),
+        }
+        stats.update(self.counts)
+        return stats
+
+
+class Harness(object):
+    """A data vault with its own data directory, and contexts to use it."""
+
+    def __init__(self, datadir):
+        self.datadir = datadir
+        self.clock = task.Clock()
+        self.hub = _CountingHub()
+        self.store = SessionStore(datadir, self.hub, reactor=self.clock)
+        self.server = DataVault(self.store)
+        self.server.initServer()
+        self._contexts = 0
+
+    def context(self, path=None):
+        """A new context, in the given directory, created if needed."""
+        self._contexts += 1
+        c = testing.Context(('bench', self._contexts))
+        self.server.initContext(c)
+        if path is not None:
+            self.server.cd(c, path, True)
+        return c
+
+    def expire(self, c):
+        self.server.expireContext(c)
+
+    def newDataset(self, c, backend_name, cols=COLUMNS):
+        """Create a dataset for writing in the context's directory."""
+        if backend_name == 'hdf5 v2':
+            self.server.new(c, 'bench', [('x', '')],
+                            [('y{}'.format(i), '', '') for i in range(cols - 1)])
+        elif backend_name == 'hdf5 v3':
+            self.server.new_ex(c, 'bench', [('x', [1], 'v', '')],
+                               [('y{}'.format(i), '', [1], 'v', '')
+                                for i in range(cols - 1)])
+        else:
+            session = self.server.getSession(c)
+            name = '{:05d} - bench'.format(session.index.lastNumber() + 1)
+            filename = os.path.join(session.dir, filename_encode(name) + '.csv')
+            cls = backend.CsvNumpyData if backend_name == 'csv numpy' else backend.CsvListData
+            data = cls(filename, reactor=self.clock)
+            data.initialize_info('bench', [backend.Independent('x', [1], 'v', '')],
+                                 [backend.Dependent('y{}'.format(i), '', [1], 'v', '')
+                                  for i in range(cols - 1)])
+            data.save()
+            data._file.close()
+            self.server.open(c, name, True)
+        return c['dataset']
+
+    def turn(self):
+        """Let the reactor run, sending any queued signals."""
+        self.clock.advance(0)
+
+
+def _elapsed(f):
+    start = time.time()
+    f()
+    return time.time() - start
+
+def _rows(start, count, cols=COLUMNS):
+    values = np.arange(start * cols, (start + count) * cols, dtype=np.float64)
+    return values.reshape((count, cols))
+
+
+def run_small_appends(harness, backend_name, size):
+    c = harness.context(['', backend_name, 'small'])
+    harness.newDataset(c, backend_name)
+    timer = _Timer()
+    for i in xrange(size.ops):
+        timer.time(harness.server.add, c, _rows(i, 1))
+    timer.extra = _elapsed(lambda: testing.result(harness.server.flush(c)))
+    return timer
+
+def run_bulk_appends(harness, backend_name, size):
+    c = harness.context(['', backend_name, 'bulk'])
+    harness.newDataset(c, backend_name)
+    timer = _Timer()
+    for i in xrange(size.ops):
+        timer.time(lambda: testing.result(harness.server.add(c, _rows(i * size.rows, size.rows))))
+    timer.extra = _elapsed(lambda: testing.result(harness.server.flush(c)))
+    return timer
+
+def run_full_reads(harness, backend_name, size):
+    # reads the dataset written by the bulk appends
+    c = harness.context(['', backend_name, 'bulk'])
+    harness.server.open(c, 1)
+    timer = _Timer()
+    for _ in xrange(size.ops):
+        timer.time(lambda: testing.result(harness.server.get(c, startOver=True)))
+    return timer
+
+def run_tail_reads(harness, backend_name, size):
+    writer = harness.context(['', backend_name, 'tail'])
+    name = harness.newDataset(writer, backend_name)
+    reader = harness.context(['', backend_name, 'tail'])
+    harness.server.open(reader, name)
+    timer = _Timer()
+    for i in xrange(size.ops):
+        harness.server.add(writer, _rows(i * size.rows, size.rows))
+        data = timer.time(lambda: testing.result(harness.server.get(reader)))
+        assert len(data) == size.rows
+    return timer
+
+def run_list_directory(harness, backend_name, size):
+    path = ['', backend_name, 'listing']
+    c = harness.context(path)
+    session = harness.server.getSession(c)
+    extensions = ['.hdf5'] if backend_name.startswith('hdf5') else ['.csv', '.ini']
+    for i in xrange(size.rows):
+        name = filename_encode('{:05d} - entry {}'.format(i + 1, i))
+        for ext in extensions:
+            open(os.path.join(session.dir, name + ext), 'w').close()
+    timer = _Timer()
+    for _ in xrange(size.ops):
+        dirs, datasets = timer.time(harness.server.dir, c)
+    assert len(datasets) == size.rows
+    return timer
+
+def run_tag_updates(harness, backend_name, size):
+    # tags the datasets listed by run_list_directory
+    c = harness.context(['', backend_name, 'listing'])
+    _, datasets = harness.server.dir(c)
+    picks = np.random.RandomState(0).randint(0, len(datasets), size.ops)
+    timer = _Timer()
+    for i in picks:
+        timer.time(harness.server.update_tags, c, ['^star'], [], [datasets[i]])
+    timer.extra = _elapsed(harness.server.getSession(c).flush)
+    return timer
+
+def run_concurrent_listeners(harness, backend_name, size, listeners=LISTENERS):
+    writer = harness.context(['', backend_name, 'listeners'])
+    name = harness.newDataset(writer, backend_name)
+    readers = [harness.context(['', backend_name, 'listeners'])
+               for _ in xrange(listeners)]
+    for reader in readers:
+        harness.server.open(reader, name)
+        testing.result(harness.server.get(reader))
+    harness.turn()
+    before = harness.hub.messages['onDataAvailable']
+
+    def notify_and_read(i):
+        # every listener hears about the new rows and reads them
+        harness.server.add(writer, _rows(i * size.rows, size.rows))
+        harness.turn()
+        for reader in readers:
+            testing.result(harness.server.get(reader))
+
+    timer = _Timer()
+    for i in xrange(size.ops):
+        timer.time(notify_and_read, i)
+    timer.counts['signals'] = harness.hub.messages['onDataAvailable'] - before
+    for c in readers + [writer]:
+        harness.expire(c)
+    return timer
+
+WORKLOADS = collections.OrderedDict([
+    ('small appends', run_small_appends),
+    ('bulk appends', run_bulk_appends),
+    ('full reads', run_full_reads),
+    ('tail reads', run_tail_reads),
+    ('list directory', run_list_directory),
+    ('tag updates', run_tag_updates),
+    ('concurrent listeners', run_concurrent_listeners),
+])
+
+
+def run_suite(tmpdir, backends=BACKENDS, sizes=DEFAULT_SIZES, progress=None):
+    """Run every workload for every backend.
+
+    Returns a list of result dicts with the backend, workload, rows per
+    operation and the statistics of _Timer.stats.  progress, if given, is
+    called with each result as it is made.
+    """
+    results = []
+    for backend_name in backends:
+        if backend_name not in BACKENDS:
+            raise ValueError('Unknown backend {!r}.  Choose from: {}'.format(
+                    backend_name, ', '.join(BACKENDS)))
+        # open_backend picks the csv reader from this module setting
+        use_numpy = backend.use_numpy
+        backend.use_numpy = backend_name != 'csv list'
+        try:
+            harness = Harness(os.path.join(tmpdir, backend_name.replace(' ', '_')))
+            for workload, run in WORKLOADS.items():
+                size = sizes[workload]
+                result = collections.OrderedDict([
+                    ('backend', backend_name),
+                    ('workload', workload),
+                    ('rows', size.rows),
+                ])
+                result.update(run(harness, backend_name, size).stats())
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+            testing.result(harness.server.flushAll())
+        finally:
+            backend.use_numpy = use_numpy
+    return results
+
+def save_results(filename, results, params):
+    with open(filename, 'w') as f:
+        json.dump({
+            'version': RESULTS_VERSION,
+            'created': time.time(),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'h5py': backend.h5py.__version__,
+            'params': params,
+            'results': results,
+        }, f, indent=2)
+
+def load_results(filename):
+    with open(filename) as f:
+        saved = json.load(f)
+    if saved.get('version') != RESULTS_VERSION:
+        raise ValueError('{} holds results of version {}, not {}'.format(
+                filename, saved.get('version'), RESULTS_VERSION))
+    return saved
+
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+    """Pair up the results of two runs.
+
+    Returns a list of (backend, workload, old ops/s, new ops/s, ratio,
+    regressed) tuples, for the workloads found in both runs.  A workload
+    has regressed if its ops/s dropped by more than the threshold fraction.
+    """
+    before = dict(((r['backend'], r['workload']), r) for r in old)
+    rows = []
+    for r in new:
+        o = before.get((r['backend'], r['workload']))
+        if o is None or not o['ops_per_sec'] or not r['ops_per_sec']:
+            continue
+        ratio = r['ops_per_sec'] / o['ops_per_sec']
+        rows.append((r['backend'], r['workload'], o['ops_per_sec'],
+                     r['ops_per_sec'], ratio, ratio < 1 - threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--quick', action='store_true',
+                        help='run each workload with fewer operations')
+    parser.add_argument('--backends', default=','.join(BACKENDS),
+                        help='comma separated backends (default: all)')
+    parser.add_argument('--json', help='save the results to this file')
+    parser.add_argument('--compare', help='compare with results saved by --json')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='slowdown counted as a regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    sizes = QUICK_SIZES if args.quick else DEFAULT_SIZES
+    backends = [name.strip() for name in args.backends.split(',')]
+    old = load_results(args.compare) if args.compare else None
+
+    def progress(r):
+        print '{:>10} {:>22} {:>12.1f} {:>10.1f} {:>10.1f}'.format(
+                r['backend'], r['workload'], r['ops_per_sec'], r['p50_us'], r['p99_us'])
+        sys.stdout.flush()
+
+    print '{:>10} {:>22} {:>12} {:>10} {:>10}'.format(
+            'backend', 'workload', 'ops/s', 'p50 us', 'p99 us')
+    tmpdir = tempfile.mkdtemp(prefix='dvbench_')
+    try:
+        results = run_suite(tmpdir, backends, sizes, progress)
+    finally:
+        shutil.rmtree(tmpdir)
+    if args.json:
+        params = dict((name, list(size)) for name, size in sizes.items())
+        params['listeners'] = LISTENERS
+        params['columns'] = COLUMNS
+        save_results(args.json, results, params)
+
+    if old is not None:
+        print
+        print 'Compared with {}:'.format(args.compare)
+        print '{:>10} {:>22} {:>12} {:>12} {:>8}'.format(
+                'backend', 'workload', 'old ops/s', 'new ops/s', 'ratio')
+        rows = compare(old['results'], results, args.threshold)
+        for backend_name, workload, before, after, ratio, regressed in rows:
+            print '{:>10} {:>22} {:>12.1f} {:>12.1f} {:>8.2f}{}'.format(
+                    backend_name, workload, before, after, ratio,
+                    '  REGRESSION' if regressed else '')
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""Block cache shared by all datasets of the data vault.
+
+Several clients often read the same rows of a dataset, for example when a
+few plotting programs poll the same live dataset, and without a cache each
+of them reads those rows from the file again.  The BlockCache keeps recently
+read rows in memory in blocks of a fixed number of rows, keyed by file name
+and block number (and, for backends that store columns separately, by
+column), so the blocks are shared by all contexts and all backend objects
+of a file.  The total size of the cached blocks is bounded by a byte
+budget, and the least recently used blocks are dropped to stay within it.
+
+Copying rows into the cache costs about as much as reading them, so a block
+is only cached when it is read a second time.  Backends read rows that were
+never read before straight into their results (see firstRead), and only the
+block keys are remembered.  A read larger than the whole budget is not
+cached past the budget, as it would only push out everything else.
+
+Datasets only grow at the end, so the only block that can go stale is the
+last, partly filled one.  Backends drop it when they append rows (see
+invalidate), and a cached block that is shorter than the rows that should
+be in it is treated as missing.
+
+Backend reads may run in I/O worker threads, so the cache is guarded by a
+lock.
+"""
+
+import collections
+import threading
+
+
+CACHE_MAX_BYTES = 256 * 2**20 # default byte budget of the block cache
+CACHE_BLOCK_ROWS = 4096 # rows per cached block
+CACHE_SEEN_KEYS = 2**16 # blocks remembered as read once, but not cached
+
+
+class BlockCache(object):
+    """An LRU cache of blocks of rows with a byte budget.
+
+    Keys are (name, block, part) tuples, where name identifies the file,
+    block is the block number (block b holds rows [b * block_rows,
+    (b + 1) * block_rows)) and part is any hashable, e.g. a column name, or
+    None.  Values are numpy arrays, which are made read-only.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, block_rows=CACHE_BLOCK_ROWS):
+        self.max_bytes = max_bytes
+        self.block_rows = block_rows
+        self._blocks = collections.OrderedDict() # key -> array, oldest first
+        self._names = collections.defaultdict(set) # name -> keys
+        self._seen = collections.OrderedDict() # keys read once, oldest first
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def stats(self):
+        """Usage counts as a list of (name, value) pairs."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            ratio = float(self.hits) / lookups if lookups else 0.0
+            return [('blocks', len(self._blocks)),
+                    ('resident bytes', self.nbytes),
+                    ('max bytes', self.max_bytes),
+                    ('hits', self.hits),
+                    ('misses', self.misses),
+                    ('hit ratio', ratio),
+                    ('evictions', self.evictions)]
+
+    def get(self, key, rows=None):
+        """The cached block for key, or None.
+
+        If rows is given, a cached block with fewer rows than that is
+        stale and counts as missing.
+        """
+        with self._lock:
+            block = self._blocks.pop(key, None)
+            if block is None or (rows is not None and len(block) < rows):
+                if block is not None:
+                    self._forget(key, block)
+                self.misses += 1
+                return None
+            self._blocks[key] = block
+            self.hits += 1
+            return block
+
+    def put(self, key, block):
+        """Add a block, dropping the least recently used ones if needed."""
+        block.flags.writeable = False
+        with self._lock:
+            old = self._blocks.pop(key, None)
+            if old is not None:
+                self._forget(key, old)
+            if block.nbytes > self.max_bytes:
+                return
+            self._blocks[key] = block
+            self._names[key[0]].add(key)
+            self.nbytes += block.nbytes
+            while self.nbytes > self.max_bytes:
+                old_key, old = self._blocks.popitem(last=False)
+                self._forget(old_key, old)
+                self.evictions += 1
+
+    def invalidate(self, name, first_block=0):
+        """Drop the blocks of a file from first_block on."""
+        with self._lock:
+            for key in list(self._names.get(name, ())):
+                if key[1] >= first_block:
+                    self._forget(key, self._blocks.pop(key))
+
+    def blocks(self, name, parts, start, stop, length, read, max_read_rows=None):
+        """Yield the blocks covering rows [start, stop) of a file.
+
+        length is the number of rows in the file.  Yields (first_row, {part:
+        array}) for each block, using cached blocks where possible.  Missing
+        blocks are read with read(parts, lo, hi), which returns {part: array}
+        for rows [lo, hi) of the file; runs of consecutive missing blocks
+        are read together, up to max_read_rows rows at a time.
+        """
+        size = self.block_rows
+        read_bytes = [0] # read so far, to stop caching past the budget
+        stop = min(stop, length)
+        run = [] # consecutive blocks missing the same parts
+        for b in xrange(start // size, -(-stop // size)):
+            lo = b * size
+            hi = min(lo + size, length)
+            found = {}
+            missing = []
+            for part in parts:
+                block = self.get((name, b, part), hi - lo)
+                if block is None:
+                    missing.append(part)
+                else:
+                    found[part] = block
+            if run and (missing != run[0][3] or
+                        max_read_rows and hi - run[0][1] > max_read_rows):
+                for item in self._readRun(name, run, read, read_bytes):
+                    yield item
+                run = []
+            if missing:
+                run.append((b, lo, hi, missing, found))
+            else:
+                yield lo, found
+        if run:
+            for item in self._readRun(name, run, read, read_bytes):
+                yield item
+
+    def _readRun(self, name, run, read, read_bytes):
+        first = run[0][1]
+        missing = run[0][3]
+        data = read(missing, first, run[-1][2])
+        read_bytes[0] += sum(data[part].nbytes for part in missing)
+        cache = read_bytes[0] <= self.max_bytes
+        for b, lo, hi, _, found in run:
+            for part in missing:
+                key = (name, b, part)
+                block = data[part][lo - first:hi - first]
+                if cache and self._readBefore(key):
+                    # copy, so that the cache does not keep the whole read alive
+                    block = block.copy()
+                    self.put(key, block)
+                found[part] = block
+            yield lo, found
+
+    def firstRead(self, name, parts, start, stop):
+        """Whether none of the blocks covering rows [start, stop) were read.
+
+        If so, the caller reads the rows itself, bypassing the cache, and
+        the blocks are remembered, to be cached if they are read again.
+        """
+        size = self.block_rows
+        keys = [(name, b, part) for b in xrange(start // size, -(-stop // size))
+                for part in parts]
+        with self._lock:
+            for key in keys:
+                if key in self._blocks or key in self._seen:
+                    return False
+            for key in keys:
+                self._seen[key] = True
+            while len(self._seen) > CACHE_SEEN_KEYS:
+                self._seen.popitem(last=False)
+            self.misses += len(keys)
+            return True
+
+    def _readBefore(self, key):
+        """Whether a missing block was read before, remembering it if not."""
+        with self._lock:
+            if self._seen.pop(key, None) is not None:
+                return True
+            self._seen[key] = True
+            if len(self._seen) > CACHE_SEEN_KEYS:
+                self._seen.popitem(last=False)
+            return False
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._names.clear()
+            self._seen.clear()
+            self.nbytes = 0
+
+    def _forget(self, key, block):
+        # the block must already be removed from self._blocks
+        self.nbytes -= block.nbytes
+        keys = self._names[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._names[key[0]]
+
+
+_block_cache = BlockCache()
+
+def get_block_cache():
+    """The BlockCache shared by all datasets."""
+    return _block_cache
@@ -0,0 +1,285 @@
+"""Downsampling of dataset columns for plotting.
+
+A plot only needs a couple of thousand points per curve, so instead of
+sending every row of a large dataset we reduce a column range to either the
+minimum and maximum of each of a number of buckets (which keeps the
+envelope of the curve intact), or to the points picked by the
+Largest-Triangle-Three-Buckets algorithm (LTTB).
+
+To make zoomed-out views of big datasets fast, each dataset keeps a Pyramid
+of pre-aggregated levels in memory.  Level 0 holds the minimum and maximum
+of every column over buckets of PYRAMID_BASE_ROWS rows, and each higher
+level combines PYRAMID_FACTOR buckets of the level below.  The pyramid is
+built from the file the first time it is needed and then updated as rows
+are appended.  A request is answered from the coarsest level whose buckets
+are no bigger than the requested buckets, plus raw rows at the ragged ends
+of the range.  LTTB is run on the minima and maxima picked this way rather
+than on every row.
+"""
+
+import numpy as np
+
+
+PYRAMID_BASE_ROWS = 256 # rows per bucket in the finest level
+PYRAMID_FACTOR = 8 # buckets of one level combined into a bucket of the next
+SYNC_BLOCK_ROWS = 2**20 # rows read at a time when building a pyramid
+
+METHODS = ('minmax', 'lttb')
+
+
+class _Level(object):
+    """One level of a Pyramid.
+
+    For every bucket and column this holds the row index, value and x value
+    of the minimum and of the maximum.  The arrays grow geometrically, like
+    the HDF5 datasets, so appending a few buckets at a time is cheap.
+    """
+
+    FIELDS = ('imin', 'ymin', 'xmin', 'imax', 'ymax', 'xmax')
+
+    def __init__(self, bucket_rows, ncols):
+        self.bucket_rows = bucket_rows
+        self.size = 0
+        self._arrays = {}
+        for field in self.FIELDS:
+            dtype = np.int64 if field.startswith('i') else np.float64
+            self._arrays[field] = np.empty((16, ncols), dtype=dtype)
+
+    def __getitem__(self, field):
+        return self._arrays[field][:self.size]
+
+    def extend(self, buckets):
+        """Append buckets given as a dict of arrays, one per field."""
+        n = len(buckets['imin'])
+        capacity = len(self._arrays['imin'])
+        if self.size + n > capacity:
+            capacity = max(2 * capacity, self.size + n)
+            for field, array in self._arrays.items():
+                grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                self._arrays[field] = grown
+        for field in self.FIELDS:
+            self._arrays[field][self.size:self.size + n] = buckets[field]
+        self.size += n
+
+
+def _extrema(rows, x, y, groups, group_rows):
+    """Minimum and maximum of each group of group_rows consecutive rows.
+
+    rows, x and y have shape (groups * group_rows, ncols).  NaNs are
+    ignored unless a group has nothing else.
+    """
+    shape = (groups, group_rows, y.shape[1])
+    result = {}
+    for kind, fill, pick in (('min', np.inf, np.argmin), ('max', -np.inf, np.argmax)):
+        values = y.reshape(shape)
+        index = pick(np.where(np.isnan(values), fill, values), axis=1)[:, np.newaxis, :]
+        result['i' + kind] = np.take_along_axis(rows.reshape(shape), index, axis=1)[:, 0]
+        result['y' + kind] = np.take_along_axis(values, index, axis=1)[:, 0]
+        result['x' + kind] = np.take_along_axis(x.reshape(shape), index, axis=1)[:, 0]
+    return result
+
+
+class Pyramid(object):
+    """Min/max aggregates of some columns of a dataset against column x."""
+
+    def __init__(self, x, columns, base_rows=PYRAMID_BASE_ROWS,
+                 factor=PYRAMID_FACTOR):
+        self.x = x
+        self.columns = list(columns)
+        self.base_rows = base_rows
+        self.factor = factor
+        self.rows = 0 # rows added so far, including the unaggregated tail
+        # set when rows were added to the dataset without going through
+        # the pyramid; sync catches up from the file
+        self.stale = True
+        self.levels = []
+        self._tail = np.empty((0, len(self.columns) + 1))
+
+    def sync(self, data):
+        """Add any rows of the backend data that are not in the pyramid."""
+        if not self.stale:
+            return
+        while True:
+            columns = data.getColumns([self.x] + self.columns, self.rows,
+                                      self.rows + SYNC_BLOCK_ROWS)
+            self._append(np.column_stack(columns))
+            if len(columns[0]) < SYNC_BLOCK_ROWS:
+                break
+        self.stale = False
+
+    def appendRecords(self, records):
+        """Add rows that were just appended to the dataset.
+
+        records is a structured array.  Anything else marks the pyramid as
+        stale, so that it is brought up to date from the file when next
+        used.
+        """
+        names = getattr(getattr(records, 'dtype', None), 'names', None)
+        if self.stale or not names:
+            self.stale = True
+            return
+        self._append(np.column_stack(
+                [records[names[i]] for i in [self.x] + self.columns]))
+
+    def _append(self, block):
+        block = np.concatenate((self._tail, block.astype(np.float64)))
+        first_row = self.rows - len(self._tail)
+        self.rows = first_row + len(block)
+        groups = len(block) // self.base_rows
+        full = groups * self.base_rows
+        self._tail = block[full:]
+        if not groups:
+            return
+        ncols = len(self.columns)
+        rows = np.arange(first_row, first_row + full)
+        rows = np.repeat(rows[:, np.newaxis], ncols, axis=1)
+        x = np.repeat(block[:full, :1], ncols, axis=1)
+        buckets = _extrema(rows, x, block[:full, 1:], groups, self.base_rows)
+        if not self.levels:
+            self.levels.append(_Level(self.base_rows, ncols))
+        self.levels[0].extend(buckets)
+        self._aggregate()
+
+    def _aggregate(self):
+        """Combine complete groups of buckets into the next level up."""
+        for k, level in enumerate(self.levels):
+            if level.size < self.factor:
+                break
+            if k + 1 == len(self.levels):
+                self.levels.append(
+                        _Level(level.bucket_rows * self.factor, len(self.columns)))
+            upper = self.levels[k + 1]
+            groups = level.size // self.factor - upper.size
+            if not groups:
+                continue
+            lo = upper.size * self.factor
+            hi = lo + groups * self.factor
+            combined = {}
+            for kind in ('min', 'max'):
+                part = _extrema(level['i' + kind][lo:hi], level['x' + kind][lo:hi],
+                                level['y' + kind][lo:hi], groups, self.factor)
+                for field in ('i', 'x', 'y'):
+                    combined[field + kind] = part[field + kind]
+            upper.extend(combined)
+
+    def level(self, bucket_rows):
+        """The coarsest level with buckets of at most bucket_rows rows."""
+        best = None
+        for level in self.levels:
+            if level.bucket_rows <= bucket_rows:
+                best = level
+        return best
+
+
+def _raw_candidates(data, x, y, start, stop):
+    if stop <= start:
+        empty = np.empty((0,))
+        return (empty.astype(np.int64), empty, empty)
+    xs, ys = data.getColumns([x, y], start, stop)
+    rows = np.arange(start, start + len(xs), dtype=np.int64)
+    return rows, np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+
+def _candidates(data, pyramid, y, start, stop, bucket_rows):
+    """Points that may be a minimum or maximum of buckets of bucket_rows.
+
+    Returns (rows, x, y) arrays for candidate minima and for candidate
+    maxima.
+    """
+    level = pyramid.level(bucket_rows)
+    if level is not None:
+        size = level.bucket_rows
+        first = -(-start // size)
+        last = min(stop // size, level.size)
+    if level is None or first >= last:
+        raw = _raw_candidates(data, pyramid.x, y, start, stop)
+        return raw, raw
+    col = pyramid.columns.index(y)
+    head = _raw_candidates(data, pyramid.x, y, start, first * size)
+    tail = _raw_candidates(data, pyramid.x, y, last * size, stop)
+    result = []
+    for kind in ('min', 'max'):
+        result.append(tuple(
+                np.concatenate((h, level[field + kind][first:last, col], t))
+                for field, h, t in zip(('i', 'x', 'y'), head, tail)))
+    return tuple(result)
+
+def _bucket_extrema(rows, x, y, start, stop, buckets, largest):
+    if not len(rows):
+        return rows, x, y
+    bucket = (rows - start) * buckets // (stop - start)
+    key = -y if largest else y
+    # NaNs sort last, so they are only picked for buckets with nothing else
+    order = np.lexsort((key, bucket))
+    sorted_buckets = bucket[order]
+    first = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+    picked = order[first]
+    return rows[picked], x[picked], y[picked]
+
+def minmax(lows, highs, start, stop, buckets):
+    """Reduce candidate points to the minimum and maximum of each bucket.
+
+    Returns an (n, 2) array of (x, y) points in row order.
+    """
+    lo = _bucket_extrema(*(lows + (start, stop, buckets, False)))
+    hi = _bucket_extrema(*(highs + (start, stop, buckets, True)))
+    rows = np.concatenate((lo[0], hi[0]))
+    rows, index = np.unique(rows, return_index=True)
+    x = np.concatenate((lo[1], hi[1]))[index]
+    y = np.concatenate((lo[2], hi[2]))[index]
+    return np.column_stack((x, y))
+
+def lttb(x, y, points):
+    """Pick points (x, y) with the Largest-Triangle-Three-Buckets algorithm.
+
+    The first and last points are always kept.  Returns an (n, 2) array.
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        if points < 3 and n > 2:
+            x, y = x[[0, -1]], y[[0, -1]]
+        return np.column_stack((x, y))
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    # averages of the bucket after each bucket, with the last point after
+    # the last bucket
+    counts = np.maximum(np.diff(edges), 1)
+    avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    avg_x = np.append(avg_x[1:], x[-1])
+    avg_y = np.append(avg_y[1:], y[-1])
+    picked = np.empty(points, dtype=np.int64)
+    picked[0] = 0
+    picked[-1] = n - 1
+    a = 0
+    for i in xrange(points - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        area = np.abs((x[a] - avg_x[i]) * (y[lo:hi] - y[a]) -
+                      (x[a] - x[lo:hi]) * (avg_y[i] - y[a]))
+        a = lo + np.argmax(area)
+        picked[i + 1] = a
+    return np.column_stack((x[picked], y[picked]))
+
+def decimate(data, pyramid, y, start, stop, points, method):
+    """Reduce column y of rows [start, stop) to about the given number of points.
+
+    data is the backend and pyramid a Pyramid for the x column that is in
+    sync with it.  Returns an (n, 2) array of (x, y) points, where n is at
+    most points.
+    """
+    stop = pyramid.rows if stop is None else min(stop, pyramid.rows)
+    if stop <= start:
+        return np.empty((0, 2))
+    span = stop - start
+    if method == 'minmax':
+        buckets = max(points // 2, 1)
+        lows, highs = _candidates(data, pyramid, y, start, stop, span // buckets)
+        return minmax(lows, highs, start, stop, buckets)
+    # LTTB on the extrema of about twice as many buckets as output points
+    buckets = max(2 * points, 1)
+    lows, highs = _candidates(data, pyramid, y, start, stop, span // buckets)
+    if pyramid.level(span // buckets) is not None:
+        candidates = minmax(lows, highs, start, stop, buckets)
+    else:
+        candidates = np.column_stack(lows[1:])
+    candidates = candidates[np.isfinite(candidates).all(axis=1)]
+    return lttb(candidates[:, 0], candidates[:, 1], points)
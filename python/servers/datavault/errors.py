@@ -46,3 +46,38 @@ class DataVersionMismatchError(T.Error):
     code = 11
     def __init__(self):
         self.msg = "Dataset was created with newer API, cannot be read.  Use get_ex"
+
+class BadStorageProfileError(T.Error):
+    code = 12
+    def __init__(self, name, known):
+        self.msg = "Unknown storage profile '{0}'.  Choose one of: {1}".format(name, ', '.join(known))
+
+class CursorNotFoundError(T.Error):
+    code = 13
+    def __init__(self, cursor):
+        self.msg = "Cursor {0} is not open in this context.".format(cursor)
+
+class BadSelectionError(T.Error):
+    code = 14
+    def __init__(self, msg):
+        self.msg = msg
+
+class BadRawDataError(T.Error):
+    code = 15
+    def __init__(self, msg):
+        self.msg = msg
+
+class BadColumnDataError(T.Error):
+    code = 16
+    def __init__(self, msg):
+        self.msg = msg
+
+class BadSearchError(T.Error):
+    code = 17
+    def __init__(self, msg):
+        self.msg = "Bad search {0}".format(msg)
+
+class SearchUnavailableError(T.Error):
+    code = 18
+    def __init__(self):
+        self.msg = "The data vault was started without a search index."
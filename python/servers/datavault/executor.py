@@ -0,0 +1,84 @@
+"""Executors that run dataset I/O for the data vault.
+
+Reading a large dataset can take long enough to stall every other client of
+the server, so backend calls that touch the data go through an executor
+instead of being made directly in the reactor thread.  The
+SynchronousExecutor just calls through and is what you get by default (and
+in tests); the ThreadPoolExecutor runs the calls in a bounded pool of
+worker threads.
+
+HDF5 is not thread-safe per file handle, so calls are serialized per file:
+each call names the SelfClosingFile it uses, and calls on the same file run
+one at a time in the order they were made.  Calls on different files run
+concurrently.
+"""
+
+from twisted.internet import defer, reactor, threads
+from twisted.python import threadpool
+
+
+IO_THREADS = 4 # default number of worker threads
+
+
+class SynchronousExecutor(object):
+    """Runs backend calls inline in the calling thread."""
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def run(self, fh, f, *args, **kw):
+        """Call f(*args, **kw) and return a Deferred with the result."""
+        return defer.maybeDeferred(f, *args, **kw)
+
+
+class ThreadPoolExecutor(object):
+    """Runs backend calls in a pool of worker threads.
+
+    run must be called from the reactor thread.  The Deferreds it returns
+    fire in the reactor thread.
+    """
+
+    def __init__(self, max_threads=IO_THREADS, reactor=reactor):
+        self.reactor = reactor
+        self.pool = threadpool.ThreadPool(0, max_threads, name='Data Vault I/O')
+        self._locks = {}
+
+    def start(self):
+        self.pool.start()
+        self.reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+
+    def stop(self):
+        if self.pool.started:
+            self.pool.stop()
+
+    def run(self, fh, f, *args, **kw):
+        """Call f(*args, **kw) in a worker thread once fh is free.
+
+        Returns a Deferred with the result.
+        """
+        lock = self._locks.get(fh)
+        if lock is None:
+            lock = self._locks[fh] = defer.DeferredLock()
+        d = lock.run(self._runInThread, fh, f, *args, **kw)
+        d.addBoth(self._forgetLock, fh, lock)
+        return d
+
+    def _runInThread(self, fh, f, *args, **kw):
+        # Hold the file open while a worker is using it.  The file is opened
+        # here if needed, so that its close timer is set up in the reactor.
+        fh.hold()
+        d = threads.deferToThreadPool(self.reactor, self.pool, f, *args, **kw)
+        d.addBoth(self._release, fh)
+        return d
+
+    def _release(self, result, fh):
+        fh.release()
+        return result
+
+    def _forgetLock(self, result, fh, lock):
+        if not lock.locked and not lock.waiting and self._locks.get(fh) is lock:
+            del self._locks[fh]
+        return result
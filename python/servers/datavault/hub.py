@@ -0,0 +1,246 @@
+"""Delivery of signals through the managers of a multi-headed Data Vault.
+
+A multi-headed Data Vault runs one DataVaultMultiHead server per manager,
+all sharing one SessionStore.  Listening contexts are ExtendedContext keys,
+which carry the server they belong to, and the SignalHub stands in for the
+server as the hub of the store: the sessions and datasets call its signals
+with contexts of every manager, and it passes each context on to the signal
+of its own server.
+
+Signals are not sent right away.  They are queued per manager and sent on
+the next turn of the reactor, with all contexts of one manager that get the
+same signal with the same data sent in one call, and a context that gets an
+identical signal more than once in the meantime sent it only once.
+
+The keepalive of each server tells the hub how its manager is doing.  If a
+keepalive is not answered before the next one is due, fails, or takes
+longer than SLOW_KEEPALIVE, the manager is stalled: its signals are kept
+queued rather than piling up in the connection, and are sent once a
+keepalive is answered in time again.  Identical signals are still merged
+while queued, so a stalled manager gets one 'data available' per context
+however much data was added.  At most MAX_QUEUED contexts are kept queued
+per manager, dropping the oldest signals first, and the signals of a
+manager are dropped when its server disconnects, since the contexts of a
+lost connection do not come back.  Streamed rows are not lost without a
+trace: a context whose 'data streamed' signals were dropped gets one in
+their place that stands for the rows they held but carries none of them,
+so the client knows to read those rows back with get_selection.  Other
+managers are never held up by a stalled one.
+"""
+
+import collections
+
+from twisted.internet import reactor
+from twisted.python import log
+
+
+# signals of the DataVault server relayed by the hub
+SIGNALS = [
+    'onNewDir',
+    'onNewDataset',
+    'onTagsUpdated',
+    'onDataAvailable',
+    'onNewParameter',
+    'onCommentsAvailable',
+    'onDataStreamed',
+]
+
+MAX_QUEUED = 100000 # contexts of queued signals kept per manager
+SLOW_KEEPALIVE = 10 # seconds to answer a keepalive before a manager is stalled
+
+
+def _dedupKey(data):
+    """A hashable stand-in for signal data, equal for equal data."""
+    try:
+        hash(data)
+        return data
+    except TypeError:
+        return repr(data)
+
+
+class Head(object):
+    """Signals waiting to be sent through the server of one manager."""
+
+    def __init__(self, server, maxQueued=MAX_QUEUED):
+        self.server = server
+        self.maxQueued = maxQueued
+        self.queued = collections.OrderedDict() # (signal, key) -> (data, contexts)
+        self.numQueued = 0
+        self.stalled = False
+        self.keepaliveTime = None # when the unanswered keepalive was sent
+        self.sent = 0 # contexts signalled
+        self.merged = 0 # contexts not signalled again for an identical signal
+        self.dropped = 0 # contexts not signalled because too many were queued
+        self.gaps = collections.OrderedDict() # context -> rows left out of its stream
+
+    def queue(self, signal, data, contexts):
+        """Queue a signal for some context IDs, or for all listeners if None."""
+        key = (signal, _dedupKey(data))
+        entry = self.queued.get(key)
+        if contexts is None:
+            if entry is None:
+                self.numQueued += 1
+            elif entry[1] is None:
+                self.merged += 1
+            else:
+                # the contexts queued so far get it anyway
+                self.merged += len(entry[1])
+                self.numQueued += 1 - len(entry[1])
+            self.queued[key] = (data, None)
+        else:
+            if entry is None:
+                entry = self.queued[key] = (data, set())
+            queued = entry[1]
+            if queued is None:
+                self.merged += len(contexts)
+            else:
+                for context in contexts:
+                    if context in queued:
+                        self.merged += 1
+                    else:
+                        queued.add(context)
+                        self.numQueued += 1
+        while self.numQueued > self.maxQueued:
+            (signal, _), (data, dropped) = self.queued.popitem(last=False)
+            count = 1 if dropped is None else len(dropped)
+            self.numQueued -= count
+            self.dropped += count
+            if signal == 'onDataStreamed' and dropped is not None:
+                for context in dropped:
+                    self._addGap(context, data)
+
+    def _addGap(self, context, message):
+        """Note that the rows of a streamed message were not sent."""
+        first, rows, dtype, _ = message
+        gap = self.gaps.get(context)
+        if gap is not None and gap[0] + gap[1] == first:
+            first, rows = gap[0], gap[1] + rows
+        # otherwise the context streams another dataset now
+        self.gaps[context] = (first, rows, dtype, '')
+
+    def send(self):
+        """Send all queued signals now."""
+        queued = self.queued
+        gaps = self.gaps
+        self.queued = collections.OrderedDict()
+        self.gaps = collections.OrderedDict()
+        self.numQueued = 0
+        # the rows left out come before those of the streamed messages kept
+        for context, message in gaps.items():
+            self.sent += 1
+            self._send('onDataStreamed', message, [context])
+        for (signal, _), (data, contexts) in queued.items():
+            if contexts is not None:
+                self.sent += len(contexts)
+                contexts = list(contexts)
+            else:
+                self.sent += 1
+            self._send(signal, data, contexts)
+
+    def _send(self, signal, data, contexts):
+        try:
+            getattr(self.server, signal)(data, contexts)
+        except Exception:
+            log.err(None, 'Failed to send signal {} to {}:{}'.format(
+                    signal, getattr(self.server, 'host', None),
+                    getattr(self.server, 'port', None)))
+
+
+class SignalHub(object):
+    """The hub of a SessionStore shared by several DataVaultMultiHead servers.
+
+    The object that connects to the managers either is, or hands its
+    servers, the SignalHub: each server calls connect when it starts and
+    disconnect when it shuts down, and reports on its keepalives.
+    """
+
+    def __init__(self, reactor=reactor, maxQueued=MAX_QUEUED,
+                 slowKeepalive=SLOW_KEEPALIVE):
+        self.reactor = reactor
+        self.maxQueued = maxQueued
+        self.slowKeepalive = slowKeepalive
+        self.heads = collections.OrderedDict() # server -> Head
+        self.unrouted = 0 # contexts whose server was not connected
+        self._send_call = None
+        for signal in SIGNALS:
+            setattr(self, signal, self._relay(signal))
+
+    def _relay(self, signal):
+        def relay(data, contexts=None):
+            self.send(signal, data, contexts)
+        relay.__name__ = signal
+        return relay
+
+    def connect(self, server):
+        """Start sending signals through a server."""
+        self.heads[server] = Head(server, self.maxQueued)
+
+    def disconnect(self, server):
+        """Stop sending signals through a server, dropping queued ones."""
+        self.heads.pop(server, None)
+
+    def send(self, signal, data, contexts=None):
+        """Queue a signal for ExtendedContext keys, or all listeners if None."""
+        if contexts is None:
+            for head in self.heads.values():
+                head.queue(signal, data, None)
+        else:
+            byServer = collections.OrderedDict()
+            for context in contexts:
+                byServer.setdefault(context.server, []).append(context.context)
+            for server, ids in byServer.items():
+                head = self.heads.get(server)
+                if head is None:
+                    self.unrouted += len(ids)
+                else:
+                    head.queue(signal, data, ids)
+        self._schedule()
+
+    def _schedule(self):
+        if self._send_call is None:
+            self._send_call = self.reactor.callLater(0, self.flush)
+
+    def flush(self):
+        """Send the queued signals of every manager that is not stalled."""
+        if self._send_call is not None:
+            if self._send_call.active():
+                self._send_call.cancel()
+            self._send_call = None
+        for head in self.heads.values():
+            if not head.stalled and (head.queued or head.gaps):
+                head.send()
+
+    def keepaliveSent(self, server):
+        head = self.heads.get(server)
+        if head is None:
+            return
+        if head.keepaliveTime is not None:
+            # the last one was not answered before this one was due
+            head.stalled = True
+        head.keepaliveTime = self.reactor.seconds()
+
+    def keepaliveAnswered(self, server):
+        head = self.heads.get(server)
+        if head is None or head.keepaliveTime is None:
+            return
+        elapsed = self.reactor.seconds() - head.keepaliveTime
+        head.keepaliveTime = None
+        if elapsed > self.slowKeepalive:
+            head.stalled = True
+        elif head.stalled:
+            head.stalled = False
+            if head.queued or head.gaps:
+                self._schedule()
+
+    def keepaliveFailed(self, server):
+        head = self.heads.get(server)
+        if head is not None:
+            head.keepaliveTime = None
+            head.stalled = True
+
+    def stats(self):
+        """(host, port, stalled, queued, sent, merged, dropped) of each server."""
+        return [(getattr(server, 'host', ''), getattr(server, 'port', 0),
+                 head.stalled, head.numQueued, head.sent, head.merged,
+                 head.dropped)
+                for server, head in self.heads.items()]
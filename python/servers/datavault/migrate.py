@@ -0,0 +1,307 @@
+"""Convert csv datasets to the HDF5 format.
+
+Run from the servers directory:
+
+    python -m datavault.migrate DATADIR [--processes N] [--chunk-rows N]
+                                        [--profile NAME] [--dry-run]
+                                        [--repack [--min-age HOURS]]
+
+Every dataset under DATADIR that is stored as a .csv file with a .ini
+metadata file is copied into a SimpleHDF5Data (version 2) file next to it,
+including its title, times, parameters and comments.  Rows are streamed in
+chunks, so memory use does not depend on the size of the dataset, and many
+datasets are converted in parallel by a pool of worker processes.
+
+Each new file is written under a temporary name, read back and compared
+with the csv file (row count and a checksum of the values) and only then
+renamed to <dataset>.hdf5.  The csv and ini files are left in place.  Since
+the dataset keeps its name, the tags in session.ini still apply to it.
+The data vault opens the .hdf5 file in preference to the .csv file unless
+the csv file was modified after the conversion, so it is safe to run this
+while the data vault is running.
+
+With --repack, the rows of the converted files, and of version 2 HDF5
+files that have not been modified for --min-age hours, are rewritten into
+one contiguous block (see backend.repack_hdf5_file) so that the data vault
+can read them through a memory map.  Unlike the conversion, this replaces
+the existing HDF5 file, so only datasets that are no longer being written
+should be repacked.
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+
+import h5py
+import numpy as np
+
+from . import backend
+
+
+CHUNK_ROWS = 100000 # rows converted at a time
+PARTIAL_SUFFIX = '.hdf5.partial'
+MIN_REPACK_AGE = 24 # hours since a file was modified before it is repacked
+
+
+class MigrationError(Exception):
+    pass
+
+
+def find_csv_datasets(datadir):
+    """Find csv datasets under datadir that have not been converted yet.
+
+    Returns a sorted list of file names without extension.
+    """
+    bases = []
+    for dirpath, dirnames, filenames in os.walk(datadir):
+        dirnames.sort()
+        names = set(filenames)
+        for name in filenames:
+            if not name.endswith('.csv'):
+                continue
+            base = name[:-4]
+            if base + '.ini' in names and base + '.hdf5' not in names:
+                bases.append(os.path.join(dirpath, base))
+    return sorted(bases)
+
+def find_hdf5_datasets(datadir, min_age=MIN_REPACK_AGE):
+    """Find HDF5 dataset files under datadir not modified for min_age hours.
+
+    Returns a sorted list of file names.
+    """
+    cutoff = time.time() - min_age * 3600
+    found = []
+    for dirpath, dirnames, filenames in os.walk(datadir):
+        dirnames.sort()
+        for name in filenames:
+            filename = os.path.join(dirpath, name)
+            if name.endswith('.hdf5') and os.path.getmtime(filename) <= cutoff:
+                found.append(filename)
+    return sorted(found)
+
+def _timestamp(dt):
+    return time.mktime(dt.timetuple()) + dt.microsecond / 1e6
+
+def _read_metadata(base):
+    meta = backend.IniData()
+    meta.infofile = base + '.ini'
+    meta.load()
+    return meta
+
+def _csv_chunks(filename, cols, chunk_rows):
+    """Yield the rows of a csv data file as 2-D arrays of up to chunk_rows rows."""
+    with open(filename, 'rb') as f:
+        rest = ''
+        while True:
+            text = f.read(backend.CSV_READ_BYTES)
+            if not text:
+                break
+            text = rest + text
+            end = text.rfind('\n') + 1
+            rest = text[end:]
+            rows = backend._parse_csv_block(text[:end], cols)
+            for start in xrange(0, len(rows), chunk_rows):
+                yield rows[start:start + chunk_rows]
+    if rest.strip():
+        raise MigrationError('{} ends with an incomplete row'.format(filename))
+
+def _hdf5_chunks(filename, chunk_rows):
+    """Yield the rows of a version 2 HDF5 file as 2-D arrays."""
+    with h5py.File(filename, 'r') as f:
+        dataset = f['DataVault']
+        rows = dataset.shape[0]
+        if backend.HDF5Data.LENGTH_ATTR in dataset.attrs:
+            rows = int(dataset.attrs[backend.HDF5Data.LENGTH_ATTR])
+        for start in xrange(0, rows, chunk_rows):
+            records = dataset[start:min(start + chunk_rows, rows)]
+            yield np.column_stack([records[name] for name in records.dtype.names])
+
+def _checksum(chunks):
+    """Number of rows and SHA-1 digest of the float64 values of some chunks."""
+    digest = hashlib.sha1()
+    rows = 0
+    for chunk in chunks:
+        digest.update(np.ascontiguousarray(chunk, dtype='<f8').tostring())
+        rows += len(chunk)
+    return rows, digest.hexdigest()
+
+def convert_dataset(base, chunk_rows=CHUNK_ROWS, profile=None, repack=False):
+    """Convert the csv dataset base.csv/base.ini to base.hdf5.
+
+    If repack is True, the new file is repacked before it is checked.
+    Returns the number of rows converted.  Raises MigrationError if the
+    converted data does not match the csv file, in which case no .hdf5 file
+    is created.
+    """
+    csv_file = base + '.csv'
+    hdf5_file = base + '.hdf5'
+    partial = base + PARTIAL_SUFFIX
+    meta = _read_metadata(base)
+    size = os.path.getsize(csv_file)
+    try:
+        fh = backend.SelfClosingFile(
+                h5py.File, open_args=(partial, 'w'),
+                open_kw=backend.file_options(profile))
+        data = backend.SimpleHDF5Data(fh, profile)
+        data.initialize_info(meta.title, meta.independents, meta.dependents, profile)
+        attrs = data.dataset.attrs
+        attrs['Creation Time'] = _timestamp(meta.created)
+        attrs['Access Time'] = _timestamp(meta.accessed)
+        attrs['Modification Time'] = _timestamp(meta.modified)
+        data.addParams([(p['label'], p['data']) for p in meta.parameters])
+        comments = [(_timestamp(t), user, comment) for t, user, comment in meta.comments]
+        data.appendComments(np.array(comments, dtype=data.comment_type))
+
+        def copied():
+            for chunk in _csv_chunks(csv_file, meta.cols, chunk_rows):
+                data.addData(np.core.records.fromarrays(chunk.T, dtype=data.dtype))
+                yield chunk
+        expected = _checksum(copied())
+        data.trim()
+        data._file.close()
+        if repack:
+            backend.repack_hdf5_file(partial)
+
+        found = _checksum(_hdf5_chunks(partial, chunk_rows))
+        if found != expected:
+            raise MigrationError(
+                    '{}: wrote {} rows with checksum {}, read back {} rows '
+                    'with checksum {}'.format(base, expected[0], expected[1],
+                                              found[0], found[1]))
+        if os.path.getsize(csv_file) != size:
+            raise MigrationError('{} was changed during the conversion'.format(csv_file))
+        os.rename(partial, hdf5_file)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return expected[0]
+
+def repack_dataset(filename):
+    """Repack a version 2 HDF5 file whose rows are not yet contiguous.
+
+    Returns the number of rows repacked, or None if the file was left alone.
+    """
+    with h5py.File(filename, 'r') as f:
+        if f.attrs['Version'][0] != 2 or f['DataVault'].chunks is None:
+            return None
+    return backend.repack_hdf5_file(filename)
+
+def _convert_job(job):
+    """Run convert_dataset in a worker process, catching any errors."""
+    base, chunk_rows, profile, repack = job
+    start = time.time()
+    try:
+        rows = convert_dataset(base, chunk_rows, profile, repack)
+    except Exception as e:
+        return base, None, '{}: {}'.format(type(e).__name__, e), time.time() - start
+    return base, rows, None, time.time() - start
+
+def _repack_job(filename):
+    """Run repack_dataset in a worker process, catching any errors."""
+    start = time.time()
+    try:
+        rows = repack_dataset(filename)
+    except Exception as e:
+        return filename, None, '{}: {}'.format(type(e).__name__, e), time.time() - start
+    return filename, rows, None, time.time() - start
+
+def migrate_tree(datadir, processes=None, chunk_rows=CHUNK_ROWS, profile=None,
+                 progress=None, repack=False):
+    """Convert all csv datasets under datadir.
+
+    progress, if given, is called as progress(done, total, base, rows, error,
+    seconds) after each dataset, where rows is None if it failed.  If repack
+    is True, the new files are repacked (see repack_dataset).  Returns a
+    list of (base, rows, error) tuples.
+    """
+    backend.get_storage_profile(profile) # fail before starting any workers
+    jobs = [(base, chunk_rows, profile, repack) for base in find_csv_datasets(datadir)]
+    return _run_jobs(_convert_job, jobs, processes, progress)
+
+def repack_tree(datadir, processes=None, min_age=MIN_REPACK_AGE, progress=None):
+    """Repack the version 2 HDF5 files under datadir not modified for min_age hours.
+
+    progress is called as for migrate_tree, with rows None for files that
+    failed or were left alone; only failed files have an error.  Returns a
+    list of (filename, rows, error) tuples.
+    """
+    return _run_jobs(_repack_job, find_hdf5_datasets(datadir, min_age),
+                     processes, progress)
+
+def _run_jobs(run, jobs, processes, progress):
+    if processes == 1:
+        pool = None
+        results = (run(job) for job in jobs)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(run, jobs)
+    done = []
+    try:
+        for base, rows, error, seconds in results:
+            done.append((base, rows, error))
+            if progress is not None:
+                progress(len(done), len(jobs), base, rows, error, seconds)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return done
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('datadir')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='worker processes (default: one per cpu)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--profile', default=None,
+                        help='storage profile for the new files')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only list the datasets that would be converted')
+    parser.add_argument('--repack', action='store_true',
+                        help='store the rows of finished datasets contiguously')
+    parser.add_argument('--min-age', type=float, default=MIN_REPACK_AGE,
+                        help='hours since an HDF5 file was modified before it '
+                             'is repacked (default: %(default)s)')
+    args = parser.parse_args()
+
+    if args.dry_run:
+        for base in find_csv_datasets(args.datadir):
+            print base
+        if args.repack:
+            for filename in find_hdf5_datasets(args.datadir, args.min_age):
+                print filename
+        return
+
+    def progress(done, total, base, rows, error, seconds):
+        name = os.path.relpath(base, args.datadir)
+        if error is None and rows is None:
+            print '[{}/{}] {}: already contiguous'.format(done, total, name)
+        elif error is None:
+            print '[{}/{}] {}: {} rows in {:.1f} s'.format(done, total, name, rows, seconds)
+        else:
+            print '[{}/{}] {}: FAILED {}'.format(done, total, name, error)
+        sys.stdout.flush()
+
+    # before converting, so that new files are not repacked twice
+    if args.repack:
+        repacked = repack_tree(args.datadir, args.processes, args.min_age, progress)
+    results = migrate_tree(args.datadir, args.processes, args.chunk_rows,
+                           args.profile, progress, args.repack)
+    failed = [r for r in results if r[1] is None]
+    print 'Converted {} datasets, {} failed.'.format(
+            len(results) - len(failed), len(failed))
+    if args.repack:
+        repack_failed = [r for r in repacked if r[2] is not None]
+        print 'Repacked {} datasets, {} failed.'.format(
+                len([r for r in repacked if r[1] is not None]), len(repack_failed))
+        failed += repack_failed
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
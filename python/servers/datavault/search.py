@@ -0,0 +1,422 @@
+"""Search index over the datasets of the whole data vault tree.
+
+Finding a dataset by title, tag or parameter otherwise means walking the
+directories one at a time.  The SearchIndex keeps the title, creation
+time, variable labels and units, parameters and tags of every dataset in
+an SQLite database in the data directory, with a full-text index over all
+of them, so that searches over hundreds of thousands of datasets take
+milliseconds.
+
+The index is kept up to date as datasets are created, tagged and given
+parameters, and crawl picks up everything else (datasets written by older
+versions or copied in from elsewhere) by reading the files whose
+modification time changed since they were indexed.  crawl is meant to run
+in a background thread; the index is guarded by a lock, and the lock is
+not held while files are read.
+
+The database only holds copies of metadata that is stored elsewhere, so
+a missing or damaged index is simply rebuilt.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import h5py
+from twisted.python import log
+
+from . import backend, errors, util
+
+
+SEARCH_INDEX_FILE = 'search.sqlite'
+SEARCH_INDEX_VERSION = 2
+SEARCH_LIMIT = 1000 # default number of results
+
+
+_SCHEMA = [
+    '''CREATE TABLE datasets (
+           id INTEGER PRIMARY KEY, dir TEXT NOT NULL, name TEXT NOT NULL,
+           title TEXT, created REAL, labels TEXT, mtime REAL, tagged REAL,
+           UNIQUE (dir, name))''',
+    'CREATE INDEX datasets_created ON datasets (created)',
+    'CREATE TABLE tags (dataset INTEGER NOT NULL, tag TEXT NOT NULL)',
+    'CREATE INDEX tags_tag ON tags (tag, dataset)',
+    'CREATE INDEX tags_dataset ON tags (dataset)',
+    '''CREATE TABLE params (dataset INTEGER NOT NULL, name TEXT NOT NULL,
+                            value TEXT)''',
+    'CREATE INDEX params_name ON params (name, value)',
+    'CREATE INDEX params_dataset ON params (dataset)',
+]
+
+
+def _dir_key(path):
+    """The key of a session path in the database."""
+    return json.dumps(list(path), encoding='latin-1')
+
+def _dir_path(key):
+    return [p.encode('latin-1') for p in json.loads(key)]
+
+def _value_text(value):
+    """The text of a parameter value, as it is searched."""
+    if isinstance(value, str):
+        return value
+    return str(value)
+
+def _timestamp(dt):
+    return time.mktime(dt.timetuple()) + dt.microsecond / 1e6
+
+
+class SearchIndex(object):
+    """Indexed metadata of all datasets, stored in an SQLite file.
+
+    Datasets are identified by their session path, a list of directory
+    names starting with '', and their name.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        try:
+            self._open()
+        except sqlite3.DatabaseError:
+            log.err(None, 'Rebuilding damaged search index {}'.format(filename))
+            os.remove(filename)
+            self._open()
+
+    def _open(self):
+        self._db = sqlite3.connect(self.filename, check_same_thread=False)
+        self._db.text_factory = str
+        # the index can be rebuilt, so trade durability for speed
+        self._db.execute('PRAGMA synchronous = OFF')
+        version, = self._db.execute('PRAGMA user_version').fetchone()
+        if version != SEARCH_INDEX_VERSION:
+            self._create()
+        self.fulltext = self._hasTable('words_content') # an fts4 table
+
+    def _hasTable(self, name):
+        return self._db.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+    def _create(self):
+        db = self._db
+        tables = [row[0] for row in db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'")]
+        for table in ['words', 'datasets', 'tags', 'params']:
+            if table in tables:
+                db.execute('DROP TABLE {}'.format(table))
+        for statement in _SCHEMA:
+            db.execute(statement)
+        try:
+            db.execute('CREATE VIRTUAL TABLE words USING fts4 (content)')
+        except sqlite3.OperationalError:
+            # sqlite without full-text search; words are matched with LIKE
+            db.execute('CREATE TABLE words (docid INTEGER PRIMARY KEY, content TEXT)')
+        db.execute('PRAGMA user_version = {}'.format(SEARCH_INDEX_VERSION))
+        db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _id(self, path, name):
+        row = self._db.execute('SELECT id FROM datasets WHERE dir = ? AND name = ?',
+                               (_dir_key(path), name)).fetchone()
+        return None if row is None else row[0]
+
+    def _updateWords(self, dataset):
+        db = self._db
+        name, title, labels = db.execute(
+                'SELECT name, title, labels FROM datasets WHERE id = ?', (dataset,)).fetchone()
+        words = [name, title or '', labels or '']
+        words.extend(tag for tag, in db.execute(
+                'SELECT tag FROM tags WHERE dataset = ?', (dataset,)))
+        for param, value in db.execute(
+                'SELECT name, value FROM params WHERE dataset = ?', (dataset,)):
+            words.extend((param, value))
+        db.execute('DELETE FROM words WHERE docid = ?', (dataset,))
+        db.execute('INSERT INTO words (docid, content) VALUES (?, ?)',
+                   (dataset, '\n'.join(words)))
+
+    def _add(self, path, name, title, created, labels, params, tags, mtime,
+             tagged=None):
+        db = self._db
+        dataset = self._id(path, name)
+        if dataset is not None:
+            self._delete(dataset)
+        cursor = db.execute(
+                '''INSERT INTO datasets (dir, name, title, created, labels, mtime,
+                                         tagged)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                (_dir_key(path), name, title, created, '\n'.join(labels), mtime,
+                 tagged))
+        dataset = cursor.lastrowid
+        db.executemany('INSERT INTO params (dataset, name, value) VALUES (?, ?, ?)',
+                       [(dataset, p, _value_text(v)) for p, v in params])
+        db.executemany('INSERT INTO tags (dataset, tag) VALUES (?, ?)',
+                       [(dataset, tag) for tag in sorted(tags)])
+        self._updateWords(dataset)
+
+    def _delete(self, dataset):
+        for table, column in [('datasets', 'id'), ('tags', 'dataset'),
+                              ('params', 'dataset'), ('words', 'docid')]:
+            self._db.execute('DELETE FROM {} WHERE {} = ?'.format(table, column),
+                             (dataset,))
+
+    def addDataset(self, path, name, title, created, labels, params=(), tags=(),
+                   mtime=None):
+        """Index a dataset, replacing what was indexed for it before.
+
+        created is a timestamp, labels a list of words describing the
+        variables (see variable_words), params a list of (name, value)
+        pairs and tags a set.
+        """
+        with self._lock:
+            self._add(path, name, title, created, labels, params, tags, mtime)
+            self._db.commit()
+
+    def addParameters(self, path, name, params):
+        with self._lock:
+            dataset = self._id(path, name)
+            if dataset is None:
+                return
+            self._db.executemany(
+                    'INSERT INTO params (dataset, name, value) VALUES (?, ?, ?)',
+                    [(dataset, p, _value_text(v)) for p, v in params])
+            self._updateWords(dataset)
+            self._db.commit()
+
+    def setTags(self, path, name, tags):
+        with self._lock:
+            dataset = self._id(path, name)
+            if dataset is None:
+                return
+            self._db.execute('DELETE FROM tags WHERE dataset = ?', (dataset,))
+            self._db.executemany('INSERT INTO tags (dataset, tag) VALUES (?, ?)',
+                                 [(dataset, tag) for tag in sorted(tags)])
+            # session.ini is saved a while later, and until then has older tags
+            self._db.execute('UPDATE datasets SET tagged = ? WHERE id = ?',
+                             (time.time(), dataset))
+            self._updateWords(dataset)
+            self._db.commit()
+
+    def remove(self, path, name):
+        with self._lock:
+            dataset = self._id(path, name)
+            if dataset is not None:
+                self._delete(dataset)
+                self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM datasets').fetchone()[0]
+
+    def indexedTimes(self, path):
+        """{name: file modification time} of the indexed datasets of a directory."""
+        with self._lock:
+            return dict(self._db.execute(
+                    'SELECT name, mtime FROM datasets WHERE dir = ?', (_dir_key(path),)))
+
+    def _tags(self, dataset):
+        return set(tag for tag, in self._db.execute(
+                'SELECT tag FROM tags WHERE dataset = ?', (dataset,)))
+
+    def updateDirectory(self, path, datasets, tags, names, listed=None,
+                        tags_mtime=None):
+        """Bring the index of one directory up to date in one transaction.
+
+        datasets is a list of (name, title, created, labels, params, mtime)
+        for the datasets that were read, tags maps dataset names to tag sets
+        and names is the set of all datasets in the directory.
+
+        Datasets that are no longer there are dropped, but only those that
+        were indexed from their files (with an mtime) before listed, the
+        time the directory was listed: the others may have been created
+        since.  tags_mtime is the modification time of the session.ini file
+        the tags were read from, and tags set with setTags after that are
+        kept, since the file is saved some time after tags change.
+        """
+        def newer(tagged):
+            return tagged is not None and (tags_mtime is None or tagged > tags_mtime)
+        with self._lock:
+            db = self._db
+            key = _dir_key(path)
+            rows = dict((name, (dataset, tagged)) for dataset, name, tagged in db.execute(
+                    'SELECT id, name, tagged FROM datasets WHERE dir = ?', (key,)))
+            for name, title, created, labels, params, mtime in datasets:
+                dataset, tagged = rows.get(name, (None, None))
+                if newer(tagged):
+                    entryTags = self._tags(dataset)
+                else:
+                    entryTags, tagged = tags.get(name, ()), None
+                self._add(path, name, title, created, labels, params,
+                          entryTags, mtime, tagged)
+            rows = db.execute('SELECT id, name, mtime, tagged FROM datasets WHERE dir = ?',
+                              (key,)).fetchall()
+            for dataset, name, mtime, tagged in rows:
+                if name not in names:
+                    if mtime is not None and (listed is None or mtime < listed):
+                        self._delete(dataset)
+                    continue
+                if newer(tagged):
+                    continue
+                indexed = self._tags(dataset)
+                if indexed != set(tags.get(name, ())):
+                    db.execute('DELETE FROM tags WHERE dataset = ?', (dataset,))
+                    db.executemany('INSERT INTO tags (dataset, tag) VALUES (?, ?)',
+                                   [(dataset, tag) for tag in sorted(tags.get(name, ()))])
+                    self._updateWords(dataset)
+            db.commit()
+
+    def search(self, text='', tags=(), params=(), after=None, before=None,
+               under=None, limit=SEARCH_LIMIT):
+        """Find datasets, newest first.
+
+        text is matched against the words of the titles, names, variable
+        labels, parameter names and values and tags (with full-text search,
+        in the SQLite FTS query syntax, e.g. 'rabi OR ramsey', 'qubit*').
+        Each of tags must be on the dataset, or, if it starts with '-',
+        must not be.  params are (name, value) pairs that must match
+        exactly, where an empty value matches any value.  after and before
+        limit the creation time, given as timestamps, and under a session
+        path limits the search to that directory and its subdirectories.
+        Returns a list of (path, name) pairs.
+        """
+        where = []
+        args = []
+        if text:
+            if self.fulltext:
+                where.append('id IN (SELECT docid FROM words WHERE content MATCH ?)')
+                args.append(text)
+            else:
+                for word in text.split():
+                    where.append("id IN (SELECT docid FROM words WHERE content LIKE ? ESCAPE '\\')")
+                    args.append('%{}%'.format(word.replace('\\', '\\\\')
+                                              .replace('%', '\\%').replace('_', '\\_')))
+        for tag in tags:
+            if tag[:1] == '-':
+                where.append('id NOT IN (SELECT dataset FROM tags WHERE tag = ?)')
+                args.append(tag[1:])
+            else:
+                where.append('id IN (SELECT dataset FROM tags WHERE tag = ?)')
+                args.append(tag)
+        for name, value in params:
+            if value:
+                where.append('id IN (SELECT dataset FROM params WHERE name = ? AND value = ?)')
+                args.extend((name, value))
+            else:
+                where.append('id IN (SELECT dataset FROM params WHERE name = ?)')
+                args.append(name)
+        if after is not None:
+            where.append('created >= ?')
+            args.append(after)
+        if before is not None:
+            where.append('created < ?')
+            args.append(before)
+        if under is not None and list(under) != ['']:
+            key = _dir_key(under)
+            prefix = key[:-1] + ', '
+            where.append('(dir = ? OR substr(dir, 1, ?) = ?)')
+            args.extend((key, len(prefix), prefix))
+        query = 'SELECT dir, name FROM datasets'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY created DESC, id DESC LIMIT ?'
+        args.append(limit)
+        with self._lock:
+            try:
+                rows = self._db.execute(query, args).fetchall()
+            except sqlite3.OperationalError as e:
+                raise errors.BadSearchError('{!r}: {}'.format(text, e))
+        return [(_dir_path(key), name) for key, name in rows]
+
+
+def _read_tags(infofile):
+    """The dataset tags of a session.ini file, or {}."""
+    from . import _tags_from_json # the package imports this module
+    if not os.path.exists(infofile):
+        return {}
+    S = util.DVSafeConfigParser()
+    S.read(infofile)
+    if not S.has_section('Tags'):
+        return {}
+    datasets = S.get('Tags', 'datasets', raw=True)
+    if S.has_option('Tags', 'format') and S.get('Tags', 'format') == 'json':
+        return _tags_from_json(datasets)
+    return eval(datasets)
+
+def variable_words(meta):
+    """The labels, legends and units of the variables of a dataset."""
+    words = []
+    for i in meta.getIndependents():
+        words.extend((i.label, i.unit))
+    for d in meta.getDependents():
+        words.extend((d.label, d.legend, d.unit))
+    return [w for w in words if w]
+
+def read_metadata(base):
+    """(title, created, labels, params) of the dataset stored at base."""
+    if os.path.exists(base + '.hdf5'):
+        # the server cannot open the file while we have it open
+        with backend.read_only_lock, h5py.File(base + '.hdf5', 'r') as f:
+            meta = backend.HDF5MetaData()
+            meta.dataset = f['DataVault']
+            attrs = meta.dataset.attrs
+            params = [(name, meta.getParameter(name)) for name in meta.getParamNames()]
+            return (str(attrs['Title']), float(attrs['Creation Time']), variable_words(meta),
+                    params)
+    meta = backend.IniData()
+    meta.infofile = base + '.ini'
+    meta.load()
+    params = [(p['label'], p['data']) for p in meta.parameters]
+    return meta.title, _timestamp(meta.created), variable_words(meta), params
+
+def _mtime(base):
+    times = [os.path.getmtime(base + ext) for ext in ('.hdf5', '.ini', '.csv')
+             if os.path.exists(base + ext)]
+    return max(times)
+
+def crawl(index, datadir):
+    """Index every dataset under datadir that changed since it was indexed.
+
+    Returns the number of datasets that were read.
+    """
+    from . import filename_decode # the package imports this module
+    read = 0
+    # every directory is listed after this
+    listed = time.time()
+    for dirpath, dirnames, filenames in os.walk(datadir):
+        dirnames[:] = sorted(d for d in dirnames if d.endswith('.dir'))
+        rel = os.path.relpath(dirpath, datadir)
+        path = ['']
+        if rel != '.':
+            path.extend(filename_decode(d[:-4]) for d in rel.split(os.sep))
+        files = set(filenames)
+        bases = set()
+        for filename in filenames:
+            base, _, ext = filename.rpartition('.')
+            if ext == 'hdf5' or (ext == 'csv' and base + '.ini' in files):
+                bases.add(base)
+        indexed = index.indexedTimes(path)
+        datasets = []
+        names = set()
+        for base in sorted(bases):
+            name = filename_decode(base)
+            names.add(name)
+            filebase = os.path.join(dirpath, base)
+            try:
+                mtime = _mtime(filebase)
+                if indexed.get(name) == mtime:
+                    continue
+                title, created, labels, params = read_metadata(filebase)
+            except Exception:
+                log.err(None, 'Could not index {}'.format(filebase))
+                continue
+            datasets.append((name, title, created, labels, params, mtime))
+            read += 1
+        infofile = os.path.join(dirpath, 'session.ini')
+        tags_mtime = os.path.getmtime(infofile) if os.path.exists(infofile) else None
+        tags = _read_tags(infofile)
+        index.updateDirectory(path, datasets, tags, names, listed, tags_mtime)
+    return read
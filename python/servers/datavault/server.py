@@ -1,22 +1,28 @@
 from __future__ import absolute_import
 
 import collections
+import time
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import DeferredList, inlineCallbacks, returnValue
 import twisted.internet.task
+from twisted.python import log
 import numpy as np
 from labrad.server import LabradServer, Signal, setting
 
-from . import errors
+from instrumentation import InstrumentedServer
 
+from . import (CURSOR_PAGE_BYTES, STREAM_MAX_BYTES, STREAM_MAX_ROWS,
+               STREAM_MIN_INTERVAL, backend, cache, errors, search, util)
 
-class DataVault(LabradServer):
+
+class DataVault(InstrumentedServer):
     name = 'Data Vault'
 
     def __init__(self, session_store):
-        LabradServer.__init__(self)
+        InstrumentedServer.__init__(self)
 
         self.session_store = session_store
+        self.cursor_page_bytes = CURSOR_PAGE_BYTES
 
         # session signals
         self.onNewDir = Signal(543617, 'signal: new dir', 's')
@@ -27,11 +33,32 @@ class DataVault(LabradServer):
         self.onDataAvailable = Signal(543619, 'signal: data available', '')
         self.onNewParameter = Signal(543620, 'signal: new parameter', '')
         self.onCommentsAvailable = Signal(543621, 'signal: comments available', '')
+        self.onDataStreamed = Signal(543623, 'signal: data streamed',
+                                     '(w{first row}, w{rows}, s{dtype}, y{data})')
 
     def initServer(self):
         # create root session
         _root = self.session_store.get([''])
 
+    def stopServer(self):
+        InstrumentedServer.stopServer(self)
+        # make sure buffered data is on disk before we go away
+        return self.flushAll()
+
+    def flushAll(self):
+        """Write buffered data and session metadata to disk.
+
+        Returns a Deferred that fires when all writes have finished.
+        """
+        for session in self.session_store.get_all():
+            session.flush()
+        # as is the metadata of sessions that are gone
+        for info in list(self.session_store.unsaved_info.values()):
+            info.flush()
+        # datasets whose session is gone are only in the unwritten set
+        flushes = [dataset.flush() for dataset in list(self.session_store.unwritten)]
+        return DeferredList(flushes, consumeErrors=True)
+
     def contextKey(self, c):
         """The key used to identify a given context for notifications"""
         return c.ID
@@ -45,16 +72,14 @@ class DataVault(LabradServer):
 
     def expireContext(self, c):
         """Stop sending any signals to this context."""
-        key = self.contextKey(c)
-        def removeFromList(ls):
-            if key in ls:
-                ls.remove(key)
-        for session in self.session_store.get_all():
-            removeFromList(session.listeners)
-            for dataset in session.datasets.values():
-                removeFromList(dataset.listeners)
-                removeFromList(dataset.param_listeners)
-                removeFromList(dataset.comment_listeners)
+        self.session_store.subscriptions.expire(self.contextKey(c))
+        self.stopStream(c)
+        for cursor in c.get('cursors', {}).values():
+            cursor.close()
+        # data added in this context should not sit in a buffer indefinitely
+        if 'datasetObj' in c:
+            d = c['datasetObj'].flush()
+            d.addErrback(log.err, 'Failed to write buffered data')
 
     def getSession(self, c):
         """Get a session object for the current path."""
@@ -66,6 +91,18 @@ class DataVault(LabradServer):
             raise errors.NoDatasetError()
         return c['datasetObj']
 
+    def stopStream(self, c):
+        """Stop pushing rows of the current dataset to this context."""
+        if 'datasetObj' in c:
+            c['datasetObj'].stopStream(self.contextKey(c))
+
+    def getCursor(self, c, cursor):
+        """Get a cursor opened in this context."""
+        try:
+            return c.get('cursors', {})[cursor]
+        except KeyError:
+            raise errors.CursorNotFoundError(cursor)
+
     @setting(5, returns=['*s'])
     def dump_existing_sessions(self, c):
         return ['/'.join(session.path)
@@ -147,8 +184,9 @@ class DataVault(LabradServer):
     @setting(9, name='s',
                 independents=['*s', '*(ss)'],
                 dependents=['*s', '*(sss)'],
+                profile='s',
                 returns='(*s{path}, s{name})')
-    def new(self, c, name, independents, dependents):
+    def new(self, c, name, independents, dependents, profile=None):
         """Create a new Dataset.
 
         Independent and dependent variables can be specified either
@@ -158,10 +196,14 @@ class DataVault(LabradServer):
         or 'label (legend) [units]'.  Label is meant to be an
         axis label that can be shared among traces, while legend is
         a legend entry that should be unique for each trace.
+        The optional profile names the HDF5 storage profile (chunking,
+        compression and chunk cache) to use instead of the server default.
         Returns the path and name for this dataset.
         """
         session = self.getSession(c)
-        dataset = session.newDataset(name or 'untitled', independents, dependents)
+        dataset = session.newDataset(name or 'untitled', independents, dependents,
+                                     profile=profile)
+        self.stopStream(c)
         c['dataset'] = dataset.name # not the same as name; has number prefixed
         c['datasetObj'] = dataset
         c['filepos'] = 0 # start at the beginning
@@ -172,8 +214,9 @@ class DataVault(LabradServer):
     @setting(1009, name='s', 
              independents='*(s*iss)',
              dependents='*(ss*iss)',
+             profile='s',
              returns=['*ss'])
-    def new_ex(self, c, name, independents, dependents):
+    def new_ex(self, c, name, independents, dependents, profile=None):
         """Create a new extended dataset
 
         Independents are specified as: (label, shape, type, unit)
@@ -190,7 +233,13 @@ class DataVault(LabradServer):
             s:          string.  The string must be plain ASCII or UTF-8 encoded 
                         unicode (until labrad has native unicode support)
                         Arbitrary binary data is *not* supported.
-            t:          Timestamp
+            sN:         string of at most N bytes, e.g. s32.  These are
+                        stored in fixed-width columns, which are much
+                        faster to read and write than variable-length
+                        strings.  The column shows up with type s.
+            t:          Timestamp, stored and read back as microseconds
+                        since 1970-01-01.  Rows may also be added with
+                        datetime objects.
         unit is the unit of the column.  Only applies for types 'v' and 'c'.
             It *must* be an empty string ('') for i,s,t datatypes
 
@@ -199,9 +248,18 @@ class DataVault(LabradServer):
         code.  The name and parameters will be there, but no actual data.
 
         The legacy format requires each column be a scalar v[unit] type.
+
+        profile optionally selects the HDF5 storage profile for this dataset:
+            legacy:     unspecified chunking, no compression (old behavior)
+            default:    ~64 kB chunks sized from the row size, no compression
+            lzf:        larger chunks with shuffle + lzf compression (fast)
+            gzip:       larger chunks with shuffle + gzip compression (small)
+        If not given, the server-wide profile from the registry is used.
         """
         session = self.getSession(c)
-        dataset = session.newDataset(name, independents, dependents, extended=True)
+        dataset = session.newDataset(name, independents, dependents, extended=True,
+                                     profile=profile)
+        self.stopStream(c)
         c['dataset'] = dataset.name # not the same as name; has number prefixed
         c['datasetObj'] = dataset
         c['filepos'] = 0 # start at the beginning
@@ -218,15 +276,45 @@ class DataVault(LabradServer):
         """
         session = self.getSession(c)
         dataset = session.openDataset(name)
+        self.stopStream(c)
         c['dataset'] = dataset.name # not the same as name; has number prefixed
         c['datasetObj'] = dataset
         c['filepos'] = 0
         c['commentpos'] = 0
         c['writing'] = append
         key = self.contextKey(c)
-        dataset.keepStreaming(key, 0)
-        dataset.keepStreamingComments(key, 0)
-        return c['path'], c['dataset']
+        yield dataset.keepStreaming(key, 0)
+        yield dataset.keepStreamingComments(key, 0)
+        returnValue((c['path'], c['dataset']))
+
+    @setting(1011, returns='*s')
+    def storage_profiles(self, c):
+        """Get the names of the available HDF5 storage profiles."""
+        return sorted(backend.STORAGE_PROFILES)
+
+    @setting(1012, returns='*(sw)')
+    def file_pool_stats(self, c):
+        """Get usage counts of the pool of open data files.
+
+        Returns (name, value) pairs: the number of files open now and the
+        most that are kept open, and how many times an open file was used
+        again (hits), a file had to be opened (misses), a file was closed
+        to make room for another (evictions) or because it was not used for
+        a while (timeouts).
+        """
+        return backend.get_file_pool().stats()
+
+    @setting(1013, returns='*(sv)')
+    def block_cache_stats(self, c):
+        """Get usage counts of the block cache shared by all datasets.
+
+        Returns (name, value) pairs: the number of cached blocks, the bytes
+        they take up and the most that are kept, how many block lookups
+        were served from memory (hits) or had to read the file (misses),
+        the fraction of lookups that were hits and how many blocks were
+        dropped to stay within the byte budget (evictions).
+        """
+        return cache.get_block_cache().stats()
 
     @setting(1010, returns='s')
     def get_version(self, c):
@@ -256,7 +344,7 @@ class DataVault(LabradServer):
         # fromarrays is faster than fromrecords, and when we have a simple 2-D array
         # we can just transpose the array.
         rec_data = np.core.records.fromarrays(data.T, dtype=dataset.data.dtype)
-        dataset.addData(rec_data)
+        return dataset.addData(rec_data)
 
     @setting(1020, data='?', returns='')
     def add_ex(self, c, data):
@@ -272,8 +360,12 @@ class DataVault(LabradServer):
         dataset = self.getDataset(c)
         if not c['writing']:
             raise errors.ReadOnlyError()
-        list_data = [tuple(row) for row in data]
-        dataset.addData(np.core.records.fromrecords(list_data, dtype=dataset.data.dtype))
+        try:
+            records = backend.records_from_rows(
+                    data, dataset.data.dtype, dataset.data.getColumnTypes())
+        except ValueError as e:
+            raise errors.BadColumnDataError(str(e))
+        return dataset.addData(records)
 
     @setting(2020, data='?', returns='')
     def add_ex_t(self, c, data):
@@ -286,7 +378,44 @@ class DataVault(LabradServer):
         dataset = self.getDataset(c)
         if not c['writing']:
             raise errors.ReadOnlyError()
-        dataset.addData(np.core.records.fromarrays(data, dtype=dataset.data.dtype))
+        try:
+            records = backend.records_from_columns(
+                    data, dataset.data.dtype, dataset.data.getColumnTypes())
+        except ValueError as e:
+            raise errors.BadColumnDataError(str(e))
+        return dataset.addData(records)
+
+    @setting(3020, data='y', dtype='s', returns='')
+    def add_raw(self, c, data, dtype):
+        """Add data to the current dataset as a block of raw bytes.
+
+        data holds the rows packed back to back, in the layout given by
+        dtype, a numpy type string with one field per column, such as
+        '<f8,<i8,(2,)<c16' (see get_raw).  A single scalar type, such as
+        '<f8', is used for every column.  If the layout matches the
+        dataset, the bytes are stored without any per-row conversion, so
+        this is the fastest way to add large blocks of data.  String
+        columns cannot be added this way.
+        """
+        dataset = self.getDataset(c)
+        if not c['writing']:
+            raise errors.ReadOnlyError()
+        try:
+            records = util.records_from_bytes(data, dtype, dataset.data.dtype)
+        except ValueError as e:
+            raise errors.BadRawDataError(str(e))
+        return dataset.addData(records)
+
+    @setting(22, returns='')
+    def flush(self, c):
+        """Write data buffered for the current dataset to disk.
+
+        Data added with add, add_ex and add_ex_t is buffered in memory and
+        written in batches.  It is visible to readers right away either way;
+        flush only forces it onto the disk now.
+        """
+        dataset = self.getDataset(c)
+        return dataset.flush()
 
     @setting(21, limit='w', startOver='b', returns='*2v')
     def get(self, c, limit=None, startOver=False):
@@ -296,14 +425,15 @@ class DataVault(LabradServer):
         the default being to return the whole dataset.  Setting the
         startOver flag to true will return data starting at the beginning
         of the dataset.  By default, only new data that has not been seen
-        in this context is returned.
+        in this context is returned.  To read a very large dataset without
+        holding all of it in memory, use open_cursor instead.
         """
         dataset = self.getDataset(c)
         c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], simpleOnly=True)
+        data, c['filepos'] = yield dataset.getData(limit, c['filepos'], simpleOnly=True)
         key = self.contextKey(c)
-        dataset.keepStreaming(key, c['filepos'])
-        return data
+        yield dataset.keepStreaming(key, c['filepos'])
+        returnValue(data)
 
     @setting(1021, limit='w', startOver='b', returns='?')
     def get_ex(self, c, limit=None, startOver=False):
@@ -316,10 +446,10 @@ class DataVault(LabradServer):
         """
         dataset = self.getDataset(c)
         c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], transpose=False)
+        data, c['filepos'] = yield dataset.getData(limit, c['filepos'], transpose=False)
         ctx = self.contextKey(c)
-        dataset.keepStreaming(ctx, c['filepos'])
-        return data
+        yield dataset.keepStreaming(ctx, c['filepos'])
+        returnValue(data)
 
     @setting(2021, limit='w', startOver='b', returns='?')
     def get_ex_t(self, c, limit=None, startOver=False):
@@ -334,10 +464,164 @@ class DataVault(LabradServer):
         """
         dataset = self.getDataset(c)
         c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], transpose=True)
+        data, c['filepos'] = yield dataset.getData(limit, c['filepos'], transpose=True)
+        ctx = self.contextKey(c)
+        yield dataset.keepStreaming(ctx, c['filepos'])
+        returnValue(data)
+
+    @setting(3021, limit='w', startOver='b', returns='(sy)')
+    def get_raw(self, c, limit=None, startOver=False):
+        """Get data from the current dataset as a block of raw bytes.
+
+        Reads rows like get_ex and returns (dtype, data), where data holds
+        the rows packed back to back in the layout given by dtype, a numpy
+        type string such as '<f8,<i8,(2,)<c16'.  With numpy,
+        np.frombuffer(data, np.dtype(dtype)) gives the rows as a record
+        array.  Datasets with string columns cannot be read this way.
+        """
+        dataset = self.getDataset(c)
+        c['filepos'] = 0 if startOver else c['filepos']
+        records, pos = yield dataset.getRecords(limit, c['filepos'])
+        try:
+            descriptor = util.dtype_descriptor(records.dtype)
+        except ValueError as e:
+            raise errors.BadRawDataError(str(e))
+        c['filepos'] = pos
         ctx = self.contextKey(c)
-        dataset.keepStreaming(ctx, c['filepos'])
-        return data
+        yield dataset.keepStreaming(ctx, c['filepos'])
+        returnValue((descriptor, records.tostring()))
+
+    @setting(30, max_rows='w', max_bytes='w', summary='b', min_interval='v[s]',
+             returns='')
+    def stream_data(self, c, max_rows=STREAM_MAX_ROWS, max_bytes=STREAM_MAX_BYTES,
+                    summary=False, min_interval=None):
+        """Push rows added to the current dataset to this context.
+
+        Instead of an empty 'data available' signal, after which the client
+        calls get, rows added from now on are sent in 'data streamed'
+        signals as (first row, rows, dtype, data), with the rows packed as
+        in get_raw.  Rows added in quick succession are sent together, in
+        messages of at most max_rows rows and max_bytes bytes of row data.
+        If more rows came in than fit in a message, only the newest ones are
+        sent or, if summary is set, a selection holding the minimum and
+        maximum of each numeric column over the rows, for plotting.  rows
+        tells how many rows of the dataset a message stands for, so rows
+        that were left out can be read with get_selection.  Messages are at
+        least min_interval apart (by default 50 ms), and rows added in
+        between are sent together in the next message.  Streaming stops
+        with stop_stream or when another dataset is opened in this context.
+        Datasets with string columns cannot be streamed.
+        """
+        dataset = self.getDataset(c)
+        if min_interval is None:
+            min_interval = STREAM_MIN_INTERVAL
+        else:
+            min_interval = min_interval['s']
+        yield dataset.startStream(self.contextKey(c), max_rows, max_bytes, summary,
+                                  min_interval)
+
+    @setting(31, returns='')
+    def stop_stream(self, c):
+        """Stop pushing rows of the current dataset to this context."""
+        self.getDataset(c)
+        self.stopStream(c)
+
+    @setting(28, columns=['*w', '*s'], start='w', stop='w', step='w',
+             returns='*2v')
+    def get_selection(self, c, columns=None, start=0, stop=None, step=1):
+        """Get some of the columns of a range of rows of the current dataset.
+
+        Columns are given as a list of column indices or labels, where
+        dependents can also be named 'label (legend)'.  By default all
+        columns are returned.  Rows start, start+step, ... up to but not
+        including row stop are returned, where the default stop is the
+        end of the dataset.  Only the selected data is read from disk.
+        This does not change the position used by get.
+        """
+        dataset = self.getDataset(c)
+        data, _pos = yield dataset.getSelection(columns, start, stop, step,
+                                                simpleOnly=True)
+        returnValue(data)
+
+    @setting(1028, columns=['*w', '*s'], start='w', stop='w', step='w',
+             returns='?')
+    def get_selection_ex(self, c, columns=None, start=0, stop=None, step=1):
+        """Get a selection of data as in get_selection, in the format of get_ex."""
+        dataset = self.getDataset(c)
+        data, _pos = yield dataset.getSelection(columns, start, stop, step,
+                                                transpose=False)
+        returnValue(data)
+
+    @setting(2028, columns=['*w', '*s'], start='w', stop='w', step='w',
+             returns='?')
+    def get_selection_ex_t(self, c, columns=None, start=0, stop=None, step=1):
+        """Get a selection of data as in get_selection, in the format of get_ex_t."""
+        dataset = self.getDataset(c)
+        data, _pos = yield dataset.getSelection(columns, start, stop, step,
+                                                transpose=True)
+        returnValue(data)
+
+    @setting(29, x=['w', 's'], y=['w', 's'], points='w', start='w',
+             stop='w', method='s', returns='*2v')
+    def get_decimated(self, c, x, y, points=2000, start=0, stop=None,
+                      method='minmax'):
+        """Get a downsampled curve of column y against column x for plotting.
+
+        Rows start up to stop (the end of the dataset by default) are
+        reduced to at most the given number of (x, y) points.  With the
+        'minmax' method the rows are split into points/2 buckets and the
+        minimum and maximum of each bucket are returned, which keeps every
+        peak visible.  With 'lttb' the points are picked by the
+        Largest-Triangle-Three-Buckets algorithm.  Columns are given by
+        index or label as in get_selection, and must hold numbers.
+        Zoomed-out views of large datasets are served from aggregates that
+        are kept up to date as data is added.
+        """
+        dataset = self.getDataset(c)
+        return dataset.getDecimated(x, y, points, start, stop, method)
+
+    @setting(25, page_rows='w', start='w', returns='w')
+    def open_cursor(self, c, page_rows=None, start=0):
+        """Open a cursor to read the current dataset a page at a time.
+
+        Each page has at most page_rows rows, starting from row start.
+        Pages are also capped in size (4 MiB by default), so the server
+        never has to hold more than a couple of pages of a huge dataset in
+        memory at once.  Read pages with cursor_next, cursor_next_ex or
+        cursor_next_ex_t and close the cursor when done.  Returns the
+        cursor ID.
+        """
+        dataset = self.getDataset(c)
+        cursors = c.setdefault('cursors', {})
+        c['nextCursor'] = c.get('nextCursor', 0) + 1
+        cursors[c['nextCursor']] = dataset.openCursor(
+                page_rows, start, max_bytes=self.cursor_page_bytes)
+        return c['nextCursor']
+
+    @setting(26, cursor='w', returns='*2v')
+    def cursor_next(self, c, cursor):
+        """Get the next page of data from a cursor.
+
+        Data is returned in the same format as get.  An empty page means
+        that the cursor has reached the end of the dataset for now.
+        """
+        return self.getCursor(c, cursor).next(simpleOnly=True)
+
+    @setting(1026, cursor='w', returns='?')
+    def cursor_next_ex(self, c, cursor):
+        """Get the next page of data from a cursor in the format of get_ex."""
+        return self.getCursor(c, cursor).next(transpose=False)
+
+    @setting(2026, cursor='w', returns='?')
+    def cursor_next_ex_t(self, c, cursor):
+        """Get the next page of data from a cursor in the format of get_ex_t."""
+        return self.getCursor(c, cursor).next(transpose=True)
+
+    @setting(27, cursor='w', returns='')
+    def close_cursor(self, c, cursor):
+        """Close a cursor opened with open_cursor."""
+        self.getCursor(c, cursor).close()
+        del c['cursors'][cursor]
 
     @setting(100, returns='(*(ss){independents}, *(sss){dependents})')
     def variables(self, c):
@@ -398,13 +682,13 @@ class DataVault(LabradServer):
     def add_parameter(self, c, name, data):
         """Add a new parameter to the current dataset."""
         dataset = self.getDataset(c)
-        dataset.addParameter(name, data)
+        yield dataset.addParameter(name, data)
 
     @setting(124, 'add parameters', params='?{((s?)(s?)...)}', returns='')
     def add_parameters(self, c, params):
         """Add a new parameter to the current dataset."""
         dataset = self.getDataset(c)
-        dataset.addParameters(params)
+        yield dataset.addParameters(params)
 
 
     @setting(126, 'get name', returns='s')
@@ -429,12 +713,11 @@ class DataVault(LabradServer):
         are not allowed).
         """
         dataset = self.getDataset(c)
-        names = dataset.getParamNames()
-        params = tuple((name, dataset.getParameter(name)) for name in names)
         key = self.contextKey(c)
         dataset.param_listeners.add(key) # send a message when new parameters are added
+        params = yield dataset.getParameters()
         if len(params):
-            return params
+            returnValue(tuple(params))
 
     @setting(200, 'add comment', comment=['s'], user=['s'], returns=[''])
     def add_comment(self, c, comment, user='anonymous'):
@@ -448,10 +731,10 @@ class DataVault(LabradServer):
         """Get comments for the current dataset."""
         dataset = self.getDataset(c)
         c['commentpos'] = 0 if startOver else c['commentpos']
-        comments, c['commentpos'] = dataset.getComments(limit, c['commentpos'])
+        comments, c['commentpos'] = yield dataset.getComments(limit, c['commentpos'])
         key = self.contextKey(c)
-        dataset.keepStreamingComments(key, c['commentpos'])
-        return comments
+        yield dataset.keepStreamingComments(key, c['commentpos'])
+        returnValue(comments)
 
     @setting(300, 'update tags', tags=['s', '*s'],
                   dirs=['s', '*s'], datasets=['s', '*s'],
@@ -489,12 +772,44 @@ class DataVault(LabradServer):
             datasets = [datasets]
         return sess.getTags(dirs, datasets)
 
+    @setting(310, 'search', text='s', tags=['s', '*s'], params='*(ss)',
+                  after='t', before='t', here='b', limit='w',
+                  returns='*(*s{path}, s{name})')
+    def search(self, c, text='', tags=[], params=[], after=None, before=None,
+               here=False, limit=search.SEARCH_LIMIT):
+        """Find datasets anywhere in the data vault.
+
+        text is matched against the words of dataset titles and names,
+        variable labels, parameter names and values, and tags.  It can use
+        the SQLite full-text query syntax, such as 'rabi OR ramsey' or
+        'qubit*'.  A dataset must have each of the given tags, except for
+        tags that start with '-', which it must not have.  params is a list
+        of (name, value) pairs that must match exactly, where an empty value
+        matches any value.  after and before limit the creation time.  If
+        here is set, only the current directory and its subdirectories are
+        searched.  Returns (path, name) for up to limit datasets, newest
+        first; cd to the path and open the name to read one.
+        """
+        index = self.session_store.search_index
+        if index is None:
+            raise errors.SearchUnavailableError()
+        if isinstance(tags, str):
+            tags = [tags]
+        if after is not None:
+            after = time.mktime(after.timetuple())
+        if before is not None:
+            before = time.mktime(before.timetuple())
+        under = c['path'] if here else None
+        return index.search(text, tags, params, after, before, under, limit)
+
 
 class DataVaultMultiHead(DataVault):
     """Data Vault server with additional settings for running multi-headed.
 
     One instance will be created for each manager we connect to, and new
     instances will be created when we reconnect after losing a connection.
+    The hub is a hub.SignalHub, which sends the signals of all instances
+    and is told about the keepalives of each.
     """
 
     def __init__(self, host, port, password, hub, session_store):
@@ -518,14 +833,20 @@ class DataVaultMultiHead(DataVault):
         # stopServer is only called when the whole application shuts down.
         # We need to manually use the onShutdown() callback
         self.keepalive_timer.stop()
+        self.hub.disconnect(self)
 
     @inlineCallbacks
     def keepalive(self):
         print "sending keepalive to {}:{}".format(self.host, self.port)
+        self.hub.keepaliveSent(self)
         try:
             yield self.client.manager.echo('ping')
         except:
-            pass # We don't care about errors, dropped connections will be recognized automatically
+            # dropped connections will be recognized automatically, but
+            # signals are held back until the manager answers again
+            self.hub.keepaliveFailed(self)
+        else:
+            self.hub.keepaliveAnswered(self)
 
     def contextKey(self, c):
         return ExtendedContext(self, c.ID)
@@ -569,6 +890,17 @@ class DataVaultMultiHead(DataVault):
     def refresh_managers(self, c):
         return self.hub.refresh_managers()
 
+    @setting(407, 'Signal Stats', returns='*(s{host}w{port}b{stalled}w{queued}w{sent}w{merged}w{dropped})')
+    def signal_stats(self, c):
+        """Get the signals sent through each manager.
+
+        Counts are of contexts.  A stalled manager has not answered a
+        keepalive in time, and its signals are queued until it does;
+        merged signals were identical to one already queued, and dropped
+        ones were queued for too long a stall.
+        """
+        return self.hub.stats()
+
 class ExtendedContext(object):
     '''
     This is an extended context that contains the manager.  This prevents
@@ -0,0 +1,121 @@
+"""Which contexts listen for which signals, and batched delivery of signals.
+
+Sessions and datasets keep the contexts that want to hear about changes in
+Listeners sets.  The SubscriptionRegistry that creates them also keeps, for
+each context, the sets it is in, so that a context can be dropped from all
+of them when it expires without looking at every session and dataset.
+
+The dataset signals carry no data, so there is no point in sending one to
+a context more than once per reactor turn.  notify queues the contexts of
+a signal and sends the signal once to all of them on the next turn of the
+reactor, however many rows or comments were added in the meantime.
+"""
+
+import collections
+
+from twisted.internet import reactor
+from twisted.python import log
+
+
+class Listeners(set):
+    """A set of context keys kept in step with a SubscriptionRegistry.
+
+    Only add, remove, discard and clear update the registry; other set
+    methods that change the set must not be used.
+    """
+
+    def __init__(self, registry):
+        set.__init__(self)
+        self._registry = registry
+
+    def add(self, context):
+        set.add(self, context)
+        self._registry._subscribed(context, self)
+
+    def remove(self, context):
+        set.remove(self, context)
+        self._registry._unsubscribed(context, self)
+
+    def discard(self, context):
+        if context in self:
+            self.remove(context)
+
+    def clear(self):
+        for context in self:
+            self._registry._unsubscribed(context, self)
+        set.clear(self)
+
+    def take(self):
+        """Remove all contexts, returning them as a plain set."""
+        contexts = set(self)
+        self.clear()
+        return contexts
+
+
+class SubscriptionRegistry(object):
+    """Indexes Listeners sets by context and batches signals."""
+
+    def __init__(self, reactor=reactor):
+        self.reactor = reactor
+        self._subscriptions = {} # context -> {id(listeners): listeners}
+        self._queued = collections.OrderedDict() # signal -> set of contexts
+        self._send_call = None
+        self.signals_sent = 0 # signals passed on to the hub, one per context
+
+    def listeners(self):
+        """A new, empty Listeners set."""
+        return Listeners(self)
+
+    def _subscribed(self, context, listeners):
+        self._subscriptions.setdefault(context, {})[id(listeners)] = listeners
+
+    def _unsubscribed(self, context, listeners):
+        subscribed = self._subscriptions.get(context)
+        if subscribed is not None:
+            subscribed.pop(id(listeners), None)
+            if not subscribed:
+                del self._subscriptions[context]
+
+    def numSubscriptions(self, context):
+        """The number of Listeners sets that context is in."""
+        return len(self._subscriptions.get(context, ()))
+
+    def expire(self, context):
+        """Drop a context from all Listeners sets and queued signals."""
+        for listeners in self._subscriptions.pop(context, {}).values():
+            set.discard(listeners, context)
+        for contexts in self._queued.values():
+            contexts.discard(context)
+
+    def notify(self, signal, listeners):
+        """Signal all contexts in a Listeners set on the next reactor turn.
+
+        The contexts are removed from the set; they have to subscribe again
+        to hear about later changes.
+        """
+        self.send(signal, listeners.take())
+
+    def send(self, signal, contexts):
+        """Queue a signal without data for some contexts."""
+        if not contexts:
+            return
+        self._queued.setdefault(signal, set()).update(contexts)
+        if self._send_call is None:
+            self._send_call = self.reactor.callLater(0, self.flush)
+
+    def flush(self):
+        """Send all queued signals now."""
+        if self._send_call is not None:
+            if self._send_call.active():
+                self._send_call.cancel()
+            self._send_call = None
+        queued = self._queued
+        self._queued = collections.OrderedDict()
+        for signal, contexts in queued.items():
+            if not contexts:
+                continue
+            self.signals_sent += len(contexts)
+            try:
+                signal(None, contexts)
+            except Exception:
+                log.err(None, 'Failed to send signal')
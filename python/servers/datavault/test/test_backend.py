@@ -14,7 +14,7 @@ from labrad import units as U
 
 from twisted.internet import task
 
-from datavault import backend, errors
+from datavault import backend, cache, errors, util
 
 
 def _unique_filename(suffix='.hdf5'):
@@ -132,6 +132,133 @@ class SelfClosingFileTest(_TestCase):
         self.assertTrue(self.close_callback_called,
                     msg='Registered callback not called!')
 
+    def test_held_file_stays_open(self):
+        self.file.hold()
+        self.clock.advance(3 * self.close_timeout_sec)
+        self.assertTrue(self.opener.file.is_open,
+                    msg='Held file closed after timeout')
+        self.file.release()
+        self.clock.advance(self.close_timeout_sec)
+        self.assertFalse(self.opener.file.is_open,
+                    msg='File not closed after release')
+
+
+class FileHandlePoolTest(_TestCase):
+    """Tests for the FileHandlePool."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.pool = backend.FileHandlePool(max_open=2, reactor=self.clock)
+        self.closed = []
+        self.openers = [_MockFileOpener() for i in range(4)]
+        self.files = []
+        for opener in self.openers:
+            fh = backend.SelfClosingFile(opener=opener, timeout=10, touch=False,
+                                         reactor=self.clock, pool=self.pool)
+            fh.onClose(self.closed.append)
+            self.files.append(fh)
+
+    def stats(self):
+        return dict(self.pool.stats())
+
+    def test_least_recently_used_file_is_evicted(self):
+        a, b, c, d = self.files
+        a()
+        b()
+        a()
+        c()
+        self.assertEqual([b], self.closed)
+        self.assertTrue(self.openers[0].file.is_open)
+        self.assertFalse(self.openers[1].file.is_open)
+        self.assertEqual(2, len(self.pool))
+        self.assertEqual({'open': 2, 'max open': 2, 'hits': 1, 'misses': 3,
+                          'evictions': 1, 'timeouts': 0}, self.stats())
+        # an evicted file is opened again on demand
+        b()
+        self.assertEqual([b, a], self.closed)
+        self.assertTrue(self.openers[1].file.is_open)
+
+    def test_held_files_are_not_evicted(self):
+        a, b, c, d = self.files
+        a.hold()
+        b.hold()
+        c()
+        self.assertEqual([], self.closed)
+        self.assertEqual(3, len(self.pool))
+        a.release()
+        d()
+        self.assertEqual([c, a], self.closed)
+        self.assertEqual(2, len(self.pool))
+
+    def test_single_timer_closes_idle_files(self):
+        pool = backend.FileHandlePool(max_open=100, reactor=self.clock)
+        files = []
+        for i in range(50):
+            fh = backend.SelfClosingFile(opener=_MockFileOpener(), timeout=10,
+                                         reactor=self.clock, pool=pool)
+            files.append(fh)
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.clock.advance(5)
+        files[0]()
+        self.assertEqual(50, len(pool))
+        self.clock.advance(5)
+        # files 1 to 49 were last used 10 seconds ago
+        self.assertEqual(1, len(pool))
+        self.assertEqual(49, dict(pool.stats())['timeouts'])
+        self.clock.advance(5)
+        self.assertEqual(0, len(pool))
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_close_removes_file_from_pool(self):
+        a = self.files[0]
+        a()
+        a.close()
+        self.assertEqual([a], self.closed)
+        self.assertEqual(0, len(self.pool))
+        a.close()
+        self.assertEqual([a], self.closed)
+
+
+class StorageProfileTest(_TestCase):
+    """Tests for choosing the HDF5 layout from a storage profile."""
+
+    def test_get_default_profile(self):
+        self.assertEqual(
+                backend.STORAGE_PROFILES[backend.DEFAULT_STORAGE_PROFILE],
+                backend.get_storage_profile(None))
+
+    def test_get_profile_passes_through_profile_objects(self):
+        profile = backend.StorageProfile(1024, None, None, False, None, None, None, None)
+        self.assertIs(profile, backend.get_storage_profile(profile))
+
+    def test_get_unknown_profile(self):
+        self.assertRaises(
+                errors.BadStorageProfileError,
+                backend.get_storage_profile,
+                'no such profile')
+
+    def test_chunk_rows_from_row_size(self):
+        profile = backend.StorageProfile(1024, None, None, False, None, None, None, None)
+        self.assertEqual(128, backend.chunk_rows([('f0', '<f8')], profile))
+        dtype = [('f0', '<f8'), ('f1', '<f8'), ('f2', '<c16', (2, 2))]
+        self.assertEqual(12, backend.chunk_rows(dtype, profile))
+        # rows bigger than a whole chunk still get one row per chunk
+        self.assertEqual(1, backend.chunk_rows([('f0', '<f8', (1000,))], profile))
+
+    def test_legacy_profile_options(self):
+        self.assertEqual({}, backend.dataset_options('f8', 'legacy'))
+        self.assertEqual({}, backend.file_options('legacy'))
+
+    def test_compressed_profile_options(self):
+        options = backend.dataset_options([('f0', '<f8')], 'gzip')
+        self.assertEqual('gzip', options['compression'])
+        self.assertTrue(options['shuffle'])
+        self.assertEqual(1, len(options['chunks']))
+        file_options = backend.file_options('gzip')
+        self.assertEqual(
+                backend.STORAGE_PROFILES['gzip'].cache_bytes,
+                file_options['rdcc_nbytes'])
+
 
 # Dependent and Independent variables used for testing IniData and HDF5MetaData.
 _INDEPENDENTS = [
@@ -219,6 +346,17 @@ class _MetadataTest(_TestCase):
                 data.addParam,
                 'Param1', param)
 
+    def test_add_params(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        data.addParams([('a', 1), ('b', 'two')])
+        self.assertEqual(['a', 'b'], data.getParamNames())
+        self.assertEqual('two', data.getParameter('b'))
+        # nothing is added if any of the names is in use
+        for params in [[('c', 3), ('a', 4)], [('c', 3), ('c', 4)]]:
+            self.assertRaises(errors.ParameterInUseError, data.addParams, params)
+            self.assertEqual(['a', 'b'], data.getParamNames())
+
     def test_add_comment(self):
         data = self.get_data()
         data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
@@ -401,25 +539,66 @@ c1=('2012-09-25, 03:14:15','fizz','buzz')
                 data.getTransposeType(), '(*v[Ghz],*v[Kelvin],*v[Dollars])')
 
 
-class _MockAttrs(dict):
-    """Mock Attributes class for use in the _MockDataset."""
-    def create(self, name, data, dtype):
-        self[name] = np.asarray(data, dtype=dtype)
-
-
-class _MockDataset(object):
-    """Mock Dataset class to use in the HDF5MetaDataTest."""
-    def __init__(self):
-        self.attrs = _MockAttrs()
-
-
 class HDF5MetaDataTest(_MetadataTest):
 
     def get_data(self):
+        f = h5py.File(_unique_filename(), 'w', driver='core', backing_store=False)
+        self.addCleanup(f.close)
         data = backend.HDF5MetaData()
-        data.dataset = _MockDataset()
+        data.dataset = f.create_dataset('DataVault', (0,), dtype=np.float64)
         return data
 
+    def test_odd_parameter_names(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        names = ['a/b', '.', '..', '%2E', 'with space']
+        for i, name in enumerate(names):
+            data.addParam(name, i)
+        self.assertEqual(names, data.getParamNames())
+        for i, name in enumerate(names):
+            self.assertEqual(i, data.getParameter(name))
+
+    def test_parameters_are_also_attributes(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        data.addParams([('b', 1), ('a', 'two')])
+        # older readers find the parameters in the attributes
+        attrs = data.dataset.attrs
+        self.assertEqual(1, backend.labrad_urldecode(attrs['Param.b']))
+        self.assertEqual('two', backend.labrad_urldecode(attrs['Param.a']))
+        self.assertEqual(['b', 'a'], data.getParamNames())
+
+    def test_comments_are_not_stored_in_an_attribute(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        for i in xrange(3):
+            data.addComment('user', 'comment {}'.format(i))
+        self.assertEqual(0, len(data.dataset.attrs['Comments']))
+        self.assertEqual(3, len(data.dataset.file['Comments']))
+
+    def test_read_legacy_comments_and_parameters(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        # how older versions stored comments and parameters
+        attrs = data.dataset.attrs
+        old_comments = [(1e9, 'old user', 'old 0'), (1e9 + 1, 'old user', 'old 1')]
+        attrs.create('Comments', np.array(old_comments, dtype=data.comment_type),
+                     dtype=data.comment_type)
+        attrs['Param.Old'] = backend.labrad_urlencode(1.5)
+
+        data.addComment('new user', 'new 0')
+        data.addParam('New', 2.5)
+        self.assertRaises(errors.ParameterInUseError, data.addParam, 'Old', 0)
+        self.assertEqual(3, data.numComments())
+        comments, pos = data.getComments(2, 1)
+        self.assertEqual(3, pos)
+        self.assertEqual([('old user', 'old 1'), ('new user', 'new 0')],
+                         [c[1:] for c in comments])
+        self.assertEqual(datetime.datetime.fromtimestamp(1e9 + 1), comments[0][0])
+        self.assertEqual(['Old', 'New'], data.getParamNames())
+        self.assertEqual(1.5, data.getParameter('old', case_sensitive=False))
+        self.assertEqual(2.5, data.getParameter('New'))
+
 
 class _BackendDataTestCase(_TestCase):
     def assert_data_in_backend(self, backend_data, expected_data):
@@ -496,6 +675,18 @@ class CsvListDataTest(_BackendDataTestCase):
         self.assertRaises(
                errors.BadDataError, self.data.addData, [(1, 2, 3, 4)])
 
+    def test_get_selection(self):
+        self.data.addData([[i, 10 * i, 100 * i] for i in range(5)])
+        read_data, next_pos = self.data.getSelection([2, 0], 1, None, 2, False, None)
+        self.assertEqual(read_data, [[100, 1], [300, 3]])
+        self.assertEqual(next_pos, 5)
+
+    def test_add_records(self):
+        # the server passes rows on as a record array
+        self.data.addData(np.core.records.fromarrays(
+                [[1, 4], [2, 5], [3, 6]], dtype=self.data.dtype))
+        self.assert_data_in_backend(self.data, [[1, 2, 3], [4, 5, 6]])
+
 
 class _BackendDataTest(_BackendDataTestCase):
     """Base tests for data backends."""
@@ -567,6 +758,38 @@ class _BackendDataTest(_BackendDataTestCase):
                None)
 
 
+    def test_get_selection(self):
+        data_to_add = np.recarray(
+            (10, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        for i in range(10):
+            data_to_add[i] = (i, 10 * i, 100 * i)
+        self.data.addData(data_to_add)
+        # HDF5 backends read big selections in blocks
+        self.data.READ_BLOCK_ROWS = 2
+
+        read_data, next_pos = self.data.getSelection([2, 0], 1, 8, 3, False, None)
+        self.assert_arrays_equal(read_data, [[100, 1], [400, 4], [700, 7]])
+        self.assertEqual(next_pos, 10)
+        # same thing with strided reads in HDF5
+        self.data.MIN_HYPERSLAB_STRIDE = 2
+        read_data, next_pos = self.data.getSelection([2, 0], 1, 8, 3, False, None)
+        self.assert_arrays_equal(read_data, [[100, 1], [400, 4], [700, 7]])
+        self.assertEqual(next_pos, 10)
+
+        read_data, next_pos = self.data.getSelection([1], 7, None, 1, False, None)
+        self.assert_arrays_equal(read_data, [[70], [80], [90]])
+        self.assertEqual(next_pos, 10)
+
+        read_data, next_pos = self.data.getSelection(None, 0, 4, 2, False, None)
+        self.assert_arrays_equal(read_data, [[0, 0, 0], [2, 20, 200]])
+        self.assertEqual(next_pos, 4)
+
+        read_data, next_pos = self.data.getSelection([0], 10, None, 1, False, None)
+        self.assertEqual(len(read_data), 0)
+        self.assertEqual(next_pos, 10)
+
+
 class CsvNumpyDataTest(_BackendDataTest):
 
     def setUp(self):
@@ -581,6 +804,7 @@ class CsvNumpyDataTest(_BackendDataTest):
         for name in self.files_to_remove:
             _remove_file_if_exists(name)
             _remove_file_if_exists(name[:-4] + '.ini')
+            _remove_file_if_exists(name[:-4] + '.idx')
 
 
     def get_backend_data(self, filename):
@@ -598,6 +822,122 @@ class CsvNumpyDataTest(_BackendDataTest):
         self.assertRaises(
                errors.BadDataError, self.data.addData, [(1, 2, 3, 4)])
 
+    def _add_rows(self, data, rows):
+        records = np.recarray(
+            (rows, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        for i in range(rows):
+            records[i] = (i, 10 * i, 0.5 * i)
+        data.addData(records)
+        return np.column_stack((records.f0, records.f1, records.f2))
+
+    def test_read_rows_through_index(self):
+        self.data.index.stride = 4
+        expected = self._add_rows(self.data, 30)
+        self.data.save()
+
+        data = self.get_backend_data(self.filename)
+        data.load()
+        data.index.stride = 4
+        for limit, start in [(5, 0), (3, 4), (6, 9), (10, 25), (None, 13)]:
+            read_data, next_pos = data.getData(limit, start, False, None)
+            stop = 30 if limit is None else min(start + limit, 30)
+            self.assert_arrays_equal(read_data, expected[start:stop])
+            self.assertEqual(next_pos, stop)
+        # rows were read without loading the whole file
+        self.assertFalse(hasattr(data, '_data'))
+        self.assertTrue(os.path.exists(self.filename[:-4] + '.idx'))
+        self.assertEqual(30, data.index.rows)
+
+    def test_saved_index_is_reused_and_checked(self):
+        self.data.index.stride = 4
+        expected = self._add_rows(self.data, 10)
+        self.data.getData(1, 9, False, None)
+        self.data.save()
+
+        data = self.get_backend_data(self.filename)
+        data.index.stride = 4
+        data.index.load(os.path.getsize(self.filename))
+        self.assertEqual(10, data.index.rows)
+        self.assertEqual([0], data.index.offsets[:1])
+        self.assertEqual(3, len(data.index.offsets))
+
+        # an index that runs past the end of the file is discarded
+        with open(self.filename, 'r+b') as f:
+            f.truncate(20)
+        data.index.load(os.path.getsize(self.filename))
+        self.assertEqual(0, data.index.rows)
+
+    def test_blank_and_comment_lines_are_not_rows(self):
+        with open(self.filename, 'wb') as f:
+            f.write('\r\n1,2,3\r\n\r\n4,5,6\r\n# c\r\n  \r\n7,8,9\r\n'
+                    ' # d\r\n10,11,12 # e\r\n13,14,15\r\n\r\n')
+        self.data.save()
+        indexed = self.get_backend_data(self.filename)
+        indexed.load()
+        indexed.index.stride = 2
+        loaded = self.get_backend_data(self.filename)
+        loaded.load()
+        self.assertEqual(5, len(loaded.data))
+        for limit, start in [(1, 2), (2, 1), (3, 2), (None, 0), (None, 3),
+                             (2, 4), (1, 5)]:
+            expected = loaded.getData(limit, start, False, None)
+            read_data, next_pos = indexed.getData(limit, start, False, None)
+            self.assert_arrays_equal(read_data, expected[0])
+            self.assertEqual(next_pos, expected[1])
+        self.assert_arrays_equal(indexed.getData(1, 2, False, None)[0],
+                                 [[7, 8, 9]])
+        for pos in range(7):
+            self.assertEqual(loaded.hasMore(pos), indexed.hasMore(pos))
+        self.assertFalse(hasattr(indexed, '_data'))
+        self.assertEqual(5, indexed.index.rows)
+        self.assertEqual(3, len(indexed.index.offsets))
+
+    def test_partial_line_is_not_read(self):
+        self._add_rows(self.data, 3)
+        self.data.file.write('7,8')
+        self.data.file.flush()
+        self.assertEqual(3, len(self.data.getData(None, 0, False, None)[0]))
+        self.assertEqual(3, len(self.data.data))
+        self.data.file.write(',9\r\n')
+        self.data.file.flush()
+        self.assert_arrays_equal(self.data.data[3], [7, 8, 9])
+        self.assertTrue(self.data.hasMore(3))
+        self.assertFalse(self.data.hasMore(4))
+
+    def test_add_data_after_read_keeps_memory_in_sync(self):
+        expected = self._add_rows(self.data, 3)
+        self.assertEqual(3, len(self.data.data))
+        more = self._add_rows(self.data, 2000)
+        expected = np.vstack((expected, more))
+        self.assert_arrays_equal(self.data.data, expected)
+        # and the same rows are read back from the file after a timeout
+        self.clock.advance(backend.DATA_TIMEOUT + 1)
+        self.assertFalse(hasattr(self.data, '_data'))
+        self.assert_arrays_equal(self.data.data, expected)
+
+    def test_get_records(self):
+        expected = self._add_rows(self.data, 5)
+        records, pos = self.data.getRecords(3, 1)
+        self.assertEqual(self.data.dtype, records.dtype)
+        self.assertEqual((3,), records.shape)
+        self.assert_arrays_equal(expected[1:4], util.from_record_array(records))
+        self.assertEqual(4, pos)
+        records, pos = self.data.getRecords(None, 5)
+        self.assertEqual((0,), records.shape)
+        self.assertEqual(5, pos)
+
+    def test_parse_csv_block(self):
+        text = '1, 2.5,-3e-3\r\n4,nan,6\n'
+        np.testing.assert_array_equal(backend._parse_csv_block(text, 3),
+                                      [[1, 2.5, -3e-3], [4, np.nan, 6]])
+        self.assertRaises(ValueError, backend._parse_csv_block, '1,x,3\n', 3)
+        text = '1,2,3\n\n# note\n4,5,6\n'
+        np.testing.assert_array_equal(backend._parse_csv_block(text, 3),
+                                      [[1, 2, 3], [4, 5, 6]])
+        self.assertEqual((0, 3), backend._parse_csv_block('\n', 3).shape)
+        self.assertRaises(ValueError, backend._parse_csv_block, '1,2\n\n', 3)
+
 class ExtendedHDF5DataTest(_BackendDataTest):
 
     def setUp(self):
@@ -635,6 +975,36 @@ class ExtendedHDF5DataTest(_BackendDataTest):
         self.assertEqual(len(actual), 3)
         self.assert_arrays_equal(actual, [[1, 4], [2, 5], [3, 6]])
 
+    def test_get_selection_transpose(self):
+        name = _unique_filename()
+        data = self.get_backend_data(name)
+        independents = [
+                backend.Independent(label='x', shape=(1,), datatype='v', unit='')]
+        dependents = [
+                backend.Dependent(label='name', legend='', shape=(1,), datatype='s', unit=''),
+                backend.Dependent(label='m', legend='', shape=(2, 2), datatype='v', unit='')]
+        data.initialize_info('Foo', independents, dependents)
+        data_to_add = np.recarray(
+            (4, ),
+            dtype=[('f0', '<f8'), ('f1', 'O'), ('f2', '<f8', (2, 2))])
+        for i in range(4):
+            data_to_add[i] = (i, 'row {}'.format(i), np.eye(2) * i)
+        data.addData(data_to_add)
+
+        columns, next_pos = data.getSelection([2, 1], 1, None, 2, True, None)
+        self.assertEqual(next_pos, 5)
+        self.assertEqual(len(columns), 2)
+        self.assert_arrays_equal(columns[0], [np.eye(2), 3 * np.eye(2)])
+        self.assertEqual(columns[1], ['row 1', 'row 3'])
+
+        # only the selected columns have to be floats for simple reads
+        rows, _ = data.getSelection([0], 0, 2, 1, False, True)
+        self.assertEqual(rows, [(0,), (1,)])
+        self.assertRaises(
+                errors.DataVersionMismatchError,
+                data.getSelection,
+                [0, 1], 0, 2, 1, False, True)
+
     def test_initialize_info_bad_vars(self):
         bad_independents = [
                         backend.Independent(
@@ -770,6 +1140,64 @@ class ExtendedHDF5DataTest(_BackendDataTest):
         added_data, _ = data.getData(None, 0, False, None)
         self.assertEqual(added_data[0][0], "{'a': 0}")
 
+    def test_fixed_width_string_column(self):
+        data = self.get_backend_data(_unique_filename())
+        independent = backend.Independent(
+                label='name', shape=(1,), datatype='s4', unit='')
+        dependent = backend.Dependent(
+                label='y', legend='', shape=(1,), datatype='v', unit='V')
+        data.initialize_info('Foo', [independent], [dependent])
+        self.assertEqual(data.dtype, np.dtype([('f0', 'S4'), ('f1', '<f8')]))
+        self.assertEqual('s', data.getIndependents()[0].datatype)
+        self.assertEqual(['s', 'v'], data.getColumnTypes())
+
+        records = backend.records_from_rows(
+                [('ab', 1.0), ('abcd', 2.0)], data.dtype, data.getColumnTypes())
+        data.addData(records)
+        rows, _ = data.getData(None, 0, False, None)
+        self.assertEqual([('ab', 1.0), ('abcd', 2.0)], rows)
+        columns, _ = data.getData(None, 0, True, None)
+        self.assertEqual(['ab', 'abcd'], columns[0])
+        self.assertRaises(ValueError, backend.records_from_columns,
+                          [['abcde'], [1.0]], data.dtype, data.getColumnTypes())
+
+    def test_timestamp_column(self):
+        data = self.get_backend_data(_unique_filename())
+        independent = backend.Independent(
+                label='t', shape=(1,), datatype='t', unit='')
+        dependent = backend.Dependent(
+                label='t', legend='', shape=(2,), datatype='t', unit='')
+        data.initialize_info('Foo', [independent], [dependent])
+        times = [datetime.datetime(2016, 2, 29, 12, 30, 15, 123456),
+                 datetime.datetime(1900, 1, 1)]
+        records = backend.records_from_columns(
+                [times, [times, times]], data.dtype, data.getColumnTypes())
+        self.assertEqual(1456749015123456, records['f0'][0])
+        data.addData(records)
+        # timestamps are read back as microseconds, as they always were
+        micros = [1456749015123456, -2208988800000000]
+        rows, _ = data.getData(None, 0, False, None)
+        self.assertEqual([micros[0], micros[1]], [row[0] for row in rows])
+        self.assertEqual([micros, micros], [list(row[1]) for row in rows])
+        columns, _ = data.getData(None, 0, True, None)
+        self.assertEqual(micros, list(columns[0]))
+        self.assertEqual([micros, micros], columns[1].tolist())
+        # datetime64 values and microseconds are taken as well
+        records = backend.records_from_columns(
+                [np.array(times, dtype='datetime64[ms]'), [[0, 1], [2, 3]]],
+                data.dtype, data.getColumnTypes())
+        self.assertEqual([1456749015123000, -2208988800000000],
+                         records['f0'].tolist())
+        self.assertEqual([[0, 1], [2, 3]], records['f1'].tolist())
+
+    def test_records_from_rows_checks_row_length(self):
+        data = self.get_backend_data(_unique_filename())
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS)
+        self.assertRaises(errors.BadDataError, backend.records_from_rows,
+                          [(1, 2, 3), (1, 2)], data.dtype, data.getColumnTypes())
+        self.assertEqual(0, len(backend.records_from_rows(
+                [], data.dtype, data.getColumnTypes())))
+
     def test_add_string_array_column(self):
         name = _unique_filename()
         data = self.get_backend_data(name)
@@ -811,5 +1239,285 @@ class SimpleHDF5DataTest(_BackendDataTest):
         self.assertEqual(read_data.dtype, np.dtype(float))
         self.assertEqual(read_data.size, 0)
 
+    def test_initialize_with_storage_profile(self):
+        name = _unique_filename()
+        data = self.get_backend_data(name)
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS, profile='lzf')
+        self.assertEqual('lzf', data.dataset.compression)
+        self.assertTrue(data.dataset.shuffle)
+        expected_rows = backend.chunk_rows(
+                data.dtype, backend.STORAGE_PROFILES['lzf'])
+        self.assertEqual((expected_rows,), data.dataset.chunks)
+        data_to_add = np.recarray(
+            (2, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        data_to_add[0] = (1, 2, 3)
+        data_to_add[1] = (4, 5, 6)
+        data.addData(data_to_add)
+        self.assert_data_in_backend(data, [[1, 2, 3], [4, 5, 6]])
+
+    def test_create_backend_sets_chunk_cache(self):
+        base = _unique_filename(suffix='')
+        self.filenames_to_remove.append(base + '.hdf5')
+        data = backend.create_backend(
+                base, 'Foo', _INDEPENDENTS, _DEPENDENTS, False, 'gzip')
+        self.assertEqual('gzip', data.dataset.compression)
+        cache_bytes = data.file.id.get_access_plist().get_cache()[2]
+        self.assertEqual(
+                backend.STORAGE_PROFILES['gzip'].cache_bytes, cache_bytes)
+
+class RepackTest(_BackendDataTestCase):
+    """Tests for contiguous datasets read through a memory map."""
+
+    def setUp(self):
+        self.base = _unique_filename(suffix='')
+        self.filename = self.base + '.hdf5'
+        self.clock = task.Clock()
+        data = backend.create_backend(
+                self.base, 'Foo', _INDEPENDENTS, _DEPENDENTS, False)
+        self.rows = np.column_stack((np.arange(1000.0), np.arange(1000.0) ** 2,
+                                     -np.arange(1000.0)))
+        data.addData(np.core.records.fromarrays(self.rows.T, dtype=data.dtype))
+        data.addParam('gain', 2.5)
+        data.addComment('someone', 'hello')
+        data._file.close()
+
+    def tearDown(self):
+        _remove_file_if_exists(self.filename)
+
+    def open(self):
+        fh = backend.SelfClosingFile(
+                h5py.File, open_args=(self.filename, 'a'), reactor=self.clock)
+        return backend.SimpleHDF5Data(fh)
+
+    def test_chunked_dataset_is_not_mapped(self):
+        data = self.open()
+        self.assertIsNone(data._memmap())
+        self.assert_arrays_equal(self.rows[5:9], data.getData(4, 5, False, None)[0])
+
+    def test_repacked_dataset_is_read_through_map(self):
+        self.assertEqual(1000, backend.repack_hdf5_file(self.filename))
+        self.assertFalse(os.path.exists(self.filename + backend.PARTIAL_SUFFIX))
+        data = self.open()
+        self.assertIsNone(data.dataset.chunks)
+        self.assertIsNotNone(data._memmap())
+        self.assertEqual(1000, len(data))
+        self.assertEqual('Foo', data.dataset.attrs['Title'])
+        self.assertEqual(2.5, data.getParameter('gain'))
+        self.assertEqual('hello', data.getComments(None, 0)[0][0][2])
+        self.assert_arrays_equal(self.rows, data.getData(None, 0, False, None)[0])
+        read, pos = data.getData(10, 995, False, None)
+        self.assert_arrays_equal(self.rows[995:], read)
+        self.assertEqual(1000, pos)
+        read, pos = data.getSelection([2, 0], 10, 500, 7, False, None)
+        self.assert_arrays_equal(self.rows[10:500:7, [2, 0]], read)
+        self.assertEqual(10 + 70 * 7, pos)
+        self.assertEqual((0, 3), data.getData(5, 2000, False, None)[0].shape)
+        x, y = data.getColumns([1, 1], 3, 6)
+        self.assert_arrays_equal(self.rows[3:6, 1], x)
+
+    def test_rows_added_after_repack(self):
+        backend.repack_hdf5_file(self.filename)
+        data = self.open()
+        self.assertIsNotNone(data._memmap())
+        data.addData(np.core.records.fromarrays([[1.0], [2.0], [3.0]], dtype=data.dtype))
+        self.assertIsNotNone(data.dataset.chunks)
+        self.assertIsNone(data._memmap())
+        self.assertEqual(1001, len(data))
+        self.assertEqual('Foo', data.dataset.attrs['Title'])
+        read, _ = data.getData(None, 0, False, None)
+        self.assert_arrays_equal(np.vstack((self.rows, [[1, 2, 3]])), read)
+
+class HDF5GrowthTest(_BackendDataTestCase):
+    """Tests for geometric over-allocation of HDF5 datasets."""
+
+    def setUp(self):
+        self.filename = _unique_filename()
+        self.clock = task.Clock()
+
+    def tearDown(self):
+        _remove_file_if_exists(self.filename)
+
+    def get_backend_data(self, profile=None):
+        fh = backend.SelfClosingFile(
+                h5py.File, open_args=(self.filename, 'a'), timeout=1,
+                reactor=self.clock)
+        return backend.SimpleHDF5Data(fh, profile)
+
+    def add_rows(self, data, start, stop):
+        for i in range(start, stop):
+            data.addData(np.core.records.fromarrays(
+                    [[i], [2*i], [3*i]], names='f0,f1,f2'))
+
+    def expected_rows(self, stop):
+        return [[i, 2*i, 3*i] for i in range(stop)]
+
+    def test_single_row_adds_over_allocate(self):
+        data = self.get_backend_data()
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS)
+        self.add_rows(data, 0, 5)
+        self.assertEqual(5, len(data))
+        self.assertTrue(data.capacity() > 5)
+        self.assertEqual(5, data.dataset.attrs['Length'])
+        self.assert_data_in_backend(data, self.expected_rows(5))
+        self.assertTrue(data.hasMore(4))
+        self.assertFalse(data.hasMore(5))
+        read_data, next_pos = data.getData(10, 3, False, None)
+        self.assertEqual(5, next_pos)
+        self.assert_arrays_equal(read_data, self.expected_rows(5)[3:])
+
+    def test_capacity_grows_geometrically(self):
+        profile = backend.StorageProfile(
+                64, None, None, False, None, None, None, 2.0)
+        data = self.get_backend_data(profile)
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS, profile)
+        capacities = set()
+        for i in range(100):
+            self.add_rows(data, i, i + 1)
+            capacities.add(data.capacity())
+        self.assertEqual(set([2, 4, 8, 16, 32, 64, 128]), capacities)
+        self.assert_data_in_backend(data, self.expected_rows(100))
+
+    def test_trim_on_file_close(self):
+        data = self.get_backend_data()
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS)
+        self.add_rows(data, 0, 3)
+        # let the file time out and close
+        self.clock.advance(1)
+        with h5py.File(self.filename, 'r') as f:
+            self.assertEqual((3,), f['DataVault'].shape)
+        # appending after the file reopens keeps working
+        self.add_rows(data, 3, 6)
+        self.assert_data_in_backend(data, self.expected_rows(6))
+
+    def test_untrimmed_file_reads_logical_rows(self):
+        data = self.get_backend_data()
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS)
+        self.add_rows(data, 0, 3)
+        data.file.flush()
+        # a second reader that has not seen the appends
+        fh = backend.SelfClosingFile(
+                h5py.File, open_args=(self.filename, 'r'), reactor=self.clock)
+        reader = backend.SimpleHDF5Data(fh)
+        self.assertEqual(3, len(reader))
+        self.assert_data_in_backend(reader, self.expected_rows(3))
+
+    def test_no_growth_resizes_exactly(self):
+        data = self.get_backend_data('legacy')
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS, 'legacy')
+        self.add_rows(data, 0, 3)
+        self.assertEqual(3, data.capacity())
+        self.assertFalse('Length' in data.dataset.attrs)
+        self.assert_data_in_backend(data, self.expected_rows(3))
+
+
+class BlockCacheReadTest(_TestCase):
+    """Tests for reads of HDF5 and csv datasets through the block cache."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.cache = cache.BlockCache(block_rows=16)
+        self.files_to_remove = []
+
+    def tearDown(self):
+        for name in self.files_to_remove:
+            _remove_file_if_exists(name)
+
+    def _records(self, start, stop):
+        rows = np.arange(start, stop, dtype=np.float64)
+        return np.core.records.fromarrays([rows, 10 * rows, 0.5 * rows],
+                                          names='f0,f1,f2')
+
+    def _expected(self, start, stop):
+        rows = np.arange(start, stop, dtype=np.float64)
+        return np.column_stack((rows, 10 * rows, 0.5 * rows))
+
+    def _hdf5(self, filename):
+        fh = backend.SelfClosingFile(
+                h5py.File, open_args=(filename, 'a'), reactor=self.clock)
+        data = backend.SimpleHDF5Data(fh)
+        data.cache = self.cache
+        return data
+
+    def _csv(self, filename):
+        data = backend.CsvNumpyData(filename, reactor=self.clock)
+        data.cache = self.cache
+        return data
+
+    def test_hdf5_reads_are_shared(self):
+        filename = _unique_filename()
+        self.files_to_remove.append(filename)
+        data = self._hdf5(filename)
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS)
+        data.addData(self._records(0, 40))
+        # the first read bypasses the cache, and the second fills it
+        for i in range(2):
+            read, _ = data.getData(None, 0, False, None)
+            self.assert_arrays_equal(self._expected(0, 40), read)
+            self.assertEqual(9 * (i + 1), self.cache.misses)
+        self.assertEqual(9, len(self.cache))
+
+        # another backend object of the same file uses the cached blocks
+        other = self._hdf5(filename)
+        read, pos = other.getSelection([2, 0], 5, 38, 3, False, None)
+        self.assert_arrays_equal(self._expected(5, 38)[::3][:, [2, 0]], read)
+        self.assertEqual(38, pos)
+        self.assertEqual(18, self.cache.misses)
+        self.assertEqual(6, self.cache.hits)
+
+    def test_hdf5_append_invalidates_tail_block(self):
+        filename = _unique_filename()
+        self.files_to_remove.append(filename)
+        data = self._hdf5(filename)
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS)
+        data.addData(self._records(0, 40))
+        data.getData(None, 0, False, None)
+        data.getData(None, 0, False, None)
+        self.assertEqual(9, len(self.cache))
+        data.addData(self._records(40, 50))
+        # only the three blocks of the last, partly filled block are dropped
+        self.assertEqual(6, len(self.cache))
+        read, _ = data.getData(None, 0, False, None)
+        self.assert_arrays_equal(self._expected(0, 50), read)
+        [x] = data.getColumns([0], 30, None)
+        self.assert_arrays_equal(np.arange(30, 50), x)
+
+    def test_csv_reads_are_shared(self):
+        filename = _unique_filename(suffix='.csv')
+        self.files_to_remove += [filename, filename[:-4] + '.ini',
+                                 filename[:-4] + '.idx']
+        data = self._csv(filename)
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS)
+        data.addData(self._records(0, 40))
+        data.save()
+        for i in range(2):
+            read, _ = data.getData(10, 12, False, None)
+            self.assert_arrays_equal(self._expected(12, 22), read)
+        self.assertEqual(4, self.cache.misses)
+        self.assertEqual(2, len(self.cache))
+
+        other = self._csv(filename)
+        other.load()
+        for i in range(2):
+            read, _ = other.getData(None, 0, False, None)
+            self.assert_arrays_equal(self._expected(0, 40), read)
+        self.assertEqual(4, self.cache.hits)
+        self.assertEqual(3, len(self.cache))
+
+        data.addData(self._records(40, 50))
+        self.assertEqual(2, len(self.cache))
+        read, _ = other.getData(None, 30, False, None)
+        self.assert_arrays_equal(self._expected(30, 50), read)
+
+    def test_create_backend_drops_cached_blocks(self):
+        base = _unique_filename(suffix='')
+        self.files_to_remove.append(base + '.hdf5')
+        name = os.path.abspath(base + '.hdf5')
+        shared = cache.get_block_cache()
+        shared.put((name, 0, 'f0'), np.zeros(3))
+        backend.create_backend(base, 'Foo', _INDEPENDENTS, _DEPENDENTS, False)
+        self.assertIsNone(shared.get((name, 0, 'f0')))
+
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
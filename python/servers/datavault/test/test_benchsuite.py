@@ -0,0 +1,56 @@
+import os
+import pytest
+import shutil
+import tempfile
+import unittest
+
+from datavault import benchsuite
+
+
+TINY_SIZES = dict((name, benchsuite.Workload(3, size.rows and min(size.rows, 20)))
+                  for name, size in benchsuite.QUICK_SIZES.items())
+
+
+class BenchSuiteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='dvtest')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_every_workload_runs_on_every_backend(self):
+        seen = []
+        results = benchsuite.run_suite(self.dir, sizes=TINY_SIZES,
+                                       progress=seen.append)
+        self.assertEqual(results, seen)
+        self.assertEqual(len(benchsuite.BACKENDS) * len(benchsuite.WORKLOADS),
+                         len(results))
+        for result in results:
+            self.assertEqual(3, result['ops'])
+            self.assertTrue(result['ops_per_sec'] > 0)
+            self.assertTrue(result['p99_us'] >= result['p50_us'])
+        listeners = [r for r in results if r['workload'] == 'concurrent listeners']
+        for result in listeners:
+            self.assertTrue(result['signals'] >= 3 * benchsuite.LISTENERS)
+
+    def test_save_and_compare(self):
+        results = benchsuite.run_suite(self.dir, ['hdf5 v2'], TINY_SIZES)
+        filename = os.path.join(self.dir, 'results.json')
+        benchsuite.save_results(filename, results, {'quick': True})
+        saved = benchsuite.load_results(filename)
+        self.assertEqual({'quick': True}, saved['params'])
+        slower = [dict(r, ops_per_sec=r['ops_per_sec'] / 2) for r in saved['results']]
+        slower[0]['ops_per_sec'] = saved['results'][0]['ops_per_sec'] * 0.9
+        rows = benchsuite.compare(saved['results'], slower, threshold=0.2)
+        self.assertEqual(len(results), len(rows))
+        self.assertEqual([False] + [True] * (len(rows) - 1), [row[-1] for row in rows])
+        self.assertAlmostEqual(0.5, rows[1][4])
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, benchsuite.run_suite, self.dir, ['nope'],
+                          TINY_SIZES)
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
@@ -0,0 +1,137 @@
+import numpy as np
+import pytest
+import unittest
+
+from datavault import cache
+
+
+class _Reader(object):
+    """Reads rows of a 2-D array as {part: column}, recording each read."""
+    def __init__(self, array):
+        self.array = array
+        self.reads = []
+
+    def __call__(self, parts, lo, hi):
+        self.reads.append((tuple(parts), lo, hi))
+        return dict((part, self.array[lo:hi, part]) for part in parts)
+
+
+class BlockCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = cache.BlockCache(max_bytes=3 * 80, block_rows=10)
+        self.array = np.arange(100 * 3, dtype=np.float64).reshape((100, 3))
+
+    def _block(self, value=0.0):
+        return np.zeros(10) + value # 80 bytes
+
+    def _collect(self, parts, start, stop, length, reader, max_read_rows=None):
+        blocks = self.cache.blocks('f', parts, start, stop, length, reader,
+                                   max_read_rows)
+        return [(lo, dict(found)) for lo, found in blocks]
+
+    def test_least_recently_used_blocks_are_evicted(self):
+        for b in range(3):
+            self.cache.put(('f', b, None), self._block(b))
+        self.assertIsNotNone(self.cache.get(('f', 0, None)))
+        self.cache.put(('f', 3, None), self._block(3))
+        self.assertEqual(3, len(self.cache))
+        self.assertEqual(240, self.cache.nbytes)
+        self.assertIsNone(self.cache.get(('f', 1, None)))
+        self.assertEqual(0, self.cache.get(('f', 0, None))[0])
+        self.assertEqual(1, self.cache.evictions)
+
+    def test_blocks_are_read_only(self):
+        block = self._block()
+        self.cache.put(('f', 0, None), block)
+        self.assertRaises(ValueError, block.__setitem__, 0, 1.0)
+
+    def test_short_block_is_stale(self):
+        self.cache.put(('f', 0, None), np.zeros(4))
+        self.assertIsNotNone(self.cache.get(('f', 0, None), 4))
+        self.assertIsNone(self.cache.get(('f', 0, None), 5))
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual(0, self.cache.nbytes)
+
+    def test_invalidate_drops_blocks_from_first_block(self):
+        self.cache.max_bytes = 10**6
+        for b in range(3):
+            self.cache.put(('f', b, None), self._block())
+        self.cache.put(('g', 2, None), self._block())
+        self.cache.invalidate('f', 1)
+        self.assertIsNotNone(self.cache.get(('f', 0, None)))
+        self.assertIsNone(self.cache.get(('f', 1, None)))
+        self.assertIsNone(self.cache.get(('f', 2, None)))
+        self.assertIsNotNone(self.cache.get(('g', 2, None)))
+        self.assertEqual(160, self.cache.nbytes)
+
+    def test_blocks_reads_runs_of_missing_blocks(self):
+        self.cache.max_bytes = 10**6
+        reader = _Reader(self.array)
+        first = self._collect([0, 2], 15, 47, 100, reader, max_read_rows=20)
+        self.assertEqual([10, 20, 30, 40], [lo for lo, _ in first])
+        self.assertEqual([((0, 2), 10, 30), ((0, 2), 30, 50)], reader.reads)
+        for lo, found in first:
+            np.testing.assert_array_equal(self.array[lo:lo + 10, 2], found[2])
+        # blocks are only cached when they are read a second time
+        self.assertEqual(0, len(self.cache))
+        self._collect([0, 2], 15, 47, 100, reader, max_read_rows=20)
+        self.assertEqual(8, len(self.cache))
+
+        # cached blocks are not read again, and missing columns are read
+        # for the blocks that need them
+        reader.reads = []
+        second = self._collect([1, 2], 0, 35, 100, reader)
+        self.assertEqual([((1, 2), 0, 10), ((1,), 10, 40)], reader.reads)
+        for lo, found in second:
+            np.testing.assert_array_equal(self.array[lo:lo + 10, 1], found[1])
+            np.testing.assert_array_equal(self.array[lo:lo + 10, 2], found[2])
+
+    def test_first_read_bypasses_cache(self):
+        self.cache.max_bytes = 10**6
+        self.assertTrue(self.cache.firstRead('f', [0, 1], 5, 25))
+        self.assertEqual(6, self.cache.misses)
+        # a read of any of those blocks is not a first read
+        self.assertFalse(self.cache.firstRead('f', [1], 20, 40))
+        reader = _Reader(self.array)
+        self._collect([1], 20, 40, 100, reader)
+        self.assertEqual(1, len(self.cache))
+        self.assertIsNotNone(self.cache.get(('f', 2, 1)))
+        self.assertFalse(self.cache.firstRead('f', [1], 20, 30))
+
+    def test_reads_past_budget_are_not_cached(self):
+        reader = _Reader(self.array)
+        for i in range(2):
+            blocks = self._collect([0], 0, 60, 100, reader, max_read_rows=10)
+        self.assertEqual(3, len(self.cache))
+        self.assertEqual([0, 1, 2],
+                         sorted(key[1] for key in self.cache._blocks))
+        for lo, found in blocks:
+            np.testing.assert_array_equal(self.array[lo:lo + 10, 0], found[0])
+
+    def test_blocks_stop_at_length(self):
+        reader = _Reader(self.array)
+        blocks = self._collect([0], 0, 100, 25, reader)
+        self.assertEqual([0, 10, 20], [lo for lo, _ in blocks])
+        self.assertEqual(5, len(blocks[-1][1][0]))
+        # the short block is read again once the file is longer
+        reader.reads = []
+        self._collect([0], 20, 30, 30, reader)
+        self.assertEqual([((0,), 20, 30)], reader.reads)
+
+    def test_stats(self):
+        self.cache.put(('f', 0, None), self._block())
+        self.cache.get(('f', 0, None))
+        self.cache.get(('f', 1, None))
+        self.cache.get(('f', 0, None))
+        stats = dict(self.cache.stats())
+        self.assertEqual(1, stats['blocks'])
+        self.assertEqual(80, stats['resident bytes'])
+        self.assertEqual(240, stats['max bytes'])
+        self.assertEqual(2, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertAlmostEqual(2 / 3.0, stats['hit ratio'])
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
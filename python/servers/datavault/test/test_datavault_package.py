@@ -1,15 +1,21 @@
+import cPickle
+import json
 import mock
 import numpy as np
 import os
 import pytest
 import tempfile
+import time
 import unittest
 
 from labrad import types
 
 from twisted.internet import task
 
-from datavault import Session, Dataset, SessionStore
+import datavault
+from datavault import Session, Dataset, SessionStore, backend, errors, migrate
+from datavault.subscriptions import SubscriptionRegistry
+from datavault.testing import result
 
 
 def _unique_dir():
@@ -98,8 +104,8 @@ class _DatavaultTestCase(unittest.TestCase):
                         expected_var.legend, actual_var.legend, msg=msg)
 
     def assertDatasetsEqual(self, expected, actual):
-        expected_entries, expected_num = expected.getData(None, 0)
-        actual_entries, actual_num = actual.getData(None, 0)
+        expected_entries, expected_num = result(expected.getData(None, 0))
+        actual_entries, actual_num = result(actual.getData(None, 0))
         self.assertEqual(expected_num, actual_num)
         self.assertArrayEqual(expected_entries, actual_entries)
         expected_independents = expected.getIndependents()
@@ -118,6 +124,10 @@ class SessionTest(_DatavaultTestCase):
         self.datadir = _unique_dir_name()
         self.hub = mock.MagicMock()
         self.store = mock.MagicMock()
+        self.store.storage_profile = None
+        self.store.io_executor = None
+        self.store.unsaved_info = {}
+        self.store.subscriptions = SubscriptionRegistry()
 
     def tearDown(self):
         _empty_and_remove_dir(self.datadir)
@@ -168,6 +178,162 @@ class SessionTest(_DatavaultTestCase):
         d2 = s2.openDataset(datasets[0])
         self.assertDatasetsEqual(d1, d2)
 
+    def test_converted_csv_dataset_is_listed_once(self):
+        session = self._get_session()
+        name = '00001 - Old'
+        base = os.path.join(session.dir, name)
+        csv_data = backend.CsvNumpyData(base + '.csv', reactor=task.Clock())
+        csv_data.initialize_info(
+                'Old', [backend.Independent('x', (1,), 'v', '')],
+                [backend.Dependent('y', '', (1,), 'v', '')])
+        csv_data.addData(np.array([[0., 1.], [2., 3.]]))
+        csv_data.save()
+        csv_data._file.close()
+        session.updateTags(['keep'], [], [name])
+
+        migrate.convert_dataset(base)
+        self.assertEqual([name], session.listDatasets())
+        self.assertEqual(([], [name]), session.listContents(['keep']))
+        dataset = session.openDataset(1)
+        self.assertIsInstance(dataset.data, backend.SimpleHDF5Data)
+        self.assertArrayEqual([[0, 1], [2, 3]], result(dataset.getData(None, 0))[0])
+
+    def test_list_contents_with_tag_filters(self):
+        session = self._get_session(['foo'])
+        self.store.get.return_value = session
+        for name in ['a', 'b', 'c']:
+            self._get_session(['foo', name])
+        for i in range(3):
+            session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        session.updateTags(['x'], ['a', 'b'], ['00001 - Foo', '00002 - Foo'])
+        session.updateTags(['y'], ['b'], ['00002 - Foo'])
+
+        all_datasets = ['00001 - Foo', '00002 - Foo', '00003 - Foo']
+        self.assertEqual((['a', 'b', 'c'], all_datasets), session.listContents([]))
+        self.assertEqual((['a', 'b'], all_datasets[:2]), session.listContents(['x']))
+        self.assertEqual((['a'], all_datasets[:1]), session.listContents(['x', '-y']))
+        self.assertEqual((['c'], all_datasets[2:]), session.listContents(['-x']))
+        self.assertEqual(([], []), session.listContents(['z']))
+        session.updateTags(['-x'], ['a'], [])
+        self.assertEqual((['b'], all_datasets[:2]), session.listContents(['x']))
+
+    def test_open_dataset_by_number(self):
+        session = self._get_session()
+        for title in ['A', 'B', 'C']:
+            session.newDataset(title, self._INDEPENDENTS, self._DEPENDENTS)
+        self.assertEqual('00002 - B', session.openDataset(2).name)
+        self.assertRaises(errors.DatasetNotFoundError, session.openDataset, 4)
+
+    def test_index_sees_changes_on_disk(self):
+        session = self._get_session()
+        session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        self.assertEqual(['00001 - Foo'], session.listDatasets())
+        # another process adds a dataset and removes one
+        os.rename(os.path.join(session.dir, '00001 - Foo.hdf5'),
+                  os.path.join(session.dir, '00007 - a%fb.hdf5'))
+        self.assertEqual(['00007 - a/b'], session.listDatasets())
+        self.assertEqual('00007 - a/b', session.index.byNumber(7))
+        self.assertIsNone(session.index.byNumber(1))
+
+    def test_index_is_saved(self):
+        session = self._get_session()
+        session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        os.mkdir(os.path.join(session.dir, 'sub.dir'))
+        self.assertEqual((['sub'], ['00001 - Foo']), session.listContents([]))
+        self.assertTrue(os.path.exists(
+                os.path.join(session.dir, datavault.SESSION_INDEX_FILE)))
+        # once the last change is old enough, the index trusts the directory
+        # time and saves it
+        session.flush()
+        old = time.time() - 60
+        os.utime(session.dir, (old, old))
+        self.assertEqual((['sub'], ['00001 - Foo']), session.listContents([]))
+
+        # a new session reads the index instead of the directory
+        with mock.patch('os.listdir') as listdir:
+            session = self._get_session()
+            self.assertEqual((['sub'], ['00001 - Foo']), session.listContents([]))
+            self.assertEqual('00001 - Foo', session.index.byNumber(1))
+            self.assertFalse(listdir.called)
+
+    def test_index_is_json(self):
+        session = self._get_session()
+        session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        session.flush()
+        old = time.time() - 60
+        os.utime(session.dir, (old, old))
+        session.listContents([])
+        indexfile = os.path.join(session.dir, datavault.SESSION_INDEX_FILE)
+        with open(indexfile) as f:
+            index = json.load(f)
+        self.assertEqual(datavault.SESSION_INDEX_VERSION, index['version'])
+
+        # an index in any other format is rebuilt, never loaded
+        with open(indexfile, 'wb') as f:
+            cPickle.dump((1, index['mtime'], {}), f)
+        session = self._get_session()
+        self.assertEqual(([], ['00001 - Foo']), session.listContents([]))
+
+    def test_access_is_saved_later(self):
+        clock = task.Clock()
+        session = Session(self.datadir, ['foo'], self.hub, self.store, reactor=clock)
+        session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        clock.advance(datavault.SESSION_SAVE_DELAY)
+        with mock.patch('datavault.util.atomic_write') as atomic_write:
+            for i in range(100):
+                session.openDataset(1)
+            self.assertFalse(atomic_write.called)
+            clock.advance(datavault.SESSION_SAVE_DELAY)
+            self.assertEqual(1, atomic_write.call_count)
+            session.flush()
+            self.assertEqual(1, atomic_write.call_count)
+
+    def test_pending_changes_are_saved_before_reading(self):
+        clock = task.Clock()
+        session = Session(self.datadir, ['foo'], self.hub, self.store, reactor=clock)
+        session.updateTags(['x'], ['a'], [])
+        other = Session(self.datadir, ['foo'], self.hub, self.store, reactor=clock)
+        self.assertEqual(([('a', ['x'])], []), other.getTags(['a'], []))
+        self.assertFalse(os.path.exists(session.infofile + '.tmp'))
+
+    def test_tags_round_trip(self):
+        session = self._get_session()
+        name = '00001 - caf\xc3\xa9 %p'
+        session.updateTags(['x', '\xff'], ['a'], [name])
+        session.flush()
+        with open(session.infofile) as f:
+            self.assertIn('format = json', f.read())
+        session.load()
+        self.assertEqual({'a': set(['x', '\xff'])}, session.session_tags)
+        self.assertEqual({name: set(['x', '\xff'])}, session.dataset_tags)
+
+    def test_load_legacy_tags(self):
+        session = self._get_session()
+        session.flush()
+        with open(session.infofile, 'w') as f:
+            f.write('[File System]\nCounter = 3\n\n'
+                    '[Information]\nCreated = 2015-01-02, 03:04:05\n'
+                    'Accessed = 2015-01-02, 03:04:05\n'
+                    'Modified = 2015-01-02, 03:04:05\n\n'
+                    '[Tags]\nsessions = {\'a\': set([\'x\'])}\n'
+                    'datasets = {\'00002 - b\': set([\'y\', \'z\'])}\n')
+        session.load()
+        self.assertEqual(3, session.counter)
+        self.assertEqual({'a': set(['x'])}, session.session_tags)
+        self.assertEqual({'00002 - b': set(['y', 'z'])}, session.dataset_tags)
+        self.assertEqual(set(['00002 - b']), session.info.tagSets()[1]['z'])
+
+    def test_counter_follows_datasets_on_disk(self):
+        session = self._get_session()
+        session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        # the data vault stopped before the new counter was saved
+        session.counter = 1
+        session.save()
+        dataset = self._get_session().newDataset(
+                self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        self.assertEqual('00003 - Foo', dataset.name)
+
     def test_add_new_tags(self):
         session1 = self._get_session()
         dataset1 = session1.newDataset(
@@ -271,6 +437,7 @@ class DatasetTest(_DatavaultTestCase):
         self.session = mock.MagicMock()
         self.session.hub = self.hub
         self.session.dir = _unique_dir()
+        self.clock = task.Clock() # signals are sent on the next reactor turn
 
     def tearDown(self):
         _empty_and_remove_dir(self.session.dir)
@@ -361,7 +528,8 @@ class DatasetTest(_DatavaultTestCase):
                 title=self._TITLE,
                 create=True,
                 independents=self._INDEPENDENTS,
-                dependents=self._DEPENDENTS)
+                dependents=self._DEPENDENTS,
+                reactor=self.clock)
 
         dataset.listeners.add('foo listener')
 
@@ -371,8 +539,9 @@ class DatasetTest(_DatavaultTestCase):
         # Add the data.
         dataset.addData(data)
 
+        self.clock.advance(0)
         self.hub.onDataAvailable.assert_called_with(None, set(['foo listener']))
-        data_in_dataset, count = dataset.getData(None, 0, simpleOnly=True)
+        data_in_dataset, count = result(dataset.getData(None, 0, simpleOnly=True))
         self.assertEqual(count, 2)
         self.assertArrayEqual([1, 2, 3], data_in_dataset[0])
         self.assertArrayEqual([2, 3, 4], data_in_dataset[1])
@@ -385,7 +554,8 @@ class DatasetTest(_DatavaultTestCase):
                 create=True,
                 independents=self._EXT_INDEPENDENTS,
                 dependents=self._EXT_DEPENDENTS,
-                extended=True)
+                extended=True,
+                reactor=self.clock)
 
         dataset.listeners.add('foo listener')
         row_1 = (1, [[0, 1], [1, 0]], [[0, 1], [2, 3], [4, 5]])
@@ -395,9 +565,10 @@ class DatasetTest(_DatavaultTestCase):
         # Add the data.
         dataset.addData(data)
 
+        self.clock.advance(0)
         self.hub.onDataAvailable.assert_called_with(None, set(['foo listener']))
 
-        data_in_dataset, count = dataset.getData(None, 0, simpleOnly=False)
+        data_in_dataset, count = result(dataset.getData(None, 0, simpleOnly=False))
         self.assertEqual(count, 2)
         self.assertArrayEqual(row_1[0], data_in_dataset[0][0])
         self.assertArrayEqual(row_1[1], data_in_dataset[0][1])
@@ -434,7 +605,7 @@ class DatasetTest(_DatavaultTestCase):
                 title=self._TITLE,
                 extended=True)
 
-        data_in_dataset, count = new_dataset.getData(None, 0, simpleOnly=False)
+        data_in_dataset, count = result(new_dataset.getData(None, 0, simpleOnly=False))
         self.assertEqual(count, 2)
         self.assertArrayEqual(row_1[0], data_in_dataset[0][0])
         self.assertArrayEqual(row_1[1], data_in_dataset[0][1])
@@ -450,15 +621,17 @@ class DatasetTest(_DatavaultTestCase):
                 title=self._TITLE,
                 create=True,
                 independents=self._INDEPENDENTS,
-                dependents=self._DEPENDENTS)
+                dependents=self._DEPENDENTS,
+                reactor=self.clock)
 
         dataset.param_listeners.add('listener')
         dataset.addParameter('param 1', 'data for param')
 
+        self.clock.advance(0)
         self.hub.onNewParameter.assert_called_with(None, set(['listener']))
 
-        self.assertEqual(['param 1'], dataset.getParamNames())
-        self.assertEqual('data for param', dataset.getParameter('param 1'))
+        self.assertEqual(['param 1'], result(dataset.getParamNames()))
+        self.assertEqual('data for param', result(dataset.getParameter('param 1')))
 
     def test_add_two_parameters(self):
         dataset = Dataset(
@@ -467,14 +640,16 @@ class DatasetTest(_DatavaultTestCase):
                 title=self._TITLE,
                 create=True,
                 independents=self._INDEPENDENTS,
-                dependents=self._DEPENDENTS)
+                dependents=self._DEPENDENTS,
+                reactor=self.clock)
 
         dataset.param_listeners.add('listener')
         dataset.addParameters([('param 2', 'data 2'), ('param 3', 'data 3')])
+        self.clock.advance(0)
         self.hub.onNewParameter.assert_called_with(None, set(['listener']))
-        self.assertEqual(['param 2', 'param 3'], dataset.getParamNames())
-        self.assertEqual('data 2', dataset.getParameter('param 2'))
-        self.assertEqual('data 3', dataset.getParameter('param 3'))
+        self.assertEqual(['param 2', 'param 3'], result(dataset.getParamNames()))
+        self.assertEqual([('param 2', 'data 2'), ('param 3', 'data 3')],
+                         result(dataset.getParameters()))
 
     def test_add_comment(self):
         dataset = Dataset(
@@ -483,14 +658,16 @@ class DatasetTest(_DatavaultTestCase):
                 title=self._TITLE,
                 create=True,
                 independents=self._INDEPENDENTS,
-                dependents=self._DEPENDENTS)
+                dependents=self._DEPENDENTS,
+                reactor=self.clock)
 
         dataset.comment_listeners.add('listener')
         dataset.addComment('user 1', 'comment 1')
 
+        self.clock.advance(0)
         self.hub.onCommentsAvailable.assert_called_with(None, set(['listener']))
 
-        retreived_comment, count = dataset.getComments(None, 0)
+        retreived_comment, count = result(dataset.getComments(None, 0))
         self.assertEqual(1, count)
         self.assertEqual('user 1', retreived_comment[0][1])
         self.assertEqual('comment 1', retreived_comment[0][2])
@@ -502,7 +679,8 @@ class DatasetTest(_DatavaultTestCase):
                 title=self._TITLE,
                 create=True,
                 independents=self._INDEPENDENTS,
-                dependents=self._DEPENDENTS)
+                dependents=self._DEPENDENTS,
+                reactor=self.clock)
 
         data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
 
@@ -512,15 +690,212 @@ class DatasetTest(_DatavaultTestCase):
         # Start streaming the listener
         dataset.keepStreaming(listener, 0)
         # Check the listener is notified of the data already available
-        self.hub.onDataAvailable.assert_called_with(None, [listener])
+        self.clock.advance(0)
+        self.hub.onDataAvailable.assert_called_with(None, set([listener]))
         self.hub.reset_mock()
         # Keep streaming for more data added
         dataset.keepStreaming(listener, 1)
         # Add more data.
         dataset.addData(data)
         # Trigger the listener again.
+        self.clock.advance(0)
         self.hub.onDataAvailable.assert_called_with(None, set([listener]))
 
+    def _get_buffered_dataset(self):
+        self.clock = task.Clock()
+        return Dataset(
+                self.session,
+                "Foo Name",
+                title=self._TITLE,
+                create=True,
+                independents=self._INDEPENDENTS,
+                dependents=self._DEPENDENTS,
+                reactor=self.clock)
+
+    def test_buffered_data_flushed_after_delay(self):
+        dataset = self._get_buffered_dataset()
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+        dataset.addData(data)
+        dataset.addData(data)
+        self.assertEqual(2, dataset.numPending())
+        self.assertEqual(0, len(dataset.data))
+        self.clock.advance(dataset.buffer_delay)
+        self.assertEqual(0, dataset.numPending())
+        self.assertEqual(2, len(dataset.data))
+
+    def test_buffered_data_flushed_when_full(self):
+        dataset = self._get_buffered_dataset()
+        dataset.buffer_rows = 3
+        data = self._get_records_simple([(1, 2, 3), (4, 5, 6)], dataset.data.dtype)
+        dataset.addData(data)
+        self.assertEqual(0, len(dataset.data))
+        dataset.addData(data)
+        self.assertEqual(0, dataset.numPending())
+        self.assertEqual(4, len(dataset.data))
+        # the timer from the first add is cancelled by the flush
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_buffered_data_visible_to_readers(self):
+        dataset = self._get_buffered_dataset()
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+        dataset.addData(data)
+        listener = 'listener'
+        dataset.keepStreaming(listener, 0)
+        self.clock.advance(0)
+        self.hub.onDataAvailable.assert_called_with(None, set([listener]))
+        data_in_dataset, count = result(dataset.getData(None, 0, simpleOnly=True))
+        self.assertEqual(1, count)
+        self.assertArrayEqual([[1, 2, 3]], data_in_dataset)
+
+    def test_unbuffered_data_written_through(self):
+        dataset = self._get_buffered_dataset()
+        dataset.buffer_rows = 0
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+        dataset.addData(data)
+        self.assertEqual(0, dataset.numPending())
+        self.assertEqual(1, len(dataset.data))
+
+    def _streamed(self, message):
+        first, rows, dtype, data = message
+        return first, rows, np.frombuffer(data, np.dtype(dtype))
+
+    def test_stream_pushes_added_rows(self):
+        dataset, data = self._get_dataset_with_rows(5)
+        result(dataset.startStream('listener'))
+        for i in range(3):
+            dataset.addData(self._get_records_simple(
+                    [(i, 2 * i, 3 * i)], dataset.data.dtype))
+        self.assertFalse(self.hub.onDataStreamed.called)
+        self.clock.advance(0)
+        # one message for all rows added in a reactor turn
+        self.assertEqual(1, self.hub.onDataStreamed.call_count)
+        message, contexts = self.hub.onDataStreamed.call_args[0]
+        self.assertEqual(['listener'], contexts)
+        first, rows, records = self._streamed(message)
+        self.assertEqual((5, 3), (first, rows))
+        self.assertArrayEqual([0, 1, 2], records['f0'])
+        self.assertArrayEqual([0, 3, 6], records['f2'])
+
+        dataset.stopStream('listener')
+        dataset.addData(self._get_records_simple([(1, 2, 3)], dataset.data.dtype))
+        self.clock.advance(0)
+        self.assertEqual(1, self.hub.onDataStreamed.call_count)
+
+    def test_stream_messages_are_spaced_out(self):
+        dataset, _ = self._get_dataset_with_rows(0)
+        result(dataset.startStream('listener', min_interval=1.0))
+        for i in range(5):
+            dataset.addData(self._get_records_simple(
+                    [(i, 0, 0)], dataset.data.dtype))
+            self.clock.advance(0 if i == 0 else 0.2)
+        # the first row went out at once, and the rows added since wait
+        self.assertEqual(1, self.hub.onDataStreamed.call_count)
+        self.clock.advance(0.2)
+        self.assertEqual(2, self.hub.onDataStreamed.call_count)
+        first, rows, records = self._streamed(self.hub.onDataStreamed.call_args[0][0])
+        self.assertEqual((1, 4), (first, rows))
+        self.assertArrayEqual([1, 2, 3, 4], records['f0'])
+        self.assertEqual(0, dataset.streams['listener'].coalesced)
+        # with nothing waiting, the next row goes out once it is due
+        dataset.addData(self._get_records_simple([(5, 0, 0)], dataset.data.dtype))
+        self.clock.advance(0.5)
+        self.assertEqual(2, self.hub.onDataStreamed.call_count)
+        self.clock.advance(0.5)
+        self.assertEqual(3, self.hub.onDataStreamed.call_count)
+
+    def test_stream_coalesces_to_newest_rows(self):
+        dataset, _ = self._get_dataset_with_rows(2)
+        itemsize = dataset.data.dtype.itemsize
+        result(dataset.startStream('listener', max_rows=100, max_bytes=4 * itemsize))
+        data = np.arange(30, dtype=float).reshape((10, 3))
+        dataset.addData(self._get_records_simple(data, dataset.data.dtype))
+        self.clock.advance(0)
+        first, rows, records = self._streamed(self.hub.onDataStreamed.call_args[0][0])
+        self.assertEqual((2, 10), (first, rows))
+        self.assertArrayEqual(data[-4:, 0], records['f0'])
+        self.assertEqual(1, dataset.streams['listener'].coalesced)
+
+    def test_stream_summary_keeps_extremes(self):
+        dataset, _ = self._get_dataset_with_rows(0)
+        result(dataset.startStream('listener', max_rows=12, summary=True))
+        x = np.arange(1000, dtype=float)
+        y = np.sin(x / 50)
+        y[321] = 5
+        y[654] = -5
+        data = np.column_stack((x, x * 0, y))
+        dataset.addData(self._get_records_simple(data, dataset.data.dtype))
+        self.clock.advance(0)
+        first, rows, records = self._streamed(self.hub.onDataStreamed.call_args[0][0])
+        self.assertEqual((0, 1000), (first, rows))
+        self.assertLessEqual(len(records), 12)
+        self.assertEqual(sorted(records['f0']), list(records['f0']))
+        self.assertIn(321, records['f0'])
+        self.assertIn(654, records['f0'])
+
+    def test_stream_rows_added_before_start_are_not_sent(self):
+        dataset = self._get_buffered_dataset()
+        dataset.addData(self._get_records_simple([(1, 2, 3)], dataset.data.dtype))
+        d = dataset.startStream('listener')
+        dataset.addData(self._get_records_simple([(4, 5, 6)], dataset.data.dtype))
+        result(d)
+        self.clock.advance(0)
+        first, rows, records = self._streamed(self.hub.onDataStreamed.call_args[0][0])
+        self.assertEqual((1, 1), (first, rows))
+        self.assertArrayEqual([4], records['f0'])
+
+    def _get_dataset_with_rows(self, rows):
+        dataset = self._get_buffered_dataset()
+        data = np.arange(3 * rows, dtype=float).reshape((rows, 3))
+        dataset.addData(self._get_records_simple(data, dataset.data.dtype))
+        dataset.flush()
+        return dataset, data
+
+    def test_cursor_pages_stay_under_memory_ceiling(self):
+        dataset, data = self._get_dataset_with_rows(1000)
+        ceiling = 64 * dataset.data.dtype.itemsize
+        reads = mock.Mock(wraps=dataset.data.getData)
+        dataset.data.getData = reads
+        # ask for bigger pages than the ceiling allows
+        cursor = dataset.openCursor(page_rows=500, max_bytes=ceiling)
+        self.assertEqual(64, cursor.page_rows)
+        pages = []
+        while True:
+            page = result(cursor.next(simpleOnly=True))
+            if not len(page):
+                break
+            self.assertLessEqual(page.nbytes, ceiling)
+            pages.append(page)
+        cursor.close()
+        self.assertArrayEqual(data, np.vstack(pages))
+        for args, kw in reads.call_args_list:
+            self.assertLessEqual(args[0], 64)
+
+    def test_cursor_prefetches_next_page(self):
+        dataset, data = self._get_dataset_with_rows(100)
+        reads = mock.Mock(wraps=dataset.data.getData)
+        dataset.data.getData = reads
+        cursor = dataset.openCursor(page_rows=40, start=10)
+        page = result(cursor.next(simpleOnly=True))
+        self.assertArrayEqual(data[10:50], page)
+        self.assertEqual(2, reads.call_count)
+        page = result(cursor.next(simpleOnly=True))
+        self.assertArrayEqual(data[50:90], page)
+        self.assertEqual(3, reads.call_count)
+        # switching formats does not use the prefetched page
+        page = result(cursor.next(transpose=False))
+        self.assertArrayEqual(data[90:100], page)
+        self.assertEqual(4, reads.call_count)
+
+    def test_cursor_sees_rows_added_after_prefetch(self):
+        dataset, data = self._get_dataset_with_rows(10)
+        cursor = dataset.openCursor(page_rows=10)
+        self.assertArrayEqual(data, result(cursor.next(simpleOnly=True)))
+        # the prefetched page was empty, but there are new rows now
+        more = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+        dataset.addData(more)
+        self.assertArrayEqual([[1, 2, 3]], result(cursor.next(simpleOnly=True)))
+        self.assertEqual(0, len(result(cursor.next(simpleOnly=True))))
+
 
 if __name__ == '__main__':
     pytest.main(['-v', '-s', __file__])
@@ -0,0 +1,171 @@
+import numpy as np
+import pytest
+import unittest
+
+from datavault import decimate
+
+
+class _ArrayData(object):
+    """Backend stand-in holding its rows in a 2-D array."""
+    def __init__(self, array):
+        self.array = array
+        self.reads = []
+
+    def getColumns(self, columns, start, stop):
+        self.reads.append((start, stop))
+        return [self.array[start:stop, i] for i in columns]
+
+
+def _brute_minmax(x, y, start, stop, buckets):
+    """Minimum and maximum of each bucket, computed row by row."""
+    points = {}
+    for row in range(start, stop):
+        b = (row - start) * buckets // (stop - start)
+        lo, hi = points.get(b, (row, row))
+        if y[row] < y[lo]:
+            lo = row
+        if y[row] > y[hi]:
+            hi = row
+        points[b] = (lo, hi)
+    rows = sorted(set(r for pair in points.values() for r in pair))
+    return np.column_stack((x[rows], y[rows]))
+
+def _brute_lttb(x, y, points):
+    """Textbook LTTB."""
+    n = len(x)
+    every = (n - 2) / float(points - 2)
+    picked = [0]
+    a = 0
+    for i in range(points - 2):
+        lo = int(np.floor(i * every)) + 1
+        hi = int(np.floor((i + 1) * every)) + 1
+        nlo = hi
+        nhi = min(int(np.floor((i + 2) * every)) + 1, n)
+        if nlo >= n - 1 or i == points - 3:
+            avg_x, avg_y = x[-1], y[-1]
+        else:
+            avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) -
+                      (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + np.argmax(area)
+        picked.append(a)
+    picked.append(n - 1)
+    return np.column_stack((x[picked], y[picked]))
+
+
+class PyramidTest(unittest.TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(0)
+        self.rows = 4096 + 37
+        self.array = np.column_stack((
+                np.arange(self.rows, dtype=float) * 0.5,
+                rand.randn(self.rows),
+                rand.randn(self.rows)))
+        self.data = _ArrayData(self.array)
+
+    def _pyramid(self):
+        return decimate.Pyramid(0, [1, 2], base_rows=4, factor=2)
+
+    def test_levels_hold_bucket_extrema(self):
+        pyramid = self._pyramid()
+        pyramid.sync(self.data)
+        self.assertEqual(self.rows, pyramid.rows)
+        for level in pyramid.levels:
+            size = level.bucket_rows
+            self.assertEqual(self.rows // size, level.size)
+            y = self.array[:level.size * size, 2].reshape((-1, size))
+            self.assertTrue(np.array_equal(y.min(axis=1), level['ymin'][:, 1]))
+            self.assertTrue(np.array_equal(y.max(axis=1), level['ymax'][:, 1]))
+            rows = level['imax'][:, 1]
+            self.assertTrue(np.array_equal(self.array[rows, 2], level['ymax'][:, 1]))
+            self.assertTrue(np.array_equal(self.array[rows, 0], level['xmax'][:, 1]))
+        self.assertEqual(4096, pyramid.levels[-1].bucket_rows)
+
+    def test_append_records_matches_sync(self):
+        synced = self._pyramid()
+        synced.sync(self.data)
+        appended = self._pyramid()
+        appended.sync(_ArrayData(self.array[:0]))
+        records = np.core.records.fromarrays(self.array.T, dtype='f8,f8,f8')
+        for start in range(0, self.rows, 100):
+            appended.appendRecords(records[start:start + 100])
+        self.assertFalse(appended.stale)
+        self.assertEqual(synced.rows, appended.rows)
+        for lo, hi in zip(synced.levels, appended.levels):
+            for field in lo.FIELDS:
+                self.assertTrue(np.array_equal(lo[field], hi[field]))
+
+    def test_append_non_records_marks_stale(self):
+        pyramid = self._pyramid()
+        pyramid.sync(_ArrayData(self.array[:10]))
+        pyramid.appendRecords([(1, 2, 3)])
+        self.assertTrue(pyramid.stale)
+        pyramid.sync(self.data)
+        self.assertEqual(self.rows, pyramid.rows)
+
+    def test_nans_are_skipped(self):
+        self.array[5, 1] = np.nan
+        self.array[8:12, 1] = np.nan
+        pyramid = self._pyramid()
+        pyramid.sync(self.data)
+        level = pyramid.levels[0]
+        self.assertEqual(np.nanmin(self.array[4:8, 1]), level['ymin'][1, 0])
+        self.assertTrue(np.isnan(level['ymin'][2, 0]))
+
+
+class DecimateTest(unittest.TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(1)
+        self.rows = 4096
+        self.x = np.arange(self.rows, dtype=float)
+        self.y = np.cumsum(rand.randn(self.rows))
+        self.data = _ArrayData(np.column_stack((self.x, self.y)))
+        self.pyramid = decimate.Pyramid(0, [1], base_rows=4, factor=2)
+        self.pyramid.sync(self.data)
+        self.data.reads = []
+
+    def test_minmax_from_pyramid_matches_rows(self):
+        # buckets of 256 rows line up with a pyramid level
+        result = decimate.decimate(self.data, self.pyramid, 1, 0, None, 32, 'minmax')
+        expected = _brute_minmax(self.x, self.y, 0, self.rows, 16)
+        self.assertTrue(np.array_equal(expected, result))
+        self.assertEqual([], self.data.reads)
+
+    def test_minmax_reads_raw_edges(self):
+        start, stop = 1001, 3003
+        result = decimate.decimate(self.data, self.pyramid, 1, start, stop, 100, 'minmax')
+        self.assertLessEqual(len(result), 100)
+        span = self.y[start:stop]
+        self.assertEqual(span.min(), result[:, 1].min())
+        self.assertEqual(span.max(), result[:, 1].max())
+        self.assertTrue(np.all(np.diff(result[:, 0]) > 0))
+        self.assertTrue(np.all(result[:, 0] >= start))
+        self.assertTrue(np.all(result[:, 0] < stop))
+        # only the partial buckets at the ends are read
+        for lo, hi in self.data.reads:
+            self.assertLess(hi - lo, 32)
+
+    def test_small_range_uses_rows(self):
+        result = decimate.decimate(self.data, self.pyramid, 1, 10, 50, 2000, 'minmax')
+        self.assertTrue(np.array_equal(np.column_stack((self.x, self.y))[10:50], result))
+
+    def test_lttb_on_rows(self):
+        result = decimate.decimate(self.data, self.pyramid, 1, 0, 1000, 400, 'lttb')
+        expected = _brute_lttb(self.x[:1000], self.y[:1000], 400)
+        self.assertTrue(np.array_equal(expected, result))
+
+    def test_lttb_on_pyramid(self):
+        result = decimate.decimate(self.data, self.pyramid, 1, 0, None, 50, 'lttb')
+        self.assertEqual(50, len(result))
+        self.assertTrue(np.all(np.diff(result[:, 0]) > 0))
+        self.assertTrue(set(result[:, 1]) <= set(self.y))
+
+    def test_empty_range(self):
+        result = decimate.decimate(self.data, self.pyramid, 1, self.rows, None, 10, 'minmax')
+        self.assertEqual((0, 2), result.shape)
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
@@ -0,0 +1,236 @@
+import mock
+import numpy as np
+import os
+import pytest
+import Queue
+import tempfile
+import threading
+import unittest
+
+from twisted.internet import defer, task
+from twisted.python import failure
+
+from datavault import Dataset, executor
+
+
+def _unique_dir():
+    return tempfile.mkdtemp(prefix='dvtest_')
+
+
+def _empty_and_remove_dir(*names):
+    for name in names:
+        if not os.path.exists(name):
+            continue
+        for listedname in os.listdir(name):
+            path = os.path.join(name, listedname)
+            if os.path.isdir(path):
+                _empty_and_remove_dir(name + '/' + listedname)
+            else:
+                os.remove(path)
+        os.rmdir(name)
+
+
+class _ThreadedClock(task.Clock):
+    """A Clock that also accepts calls from worker threads.
+
+    Calls from threads are queued until wait runs them, so tests can drive
+    the ThreadPoolExecutor without running a reactor.
+    """
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.thread_calls = Queue.Queue()
+
+    def callFromThread(self, f, *args, **kw):
+        self.thread_calls.put((f, args, kw))
+
+    def addSystemEventTrigger(self, *args, **kw):
+        pass
+
+    def wait(self, d, timeout=10):
+        """Run calls from threads until d fires, and return its result."""
+        results = []
+        d.addBoth(results.append)
+        while not results:
+            f, args, kw = self.thread_calls.get(timeout=timeout)
+            f(*args, **kw)
+        result = results[0]
+        if isinstance(result, failure.Failure):
+            result.raiseException()
+        return result
+
+
+class _MockFile(object):
+    """Stands in for a SelfClosingFile, counting holds."""
+    def __init__(self):
+        self.holds = 0
+        self.max_holds = 0
+
+    def hold(self):
+        self.holds += 1
+        self.max_holds = max(self.max_holds, self.holds)
+
+    def release(self):
+        self.holds -= 1
+
+
+class SynchronousExecutorTest(unittest.TestCase):
+
+    def test_run_returns_result(self):
+        d = executor.SynchronousExecutor().run(_MockFile(), lambda x: x + 1, 1)
+        self.assertEqual(2, _ThreadedClock().wait(d))
+
+    def test_run_returns_failure(self):
+        def fail():
+            raise ValueError('boom')
+        d = executor.SynchronousExecutor().run(_MockFile(), fail)
+        self.assertRaises(ValueError, _ThreadedClock().wait, d)
+
+
+class ThreadPoolExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = _ThreadedClock()
+        self.executor = executor.ThreadPoolExecutor(max_threads=4,
+                                                    reactor=self.clock)
+        self.executor.start()
+
+    def tearDown(self):
+        self.executor.stop()
+
+    def test_runs_in_worker_thread(self):
+        fh = _MockFile()
+        thread = self.clock.wait(self.executor.run(fh, threading.current_thread))
+        self.assertIsNot(threading.current_thread(), thread)
+        self.assertEqual(0, fh.holds)
+        self.assertEqual(1, fh.max_holds)
+
+    def test_passes_on_errors(self):
+        def fail():
+            raise ValueError('boom')
+        d = self.executor.run(_MockFile(), fail)
+        self.assertRaises(ValueError, self.clock.wait, d)
+        self.assertEqual({}, self.executor._locks)
+
+    def test_calls_on_one_file_are_serialized(self):
+        fh = _MockFile()
+        started = threading.Event()
+        unblock = threading.Event()
+        calls = []
+        def first():
+            started.set()
+            unblock.wait(10)
+            calls.append('first')
+        def second():
+            calls.append('second')
+        d1 = self.executor.run(fh, first)
+        d2 = self.executor.run(fh, second)
+        # a call on another file is not held up by the blocked one
+        self.clock.wait(self.executor.run(_MockFile(), calls.append, 'other'))
+        self.assertTrue(started.wait(10))
+        self.assertEqual(['other'], calls)
+        unblock.set()
+        self.clock.wait(defer.gatherResults([d1, d2]))
+        self.assertEqual(['other', 'first', 'second'], calls)
+        self.assertEqual(1, fh.max_holds)
+        self.assertEqual({}, self.executor._locks)
+
+
+class ConcurrentDatasetTest(unittest.TestCase):
+    """Readers and writers sharing datasets through the thread pool."""
+
+    _INDEPENDENTS = [('x', 'ms')]
+    _DEPENDENTS = [('y', 'Voltage', 'V'), ('z', 'Voltage', 'V')]
+
+    def setUp(self):
+        self.clock = _ThreadedClock()
+        self.executor = executor.ThreadPoolExecutor(max_threads=4,
+                                                    reactor=self.clock)
+        self.executor.start()
+        self.session = mock.MagicMock()
+        self.session.dir = _unique_dir()
+
+    def tearDown(self):
+        self.executor.stop()
+        _empty_and_remove_dir(self.session.dir)
+
+    def _dataset(self, name):
+        return Dataset(
+                self.session,
+                name,
+                title=name,
+                create=True,
+                independents=self._INDEPENDENTS,
+                dependents=self._DEPENDENTS,
+                reactor=self.clock,
+                io_executor=self.executor)
+
+    def _records(self, dataset, start, rows):
+        x = np.arange(start, start + rows, dtype=float)
+        return np.core.records.fromarrays([x, 2 * x, 3 * x],
+                                          dtype=dataset.data.dtype)
+
+    def _check_rows(self, data, rows):
+        self.assertEqual((rows, 3), data.shape)
+        x = np.arange(rows, dtype=float)
+        self.assertTrue(np.array_equal(x, data[:, 0]))
+        self.assertTrue(np.array_equal(3 * x, data[:, 2]))
+
+    def test_reads_during_appends(self):
+        big = self._dataset('big')
+        big.buffer_rows = 0
+        self.clock.wait(big.addData(self._records(big, 0, 200000)))
+        live = self._dataset('live')
+
+        reads = []
+        writes = []
+        for i in range(20):
+            reads.append(big.getData(None, 0, False, True))
+            writes.append(live.addData(self._records(live, 100 * i, 100)))
+        results = self.clock.wait(defer.gatherResults(reads))
+        self.clock.wait(defer.gatherResults(writes))
+
+        for data, pos in results:
+            self.assertEqual(200000, pos)
+            self._check_rows(data, 200000)
+        data, pos = self.clock.wait(live.getData(None, 0, False, True))
+        self.assertEqual(2000, pos)
+        self._check_rows(data, 2000)
+
+    def test_reads_see_earlier_writes(self):
+        dataset = self._dataset('foo')
+        dataset.buffer_rows = 0
+        reads = []
+        for i in range(10):
+            dataset.addData(self._records(dataset, 10 * i, 10))
+            reads.append(dataset.getData(None, 0, False, True))
+        results = self.clock.wait(defer.gatherResults(reads))
+        for i, (data, pos) in enumerate(results):
+            self.assertEqual(10 * (i + 1), pos)
+            self._check_rows(data, 10 * (i + 1))
+
+    def test_metadata_during_appends(self):
+        dataset = self._dataset('foo')
+        dataset.buffer_rows = 0
+        calls = []
+        for i in range(10):
+            calls.append(dataset.addData(self._records(dataset, 100 * i, 100)))
+            calls.append(dataset.addComment('user', 'comment {}'.format(i)))
+            calls.append(dataset.addParameter('p{}'.format(i), i))
+            calls.append(dataset.keepStreaming('listener', 100 * (i + 1)))
+        calls.append(dataset.keepStreaming('behind', 900))
+        self.clock.wait(defer.gatherResults(calls))
+        comments, pos = self.clock.wait(dataset.getComments(None, 0))
+        self.assertEqual(10, pos)
+        params = self.clock.wait(dataset.getParameters())
+        self.assertEqual([('p{}'.format(i), i) for i in range(10)], params)
+        data, pos = self.clock.wait(dataset.getData(None, 0, False, True))
+        self._check_rows(data, 1000)
+        # each keepStreaming saw the rows added before it
+        self.assertEqual(set(['listener']), set(dataset.listeners))
+        self.clock.advance(0)
+        [(_, contexts), _] = self.session.hub.onDataAvailable.call_args
+        self.assertIn('behind', contexts)
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
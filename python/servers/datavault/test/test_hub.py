@@ -0,0 +1,193 @@
+import pytest
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import task
+from labrad.server import Signal
+
+from datavault import SessionStore, hub
+from datavault.server import ExtendedContext
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.messages = []
+
+    def sendMessage(self, target, records, context):
+        for ID, data, tag in records:
+            self.messages.append((context, data))
+
+
+class FakeServer(object):
+    """A DataVaultMultiHead connected to a manager, as the hub sees it."""
+
+    def __init__(self, port):
+        self.host = 'localhost'
+        self.port = port
+        self._cxn = FakeConnection()
+        for name in hub.SIGNALS:
+            signal = Signal(1, name, '')
+            signal.parent = self
+            setattr(self, name, signal)
+
+    def listen(self, signal, *contexts):
+        for context in contexts:
+            getattr(self, signal).connect(context, 'client', 1)
+        return [ExtendedContext(self, context) for context in contexts]
+
+    @property
+    def messages(self):
+        return self._cxn.messages
+
+
+class SignalHubTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.hub = hub.SignalHub(reactor=self.clock, maxQueued=5)
+        self.servers = [FakeServer(7682 + i) for i in range(3)]
+        for server in self.servers:
+            self.hub.connect(server)
+
+    def test_signals_go_through_their_own_manager(self):
+        a, b, c = self.servers
+        contexts = (a.listen('onNewDir', (1, 1), (1, 2)) +
+                    b.listen('onNewDir', (1, 1)))
+        self.hub.onNewDir('x', contexts)
+        self.hub.onNewDir('y', contexts[:1])
+        self.assertEqual([], a.messages)
+        self.clock.advance(0)
+        self.assertEqual([((1, 1), 'x'), ((1, 1), 'y'), ((1, 2), 'x')],
+                         sorted(a.messages))
+        self.assertEqual([((1, 1), 'x')], b.messages)
+        self.assertEqual([], c.messages)
+
+    def test_identical_signals_are_merged(self):
+        a, b, _ = self.servers
+        contexts = a.listen('onDataAvailable', (1, 1), (1, 2))
+        for _ in range(10):
+            self.hub.onDataAvailable(None, contexts)
+        self.hub.onTagsUpdated(([('d', ['x'])], []), a.listen('onTagsUpdated', (1, 1)))
+        self.hub.onTagsUpdated(([('d', ['x'])], []), a.listen('onTagsUpdated', (1, 1)))
+        self.clock.advance(0)
+        self.assertEqual(3, len(a.messages))
+        self.assertEqual([('localhost', a.port, False, 0, 3, 19, 0),
+                          ('localhost', b.port, False, 0, 0, 0, 0)],
+                         self.hub.stats()[:2])
+
+    def test_stalled_manager_does_not_hold_up_others(self):
+        a, b, _ = self.servers
+        slow = a.listen('onNewDataset', *[(1, i) for i in range(4)])
+        fast = b.listen('onNewDataset', (1, 1))
+        self.hub.keepaliveSent(a)
+        self.hub.keepaliveSent(b)
+        self.hub.keepaliveAnswered(b)
+        self.clock.advance(120)
+        self.hub.keepaliveSent(a) # the first one was never answered
+        self.hub.keepaliveSent(b)
+        self.hub.onNewDataset('one', slow + fast)
+        self.hub.onNewDataset('two', slow[:2] + fast)
+        self.clock.advance(0)
+        self.assertEqual([((1, 1), 'one'), ((1, 1), 'two')], b.messages)
+        self.assertEqual([], a.messages)
+        # too many queued: the oldest signal goes
+        self.assertEqual((True, 2, 0, 4), self.hub.stats()[0][2:4] + self.hub.stats()[0][5:])
+
+        self.clock.advance(1)
+        self.hub.keepaliveAnswered(a)
+        self.clock.advance(0)
+        self.assertEqual([((1, 0), 'two'), ((1, 1), 'two')], sorted(a.messages))
+        self.assertFalse(self.hub.stats()[0][2])
+
+    def test_dropped_streamed_rows_leave_a_gap(self):
+        a, _, _ = self.servers
+        [streaming] = a.listen('onDataStreamed', (1, 1))
+        [other] = a.listen('onNewDir', (1, 2))
+        self.hub.keepaliveSent(a)
+        self.clock.advance(120)
+        self.hub.keepaliveSent(a)
+        for i in range(7):
+            self.hub.onDataStreamed((10 * i, 10, '<f8', 'rows {}'.format(i)),
+                                    [streaming])
+        self.hub.onNewDir('x', [other])
+        self.clock.advance(1)
+        self.hub.keepaliveAnswered(a)
+        self.clock.advance(0)
+        # the first three messages are replaced by one without rows
+        self.assertEqual([((1, 1), (0, 30, '<f8', ''))] +
+                         [((1, 1), (10 * i, 10, '<f8', 'rows {}'.format(i)))
+                          for i in range(3, 7)] +
+                         [((1, 2), 'x')], a.messages)
+
+    def test_slow_and_failed_keepalives(self):
+        a, b, _ = self.servers
+        contexts = a.listen('onNewDir', (1, 1))
+        self.hub.keepaliveSent(a)
+        self.clock.advance(hub.SLOW_KEEPALIVE + 1)
+        self.hub.keepaliveAnswered(a)
+        self.hub.onNewDir('x', contexts)
+        self.clock.advance(0)
+        self.assertEqual([], a.messages)
+        self.hub.keepaliveSent(a)
+        self.hub.keepaliveAnswered(a)
+        self.clock.advance(0)
+        self.assertEqual([((1, 1), 'x')], a.messages)
+        self.hub.keepaliveSent(b)
+        self.hub.keepaliveFailed(b)
+        self.assertTrue(self.hub.stats()[1][2])
+
+    def test_disconnected_manager(self):
+        a, b, _ = self.servers
+        contexts = a.listen('onNewDir', (1, 1)) + b.listen('onNewDir', (1, 1))
+        self.hub.onNewDir('x', contexts)
+        self.hub.disconnect(a)
+        self.hub.onNewDir('y', contexts)
+        self.clock.advance(0)
+        self.assertEqual([], a.messages)
+        self.assertEqual([((1, 1), 'x'), ((1, 1), 'y')], b.messages)
+        self.assertEqual(1, self.hub.unrouted)
+
+    def test_broadcast(self):
+        a, b, c = self.servers
+        a.listen('onNewDir', (1, 1), (1, 2))
+        contexts = b.listen('onNewDir', (1, 1))
+        self.hub.onNewDir('x', contexts)
+        self.hub.onNewDir('x')
+        self.clock.advance(0)
+        self.assertEqual(2, len(a.messages))
+        self.assertEqual([((1, 1), 'x')], b.messages)
+        self.assertEqual([], c.messages)
+
+
+class SharedStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp(prefix='dvtest')
+        self.clock = task.Clock()
+        self.hub = hub.SignalHub(reactor=self.clock)
+        self.store = SessionStore(self.datadir, self.hub, reactor=self.clock)
+        self.servers = [FakeServer(7682 + i) for i in range(2)]
+        for server in self.servers:
+            self.hub.connect(server)
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def test_dataset_signals(self):
+        session = self.store.get([''])
+        dataset = session.newDataset('x', ['t [s]'], ['v (x) [V]'])
+        for server in self.servers:
+            for context in server.listen('onDataAvailable', (1, 1), (2, 1)):
+                dataset.listeners.add(context)
+        dataset.addData([[0.0, 1.0]])
+        dataset.addData([[1.0, 2.0]])
+        self.clock.advance(0)
+        self.clock.advance(0)
+        for server in self.servers:
+            self.assertEqual([((1, 1), None), ((2, 1), None)],
+                             sorted(server.messages))
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
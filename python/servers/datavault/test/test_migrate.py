@@ -0,0 +1,165 @@
+import h5py
+import numpy as np
+import os
+import pytest
+import shutil
+import tempfile
+import time
+import unittest
+
+from twisted.internet import task
+
+from datavault import backend, migrate
+
+
+_INDEPENDENTS = [
+    backend.Independent(label='x', shape=(1,), datatype='v', unit='s')]
+_DEPENDENTS = [
+    backend.Dependent(label='y', legend='a', shape=(1,), datatype='v', unit='V'),
+    backend.Dependent(label='y', legend='b', shape=(1,), datatype='v', unit='')]
+
+
+class MigrateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp(prefix='dvtest')
+        self.clock = task.Clock()
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def _make_csv_dataset(self, relpath, rows):
+        base = os.path.join(self.datadir, relpath)
+        if not os.path.exists(os.path.dirname(base)):
+            os.makedirs(os.path.dirname(base))
+        data = backend.CsvNumpyData(base + '.csv', reactor=self.clock)
+        data.initialize_info('Title of ' + relpath, _INDEPENDENTS, _DEPENDENTS)
+        data.addParam('gain', 2.5)
+        data.addParam('names', ['a', 'b'])
+        data.addComment('someone', 'first')
+        data.addComment('someone else', 'second')
+        values = np.column_stack((np.arange(rows) * 0.1, np.sin(np.arange(rows)),
+                                  np.arange(rows) ** 2))
+        if rows:
+            data.addData(values)
+        data.save()
+        data._file.close()
+        return base, values
+
+    def test_find_csv_datasets(self):
+        a, _ = self._make_csv_dataset('00001 - a', 3)
+        b, _ = self._make_csv_dataset('sub.dir/00001 - b', 3)
+        self.assertEqual([a, b], migrate.find_csv_datasets(self.datadir))
+        migrate.convert_dataset(a)
+        self.assertEqual([b], migrate.find_csv_datasets(self.datadir))
+
+    def test_convert_copies_rows_and_metadata(self):
+        base, values = self._make_csv_dataset('00001 - a', 25)
+        csv_data = backend.CsvNumpyData(base + '.csv', reactor=self.clock)
+        csv_data.load()
+
+        self.assertEqual(25, migrate.convert_dataset(base, chunk_rows=7))
+        data = backend.open_backend(base)
+        self.assertIsInstance(data, backend.SimpleHDF5Data)
+        read, _ = data.getData(None, 0, False, False)
+        np.testing.assert_array_equal(csv_data.data, read)
+        self.assertEqual('Title of 00001 - a', data.dataset.attrs['Title'])
+        self.assertEqual(
+            [(i.label, i.unit) for i in _INDEPENDENTS],
+            [(i.label, i.unit) for i in data.getIndependents()])
+        self.assertEqual(
+            [(d.label, d.legend, d.unit) for d in _DEPENDENTS],
+            [(d.label, d.legend, d.unit) for d in data.getDependents()])
+        self.assertEqual(2.5, data.getParameter('gain'))
+        self.assertEqual(['a', 'b'], data.getParameter('names'))
+        comments, _ = data.getComments(None, 0)
+        self.assertEqual([c[1:] for c in csv_data.comments], [c[1:] for c in comments])
+        for (t0, _, _), (t1, _, _) in zip(csv_data.comments, comments):
+            self.assertLess(abs((t0 - t1).total_seconds()), 1e-3)
+        self.assertAlmostEqual(time.mktime(csv_data.created.timetuple()),
+                               data.dataset.attrs['Creation Time'], delta=1)
+        # the csv files are kept
+        self.assertTrue(os.path.exists(base + '.csv'))
+        self.assertTrue(os.path.exists(base + '.ini'))
+
+    def test_convert_empty_dataset(self):
+        base, _ = self._make_csv_dataset('00001 - a', 0)
+        self.assertEqual(0, migrate.convert_dataset(base))
+        data = backend.open_backend(base)
+        self.assertEqual(0, len(data))
+
+    def test_failed_verification_leaves_no_file(self):
+        base, _ = self._make_csv_dataset('00001 - a', 10)
+        original = migrate._hdf5_chunks
+        def corrupted(filename, chunk_rows):
+            for chunk in original(filename, chunk_rows):
+                yield chunk + 1
+        migrate._hdf5_chunks = corrupted
+        try:
+            self.assertRaises(migrate.MigrationError, migrate.convert_dataset, base)
+        finally:
+            migrate._hdf5_chunks = original
+        self.assertFalse(os.path.exists(base + '.hdf5'))
+        self.assertFalse(os.path.exists(base + migrate.PARTIAL_SUFFIX))
+        self.assertIsInstance(backend.open_backend(base), backend.CsvNumpyData)
+
+    def test_incomplete_row_is_an_error(self):
+        base, _ = self._make_csv_dataset('00001 - a', 10)
+        with open(base + '.csv', 'ab') as f:
+            f.write('1,2')
+        self.assertRaises(migrate.MigrationError, migrate.convert_dataset, base)
+        self.assertFalse(os.path.exists(base + '.hdf5'))
+
+    def test_modified_csv_is_preferred(self):
+        base, _ = self._make_csv_dataset('00001 - a', 10)
+        migrate.convert_dataset(base)
+        self.assertIsInstance(backend.open_backend(base), backend.SimpleHDF5Data)
+        later = os.path.getmtime(base + '.hdf5') + 10
+        os.utime(base + '.csv', (later, later))
+        self.assertIsInstance(backend.open_backend(base), backend.CsvNumpyData)
+
+    def test_migrate_tree_in_worker_processes(self):
+        bases = [self._make_csv_dataset('{:05d} - d.dir/00001 - x'.format(i), 5 * i)[0]
+                 for i in range(4)]
+        progress = []
+        def on_progress(done, total, base, rows, error, seconds):
+            progress.append((done, total, error))
+        results = migrate.migrate_tree(self.datadir, processes=2, chunk_rows=3,
+                                       progress=on_progress)
+        self.assertEqual(sorted((b, 5 * i, None) for i, b in enumerate(bases)),
+                         sorted(results))
+        self.assertEqual([(i + 1, 4, None) for i in range(4)], progress)
+        for base in bases:
+            self.assertTrue(os.path.exists(base + '.hdf5'))
+        self.assertEqual([], migrate.migrate_tree(self.datadir, processes=1))
+
+    def test_repack(self):
+        old, values = self._make_csv_dataset('00001 - old', 10)
+        migrate.convert_dataset(old)
+        new, _ = self._make_csv_dataset('00002 - new', 10)
+        self.assertEqual(10, migrate.convert_dataset(new, chunk_rows=3, repack=True))
+        with h5py.File(new + '.hdf5', 'r') as f:
+            self.assertIsNone(f['DataVault'].chunks)
+        self.assertEqual([old + '.hdf5', new + '.hdf5'],
+                         migrate.find_hdf5_datasets(self.datadir, min_age=0))
+        self.assertEqual([], migrate.find_hdf5_datasets(self.datadir))
+        results = migrate.repack_tree(self.datadir, processes=1, min_age=0)
+        self.assertEqual([(old + '.hdf5', 10, None), (new + '.hdf5', None, None)],
+                         results)
+        data = backend.open_backend(old)
+        self.assertIsNotNone(data._memmap())
+        np.testing.assert_array_almost_equal(values, data.getData(None, 0, False, False)[0])
+        self.assertEqual(2.5, data.getParameter('gain'))
+
+    def test_errors_are_reported(self):
+        base, _ = self._make_csv_dataset('00001 - a', 10)
+        with open(base + '.ini', 'w') as f:
+            f.write('garbage')
+        [(found, rows, error)] = migrate.migrate_tree(self.datadir, processes=1)
+        self.assertEqual(base, found)
+        self.assertIsNone(rows)
+        self.assertTrue(error)
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
@@ -0,0 +1,212 @@
+import datetime
+import mock
+import os
+import pytest
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from twisted.internet import task
+
+from datavault import SessionStore, backend, errors, search
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='dvtest')
+        self.filename = os.path.join(self.dir, search.SEARCH_INDEX_FILE)
+        self.index = search.SearchIndex(self.filename)
+        self.index.addDataset([''], '00001 - rabi', 'rabi', 100.0,
+                              ['time', 'P1', 'qubit A'],
+                              params=[('qubit', 'q1'), ('power', 5.0)],
+                              tags=set(['good']))
+        self.index.addDataset(['', 'cooldown', 'q2'], '00001 - ramsey', 'ramsey',
+                              200.0, ['time', 'P1', 'qubit B'],
+                              params=[('qubit', 'q2')])
+        self.index.addDataset(['', 'cooldown'], '00002 - T1', 'T1', 300.0,
+                              ['delay', 'P1', 'qubit A'])
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.dir)
+
+    def _names(self, **kw):
+        return [name for _, name in self.index.search(**kw)]
+
+    def test_text_search(self):
+        self.assertEqual(['00001 - ramsey', '00001 - rabi'], self._names(text='time'))
+        self.assertEqual(['00002 - T1', '00001 - rabi'], self._names(text='A'))
+        self.assertEqual(['00001 - ramsey', '00001 - rabi'],
+                         self._names(text='ramsey OR rabi'))
+        self.assertEqual(['00001 - ramsey'], self._names(text='q2'))
+        self.assertEqual(['00002 - T1', '00001 - ramsey', '00001 - rabi'],
+                         self._names())
+        self.assertRaises(errors.BadSearchError, self.index.search, text='"')
+
+    def test_tags_params_and_times(self):
+        self.assertEqual(['00001 - rabi'], self._names(tags=['good']))
+        self.assertEqual(['00002 - T1', '00001 - ramsey'], self._names(tags=['-good']))
+        self.assertEqual(['00001 - ramsey'], self._names(params=[('qubit', 'q2')]))
+        self.assertEqual(['00001 - ramsey', '00001 - rabi'],
+                         self._names(params=[('qubit', '')]))
+        self.assertEqual(['00001 - rabi'], self._names(params=[('power', '5.0')]))
+        self.assertEqual(['00001 - ramsey'], self._names(after=150, before=300))
+        self.assertEqual(['00002 - T1'], self._names(limit=1))
+
+    def test_search_under_directory(self):
+        results = self.index.search(under=['', 'cooldown'])
+        self.assertEqual([(['', 'cooldown'], '00002 - T1'),
+                          (['', 'cooldown', 'q2'], '00001 - ramsey')], results)
+        self.assertEqual([], self.index.search(under=['', 'cool']))
+        self.assertEqual(3, len(self.index.search(under=[''])))
+
+    def test_updates(self):
+        self.index.setTags([''], '00001 - rabi', set(['bad']))
+        self.assertEqual([], self._names(tags=['good']))
+        self.assertEqual(['00001 - rabi'], self._names(text='bad'))
+        self.index.addParameters(['', 'cooldown'], '00002 - T1', [('qubit', 'q1')])
+        self.assertEqual(['00002 - T1', '00001 - rabi'], self._names(text='q1'))
+        self.index.remove([''], '00001 - rabi')
+        self.assertEqual(['00002 - T1'], self._names(text='q1'))
+        self.assertEqual(2, len(self.index))
+
+    def test_index_is_kept(self):
+        self.index.close()
+        self.index = search.SearchIndex(self.filename)
+        self.assertEqual(3, len(self.index))
+        self.assertEqual(['00001 - ramsey'], self._names(text='ramsey'))
+
+
+class CrawlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp(prefix='dvtest')
+        self.index = search.SearchIndex(
+                os.path.join(self.datadir, search.SEARCH_INDEX_FILE))
+        self.clock = task.Clock()
+        # a store without the index stands in for older versions
+        self.store = SessionStore(self.datadir, mock.MagicMock(), reactor=self.clock)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.datadir)
+
+    def test_crawl(self):
+        session = self.store.get(['', 'a/b'])
+        dataset = session.newDataset('sweep', ['f [GHz]'], ['S21 (mag) [dB]'])
+        dataset.addParameter('bias', 0.5)
+        session.updateTags(['nice'], [], [dataset.name])
+        session.info.flush()
+        base = os.path.join(self.datadir, 'csv')
+        data = backend.CsvNumpyData(base + '.csv', reactor=self.clock)
+        data.initialize_info('old scan', [backend.Independent('x', [1], 'v', 's')],
+                             [backend.Dependent('y', 'z', [1], 'v', 'V')])
+        data.addParam('attenuation', 20)
+        data.save()
+        data._file.close()
+
+        self.assertEqual(2, search.crawl(self.index, self.datadir))
+        self.assertEqual([(['', 'a/b'], dataset.name)],
+                         self.index.search(text='S21 bias nice'))
+        [(path, name)] = self.index.search(params=[('attenuation', '20')])
+        self.assertEqual(([''], 'csv'), (path, name))
+        self.assertEqual([(['', 'a/b'], dataset.name)],
+                         self.index.search(after=time.time() - 60, under=['', 'a/b']))
+
+        # only changed files are read again
+        self.assertEqual(0, search.crawl(self.index, self.datadir))
+        session.updateTags(['-nice'], [], [dataset.name])
+        session.info.flush()
+        os.remove(base + '.csv')
+        os.remove(base + '.ini')
+        self.assertEqual(0, search.crawl(self.index, self.datadir))
+        self.assertEqual([], self.index.search(text='nice'))
+        self.assertEqual(1, len(self.index))
+
+    def test_crawl_keeps_datasets_created_since_listing(self):
+        store = SessionStore(self.datadir, mock.MagicMock(), reactor=self.clock,
+                             search_index=self.index)
+        session = store.get([''])
+        listed = time.time() - 1
+        dataset = session.newDataset('sweep', ['f [GHz]'], ['S21 (mag) [dB]'])
+        # as if the directory was listed before the dataset was created
+        self.index.updateDirectory([''], [], {}, set(), listed)
+        self.assertEqual([([''], dataset.name)], self.index.search(text='S21'))
+        # once it is indexed from its file, it is dropped when it is gone
+        search.crawl(self.index, self.datadir)
+        self.index.updateDirectory([''], [], {}, set(), listed)
+        self.assertEqual(1, len(self.index))
+        self.index.updateDirectory([''], [], {}, set(), time.time() + 1)
+        self.assertEqual(0, len(self.index))
+
+    def test_crawl_keeps_tags_not_yet_saved(self):
+        store = SessionStore(self.datadir, mock.MagicMock(), reactor=self.clock,
+                             search_index=self.index)
+        session = store.get([''])
+        dataset = session.newDataset('sweep', ['f [GHz]'], ['S21 (mag) [dB]'])
+        session.info.flush()
+        search.crawl(self.index, self.datadir)
+        infofile = session.infofile
+        saved = os.path.getmtime(infofile) - 10
+        os.utime(infofile, (saved, saved))
+        # session.ini is saved later, so it does not have the tag yet
+        session.updateTags(['nice'], [], [dataset.name])
+        search.crawl(self.index, self.datadir)
+        self.assertEqual([([''], dataset.name)], self.index.search(tags=['nice']))
+        # also when the dataset itself is read again
+        base = os.path.join(session.dir, dataset.name)
+        os.utime(base + '.hdf5', None)
+        self.assertEqual(1, search.crawl(self.index, self.datadir))
+        self.assertEqual([([''], dataset.name)], self.index.search(tags=['nice']))
+        # tags saved since are taken from the file
+        session.updateTags(['-nice'], [], [dataset.name])
+        session.info.flush()
+        later = time.time() + 10
+        os.utime(infofile, (later, later))
+        self.index.setTags([''], dataset.name, set(['stale']))
+        search.crawl(self.index, self.datadir)
+        self.assertEqual([], self.index.search(tags=['stale']))
+
+    def test_dataset_opens_while_crawl_reads_it(self):
+        session = self.store.get([''])
+        dataset = session.newDataset('sweep', ['f [GHz]'], ['S21 (mag) [dB]'])
+        dataset.data._file.close()
+        reading = threading.Event()
+        done = threading.Event()
+        def variable_words(meta):
+            # the crawl has the file open read-only now
+            reading.set()
+            done.wait(5)
+            return words(meta)
+        words = search.variable_words
+        with mock.patch.object(search, 'variable_words', variable_words):
+            crawler = threading.Thread(target=search.crawl,
+                                       args=(self.index, self.datadir))
+            crawler.start()
+            self.assertTrue(reading.wait(5))
+            threading.Timer(0.1, done.set).start()
+            # both wait for the crawl to close the file
+            dataset.data._file()
+            data = backend.open_backend(os.path.join(session.dir, dataset.name))
+            crawler.join(5)
+        self.assertEqual('sweep', data.dataset.attrs['Title'])
+        self.assertEqual([([''], dataset.name)], self.index.search(text='S21'))
+
+    def test_live_updates(self):
+        store = SessionStore(self.datadir, mock.MagicMock(), reactor=self.clock,
+                             search_index=self.index)
+        session = store.get([''])
+        dataset = session.newDataset('sweep', ['f [GHz]'], ['S21 (mag) [dB]'])
+        self.assertEqual([([''], dataset.name)], self.index.search(text='S21'))
+        dataset.addParameters([('bias', 0.5), ('gain', 'high')])
+        session.updateTags(['^nice'], [], [dataset.name])
+        self.assertEqual([([''], dataset.name)],
+                         self.index.search(text='high', tags=['nice'],
+                                           params=[('bias', '0.5')]))
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
@@ -1,3 +1,5 @@
+import datetime
+import gc
 import mock
 import numpy as np
 import os
@@ -9,8 +11,10 @@ from twisted.internet import reactor, task
 
 from labrad.server import LabradServer, Signal, setting
 from labrad import server
+from labrad import units as U
 
-from datavault import backend, errors, server, SessionStore
+from datavault import backend, errors, search, server, SessionInfo, SessionStore
+from datavault.testing import Context, result
 
 
 def _unique_dir():
@@ -38,11 +42,6 @@ def _empty_and_remove_dir(*names):
         os.rmdir(name)
 
 
-class MockContext(dict):
-    def __init__(self, name='test-context'):
-        self.ID = name
-
-
 class DataVaultTest(unittest.TestCase):
     '''Tests for the datavault server.'''
 
@@ -53,7 +52,7 @@ class DataVaultTest(unittest.TestCase):
         self.datavault = server.DataVault(self.store)
         self.set_default_labrad_server_mocks(self.datavault)
 
-        self.context = MockContext()
+        self.context = Context()
 
         self.datavault.initServer()
 
@@ -155,6 +154,53 @@ class DataVaultTest(unittest.TestCase):
         self.assertEqual(
                 '(*v[ms],*v[eV])', self.datavault.transpose_type(self.context))
 
+    def test_file_pool_stats(self):
+        self.datavault.initContext(self.context)
+        before = dict(self.datavault.file_pool_stats(self.context))
+        self.datavault.new(self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        stats = dict(self.datavault.file_pool_stats(self.context))
+        self.assertEqual(backend.FILE_POOL_MAX_OPEN, stats['max open'])
+        self.assertEqual(before['misses'] + 1, stats['misses'])
+        self.assertGreater(stats['hits'], before['hits'])
+        self.assertGreaterEqual(stats['open'], 1)
+
+    def test_block_cache_stats(self):
+        self.datavault.initContext(self.context)
+        _, name = self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        self.datavault.add(self.context, [[0.0, 1.0], [1.0, 2.0]])
+        before = dict(self.datavault.block_cache_stats(self.context))
+        # the first read bypasses the cache, the second fills it
+        for i in range(3):
+            result(self.datavault.open(self.context, name))
+            result(self.datavault.get(self.context))
+        stats = dict(self.datavault.block_cache_stats(self.context))
+        self.assertEqual(before['misses'] + 4, stats['misses'])
+        self.assertEqual(before['hits'] + 2, stats['hits'])
+        self.assertGreater(stats['resident bytes'], 0)
+        self.assertGreater(stats['hit ratio'], 0)
+
+    def test_create_dataset_with_storage_profile(self):
+        self.datavault.initContext(self.context)
+        self.assertIn('gzip', self.datavault.storage_profiles(self.context))
+        self.datavault.new_ex(
+                self.context,
+                'foo',
+                [('x', [1], 'v', 'ms')],
+                [('y', 'E', [1], 'v', 'eV')],
+                profile='gzip')
+        dataset = self.datavault.getDataset(self.context)
+        self.assertEqual('gzip', dataset.data.dataset.compression)
+
+        self.assertRaises(
+                errors.BadStorageProfileError,
+                self.datavault.new,
+                self.context,
+                'bar',
+                [('x', 'ms')],
+                [('y', 'E', 'eV')],
+                profile='no such profile')
+
     def test_expire_context(self):
         # Create the root session.
         self.datavault.initContext(self.context)
@@ -174,6 +220,64 @@ class DataVaultTest(unittest.TestCase):
         # Check the dataset doesn't have anymore listeners.
         self.assertEqual(set([]), dataset.listeners)
 
+    def test_expire_context_flushes_data(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        dataset = self.datavault.getDataset(self.context)
+        self.datavault.add(self.context, [(.1, .2)])
+        self.assertEqual(1, dataset.numPending())
+        self.datavault.expireContext(self.context)
+        self.assertEqual(0, dataset.numPending())
+        self.assertEqual(1, len(dataset.data))
+
+    def test_flush(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        dataset = self.datavault.getDataset(self.context)
+        self.datavault.add(self.context, [(.1, .2)])
+        self.datavault.flush(self.context)
+        self.assertEqual(0, dataset.numPending())
+        self.assertEqual(1, len(dataset.data))
+
+        # everything is flushed when the server stops
+        self.datavault.add(self.context, [(.3, .4)])
+        self.assertEqual(1, dataset.numPending())
+        self.datavault.stopServer()
+        self.assertEqual(0, dataset.numPending())
+        self.assertEqual(2, len(dataset.data))
+
+    def test_flush_after_session_is_gone(self):
+        self.datavault.initContext(self.context)
+        self.datavault.cd(self.context, 'sub', True)
+        _path, name = self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        self.datavault.add(self.context, [(.1, .2)])
+        # only the flush timer of the dataset refers to it now
+        self.context = Context()
+        gc.collect()
+        self.assertNotIn(('', 'sub'), [s.path for s in self.store.get_all()])
+        self.datavault.flushAll()
+        self.assertEqual(set(), self.store.unwritten)
+        dataset = self.store.get(['', 'sub']).openDataset(name)
+        self.assertEqual(1, len(dataset.data))
+
+    def test_flush_tags_after_session_is_gone(self):
+        self.datavault.initContext(self.context)
+        self.datavault.cd(self.context, 'sub', True)
+        _path, name = self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        self.datavault.update_tags(self.context, 'a', [], [name])
+        infofile = self.datavault.getSession(self.context).infofile
+        self.context = Context()
+        gc.collect()
+        self.assertNotIn(('', 'sub'), [s.path for s in self.store.get_all()])
+        self.datavault.flushAll()
+        self.assertEqual({}, self.store.unsaved_info)
+        info = SessionInfo(infofile)
+        self.assertEqual({name: set(['a'])}, info.dataset_tags)
+
     def test_get_dataset_not_yet_created(self):
         self.datavault.initContext(self.context)
         self.assertRaises(
@@ -239,25 +343,25 @@ class DataVaultTest(unittest.TestCase):
         # Add two rows of data.
         self.datavault.add(self.context, [(.1, .2, .3), (.4, .5, .6)])
         # Check that the data is there.
-        data = self.datavault.get(self.context)
+        data = result(self.datavault.get(self.context))
         self.assertArrayEqual([[.1, .2, .3], [.4, .5, .6]], data)
-        more_data = self.datavault.get(self.context)
+        more_data = result(self.datavault.get(self.context))
         self.assertArrayEqual([], more_data)
 
         # Check that data can be fetched incrementally.
-        row_1 = self.datavault.get(self.context, limit=1, startOver=True)
-        row_2 = self.datavault.get(self.context, limit=1)
+        row_1 = result(self.datavault.get(self.context, limit=1, startOver=True))
+        row_2 = result(self.datavault.get(self.context, limit=1))
         self.assertArrayEqual([[.1, .2, .3]], row_1)
         self.assertArrayEqual([[.4, .5, .6]], row_2)
 
         # Check that the data can be fetched in extended format.
-        data_ex = self.datavault.get_ex(self.context, startOver=True)
+        data_ex = result(self.datavault.get_ex(self.context, startOver=True))
         self.assertArrayEqual([[.1, .2, .3], [.4, .5, .6]], data_ex)
 
         # Check that the data can not be fetched in extended transpose format.
         self.assertRaises(
                 RuntimeError,
-                self.datavault.get_ex_t,
+                lambda *a, **kw: result(self.datavault.get_ex_t(*a, **kw)),
                 self.context,
                 startOver=True)
 
@@ -275,21 +379,21 @@ class DataVaultTest(unittest.TestCase):
         self.datavault.add_ex(self.context, [data_row_1, data_row_2])
 
         # Check that the data is there.
-        data = self.datavault.get_ex(self.context)
+        data = result(self.datavault.get_ex(self.context))
         self.assertDataRowEqual(data_row_1, data[0])
         self.assertDataRowEqual(data_row_2, data[1])
 
-        more_data = self.datavault.get_ex(self.context)
+        more_data = result(self.datavault.get_ex(self.context))
         self.assertArrayEqual([], more_data)
 
         # Check that data can be fetched incrementally.
-        row_1 = self.datavault.get_ex(self.context, limit=1, startOver=True)
-        row_2 = self.datavault.get_ex(self.context, limit=1)
+        row_1 = result(self.datavault.get_ex(self.context, limit=1, startOver=True))
+        row_2 = result(self.datavault.get_ex(self.context, limit=1))
         self.assertDataRowEqual(data_row_1, row_1[0])
         self.assertDataRowEqual(data_row_2, row_2[0])
 
         # Check that the data can be fetched in transpose format.
-        data_t = self.datavault.get_ex_t(self.context, startOver=True)
+        data_t = result(self.datavault.get_ex_t(self.context, startOver=True))
         expected_x = [[[.1, .5], [.5, .9]], [[.3, .4], [.4, .8]]]
         expected_y = [2, 3]
         expected_z =  [[[.1j, 2j]], [[.3j, 5j]]]
@@ -300,7 +404,7 @@ class DataVaultTest(unittest.TestCase):
         # Extended data format cannot be read as simple data.
         self.assertRaises(
                 errors.DataVersionMismatchError,
-                self.datavault.get,
+                lambda *a, **kw: result(self.datavault.get(*a, **kw)),
                 self.context)
 
     def test_add_extended_data_transpose(self):
@@ -320,21 +424,21 @@ class DataVaultTest(unittest.TestCase):
         # Check that the data is there as non-transposed data.
         data_row_1 = ([[.1, .5], [.5, .9]], 2, [[.1j, 2j]])
         data_row_2 = ([[.3, .4], [.4, .8]], 3, [[.3j, 5j]])
-        data = self.datavault.get_ex(self.context)
+        data = result(self.datavault.get_ex(self.context))
         self.assertDataRowEqual(data_row_1, data[0])
         self.assertDataRowEqual(data_row_2, data[1])
 
-        more_data = self.datavault.get_ex(self.context)
+        more_data = result(self.datavault.get_ex(self.context))
         self.assertArrayEqual([], more_data)
 
         # Check that data can be fetched incrementally.
-        row_1 = self.datavault.get_ex(self.context, limit=1, startOver=True)
-        row_2 = self.datavault.get_ex(self.context, limit=1)
+        row_1 = result(self.datavault.get_ex(self.context, limit=1, startOver=True))
+        row_2 = result(self.datavault.get_ex(self.context, limit=1))
         self.assertDataRowEqual(data_row_1, row_1[0])
         self.assertDataRowEqual(data_row_2, row_2[0])
 
         # Check that the data can be fetched in transpose format.
-        data_t = self.datavault.get_ex_t(self.context, startOver=True)
+        data_t = result(self.datavault.get_ex_t(self.context, startOver=True))
         self.assertArrayEqual(x, data_t[0])
         self.assertArrayEqual(y, data_t[1])
         self.assertArrayEqual(z, data_t[2])
@@ -342,8 +446,241 @@ class DataVaultTest(unittest.TestCase):
         # Extended data format cannot be read as simple data.
         self.assertRaises(
                 errors.DataVersionMismatchError,
-                self.datavault.get,
+                lambda *a, **kw: result(self.datavault.get(*a, **kw)),
                 self.context)
 
+    def test_add_strings_and_timestamps(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(
+                self.context, 'foo',
+                [('t', [1], 't', ''), ('name', [1], 's8', '')],
+                [('note', 'N', [1], 's', '')])
+        times = [datetime.datetime(2016, 2, 29, 12, 30, 15, 123456),
+                 datetime.datetime(2016, 3, 1)]
+        micros = [1456749015123456, 1456790400000000]
+        self.datavault.add_ex(self.context, [(times[0], 'a', 'first'),
+                                             (times[1], 'bb', 'second')])
+        self.datavault.add_ex_t(self.context, [times, ['c', 'dd'], ['x', 'y']])
+        # timestamps are read back as microseconds since 1970
+        rows = result(self.datavault.get_ex(self.context))
+        self.assertEqual([(micros[0], 'a', 'first'), (micros[1], 'bb', 'second'),
+                          (micros[0], 'c', 'x'), (micros[1], 'dd', 'y')], rows)
+        columns = result(self.datavault.get_ex_t(self.context, startOver=True))
+        self.assertEqual(micros * 2, list(columns[0]))
+        self.assertEqual(['a', 'bb', 'c', 'dd'], columns[1])
+        independents, _ = self.datavault.variables_ex(self.context)
+        self.assertEqual('s', independents[1].datatype)
+        self.assertRaises(errors.BadColumnDataError, self.datavault.add_ex,
+                          self.context, [(times[0], 'too long!', '')])
+
+    def test_add_and_get_raw_data(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(
+                self.context,
+                'foo',
+                [('x', [2, 2], 'v', 'ms'), ('y', [1], 'i', '')],
+                [('z', 'E',  [1, 2], 'c', 'eV'), ('t', 'T', [1], 't', '')])
+        layout = '(2, 2)<f8,<i4,(1, 2)<c16,<i8'
+        dtype = np.dtype(layout)
+        rows = np.zeros(3, dtype=dtype)
+        rows['f0'] = [[.1, .5], [.5, .9]]
+        rows['f1'] = [1, 2, 3]
+        rows['f2'] = [[.1j, 2j]]
+        rows['f3'] = [10, 20, 30]
+        self.datavault.add_raw(self.context, rows[:2].tostring(), layout)
+        self.datavault.add_raw(self.context, rows[2:].tostring(), layout)
+
+        descriptor, data = result(self.datavault.get_raw(self.context, limit=2))
+        self.assertEqual(dtype, np.dtype(descriptor))
+        self.assertTrue(np.array_equal(rows[:2], np.frombuffer(data, np.dtype(descriptor))))
+        descriptor, data = result(self.datavault.get_raw(self.context))
+        self.assertTrue(np.array_equal(rows[2:], np.frombuffer(data, np.dtype(descriptor))))
+        _, data = result(self.datavault.get_raw(self.context))
+        self.assertEqual('', data)
+
+        # the rows are the same as with the other formats
+        data_t = result(self.datavault.get_ex_t(self.context, startOver=True))
+        self.assertArrayEqual([1, 2, 3], data_t[1])
+        self.assertArrayEqual([10, 20, 30], data_t[3])
+
+        self.assertRaises(errors.BadRawDataError, self.datavault.add_raw,
+                          self.context, rows.tostring()[:-1], layout)
+        self.assertRaises(errors.BadRawDataError, self.datavault.add_raw,
+                          self.context, rows.tostring(), '<f8,<i4')
+
+    def test_add_and_get_raw_simple_data(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', [('x', 'ms')], [('y', 'V', 'V')])
+        values = np.arange(10, dtype='<f8').reshape((5, 2))
+        self.datavault.add_raw(self.context, values.tostring(), '<f8')
+        self.assertArrayEqual(values, result(self.datavault.get(self.context)))
+        descriptor, data = result(self.datavault.get_raw(self.context, startOver=True))
+        self.assertEqual('<f8,<f8', descriptor)
+        self.assertEqual(values.tostring(), data)
+
+    def test_get_raw_string_column(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(self.context, 'foo', [('x', [1], 's', '')],
+                              [('y', 'V', [1], 'v', 'V')])
+        self.datavault.add_ex(self.context, [('a', 1.0)])
+        self.assertRaises(errors.BadRawDataError,
+                          lambda: result(self.datavault.get_raw(self.context)))
+        self.assertRaises(errors.BadRawDataError, self.datavault.add_raw,
+                          self.context, '\0' * 16, '<f8,<f8')
+
+    def test_stream_data(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', [('x', 'ms')], [('y', 'V', 'V')])
+        self.datavault.add(self.context, [(0.0, 1.0)])
+        dataset = self.datavault.getDataset(self.context)
+        result(self.datavault.stream_data(self.context, max_rows=10,
+                                          min_interval=U.Value(250, 'ms')))
+        self.assertEqual(0.25, dataset.streams[self.context.ID].min_interval)
+        self.datavault.add(self.context, [(1.0, 2.0), (2.0, 3.0)])
+        dataset._sendStreams()
+        (first, rows, dtype, data), contexts = self.hub.onDataStreamed.call_args[0]
+        self.assertEqual([self.context.ID], contexts)
+        self.assertEqual((1, 2), (first, rows))
+        self.assertArrayEqual([2.0, 3.0], np.frombuffer(data, np.dtype(dtype))['f1'])
+
+        # opening another dataset stops the stream
+        self.datavault.open(self.context, dataset.name)
+        self.assertEqual({}, dataset.streams)
+        result(self.datavault.stream_data(self.context))
+        self.datavault.expireContext(self.context)
+        self.assertEqual({}, dataset.streams)
+
+    def test_stream_string_column(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(self.context, 'foo', [('x', [1], 's', '')],
+                              [('y', 'V', [1], 'v', 'V')])
+        self.assertRaises(errors.BadRawDataError,
+                          lambda: result(self.datavault.stream_data(self.context)))
+
+    def test_search(self):
+        self.datavault.initContext(self.context)
+        self.assertRaises(errors.SearchUnavailableError,
+                          self.datavault.search, self.context, 'foo')
+        index = search.SearchIndex(os.path.join(self.datadir, search.SEARCH_INDEX_FILE))
+        self.addCleanup(index.close)
+        self.store.search_index = index
+        self.datavault.cd(self.context, 'sub', True)
+        _, name = self.datavault.new(self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        self.datavault.add_parameter(self.context, 'gain', 3)
+        self.datavault.update_tags(self.context, 'star', [], name)
+        self.datavault.cd(self.context, 1)
+        self.datavault.new(self.context, 'bar', [('x', 'ms')], [('y', 'E', 'eV')])
+        self.assertEqual([(['', 'sub'], name)],
+                         self.datavault.search(self.context, 'foo', 'star', [('gain', '3')]))
+        self.assertEqual(2, len(self.datavault.search(self.context, 'eV')))
+        self.datavault.cd(self.context, 'sub')
+        self.assertEqual([(['', 'sub'], name)],
+                         self.datavault.search(self.context, 'eV', here=True))
+        yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
+        self.assertEqual([], self.datavault.search(self.context, before=yesterday))
+
+    def test_cursor_reads_dataset_larger_than_page_limit(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', [('x', 'ms')], [('y', 'V', 'V')])
+        rows = 1000
+        data = np.arange(2 * rows, dtype=float).reshape((rows, 2))
+        self.datavault.add(self.context, data)
+        # allow only 100 rows (16 bytes each) per page
+        self.datavault.cursor_page_bytes = 1600
+        cursor = self.datavault.open_cursor(self.context)
+        pages = []
+        while True:
+            page = result(self.datavault.cursor_next(self.context, cursor))
+            if not len(page):
+                break
+            self.assertLessEqual(len(page), 100)
+            pages.append(page)
+        self.assertEqual(10, len(pages))
+        self.assertArrayEqual(data, np.vstack(pages))
+        # the cursor does not move the position used by get
+        self.assertArrayEqual(data, result(self.datavault.get(self.context)))
+        self.datavault.close_cursor(self.context, cursor)
+        self.assertRaises(
+                errors.CursorNotFoundError,
+                self.datavault.cursor_next,
+                self.context,
+                cursor)
+
+    def test_cursor_extended_formats(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(
+                self.context,
+                'foo',
+                [('x', [1], 'v', 'ms')],
+                [('z', 'E', [1], 'i', '')])
+        self.datavault.add_ex_t(self.context, [[.1, .2, .3], [1, 2, 3]])
+        cursor = self.datavault.open_cursor(self.context, 2, 1)
+        page = result(self.datavault.cursor_next_ex_t(self.context, cursor))
+        self.assertArrayEqual([.2, .3], page[0])
+        self.assertArrayEqual([2, 3], page[1])
+        cursor = self.datavault.open_cursor(self.context, 2)
+        page = result(self.datavault.cursor_next_ex(self.context, cursor))
+        self.assertDataRowEqual((.1, 1), page[0])
+        self.assertDataRowEqual((.2, 2), page[1])
+
+    def test_get_selection(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context,
+                'foo',
+                [('x', 'ms')],
+                [('y', 'I', 'A'), ('y', 'Q', 'A'), ('z', '', 'V')])
+        data = np.arange(40, dtype=float).reshape((10, 4))
+        self.datavault.add(self.context, data)
+
+        selection = result(self.datavault.get_selection(
+                self.context, ['z', 'x'], 2, 9, 3))
+        self.assertArrayEqual(data[2:9:3][:, [3, 0]], selection)
+        selection = result(self.datavault.get_selection(
+                self.context, [2], step=4))
+        self.assertArrayEqual(data[::4][:, [2]], selection)
+        selection = result(self.datavault.get_selection(
+                self.context, ['y (Q)'], 8))
+        self.assertArrayEqual(data[8:][:, [2]], selection)
+        # get still starts from the beginning
+        self.assertArrayEqual(data, result(self.datavault.get(self.context)))
+
+        for columns in [['y'], ['w'], [4], [], [0, 0], ['x', 0]]:
+            self.assertRaises(
+                    errors.BadSelectionError,
+                    lambda *a: result(self.datavault.get_selection(*a)),
+                    self.context,
+                    columns)
+
+    def test_get_decimated(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', [('t', 's')], [('v', '', 'V')])
+        t = np.arange(5000, dtype=float)
+        v = np.sin(t / 100.0)
+        self.datavault.add(self.context, np.column_stack((t, v)))
+
+        points = result(self.datavault.get_decimated(self.context, 't', 'v', 100))
+        self.assertLessEqual(len(points), 100)
+        self.assertEqual(v.min(), points[:, 1].min())
+        self.assertEqual(v.max(), points[:, 1].max())
+
+        # rows added later are included
+        self.datavault.add(self.context, [(5000, 2.0)])
+        points = result(self.datavault.get_decimated(self.context, 0, 1, 100))
+        self.assertEqual(2.0, points[-1, 1])
+        self.assertEqual(5000, points[-1, 0])
+
+        points = result(self.datavault.get_decimated(
+                self.context, 't', 'v', 50, 1000, 2000, 'lttb'))
+        self.assertEqual(50, len(points))
+        self.assertEqual((1000, v[1000]), tuple(points[0]))
+        self.assertEqual((1999, v[1999]), tuple(points[-1]))
+
+        self.assertRaises(
+                errors.BadSelectionError,
+                self.datavault.get_decimated,
+                self.context, 't', 'v', 100, 0, None, 'median')
+
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
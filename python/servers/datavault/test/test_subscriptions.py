@@ -0,0 +1,78 @@
+import mock
+import pytest
+import unittest
+
+from twisted.internet import task
+
+from datavault.subscriptions import SubscriptionRegistry
+
+
+class SubscriptionRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.registry = SubscriptionRegistry(self.clock)
+        self.signal = mock.MagicMock()
+
+    def test_expire_drops_context_from_its_sets(self):
+        a = self.registry.listeners()
+        b = self.registry.listeners()
+        a.add('ctx')
+        a.add('other')
+        b.add('ctx')
+        self.assertEqual(2, self.registry.numSubscriptions('ctx'))
+        self.registry.expire('ctx')
+        self.assertEqual(set(['other']), a)
+        self.assertEqual(set(), b)
+        self.assertEqual(0, self.registry.numSubscriptions('ctx'))
+        self.assertEqual(1, self.registry.numSubscriptions('other'))
+
+    def test_removed_contexts_are_forgotten(self):
+        a = self.registry.listeners()
+        a.add('ctx')
+        a.remove('ctx')
+        a.discard('ctx')
+        self.assertEqual(0, self.registry.numSubscriptions('ctx'))
+        a.add('ctx')
+        a.clear()
+        self.assertEqual(0, self.registry.numSubscriptions('ctx'))
+
+    def test_signals_are_sent_on_next_reactor_turn(self):
+        listeners = self.registry.listeners()
+        listeners.add('ctx')
+        self.registry.notify(self.signal, listeners)
+        self.assertEqual(set(), listeners)
+        self.assertEqual(0, self.registry.numSubscriptions('ctx'))
+        self.assertFalse(self.signal.called)
+        self.clock.advance(0)
+        self.signal.assert_called_once_with(None, set(['ctx']))
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_expired_context_is_not_signalled(self):
+        self.registry.send(self.signal, ['ctx', 'other'])
+        self.registry.expire('ctx')
+        self.clock.advance(0)
+        self.signal.assert_called_once_with(None, set(['other']))
+
+    def test_many_listening_contexts(self):
+        # 1000 contexts follow 10 datasets; 100 notifications per dataset
+        # in one reactor turn make one signal per context
+        contexts = ['ctx {}'.format(i) for i in range(1000)]
+        datasets = [self.registry.listeners() for _ in range(10)]
+        for i, context in enumerate(contexts):
+            datasets[i % 10].add(context)
+        for _ in range(100):
+            for listeners in datasets:
+                self.registry.notify(self.signal, listeners)
+                # listeners that read to the end subscribe again
+                listeners.add('reader')
+        self.clock.advance(0)
+        self.signal.assert_called_once_with(None, set(contexts + ['reader']))
+        self.assertEqual(1001, self.registry.signals_sent)
+        self.assertEqual(10, self.registry.numSubscriptions('reader'))
+        self.registry.expire('reader')
+        self.assertEqual(0, sum(len(listeners) for listeners in datasets))
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
@@ -51,6 +51,44 @@ class Testutil(unittest.TestCase):
         self.assertEqual(expected.dtype, actual.dtype, msg='dtype mismatch')
         self.assertTrue(np.array_equal(expected, actual), msg='array mismatch')
 
+    def test_dtype_descriptor(self):
+        dtype = np.dtype([('f0', '<f8'), ('f1', '<i4'), ('f2', '<c16', (2, 3))])
+        descriptor = util.dtype_descriptor(dtype)
+        self.assertEqual('<f8,<i4,(2, 3)<c16', descriptor)
+        self.assertEqual(dtype, np.dtype(descriptor))
+        self.assertRaises(ValueError, util.dtype_descriptor,
+                          np.dtype([('f0', '<f8'), ('f1', object)]))
+
+    def test_records_from_bytes_view(self):
+        dtype = np.dtype([('f0', '<f8'), ('f1', '<i8', (2,))])
+        data = np.array([(1.5, [2, 3]), (4.5, [5, 6])], dtype=dtype)
+        records = util.records_from_bytes(data.tostring(), '<f8,(2,)<i8', dtype)
+        self.assertEqual(dtype, records.dtype)
+        self.assertTrue(np.array_equal(data, records))
+        # no copy is made
+        self.assertFalse(records.flags.owndata)
+
+    def test_records_from_bytes_converts(self):
+        dtype = np.dtype([('f0', '<f8'), ('f1', '<f8')])
+        data = np.array([(1, 2), (3, 4)], dtype='>i4,>f4')
+        records = util.records_from_bytes(data.tostring(), '>i4,>f4', dtype)
+        self.assertEqual(dtype, records.dtype)
+        self.assertEqual([(1, 2), (3, 4)], records.tolist())
+        # a scalar type applies to every column
+        values = np.arange(4, dtype='<f4')
+        records = util.records_from_bytes(values.tostring(), '<f4', dtype)
+        self.assertEqual([(0, 1), (2, 3)], records.tolist())
+
+    def test_records_from_bytes_checks_layout(self):
+        dtype = np.dtype([('f0', '<f8'), ('f1', '<f8')])
+        data = np.zeros(3, dtype=dtype).tostring()
+        for descriptor in ['<f8', '<f8,<f8,<f8', '<f8,(2,)<f8', 'nonsense']:
+            self.assertRaises(ValueError, util.records_from_bytes,
+                              data[:-1] if descriptor == '<f8' else data,
+                              descriptor, dtype)
+        self.assertRaises(ValueError, util.records_from_bytes, '', '<f8',
+                          np.dtype([('f0', '<f8'), ('f1', object)]))
+
     def test_braced(self):
         actual = util.braced('foo')
         expected = '{' + 'foo' + '}'
@@ -0,0 +1,28 @@
+"""Helpers for calling the data vault settings without a running reactor.
+
+Used by the tests and the benchmarks, which call DataVault settings
+directly with contexts made here.
+"""
+
+from twisted.python import failure
+
+
+def result(d):
+    """Get the result of a Deferred that has already fired.
+
+    With the default synchronous I/O executor, reads and writes finish
+    before the Deferreds for them are returned.  A failure is raised.
+    """
+    results = []
+    d.addBoth(results.append)
+    result = results[0]
+    if isinstance(result, failure.Failure):
+        result.raiseException()
+    return result
+
+
+class Context(dict):
+    """Stands in for a server context: a dict of state with an ID."""
+
+    def __init__(self, ID='test-context'):
+        self.ID = ID
@@ -1,4 +1,5 @@
 import ConfigParser as cp
+import os
 
 import numpy as np
 
@@ -28,6 +29,25 @@ class DVSafeConfigParser(cp.SafeConfigParser):
             fp.write(newline)
 
 
+def atomic_write(filename, text):
+    """Replace the contents of a file, so that readers never see a partial file.
+
+    The text is written to a temporary file that is then renamed over the
+    old file.
+    """
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        os.rename(tmp, filename)
+    except OSError:
+        # windows does not rename over an existing file
+        os.remove(filename)
+        os.rename(tmp, filename)
+
+
 def to_record_array(data):
     """Take a 2-D array of numpy data and return a 1-D array of records."""
     return np.core.records.fromarrays(data.T)
@@ -38,9 +58,68 @@ def from_record_array(data):
 
     The records must be homogeneous.
     """
+    names = getattr(getattr(data, 'dtype', None), 'names', None)
+    if names:
+        return np.column_stack([data[name] for name in names])
     return np.vstack([np.array(tuple(row)) for row in data])
 
 
+def dtype_descriptor(dtype):
+    """Describe a structured dtype as a comma-separated numpy type string.
+
+    For example '<f8,<i4,(2,)<c16'.  np.dtype(descriptor) gives a packed
+    dtype with the same fields, named f0, f1, ...  Object fields (such as
+    variable-length strings) have no fixed binary form and raise
+    ValueError.
+    """
+    formats = []
+    for name in dtype.names:
+        field = dtype[name]
+        if field.hasobject:
+            raise ValueError('Column {} has no fixed binary layout'.format(name))
+        if field.shape:
+            formats.append('{}{}'.format(field.shape, field.base.str))
+        else:
+            formats.append(field.str)
+    return ','.join(formats)
+
+
+def records_from_bytes(data, descriptor, dtype):
+    """Interpret a byte string as a 1-D array of records of the given dtype.
+
+    descriptor is a numpy type string for the records in data, such as one
+    made by dtype_descriptor.  It must have the same number of fields, of
+    the same shapes, as dtype, or be a single scalar type, which is then
+    used for every field.  If the layouts match, the result is a read-only
+    view of data; otherwise the fields are converted, by position.  Raises
+    ValueError if the data does not fit.
+    """
+    try:
+        given = np.dtype(descriptor)
+    except TypeError as e:
+        raise ValueError("Bad dtype '{}': {}".format(descriptor, e))
+    if dtype.hasobject:
+        raise ValueError('Dataset has columns with no fixed binary layout')
+    if given.names is None:
+        given = np.dtype([(name, given, dtype[name].shape) for name in dtype.names])
+    if len(given.names) != len(dtype.names):
+        raise ValueError('Dataset has {} columns, not {}'.format(
+                len(dtype.names), len(given.names)))
+    for a, b in zip(given.names, dtype.names):
+        if given[a].shape != dtype[b].shape:
+            raise ValueError('Column {} has shape {}, not {}'.format(
+                    b, dtype[b].shape, given[a].shape))
+    if len(data) % given.itemsize:
+        raise ValueError('{} bytes is not a whole number of {}-byte rows'.format(
+                len(data), given.itemsize))
+    records = np.frombuffer(data, dtype=given)
+    if given.itemsize == dtype.itemsize and all(
+            given[a] == dtype[b] and given.fields[a][1] == dtype.fields[b][1]
+            for a, b in zip(given.names, dtype.names)):
+        return records.view(dtype)
+    return records.astype(dtype)
+
+
 def braced(s):
     """Wrap the given string in braces, which is awkward with str.format"""
     return '{' + s + '}'
@@ -4,6 +4,7 @@ from labrad.server import LabradServer, Signal, setting
 import functools
 import inspect
 from labrad.types import Error
+from instrumentation import InstrumentedServer
 
 ############## instructions #####################
 #
@@ -336,7 +337,7 @@ class Device:
             if self.get_owning_context() == context_id:
                 self._unlock()
 
-class DeviceServer(LabradServer):
+class DeviceServer(InstrumentedServer):
     sendTracebacks=False
     name = NAME
 
@@ -379,7 +380,7 @@ class DeviceServer(LabradServer):
                     attribute_name,
                     signal
                 )
-        LabradServer.__init__(self)
+        InstrumentedServer.__init__(self)
 
     @setting(GET_DEVICES,returns='*s')
     def get_devices(self,c):
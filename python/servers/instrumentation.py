@@ -0,0 +1,360 @@
+from twisted.internet import defer, task
+from twisted.python import log
+from labrad.server import LabradServer, setting
+import bisect
+import collections
+import numpy as np
+import time
+
+############## instructions #####################
+#
+# instrumented server is a base class that
+# records how often each setting of a server
+# is called and how long the calls take. the
+# lock server, device server and data vault
+# inherit from it, so every server built on
+# them is instrumented without any changes.
+#
+# every setting registered with the manager
+# is wrapped when it is added. each call is
+# counted per setting and per context, along
+# with its latency, errors, calls still in
+# progress and the approximate size of the
+# data passed in and returned. sizes are
+# estimated from the unflattened values rather
+# than by flattening them a second time, so
+# that large transfers do not cost more.
+#
+# clients read the numbers with get_stats and
+# get_context_stats, or get the full latency
+# histogram of a setting. dump_stats starts
+# writing the numbers for every setting to a
+# data vault dataset at a regular interval,
+# until it is called with zero or the server
+# stops. servers that define stopServer must
+# call InstrumentedServer.stopServer.
+#
+###################################################
+
+GET_STATS = 9000
+GET_CONTEXT_STATS = 9001
+GET_LATENCY_HISTOGRAM = 9002
+RESET_STATS = 9003
+DUMP_STATS = 9004
+
+# latency histogram buckets: 1 us, 2 us, 4 us, ... up to about 35 minutes
+LATENCY_BUCKETS = [1e-6 * 2 ** k for k in range(32)]
+MAX_CONTEXTS = 1000 # contexts whose numbers are kept, least recently used dropped
+STATS_DIRECTORY = ['', 'Server Stats']
+
+def payload_size(value):
+    """Estimate the number of bytes of a value in a labrad packet.
+
+    Lists are assumed to hold elements of the size of their first element.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 4 * value.ndim
+    if isinstance(value, str):
+        return 4 + len(value)
+    if isinstance(value, unicode):
+        return 4 + len(value.encode('utf-8'))
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, long)):
+        return 4
+    if isinstance(value, complex):
+        return 16
+    if isinstance(value, float):
+        return 8
+    if isinstance(value, tuple):
+        return sum(payload_size(v) for v in value)
+    if isinstance(value, list):
+        if not value:
+            return 4
+        return 4 + len(value) * payload_size(value[0])
+    # units values and other scalars
+    return 8
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile, in seconds."""
+        n = sum(self.counts)
+        if not n:
+            return 0.0
+        rank = q / 100. * n
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                if bucket == len(LATENCY_BUCKETS):
+                    return self.max
+                return min(LATENCY_BUCKETS[bucket], self.max)
+        return self.max
+
+    def buckets(self):
+        """(upper bound in seconds, count) of every bucket."""
+        return zip(LATENCY_BUCKETS + [self.max], self.counts)
+
+class CallStats:
+    """Counts of the calls of one setting, or in one context."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = LatencyHistogram()
+
+class ServerStats:
+    """Numbers for all settings and recent contexts of one server."""
+
+    def __init__(self, max_contexts=MAX_CONTEXTS, clock=time.time):
+        self.max_contexts = max_contexts
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        self.settings = {}
+        self.contexts = collections.OrderedDict()
+        self.since = self.clock()
+
+    def _context(self, context_id):
+        stats = self.contexts.pop(context_id, None)
+        if stats is None:
+            stats = CallStats()
+            while len(self.contexts) >= self.max_contexts:
+                self.contexts.popitem(last=False)
+        self.contexts[context_id] = stats
+        return stats
+
+    def call(self, setting_id, context_id, data, f):
+        """Call f(), recording it as a call of a setting in a context.
+
+        f may return a Deferred, in which case the call is recorded when
+        it fires.
+        """
+        if setting_id not in self.settings:
+            self.settings[setting_id] = CallStats()
+        records = [self.settings[setting_id], self._context(context_id)]
+        size = payload_size(data)
+        for stats in records:
+            stats.calls += 1
+            stats.in_flight += 1
+            stats.bytes_in += size
+        start = self.clock()
+
+        def done(result, failed=False):
+            elapsed = self.clock() - start
+            size = 0 if failed else payload_size(result)
+            for stats in records:
+                stats.in_flight -= 1
+                stats.errors += failed
+                stats.bytes_out += size
+                stats.latency.add(elapsed)
+
+        try:
+            result = f()
+        except Exception:
+            done(None, True)
+            raise
+        if isinstance(result, defer.Deferred):
+            def succeeded(result):
+                done(result)
+                return result
+            def failed(failure):
+                done(None, True)
+                return failure
+            result.addCallbacks(succeeded, failed)
+        else:
+            done(result)
+        return result
+
+class InstrumentedSetting:
+    """Stands in for a setting in a server's settings, recording its calls."""
+
+    def __init__(self, setting, stats):
+        self.setting = setting
+        self.stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self.setting, name)
+
+    def handleRequest(self, server, c, data):
+        return self.stats.call(
+            self.setting.ID,
+            c.ID,
+            data,
+            lambda: self.setting.handleRequest(server, c, data)
+        )
+
+class StatsDump:
+    """Writes the numbers of every setting to a data vault dataset.
+
+    Each dump adds one row per setting that has been called, with the
+    numbers counted since the stats were last reset.
+    """
+
+    def __init__(self, server, interval):
+        self.server = server
+        self.interval = interval
+        self.context = None
+        self.call = task.LoopingCall(self.dump)
+
+    def start(self):
+        d = self.call.start(self.interval, now=False)
+        d.addErrback(log.err, 'Failed to dump stats of %s' % self.server.name)
+
+    def stop(self):
+        if self.call.running:
+            self.call.stop()
+
+    @defer.inlineCallbacks
+    def dump(self):
+        dv = self.server.client.data_vault
+        if self.context is None:
+            context = self.server.client.context()
+            yield dv.cd(STATS_DIRECTORY + [self.server.name], True, context=context)
+            yield dv.new(
+                'setting stats',
+                [('time', 's'), ('setting', '')],
+                [
+                    ('calls', '', ''),
+                    ('errors', '', ''),
+                    ('in flight', '', ''),
+                    ('latency', 'p50', 'ms'),
+                    ('latency', 'p99', 'ms'),
+                    ('latency', 'max', 'ms'),
+                    ('bytes in', '', ''),
+                    ('bytes out', '', '')
+                ],
+                context=context
+            )
+            self.context = context
+        now = time.time()
+        rows = [
+            [now, setting_id] + list(values)
+            for setting_id, values in self.server.stats_rows()
+        ]
+        if rows:
+            yield dv.add(rows, context=self.context)
+
+class InstrumentedServer(LabradServer):
+    def __init__(self):
+        self.stats = ServerStats()
+        self.stats_dump = None
+        LabradServer.__init__(self)
+
+    def stopServer(self):
+        # subclasses that stop other things must call this too
+        if self.stats_dump is not None:
+            self.stats_dump.stop()
+            self.stats_dump = None
+
+    def addSetting(self, setting, packet=None):
+        return LabradServer.addSetting(
+            self,
+            InstrumentedSetting(setting, self.stats),
+            packet
+        )
+
+    def stats_rows(self):
+        """(setting id, numbers) for each setting called, as get_stats returns them."""
+        rows = []
+        for setting_id, stats in sorted(self.stats.settings.items()):
+            latency = stats.latency
+            rows.append((
+                setting_id,
+                (
+                    stats.calls,
+                    stats.errors,
+                    stats.in_flight,
+                    latency.percentile(50) * 1e3,
+                    latency.percentile(99) * 1e3,
+                    latency.max * 1e3,
+                    stats.bytes_in,
+                    stats.bytes_out
+                )
+            ))
+        return rows
+
+    @setting(
+        GET_STATS,
+        returns='v{seconds counted}, *(ws{name}w{calls}w{errors}w{in flight}v{p50 ms}v{p99 ms}v{max ms}w{bytes in}w{bytes out})'
+    )
+    def get_stats(self,c):
+        """get call counts and latencies of every setting called
+
+        latencies are the upper bounds of histogram buckets that double in
+        width, so they are accurate to within a factor of two.
+        """
+        rows = []
+        for setting_id, values in self.stats_rows():
+            name = self.settings[setting_id].name if setting_id in self.settings else ''
+            rows.append((setting_id, name) + values)
+        return time.time() - self.stats.since, rows
+
+    @setting(
+        GET_CONTEXT_STATS,
+        returns='*((ww){context}w{calls}w{errors}w{in flight}v{total ms}w{bytes in}w{bytes out})'
+    )
+    def get_context_stats(self,c):
+        """get call counts of the most recently active contexts"""
+        return [
+            (
+                context_id,
+                stats.calls,
+                stats.errors,
+                stats.in_flight,
+                stats.latency.total * 1e3,
+                stats.bytes_in,
+                stats.bytes_out
+            )
+            for context_id, stats in reversed(self.stats.contexts.items())
+        ]
+
+    @setting(GET_LATENCY_HISTOGRAM, setting_id='w', returns='*(v{upper bound ms}w{calls})')
+    def get_latency_histogram(self,c,setting_id):
+        """get the latency histogram of a setting
+
+        the last bucket holds calls slower than the other buckets, and its
+        bound is the slowest call.
+        """
+        if setting_id not in self.stats.settings:
+            return []
+        return [
+            (bound * 1e3, count)
+            for bound, count in self.stats.settings[setting_id].latency.buckets()
+        ]
+
+    @setting(RESET_STATS)
+    def reset_stats(self,c):
+        """start counting again from zero"""
+        self.stats.reset()
+
+    @setting(DUMP_STATS, interval='v[s]')
+    def dump_stats(self,c,interval):
+        """write stats to the data vault every interval, or stop if zero
+
+        rows are added to a new dataset in the directory
+        Server Stats/<server name>.
+        """
+        interval = interval['s']
+        if self.stats_dump is not None:
+            self.stats_dump.stop()
+            self.stats_dump = None
+        if interval > 0:
+            self.stats_dump = StatsDump(self, interval)
+            self.stats_dump.start()
@@ -1,5 +1,6 @@
 from labrad.decorators import Setting
 from labrad.server import LabradServer, Signal, setting
+from instrumentation import InstrumentedServer
 import functools
 import inspect
 
@@ -160,7 +161,7 @@ def lockable_setting(lr_ID, lr_name=None, returns=[], unflatten=True, **params):
             raise
     return decorator
     
-class LockServer(LabradServer):
+class LockServer(InstrumentedServer):
     sendTracebacks = False
     on_setting_locked = Signal(
         ON_SETTING_LOCKED_ID,
@@ -174,7 +175,7 @@ class LockServer(LabradServer):
     )
     def __init__(self):
         self.locked_settings = {}
-        LabradServer.__init__(self)
+        InstrumentedServer.__init__(self)
 
     @setting(LOCK_SETTING_ID,setting_id='w',returns=[])
     def lock_setting(self,c,setting_id):    
@@ -4,6 +4,7 @@ from twisted.internet.defer import inlineCallbacks
 import labrad
 from labrad.types import Error
 from steppermotor import NetworkStepperMotor, TimeoutException, DigitalStepperMotor, CounterStepperMotor, RampStepperMotor, SerialStepperMotor, SetPositionStoppedException, DisabledException
+from daqmx import select_driver, DRIVER_KEY
 from daqmx.task.do import DOTask
 from daqmx.task.co import COTask
 from daqmx.task.ci import CITask
@@ -142,8 +143,8 @@ class StepperMotorServer(DeviceServer):
     def initServer(self):  # Do initialization here
         reg = self.client.registry
         yield reg.cd(REGISTRY_PATH)
-        stepper_motor_names = yield reg.dir()
-        stepper_motor_names = stepper_motor_names[0] # just get directories
+        stepper_motor_names, keys = yield reg.dir() # stepper motors are directories
+        select_driver((yield reg.get(DRIVER_KEY)) if DRIVER_KEY in keys else None)
         self.stepper_motors = {name:None for name in stepper_motor_names}
         for stepper_motor_name in stepper_motor_names:
             print 'adding', stepper_motor_name
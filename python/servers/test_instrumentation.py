@@ -0,0 +1,128 @@
+import mock
+import numpy as np
+import os
+import pytest
+import tempfile
+import unittest
+
+from twisted.internet import defer, task
+
+from labrad import units as U
+
+from datavault import errors, server, SessionStore
+from datavault.testing import Context, result
+
+
+def _unique_dir_name():
+    newdir = tempfile.mkdtemp(prefix='dvtest_')
+    # the session store creates the directory again
+    os.rmdir(newdir)
+    return newdir
+
+
+def _empty_and_remove_dir(*names):
+    for name in names:
+        if not os.path.exists(name):
+            continue
+        for listedname in os.listdir(name):
+            path = os.path.join(name, listedname)
+            if os.path.isdir(path):
+                _empty_and_remove_dir(name + '/' + listedname)
+            else:
+                os.remove(path)
+        os.rmdir(name)
+
+
+class InstrumentationTest(unittest.TestCase):
+    """Tests for the setting stats of an InstrumentedServer, the data vault."""
+
+    def setUp(self):
+        self.datadir = _unique_dir_name()
+        self.store = SessionStore(self.datadir, mock.MagicMock(), reactor=task.Clock())
+        self.datavault = server.DataVault(self.store)
+        self.datavault.initServer()
+        # as done when the server registers its settings with the manager
+        for handler in self.datavault._findSettingHandlers():
+            self.datavault.addSetting(handler, mock.MagicMock())
+        self.context = Context(('client', 1))
+        self.datavault.initContext(self.context)
+
+    def tearDown(self):
+        _empty_and_remove_dir(self.datadir)
+
+    def request(self, name, data=None, context=None):
+        s = [s for s in self.datavault.settings.values() if s.name == name][0]
+        return s.handleRequest(self.datavault, context or self.context, data)
+
+    def test_settings_are_counted(self):
+        self.request('new', ('foo', ['x'], ['y']))
+        for i in range(3):
+            self.request('add', np.array([[i, i]], dtype=float))
+        result(self.request('get'))
+        self.assertRaises(errors.DatasetNotFoundError, result, self.request('open', 'bar'))
+        other = Context(('client', 2))
+        self.datavault.initContext(other)
+        self.request('cd', '', context=other)
+
+        seconds, rows = self.datavault.get_stats(self.context)
+        stats = dict((row[1], row) for row in rows)
+        self.assertEqual(['add', 'cd', 'get', 'new', 'open'], sorted(stats))
+        setting_id, name, calls, errors_, in_flight, p50, p99, slowest, bytes_in, bytes_out = stats['add']
+        self.assertEqual((20, 3, 0, 0), (setting_id, calls, errors_, in_flight))
+        self.assertEqual(3 * (16 + 8), bytes_in)
+        self.assertTrue(0 < p50 <= p99 and p99 <= 2 * slowest)
+        self.assertEqual(1, stats['open'][3])
+        self.assertEqual(2 * 3 * 8 + 8, stats['get'][9])
+
+        contexts = self.datavault.get_context_stats(self.context)
+        self.assertEqual([('client', 2), ('client', 1)], [row[0] for row in contexts])
+        self.assertEqual((6, 1), contexts[1][1:3])
+        histogram = self.datavault.get_latency_histogram(self.context, 20)
+        self.assertEqual(3, sum(count for _, count in histogram))
+        self.assertEqual([], self.datavault.get_latency_histogram(self.context, 9999))
+
+        self.datavault.reset_stats(self.context)
+        self.assertEqual([], self.datavault.get_stats(self.context)[1])
+
+    def test_calls_in_flight(self):
+        self.request('new', ('foo', ['x'], ['y']))
+        d = defer.Deferred()
+        with mock.patch.object(self.datavault.getDataset(self.context), 'getData',
+                               return_value=d):
+            self.request('get')
+            [row] = [r for r in self.datavault.get_stats(self.context)[1] if r[1] == 'get']
+            self.assertEqual(1, row[4])
+            d.errback(ValueError('failed'))
+        [row] = [r for r in self.datavault.get_stats(self.context)[1] if r[1] == 'get']
+        self.assertEqual((1, 1, 0), row[2:5])
+
+    def test_lockserver_style_lookups_see_the_setting(self):
+        add = self.datavault.settings[20]
+        self.assertEqual('add', add.name)
+        self.assertEqual(add.setting.returns, add.returns)
+
+    def test_stats_dump(self):
+        dv = mock.MagicMock()
+        self.datavault.client = mock.MagicMock()
+        self.datavault.client.data_vault = dv
+        self.request('cd', '')
+        self.datavault.dump_stats(self.context, U.Value(10, 's'))
+        result(self.datavault.stats_dump.dump())
+        dv.new.assert_called_once()
+        [(rows,), _] = dv.add.call_args
+        self.assertEqual([7], [row[1] for row in rows])
+        self.assertEqual(1, rows[0][2])
+        self.datavault.dump_stats(self.context, U.Value(0, 's'))
+        self.assertIsNone(self.datavault.stats_dump)
+
+    def test_stop_server_stops_stats_dump(self):
+        self.datavault.dump_stats(self.context, U.Value(10, 's'))
+        dump = self.datavault.stats_dump
+        self.assertTrue(dump.call.running)
+        result(self.datavault.stopServer())
+        self.assertFalse(dump.call.running)
+        self.assertIsNone(self.datavault.stats_dump)
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
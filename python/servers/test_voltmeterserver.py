@@ -0,0 +1,126 @@
+import mock
+import numpy as np
+import pytest
+import unittest
+
+from twisted.internet import defer
+
+from daqmx import DAQmxException
+from daqmx.task.ai import AITask, ERROR_SAMPLING_STOPPED
+
+import voltmeterserver
+from datavault.testing import result
+
+
+class Threads(object):
+    """Stands in for deferToThread, running the calls when told to."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, f, *args, **kwargs):
+        d = defer.Deferred()
+        self.calls.append((d, f, args, kwargs))
+        return d
+
+    def run(self):
+        """Run the calls in order, including any made meanwhile."""
+        while self.calls:
+            d, f, args, kwargs = self.calls.pop(0)
+            try:
+                value = f(*args, **kwargs)
+            except Exception:
+                d.errback()
+            else:
+                d.callback(value)
+
+
+def _stopped():
+    return DAQmxException(ERROR_SAMPLING_STOPPED, 'continuous sampling was stopped')
+
+
+class ContinuousTest(unittest.TestCase):
+    """Tests for sampling continuously, with a mocked task."""
+
+    def setUp(self):
+        self.threads = Threads()
+        patcher = mock.patch.object(voltmeterserver, 'deferToThread', self.threads)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.task = mock.Mock(spec=AITask)
+        self.task.get_sample_quantity.return_value = 100
+        self.task.get_sampling_rate.return_value = 1000.
+        self.task.has_failed.return_value = False
+        self.task.has_samples.return_value = False
+        self.task.get_latest.return_value = {'ai0': np.ones(100) * 2}
+        self.server = voltmeterserver.VoltmeterServer()
+        # as done by initServer, without the registry
+        for signal in ('on_active_channels_changed', 'on_sampling_duration_changed',
+                       'on_triggering_changed', 'on_continuous_changed'):
+            setattr(self.server, signal, mock.Mock())
+        self.server.task = self.task
+        self.server.continuous = False
+        self.server.acquiring = False
+        self.server.subscribers = []
+        self.server.queue = []
+        self.server._set_continuous(True)
+        self.threads.run()
+        self.assertTrue(self.server.continuous)
+        self.task.start_continuous.assert_called_once_with(100)
+
+    def test_get_sample(self):
+        d = self.server._get_sample('ai0')
+        self.threads.run()
+        self.assertEqual(2, result(d))
+        self.task.get_latest.assert_called_once_with(
+            100, ['ai0'], timeout=0.1 + voltmeterserver.WINDOW_TIMEOUT)
+
+    def test_get_sample_during_restart(self):
+        change = mock.Mock()
+        waiting = self.server._get_sample('ai0')
+        # the change stops sampling before the window is filled
+        samples = self.task.get_latest.return_value
+        self.task.get_latest.side_effect = [_stopped(), samples, samples]
+        changed = self.server._change(change)
+        self.assertTrue(self.server.acquiring)
+        queued = self.server._get_sample('ai0')
+        self.assertFalse(queued.called)
+        self.threads.run()
+        self.assertEqual(2, result(waiting))
+        self.assertEqual(2, result(queued))
+        result(changed)
+        change.assert_called_once_with()
+        self.assertEqual(1, self.task.stop_continuous.call_count)
+        self.assertEqual(2, self.task.start_continuous.call_count)
+        self.assertFalse(self.server.acquiring)
+
+    def test_restart_after_failure(self):
+        self.task.has_failed.return_value = True
+        def stop_continuous():
+            self.task.has_failed.return_value = False
+        self.task.stop_continuous.side_effect = stop_continuous
+        first = self.server._get_sample('ai0')
+        second = self.server._get_sample('ai0')
+        self.threads.run()
+        self.assertEqual(2, result(first))
+        self.assertEqual(2, result(second))
+        # only one restart for both samples
+        self.assertEqual(1, self.task.stop_continuous.call_count)
+        self.assertEqual(2, self.task.start_continuous.call_count)
+
+    def test_stop_server(self):
+        waiting = self.server._get_sample('ai0')
+        self.task.get_latest.side_effect = _stopped()
+        # as done by LabradServer._stopServer
+        self.server.stopping = True
+        stopped = self.server.stopServer()
+        self.threads.run()
+        result(stopped)
+        self.task.stop_continuous.assert_called_once_with()
+        # the sample waited for fails instead of restarting sampling
+        self.assertRaises(DAQmxException, result, waiting)
+        self.task.start_continuous.assert_called_once_with(100)
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
@@ -1,9 +1,10 @@
 from lockserver import LockServer, lockable_setting
 from labrad.server import setting, Signal
-from twisted.internet.defer import inlineCallbacks, Deferred
+from twisted.internet.defer import inlineCallbacks, returnValue, maybeDeferred, Deferred
 from twisted.python.failure import Failure
 import labrad
-from daqmx.task.ai import AITask
+from daqmx import select_driver, DRIVER_KEY, DAQmxException
+from daqmx.task.ai import AITask, ERROR_SAMPLING_STOPPED
 from twisted.internet.threads import deferToThread
 import numpy as np
 from functools import partial
@@ -34,10 +35,15 @@ TRIGGERING = 'triggering'
 TRIGGER_SOURCE = 'trigger source'
 TRIGGER_EDGE = 'trigger edge'
 SAMPLING_DURATION = 'sampling duration'
+CONTINUOUS = 'continuous'
+
+WINDOW_TIMEOUT = 10.
+"""seconds beyond the sampling duration to wait for a window of samples"""
 
 ON_ACTIVE_CHANNELS_CHANGED = 'on_active_channels_changed'
 ON_SAMPLING_DURATION_CHANGED = 'on_sampling_duration_changed'
 ON_TRIGGERING_CHANGED = 'on_triggering_changed'
+ON_CONTINUOUS_CHANGED = 'on_continuous_changed'
 
 class VoltmeterServer(LockServer):
     name = NAME
@@ -45,26 +51,38 @@ class VoltmeterServer(LockServer):
     on_active_channels_changed = Signal(110,ON_ACTIVE_CHANNELS_CHANGED,'*s')
     on_sampling_duration_changed = Signal(111,ON_SAMPLING_DURATION_CHANGED,'v')
     on_triggering_changed = Signal(112,ON_TRIGGERING_CHANGED,'b')
+    on_continuous_changed = Signal(113,ON_CONTINUOUS_CHANGED,'b')
 
     @inlineCallbacks
     def initServer(self):  # Do initialization here
         reg = self.client.registry
         yield reg.cd(REGISTRY_PATH)
+        dirs, keys = yield reg.dir()
+        select_driver((yield reg.get(DRIVER_KEY)) if DRIVER_KEY in keys else None)
         self.available_channels = yield reg.get(AVAILABLE_CHANNELS)
         default_channels = yield reg.get(DEFAULT_CHANNELS)
         triggering = yield reg.get(TRIGGERING)
         self.trigger_source = yield reg.get(TRIGGER_SOURCE)
         self.trigger_edge = yield reg.get(TRIGGER_EDGE)
         sampling_duration = yield reg.get(SAMPLING_DURATION)
+        continuous = (yield reg.get(CONTINUOUS)) if CONTINUOUS in keys else False
+        self.continuous = False
         self._set_active_channels(
             default_channels,
             triggering=triggering,
             sampling_duration=sampling_duration
         )
-        self.acquiring = False
+        self.acquiring = False # also while sampling stops or restarts
         self.subscribers = []
         self.queue = []
+        if continuous:
+            yield self._set_continuous(True)
         yield LockServer.initServer(self)
+
+    def stopServer(self):
+        LockServer.stopServer(self)
+        if self.continuous:
+            return deferToThread(self.task.stop_continuous)
     
     @inlineCallbacks
     def start_acquisition(self):
@@ -75,17 +93,44 @@ class VoltmeterServer(LockServer):
             channel:np.average(series) 
             for channel, series in samples.items()
         }
-        while self.queue:
-            self.queue.pop(0)()
-        for d, channel in self.subscribers:
+        subscribers, self.subscribers = self.subscribers, []
+        for d, channel in subscribers:
             try:
                 d.callback(averages[channel])
             except KeyError, e:
                 d.errback(e)
-        self.subscribers = []
+        self._run_queue()
+
+    def _run_queue(self):
+        # what was queued queues itself again if the task is busy
+        queue, self.queue = self.queue, []
+        for f in queue:
+            f()
+
+    @inlineCallbacks
+    def _exclusively(self,f,*args):
+        # run f, queueing changes and samples until its deferred fires
+        self.acquiring = True
+        try:
+            yield f(*args)
+        finally:
+            self.acquiring = False
+            self._run_queue()
 
     @setting(10, channel='s', returns='v')    
     def get_sample(self,c,channel):
+        return self._get_sample(channel)
+
+    def _get_sample(self,channel):
+        if self.acquiring and not self.subscribers:
+            # sampling is stopping or restarting
+            d = Deferred()
+            self.queue.append(
+                lambda: maybeDeferred(self._get_sample,channel).chainDeferred(d)
+            )
+            return d
+        if self.continuous:
+            return self._get_window_average(channel)
         if not self.subscribers:
             self.start_acquisition()
         d = Deferred()
@@ -104,25 +149,14 @@ class VoltmeterServer(LockServer):
     def set_active_channels(self,c,channels):
         if not channels:
             raise Exception('must have at least one active channel')
-        if self.acquiring:
-            self.queue.append(partial(self._set_active_channels,channels))
-        else:
-            self._set_active_channels(channels)
+        return self._change(partial(self._set_active_channels,channels))
     @setting(14, channel='s', returns='s')
     def get_units(self,c,channel):
         return AITask(channel).get_units()[channel]
 
     @lockable_setting(15, duration = 'v')
     def set_sampling_duration(self,c,duration):
-        if self.acquiring:
-            self.queue.append(
-                partial(
-                    self._set_sampling_duration,
-                    duration
-                )
-            )
-        else:
-            self._set_sampling_duration(duration)
+        return self._change(partial(self._set_sampling_duration,duration))
 
     @setting(16, returns='v')
     def get_sampling_duration(self,c):
@@ -134,14 +168,82 @@ class VoltmeterServer(LockServer):
 
     @lockable_setting(18, is_triggering='b')
     def set_triggering(self,c,is_triggering):
+        return self._change(partial(self._set_triggering,is_triggering))
+
+    @lockable_setting(19, continuous='b')
+    def set_continuous(self,c,continuous):
+        """
+        sample continuously into a ring buffer and average the
+        most recent sampling duration of samples for get_sample,
+        or acquire new samples for each batch of requests. when
+        sampling continuously, a trigger only starts sampling.
+        """
+        return self._set_continuous(continuous)
+
+    @setting(20, returns='b')
+    def is_continuous(self,c):
+        return self.continuous
+
+    def _change(self,change):
+        # apply a change now, or after the acquisition in progress
         if self.acquiring:
-            self.queue.append(
-                partial(
-                    self._set_triggering,is_triggering
-                )
-            )
+            self.queue.append(partial(self._change,change))
+        elif self.continuous:
+            # stopping joins the reader, so keep it off the reactor
+            return self._exclusively(self._restart_continuous,change)
         else:
-            self._set_triggering(is_triggering)
+            change()
+
+    def _set_continuous(self,continuous):
+        if self.acquiring:
+            self.queue.append(partial(self._set_continuous,continuous))
+        elif continuous != self.continuous:
+            return self._exclusively(self._switch_continuous,continuous)
+        else:
+            self.on_continuous_changed(continuous)
+
+    @inlineCallbacks
+    def _switch_continuous(self,continuous):
+        if continuous:
+            yield self._start_continuous()
+        else:
+            yield deferToThread(self.task.stop_continuous)
+        self.continuous = continuous
+        self.on_continuous_changed(continuous)
+
+    @inlineCallbacks
+    def _restart_continuous(self,change=None):
+        yield deferToThread(self.task.stop_continuous)
+        if change is not None:
+            change()
+        yield self._start_continuous()
+
+    def _start_continuous(self):
+        self.window = self.task.get_sample_quantity()
+        return deferToThread(self.task.start_continuous,self.window)
+
+    @inlineCallbacks
+    def _get_window_average(self,channel):
+        if self.task.has_failed():
+            # samples were lost, e.g. because reading fell behind
+            yield self._exclusively(self._restart_continuous)
+        if self.task.has_samples(self.window):
+            samples = self.task.get_latest(self.window,[channel])
+        else:
+            try:
+                samples = yield deferToThread(
+                    self.task.get_latest,
+                    self.window,
+                    [channel],
+                    timeout=self._get_sampling_duration() + WINDOW_TIMEOUT
+                )
+            except DAQmxException, e:
+                if e.code != ERROR_SAMPLING_STOPPED or self.stopping:
+                    raise
+                # sampling was stopped for a change while we waited,
+                # so get a sample as sampling is now
+                returnValue((yield self._get_sample(channel)))
+        returnValue(np.average(samples[channel]))
 
     def _set_active_channels(self,channels,triggering=None,sampling_duration=None):
         task = AITask(*list(channels)) # list cast necessary to handle LazyList output from registry call